@@ -1,4 +1,6 @@
 """Import files into a ContentFiles database."""
+import collections
+import functools
 import hashlib
 import multiprocessing
 import os
@@ -47,48 +49,68 @@ def ShouldImportRepo(session: orm.session.Session,
   return not contentfiles.GitHubRepository.IsInDatabase(session, meta)
 
 
+# The maximum number of repositories whose file lists are cached by a worker.
+_ALL_FILES_RELPATHS_CACHE_SIZE = 16
+
+
+@functools.lru_cache(maxsize=_ALL_FILES_RELPATHS_CACHE_SIZE)
+def _GetAllFilesRelativePaths(clone_dir: str) -> typing.List[str]:
+  """Get the relative paths of all files in a repo, cached per worker.
+
+  Jobs do not include the list of files in their repository, since for large
+  repos copying the list into every job dominates the cost of the import.
+  Instead, each worker computes the list once per repository.
+  """
+  return public.GetAllFilesRelativePaths(pathlib.Path(clone_dir))
+
+
 def ImportWorker(
     job: scrape_repos_pb2.ImportWorker
-) -> typing.List[contentfiles.ContentFile]:
-  """Import a content file."""
+) -> typing.List[typing.Dict[str, typing.Any]]:
+  """Import a content file.
+
+  Returns:
+    A list of ContentFile rows, as maps from column name to value.
+  """
   relpath = job.abspath[len(str(job.clone_dir)) + 1:]
-  outputs: typing.List[contentfiles.ContentFile] = []
+  all_files_relpaths = (job.all_files_relpaths or
+                        _GetAllFilesRelativePaths(job.clone_dir))
+  rows: typing.List[typing.Dict[str, typing.Any]] = []
   try:
     texts = preprocessors.Preprocess(pathlib.Path(job.clone_dir), relpath,
-                                     job.all_files_relpaths, job.preprocessors)
+                                     all_files_relpaths, job.preprocessors)
     for i, text in enumerate(texts):
       sha256 = hashlib.sha256(text.encode('utf-8'))
-      outputs.append(contentfiles.ContentFile(
-          clone_from_url=job.clone_from_url,
-          relpath=relpath, artifact_index=i,
-          sha256=sha256.digest(), charcount=len(text),
-          linecount=len(text.split('\n')), text=text))
+      rows.append({
+        'clone_from_url': job.clone_from_url,
+        'relpath': relpath, 'artifact_index': i,
+        'sha256': sha256.digest(), 'charcount': len(text),
+        'linecount': len(text.split('\n')), 'text': text,
+      })
   except UnicodeDecodeError:
     logging.warning('Failed to decode %s', relpath)
-  return outputs
+  return rows
 
 
-def ImportRepo(session: orm.session.Session,
-               language: scrape_repos_pb2.LanguageToClone,
-               metafile: pathlib.Path,
-               pool: multiprocessing.Pool) -> None:
-  """Import contentfiles from repository.
+def GetImportJobs(
+    language: scrape_repos_pb2.LanguageToClone,
+    metafile: pathlib.Path) -> typing.List[scrape_repos_pb2.ImportWorker]:
+  """Get the jobs to import contentfiles from a repository.
 
   Args:
-    session: A database session to import to.
     language: The language specification for the repo.
     metafile: The repo metafile.
-    pool: A multiprocessing pool.
+
+  Returns:
+    A list of jobs, one per file to import.
   """
   meta = pbutil.FromFile(metafile, scrape_repos_pb2.GitHubRepoMetadata())
   clone_dir = metafile.parent / f'{meta.owner}_{meta.name}'
-  repo = contentfiles.GitHubRepository.GetOrAdd(session, meta)
-  repo.language = language.language
-
+  jobs = []
   for importer in language.importer:
     if not importer.source_code_pattern:
       logging.error('No source_code_pattern specified! Stopping now.')
-      return
+      return []
 
     pat = importer.source_code_pattern
     pat = f'{clone_dir}/{pat[1:]}' if pat[0] == '^' else f'{clone_dir}/{pat}'
@@ -99,24 +121,93 @@ def ImportRepo(session: orm.session.Session,
         cmd, universal_newlines=True).rstrip().split('\n')
     if len(paths) == 1 and not paths[0]:
       logging.debug('No files to import from %s', clone_dir)
-      return
+      return jobs
     logging.info("Importing %s '%s' files from %s ...",
                  humanize.intcomma(len(paths)),
                  importer.source_code_pattern, clone_dir)
-    all_files_relpaths = public.GetAllFilesRelativePaths(clone_dir)
-    jobs = [
+    jobs += [
       scrape_repos_pb2.ImportWorker(
           clone_from_url=meta.clone_from_url,
           clone_dir=str(clone_dir),
           abspath=p,
-          all_files_relpaths=all_files_relpaths,
           preprocessors=importer.preprocessor,
       ) for p in paths
     ]
-    bar = progressbar.ProgressBar(max_value=len(jobs))
-    for outputs in bar(pool.imap_unordered(ImportWorker, jobs)):
-      for output in outputs:
-        session.add(output)
+  return jobs
+
+
+def ImportRepos(session: orm.session.Session,
+                language: scrape_repos_pb2.LanguageToClone,
+                metafiles: typing.Iterable[pathlib.Path],
+                pool: multiprocessing.Pool,
+                chunksize: int = 32, batch_size: int = 1000) -> None:
+  """Import contentfiles from repositories.
+
+  Jobs are generated lazily, one repository at a time, and the files of
+  successive repositories are processed concurrently. Contentfiles are inserted
+  in batches, and each repository is committed once all of its files have been
+  imported, so an interrupted import resumes from the first uncommitted
+  repository.
+
+  Args:
+    session: A database session to import to.
+    language: The language specification for the repos.
+    metafiles: The repo metafiles.
+    pool: A multiprocessing pool.
+    chunksize: The number of jobs to send to a worker at a time.
+    batch_size: The number of contentfiles to insert at a time.
+  """
+  # A queue of [metafile, remaining_job_count] pairs, in job order. A repo is
+  # appended by the job generator, which runs in a thread of the pool, before
+  # the jobs of the repo are yielded.
+  repos = collections.deque()
+  rows = []
+
+  def Jobs() -> typing.Iterator[scrape_repos_pb2.ImportWorker]:
+    for metafile in metafiles:
+      jobs = GetImportJobs(language, metafile)
+      repos.append([metafile, len(jobs)])
+      yield from jobs
+
+  def InsertRows() -> None:
+    session.bulk_insert_mappings(contentfiles.ContentFile, rows)
+    rows.clear()
+
+  def CommitCompletedRepos() -> None:
+    while repos and not repos[0][1]:
+      metafile, _ = repos.popleft()
+      InsertRows()
+      meta = pbutil.FromFile(metafile, scrape_repos_pb2.GitHubRepoMetadata())
+      repo = contentfiles.GitHubRepository.GetOrAdd(session, meta)
+      repo.language = language.language
+      session.commit()
+
+  # Results are returned in job order, so all of the rows belong to the repo
+  # at the head of the queue.
+  bar = progressbar.ProgressBar(max_value=progressbar.UnknownLength)
+  for outputs in bar(pool.imap(ImportWorker, Jobs(), chunksize=chunksize)):
+    CommitCompletedRepos()
+    repos[0][1] -= 1
+    rows += outputs
+    if len(rows) >= batch_size:
+      InsertRows()
+    CommitCompletedRepos()
+  CommitCompletedRepos()
+
+
+def ImportRepo(session: orm.session.Session,
+               language: scrape_repos_pb2.LanguageToClone,
+               metafile: pathlib.Path,
+               pool: multiprocessing.Pool) -> None:
+  """Import contentfiles from repository.
+
+  Args:
+    session: A database session to import to.
+    language: The language specification for the repo.
+    metafile: The repo metafile.
+    pool: A multiprocessing pool.
+  """
+  ImportRepos(session, language, [metafile], pool)
 
 
 def ImportFromLanguage(db: contentfiles.ContentFiles,
@@ -144,9 +235,8 @@ def ImportFromLanguage(db: contentfiles.ContentFiles,
   logging.info('Importing %s %s repos ...',
                humanize.intcomma(len(repos_to_import)),
                language.language.capitalize())
-  for metafile in repos_to_import:
-    with db.Session(commit=True) as session:
-      ImportRepo(session, language, metafile, pool)
+  with db.Session() as session:
+    ImportRepos(session, language, repos_to_import, pool)
 
 
 def main(argv):
@@ -11,6 +11,7 @@ from absl import flags
 
 from datasets.github.scrape_repos import contentfiles
 from datasets.github.scrape_repos import importer
+from datasets.github.scrape_repos.preprocessors import public
 from datasets.github.scrape_repos.proto import scrape_repos_pb2
 from labm8 import pbutil
 
@@ -18,6 +19,42 @@ from labm8 import pbutil
 FLAGS = flags.FLAGS
 
 
+@public.dataset_preprocessor
+def MockPreprocessor(
+    import_root: pathlib.Path, file_relpath: str,
+    text: str, all_file_relpaths: typing.List[str]) -> typing.List[str]:
+  """A mock preprocessor which returns the number of files in the repo."""
+  del import_root
+  del file_relpath
+  return [f'{text.strip()} {len(all_file_relpaths)}']
+
+
+def MakeRepo(directory: pathlib.Path, name: str, num_files: int) -> None:
+  """Create a repo with a metafile and num_files '.txt' files."""
+  pbutil.ToFile(scrape_repos_pb2.GitHubRepoMetadata(
+      owner='Owner', name=name, clone_from_url=f'https://github.com/{name}'),
+      directory / f'Owner_{name}.pbtxt')
+  (directory / f'Owner_{name}' / '.git').mkdir(parents=True)
+  (directory / f'Owner_{name}' / 'README.md').write_text('README')
+  for i in range(num_files):
+    (directory / f'Owner_{name}' / f'{i}.txt').write_text(f'{name} {i}')
+
+
+def MockLanguage(directory: pathlib.Path) -> scrape_repos_pb2.LanguageToClone:
+  """Return a language which imports '.txt' files with MockPreprocessor."""
+  return scrape_repos_pb2.LanguageToClone(
+      language='foolang',
+      query=[],
+      destination_directory=str(directory),
+      importer=[
+        scrape_repos_pb2.ContentFilesImporterConfig(
+            source_code_pattern='.*\\.txt',
+            preprocessor=['datasets.github.scrape_repos.importer_test:'
+                          'MockPreprocessor']),
+      ]
+  )
+
+
 @pytest.fixture(scope='function')
 def tempdir() -> pathlib.Path:
   with tempfile.TemporaryDirectory(prefix='phd_') as d:
@@ -93,6 +130,60 @@ public class B {
     }
 
 
+def test_ImportFromLanguage_multiple_repos(test_db: contentfiles.ContentFiles,
+                                           tempdir: pathlib.Path):
+  """Test importing the files of many repos concurrently."""
+  for i in range(5):
+    MakeRepo(tempdir, f'Repo{i}', i * 3)
+  importer.ImportFromLanguage(test_db, MockLanguage(tempdir),
+                              multiprocessing.Pool(2))
+  with test_db.Session() as session:
+    assert session.query(contentfiles.GitHubRepository).count() == 5
+    for i in range(5):
+      query = session.query(contentfiles.ContentFile).filter(
+          contentfiles.ContentFile.clone_from_url ==
+          f'https://github.com/Repo{i}')
+      # Each file is given the list of all files in its repo, including the
+      # README and files in .git.
+      assert sorted(cf.text for cf in query) == sorted(
+          f'Repo{i} {j} {i * 3 + 1}' for j in range(i * 3))
+
+
+def test_ImportRepos_small_batches_and_chunks(
+    test_db: contentfiles.ContentFiles, tempdir: pathlib.Path):
+  """Test that the result is independent of the batch and chunk sizes."""
+  MakeRepo(tempdir, 'Foo', 7)
+  MakeRepo(tempdir, 'Empty', 0)
+  MakeRepo(tempdir, 'Bar', 5)
+  metafiles = [tempdir / f'Owner_{name}.pbtxt'
+               for name in ('Foo', 'Empty', 'Bar')]
+  with test_db.Session() as session:
+    importer.ImportRepos(session, MockLanguage(tempdir), metafiles,
+                         multiprocessing.Pool(2), chunksize=2, batch_size=3)
+  with test_db.Session() as session:
+    assert session.query(contentfiles.GitHubRepository).count() == 3
+    assert session.query(contentfiles.ContentFile).count() == 12
+    # A repo without any files to import is still recorded.
+    assert session.query(contentfiles.GitHubRepository).filter(
+        contentfiles.GitHubRepository.name == 'Empty').one().language == (
+      'foolang')
+
+
+def test_ImportWorker_with_all_files_relpaths(tempdir: pathlib.Path):
+  """Test that a job may specify the list of files in the repo."""
+  MakeRepo(tempdir, 'Foo', 1)
+  rows = importer.ImportWorker(scrape_repos_pb2.ImportWorker(
+      clone_from_url='https://github.com/Foo',
+      clone_dir=str(tempdir / 'Owner_Foo'),
+      abspath=str(tempdir / 'Owner_Foo' / '0.txt'),
+      all_files_relpaths=['0.txt'],
+      preprocessors=['datasets.github.scrape_repos.importer_test:'
+                     'MockPreprocessor']))
+  assert len(rows) == 1
+  assert rows[0]['relpath'] == '0.txt'
+  assert rows[0]['text'] == 'Foo 0 1'
+
+
 def main(argv: typing.List[str]):
   """Main entry point."""
   if len(argv) > 1:
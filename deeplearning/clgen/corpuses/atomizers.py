@@ -4,6 +4,7 @@ An atomizer converts a block of text into a sequence of vocbulary tokens.
 """
 import pathlib
 import pickle
+import re
 import typing
 from collections import Counter
 
@@ -72,6 +73,21 @@ class AtomizerBase(object):
     """
     raise NotImplementedError("abstract class")
 
+  def AtomizeStrings(self,
+                     texts: typing.Iterable[str]) -> typing.List[np.array]:
+    """Atomize a sequence of texts into arrays of vocabulary indices.
+
+    Args:
+      texts: A sequence of input texts.
+
+    Returns:
+      A list of arrays of indices into vocabulary, one for each text.
+
+    Raises:
+      VocabError: If an input text contains elements not in the vocabulary.
+    """
+    return [self.AtomizeString(text) for text in texts]
+
   def TokenizeString(self, text: str) -> typing.List[str]:
     """Split the text into atoms, but do not encode to indices.
 
@@ -160,16 +176,27 @@ class AsciiCharacterAtomizer(AtomizerBase):
 
 
 class GreedyAtomizer(AtomizerBase):
-  """A greedy atomizer supports multi-character tokens."""
+  """A greedy atomizer supports multi-character tokens.
+
+  Text is split into the longest matching multi-character token at each
+  position, falling back to single characters. Matching is performed by a
+  regular expression compiled from a prefix trie of the multi-character tokens,
+  so the cost of atomizing is linear in the length of the text, rather than in
+  the product of the text length and the number of tokens.
+  """
 
   def __init__(self, vocab: typing.Dict[str, int], determine_chars=False):
     self.determine_chars = determine_chars
     super(GreedyAtomizer, self).__init__(vocab)
 
-    multichars = set(k for k in self.atoms if len(k) > 1)
-    first_chars = set(a[0] for a in multichars)
-    self.lookup = dict(
-        (c, [a for a in multichars if a[0] == c]) for c in first_chars)
+    self.regex = _CompileGreedyRegex(self.atoms)
+
+  def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+    """Restore a pickled atomizer, rebuilding the regex for older pickles."""
+    self.__dict__.update(state)
+    if 'regex' not in state:
+      self.regex = _CompileGreedyRegex(self.atoms)
+      self.__dict__.pop('lookup', None)
 
   def AtomizeString(self, text: str) -> np.array:
     """Atomize a text into an array of vocabulary indices.
@@ -179,48 +206,48 @@ class GreedyAtomizer(AtomizerBase):
 
     Returns:
       An array of indices into vocabulary for all atoms in text.
+
+    Raises:
+      VocabError: If the input text contains elements not in the vocabulary.
     """
+    return self.AtomizeStrings([text])[0]
+
+  def AtomizeStrings(self,
+                     texts: typing.Iterable[str]) -> typing.List[np.array]:
+    """Atomize a sequence of texts into arrays of vocabulary indices.
 
-    def _AddToVocab(token: str) -> int:
-      """Add a token to the vocabulary and return its index."""
-      if self.determine_chars and token not in self.vocab:
-        max_index = max(self.vocab.values())
-        self.vocab[token] = max_index + 1
-      return self.vocab[token]
+    This is equivalent to calling AtomizeString() on each text, but amortizes
+    the per-call overhead across the batch.
 
-    indices = []
-    i = 0
-    j = 2
+    Args:
+      texts: A sequence of input texts.
+
+    Returns:
+      A list of arrays of indices into vocabulary, one for each text.
+
+    Raises:
+      VocabError: If an input text contains elements not in the vocabulary.
+    """
+    findall = self.regex.findall
+    vocab = self.vocab
+    lookup = vocab.__getitem__
+    encoded = []
     try:
-      while i < len(text):
-        if self.lookup.get(text[i]):
-          if j <= len(text) and any(
-              x.startswith(text[i:j]) for x in self.lookup[text[i]]):
-            j += 1
-          else:
-            while j > i + 1:
-              if any(x == text[i:j] for x in self.lookup[text[i]]):
-                indices.append(self.vocab[text[i:j]])
-                i = j
-                j += 2
-                break
-              else:
-                j -= 1
-            else:
-              indices.append(_AddToVocab(text[i]))
-              i += 1
-              j += 2
-        else:
-          indices.append(_AddToVocab(text[i]))
-          i += 1
-          j += 2
+      for text in texts:
+        tokens = findall(text)
+        if self.determine_chars:
+          # Add unknown tokens in order of first appearance.
+          for token in dict.fromkeys(tokens):
+            if token not in vocab:
+              vocab[token] = max(vocab.values()) + 1
+        encoded.append(np.array(list(map(lookup, tokens)), dtype=np.int32))
     except KeyError:
       raise errors.VocabError
 
     if self.determine_chars:
       self._UpdateVocabulary()
 
-    return np.array(indices, dtype=np.int32)
+    return encoded
 
   def __repr__(self) -> str:
     return f'GreedyAtomizer[{self.vocab_size} tokens]'
@@ -248,3 +275,65 @@ class GreedyAtomizer(AtomizerBase):
     end_time = labdate.MillisecondsTimestamp()
     # Return a new atomizer using the subset vocabulary.
     return GreedyAtomizer(vocab_subset)
+
+
+def _BuildTrie(atoms: typing.Iterable[str]) -> typing.Dict[str, typing.Any]:
+  """Build a prefix trie of atoms.
+
+  Args:
+    atoms: The atoms to insert into the trie.
+
+  Returns:
+    A nested dictionary mapping characters to subtries. A subtrie which
+    terminates an atom contains the empty string as a key.
+  """
+  trie = {}
+  for atom in atoms:
+    node = trie
+    for char in atom:
+      node = node.setdefault(char, {})
+    node[''] = {}
+  return trie
+
+
+def _TrieRegex(trie: typing.Dict[str, typing.Any]) -> str:
+  """Produce a regular expression which matches the longest atom in a trie.
+
+  Alternatives at each node of the trie begin with distinct characters, and the
+  continuation of an atom which is a prefix of other atoms is optional and
+  greedy, so the regex engine always returns the longest matching atom.
+
+  Args:
+    trie: A trie, as returned by _BuildTrie().
+
+  Returns:
+    A regular expression pattern, or the empty string if the trie is empty.
+  """
+  alternatives = []
+  for char, subtrie in sorted(trie.items()):
+    if not char:
+      continue
+    suffix = _TrieRegex(subtrie)
+    if suffix and '' in subtrie:
+      alternatives.append(f'{re.escape(char)}(?:{suffix})?')
+    else:
+      alternatives.append(re.escape(char) + suffix)
+  if not alternatives:
+    return ''
+  elif len(alternatives) == 1:
+    return alternatives[0]
+  else:
+    return '(?:' + '|'.join(alternatives) + ')'
+
+
+def _CompileGreedyRegex(atoms: typing.Iterable[str]) -> typing.Pattern:
+  """Compile a regex which matches the longest multi-character atom, or a char.
+
+  Args:
+    atoms: The atoms of a vocabulary. Single-character atoms are ignored.
+
+  Returns:
+    A compiled regular expression, for use with findall().
+  """
+  pattern = _TrieRegex(_BuildTrie(a for a in atoms if len(a) > 1))
+  return re.compile(f'{pattern}|.' if pattern else '.', re.DOTALL)
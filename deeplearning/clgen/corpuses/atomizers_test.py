@@ -1,13 +1,18 @@
 """Unit tests for //deeplearning/clgen/atomizers.py."""
 import pathlib
+import pickle
+import random
 import sys
+import tarfile
 import tempfile
 
+import numpy as np
 import pytest
 from absl import app
 
 import deeplearning.clgen.errors
 from deeplearning.clgen.corpuses import atomizers
+from labm8 import bazelutil
 
 
 # The set of multichar tokens for the OpenCL programming language.
@@ -33,6 +38,49 @@ OPENCL_ATOMS = set(
      'union', 'unsigned', 'void', 'volatile', 'while', 'wide', 'write_only', ])
 
 
+def ReferenceGreedyTokenize(text: str, vocab) -> list:
+  """The original per-character GreedyAtomizer scan, used as a test oracle."""
+  multichars = set(k for k in vocab if len(k) > 1)
+  first_chars = set(a[0] for a in multichars)
+  lookup = dict((c, [a for a in multichars if a[0] == c]) for c in first_chars)
+  tokens = []
+  i = 0
+  j = 2
+  while i < len(text):
+    if lookup.get(text[i]):
+      if j <= len(text) and any(
+          x.startswith(text[i:j]) for x in lookup[text[i]]):
+        j += 1
+      else:
+        while j > i + 1:
+          if any(x == text[i:j] for x in lookup[text[i]]):
+            tokens.append(text[i:j])
+            i = j
+            j += 2
+            break
+          else:
+            j -= 1
+        else:
+          tokens.append(text[i])
+          i += 1
+          j += 2
+    else:
+      tokens.append(text[i])
+      i += 1
+      j += 2
+  return tokens
+
+
+@pytest.fixture(scope='module')
+def opencl_corpus() -> list:
+  """A list of the OpenCL kernels from the tiny test corpus."""
+  path = bazelutil.DataPath(
+      'phd/deeplearning/clgen/tests/data/tiny/corpus.tar.bz2')
+  with tarfile.open(path, 'r:bz2') as tar:
+    return [tar.extractfile(m).read().decode('utf-8') for m in tar.getmembers()
+            if m.isfile() and m.name.endswith('.cl')]
+
+
 # AsciiCharacterAtomizer
 
 
@@ -170,6 +218,93 @@ __kernel void A(__global float* a, __global float* b, const int c) {
   assert c.vocab_size == len(tokens)
 
 
+def test_GreedyAtomizer_TokenizeString_random_text():
+  """Test that tokens match the reference implementation on random text."""
+  vocab = {'a': 0, 'b': 1, 'c': 2, 'ab': 3, 'abc': 4, 'abcab': 5, 'bca': 6,
+           'ca': 7, 'cccc': 8}
+  c = atomizers.GreedyAtomizer(vocab)
+  rng = random.Random(0)
+  for _ in range(100):
+    text = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 50)))
+    assert c.TokenizeString(text) == ReferenceGreedyTokenize(text, vocab)
+
+
+def test_GreedyAtomizer_TokenizeString_regex_characters():
+  """Test that atoms containing regex metacharacters are matched literally."""
+  vocab = {'.': 0, '*': 1, '.*': 2, '(': 3, ')': 4, '()': 5, 'a': 6, '\\': 7,
+           '\\n': 8, 'n': 9, '\n': 10}
+  c = atomizers.GreedyAtomizer(vocab)
+  assert c.TokenizeString('.*a()\\n.\n*') == [
+    '.*', 'a', '()', '\\n', '.', '\n', '*']
+
+
+def test_GreedyAtomizer_AtomizeString_vocab_error():
+  """Test that VocabError is raised for a character not in the vocabulary."""
+  c = atomizers.GreedyAtomizer({'a': 0, 'ab': 1})
+  with pytest.raises(deeplearning.clgen.errors.VocabError):
+    c.AtomizeString('abc')
+
+
+def test_GreedyAtomizer_AtomizeString_no_multichars():
+  """Test an atomizer with no multi-character atoms."""
+  c = atomizers.GreedyAtomizer({'a': 0, 'b': 1})
+  np.testing.assert_array_equal(c.AtomizeString('abba'), [0, 1, 1, 0])
+  assert c.AtomizeString('').shape == (0,)
+
+
+def test_GreedyAtomizer_AtomizeStrings():
+  """Test that AtomizeStrings() is equivalent to AtomizeString()."""
+  vocab = {'abc': 1, 'a': 2, 'b': 3, 'ab': 4, 'c': 5, 'cab': 6, ' ': 7}
+  c = atomizers.GreedyAtomizer(vocab)
+  texts = ['abcab', '', 'c ab', 'cabcab']
+  encoded = c.AtomizeStrings(texts)
+  assert len(encoded) == len(texts)
+  for text, indices in zip(texts, encoded):
+    assert indices.dtype == np.int32
+    np.testing.assert_array_equal(indices, c.AtomizeString(text))
+
+
+def test_GreedyAtomizer_FromFile_legacy_pickle():
+  """Test that an atomizer pickled without a regex can be loaded."""
+  c = atomizers.GreedyAtomizer({'a': 0, 'b': 1, 'ab': 2})
+  state = c.__dict__.copy()
+  del state['regex']
+  state['lookup'] = {'a': ['ab']}
+  legacy = atomizers.GreedyAtomizer.__new__(atomizers.GreedyAtomizer)
+  legacy.__dict__.update(state)
+  with tempfile.TemporaryDirectory() as d:
+    with open(f'{d}/atomizer.pkl', 'wb') as f:
+      pickle.dump(legacy, f)
+    # Loading restores the instance via __setstate__() with the legacy state.
+    c2 = atomizers.GreedyAtomizer.FromFile(pathlib.Path(f'{d}/atomizer.pkl'))
+  assert not hasattr(c2, 'lookup')
+  assert c2.TokenizeString('aabb') == ['a', 'ab', 'b']
+
+
+def test_GreedyAtomizer_opencl_corpus(opencl_corpus):
+  """Test that tokens match the reference implementation on a real corpus."""
+  c = atomizers.GreedyAtomizer.FromText(''.join(opencl_corpus), OPENCL_ATOMS)
+  for text in opencl_corpus[:20]:
+    assert c.TokenizeString(text) == ReferenceGreedyTokenize(text, c.vocab)
+
+
+# Benchmarks.
+
+def test_benchmark_GreedyAtomizer_AtomizeStrings_opencl_corpus(
+    benchmark, opencl_corpus):
+  """Benchmark atomizing a real OpenCL corpus."""
+  c = atomizers.GreedyAtomizer.FromText(''.join(opencl_corpus), OPENCL_ATOMS)
+  benchmark(c.AtomizeStrings, opencl_corpus)
+
+
+def test_benchmark_ReferenceGreedyTokenize_opencl_corpus(
+    benchmark, opencl_corpus):
+  """Benchmark the reference implementation, for comparison."""
+  c = atomizers.GreedyAtomizer.FromText(''.join(opencl_corpus), OPENCL_ATOMS)
+  benchmark(lambda: [ReferenceGreedyTokenize(t, c.vocab)
+                     for t in opencl_corpus])
+
+
 def main(argv):
   """Main entry point."""
   if len(argv) > 1:
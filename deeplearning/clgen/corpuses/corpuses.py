@@ -21,6 +21,7 @@ from deeplearning.clgen import errors
 from deeplearning.clgen.corpuses import atomizers
 from deeplearning.clgen.corpuses import encoded
 from deeplearning.clgen.corpuses import preprocessed
+from deeplearning.clgen.corpuses import preprocessing_cache
 from deeplearning.clgen.preprocessors import preprocessors
 from deeplearning.clgen.proto import corpus_pb2
 from labm8 import bazelutil
@@ -58,6 +59,9 @@ def AssertConfigIsValid(config: corpus_pb2.Corpus) -> corpus_pb2.Corpus:
     pbutil.AssertFieldIsSet(config, 'contentfiles')
     pbutil.AssertFieldIsSet(config, 'atomizer')
     pbutil.AssertFieldIsSet(config, 'contentfile_separator')
+    if config.incremental and not config.HasField('local_directory'):
+      raise errors.UserError(
+          'Corpus.incremental requires a Corpus.local_directory')
     # Check that the preprocessor pipeline resolves to preprocessor functions.
     [preprocessors.GetPreprocessorFunction(p) for p in config.preprocessor]
 
@@ -122,6 +126,13 @@ class Corpus(object):
       raise errors.UserError(f"Content ID not found: '{self.content_id}'")
     self.preprocessed = preprocessed.PreprocessedContentFiles(
         preprocessed_db_path)
+    # Cache of pre-processed texts which is shared across corpuses.
+    if FLAGS.clgen_preprocessing_cache_size_mb:
+      self.preprocessing_cache = preprocessing_cache.PreprocessingCache(
+          cache.cachepath('preprocessing_cache.db'),
+          FLAGS.clgen_preprocessing_cache_size_mb * 1024 * 1024)
+    else:
+      self.preprocessing_cache = None
     # Create symlink to contentfiles.
     symlink = pathlib.Path(
         self.preprocessed.url[len('sqlite:///'):]).parent / 'contentfiles'
@@ -165,7 +176,7 @@ class Corpus(object):
         self.preprocessed.url[len('sqlite:///'):]).parent / 'LOCK'
     with lockfile.LockFile(preprocessed_lock_path).acquire(
         replace_stale=True, block=True):
-      self.preprocessed.Create(self.config)
+      self.preprocessed.Create(self.config, self.preprocessing_cache)
     if not self.preprocessed.size:
       raise errors.EmptyCorpusException(
           f"Pre-processed corpus contains no files: '{self.preprocessed.url}'")
@@ -179,7 +190,8 @@ class Corpus(object):
                    humanize.intcomma(atomizer.vocab_size),
                    humanize.intcomma(int((time.time() - start_time) * 1000)))
       self.encoded.Create(self.preprocessed, atomizer,
-                          self.config.contentfile_separator)
+                          self.config.contentfile_separator,
+                          incremental=self.config.incremental)
 
   @property
   def is_locked(self) -> bool:
@@ -213,19 +225,17 @@ class Corpus(object):
   def GetTrainingData(self, shuffle: bool) -> np.ndarray:
     """Concatenate the entire encoded corpus into an array.
 
+    The array is read from the memory-mapped token store of the encoded corpus,
+    so must call Create() first.
+
     Args:
-      shuffle: If true, randomize order of ebcided contentfiles.
+      shuffle: If true, randomize order of encoded contentfiles.
 
     Returns:
-      The encoded corpus.
+      The encoded corpus. If shuffle is false, this is a read-only view of the
+      token store.
     """
-    # TODO: Can binary numpy strings be concatenated and decoded as one?
-    with self.encoded.Session() as session:
-      query = session.query(encoded.EncodedContentFile.data)
-      if shuffle:
-        query = query.order_by(func.random())
-      return np.concatenate(
-          [np.frombuffer(x[0], dtype=np.int32) for x in query])
+    return self.encoded.token_store.GetTokens(shuffle)
 
   def GetNumContentFiles(self) -> int:
     """Get the number of contentfiles which were pre-processed."""
@@ -275,7 +285,7 @@ class Corpus(object):
   @property
   def size(self) -> int:
     """Return the size of the atomized corpus."""
-    return len(self.GetTrainingData(shuffle=False))
+    return self.encoded.token_store.token_count
 
   def __eq__(self, rhs) -> bool:
     if not isinstance(rhs, Corpus):
@@ -326,7 +336,15 @@ def ResolveContentId(config: corpus_pb2.Corpus, hc: hashcache.HashCache) -> str:
     return config.content_id
 
   start_time = time.time()
-  if config.HasField('local_directory'):
+  if config.incremental:
+    # The contents of an incremental corpus may change, so it is identified by
+    # its path.
+    path = ExpandConfigPath(config.local_directory,
+                            path_prefix=FLAGS.clgen_local_path_prefix)
+    if not path.is_dir():
+      raise errors.UserError(f"Directory not found: '{path}'")
+    content_id = crypto.sha1_str(f'incremental:{path}')
+  elif config.HasField('local_directory'):
     # After the first time we compute the hash of a directory, we write it into
     # a file. This is a shortcut to work around the fact that computing the
     # directory checksum is O(n) with respect to the number of files in the
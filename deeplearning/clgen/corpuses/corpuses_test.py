@@ -4,6 +4,7 @@ import pathlib
 import sys
 import tempfile
 
+import numpy as np
 import pytest
 from absl import app
 from absl import flags
@@ -342,6 +343,19 @@ def test_Corpus_GetTrainingData_decode(clgen_cache_dir, abc_corpus):
              'The cat sat on the mat.\n!!\n') == len(decoded)
 
 
+def test_Corpus_GetTrainingData_shuffle(clgen_cache_dir, abc_corpus):
+  """Test that shuffled training data contains the same tokens."""
+  del clgen_cache_dir
+  c = corpuses.Corpus(corpus_pb2.Corpus(local_directory=abc_corpus,
+                                        ascii_character_atomizer=True,
+                                        contentfile_separator='\n!!\n'))
+  c.Create()
+  np.testing.assert_array_equal(
+      np.sort(c.GetTrainingData(shuffle=False)),
+      np.sort(c.GetTrainingData(shuffle=True)))
+  assert c.size == len(c.GetTrainingData(shuffle=True))
+
+
 def test_Corpus_preprocessed_symlink(clgen_cache_dir, abc_corpus_config):
   """Test path of symlink to pre-preprocessed files."""
   del clgen_cache_dir
@@ -356,6 +370,76 @@ def test_Corpus_preprocessed_symlink(clgen_cache_dir, abc_corpus_config):
       str(pathlib.Path(c.preprocessed.url[len('sqlite:///'):]).parent))
 
 
+def test_Corpus_incremental_requires_local_directory(clgen_cache_dir,
+                                                    abc_corpus_archive):
+  """Test that incremental corpuses must be local directories."""
+  del clgen_cache_dir
+  with pytest.raises(errors.UserError) as e_ctx:
+    corpuses.Corpus(corpus_pb2.Corpus(local_tar_archive=abc_corpus_archive,
+                                      ascii_character_atomizer=True,
+                                      contentfile_separator='\n\n',
+                                      incremental=True))
+  assert 'Corpus.incremental requires a Corpus.local_directory' == str(
+      e_ctx.value)
+
+
+def test_Corpus_incremental_add_file(clgen_cache_dir, abc_corpus_config):
+  """Test that new files are added to an incremental corpus."""
+  del clgen_cache_dir
+  abc_corpus_config.incremental = True
+  c1 = corpuses.Corpus(abc_corpus_config)
+  c1.Create()
+  assert 3 == c1.GetNumPreprocessedFiles()
+  size = c1.size
+  with open(pathlib.Path(abc_corpus_config.local_directory) / 'd', 'w') as f:
+    f.write('tac')
+
+  c2 = corpuses.Corpus(abc_corpus_config)
+  assert c1.hash == c2.hash
+  c2.Create()
+  assert 4 == c2.GetNumPreprocessedFiles()
+  assert size + len('tac\n\n') == c2.size
+  assert 'tac' in c2.atomizer.DeatomizeIndices(
+      c2.GetTrainingData(shuffle=False))
+  with c2.preprocessed.Session() as session:
+    # Only the new file was pre-processed, and the unchanged files were not
+    # read from the cache.
+    assert '0' == session.query(preprocessed.Meta.value).filter(
+        preprocessed.Meta.key == 'preprocessing_cache_hits').scalar()
+    assert '4' == session.query(preprocessed.Meta.value).filter(
+        preprocessed.Meta.key == 'preprocessing_cache_misses').scalar()
+
+
+def test_Corpus_incremental_modify_and_remove_files(clgen_cache_dir,
+                                                    abc_corpus_config):
+  """Test that changed and removed files are updated in the corpus."""
+  del clgen_cache_dir
+  abc_corpus_config.incremental = True
+  corpuses.Corpus(abc_corpus_config).Create()
+  path = pathlib.Path(abc_corpus_config.local_directory)
+  (path / 'a').write_text('The cat sat on the hat.')
+  (path / 'b').unlink()
+
+  c = corpuses.Corpus(abc_corpus_config)
+  c.Create()
+  assert 2 == c.GetNumPreprocessedFiles()
+  text = c.atomizer.DeatomizeIndices(c.GetTrainingData(shuffle=False))
+  assert 'The cat sat on the hat.' in text
+  assert 'The cat sat on the mat.' not in text
+  assert 'Hello, world!' not in text
+
+
+def test_Corpus_incremental_new_vocabulary(clgen_cache_dir, abc_corpus_config):
+  """Test that new files must be encoded using the existing vocabulary."""
+  del clgen_cache_dir
+  abc_corpus_config.incremental = True
+  corpuses.Corpus(abc_corpus_config).Create()
+  (pathlib.Path(abc_corpus_config.local_directory) / 'd').write_text('XYZ')
+
+  with pytest.raises(errors.VocabError):
+    corpuses.Corpus(abc_corpus_config).Create()
+
+
 def main(argv):
   """Main entry point."""
   if len(argv) > 1:
@@ -2,8 +2,10 @@
 import binascii
 import datetime
 import multiprocessing
+import os
 import pathlib
 import pickle
+import queue
 import time
 import typing
 
@@ -19,7 +21,6 @@ from sqlalchemy.sql import func
 from deeplearning.clgen import errors
 from deeplearning.clgen.corpuses import atomizers
 from deeplearning.clgen.corpuses import preprocessed
-from deeplearning.clgen.proto import internal_pb2
 from labm8 import sqlutil
 
 
@@ -95,19 +96,247 @@ class EncodedContentFile(Base):
         date_added=datetime.datetime.utcnow())
 
 
+# The state of an encoder worker process, set by EncoderWorkerInit().
+_encoder_worker_state = {}
+
+
+def EncoderWorkerInit(preprocessed_db_url: str, pickled_atomizer: bytes,
+                      contentfile_separator: str) -> None:
+  """Initialize an encoder worker process.
+
+  This is called once per process of the encoder pool, so that the atomizer is
+  unpickled once per worker, rather than once per job.
+
+  Args:
+    preprocessed_db_url: The URL of the PreprocessedContentFiles database to
+      read texts from.
+    pickled_atomizer: The pickled atomizer to encode using.
+    contentfile_separator: The end-of-file marker.
+  """
+  _encoder_worker_state['db'] = sqlutil.Database(
+      preprocessed_db_url, preprocessed.Base, must_exist=True)
+  _encoder_worker_state['atomizer'] = pickle.loads(pickled_atomizer)
+  _encoder_worker_state['contentfile_separator'] = contentfile_separator
+
+
 def EncoderWorker(
-    job: internal_pb2.EncoderWorker) -> typing.Optional[EncodedContentFile]:
-  """Encode a single content file."""
-  # TODO(cec): There is a bug in the atomizer creation logic such that the
-  # derived atomizer is not always capable of encoding the preprocessed files.
-  # Once this has been fixed, there is no need to catch the VocabError here,
-  # and EncoderWorker can always return an EncodedContentFile instance.
-  try:
-    return EncodedContentFile.FromPreprocessed(
-        preprocessed.PreprocessedContentFile(id=job.id, text=job.text),
-        pickle.loads(job.pickled_atomizer), job.contentfile_separator)
-  except errors.VocabError:
-    return None
+    ids: typing.List[int]) -> typing.Tuple[typing.List[EncodedContentFile], int]:
+  """Encode a chunk of content files.
+
+  The worker must first be initialized by EncoderWorkerInit().
+
+  Args:
+    ids: The IDs of the PreprocessedContentFiles to encode.
+
+  Returns:
+    A tuple of the list of encoded content files, and the number of files which
+    could not be encoded because they contain tokens which are not in the
+    vocabulary. Files which cannot be encoded are omitted from the list.
+  """
+  atomizer = _encoder_worker_state['atomizer']
+  eof = _encoder_worker_state['contentfile_separator']
+  encoded_cfs = []
+  num_vocab_errors = 0
+  with _encoder_worker_state['db'].Session() as session:
+    query = session.query(preprocessed.PreprocessedContentFile.id,
+                          preprocessed.PreprocessedContentFile.text).filter(
+        preprocessed.PreprocessedContentFile.id.in_(ids))
+    for id_, text in query:
+      # TODO(cec): There is a bug in the atomizer creation logic such that the
+      # derived atomizer is not always capable of encoding the preprocessed
+      # files. Once this has been fixed, there is no need to catch the
+      # VocabError here.
+      try:
+        encoded_cfs.append(EncodedContentFile.FromPreprocessed(
+            preprocessed.PreprocessedContentFile(id=id_, text=text),
+            atomizer, eof))
+      except errors.VocabError:
+        num_vocab_errors += 1
+  return encoded_cfs, num_vocab_errors
+
+
+def TokenStoreDtype(vocab_size: int) -> np.dtype:
+  """Return the narrowest integer type which can represent a vocabulary.
+
+  Args:
+    vocab_size: The number of tokens in the vocabulary.
+
+  Returns:
+    A numpy dtype.
+  """
+  return np.dtype(np.uint16 if vocab_size < 2 ** 16 else np.int32)
+
+
+class TokenStore(object):
+  """A flat, memory-mapped store of the tokens of an encoded corpus.
+
+  The encoded data of every contentfile is written contiguously, in order of
+  contentfile ID, to a single binary file. A second file of offsets indexes
+  into this array, such that the tokens of the i-th contentfile are
+  tokens[offsets[i]:offsets[i+1]]. Reading the store does not require loading
+  it into memory, and the unshuffled token array is a zero-copy view of the
+  file.
+  """
+
+  def __init__(self, tokens_path: pathlib.Path, offsets_path: pathlib.Path,
+               dtype: np.dtype):
+    """Instantiate a token store.
+
+    Args:
+      tokens_path: The path of the binary tokens file.
+      offsets_path: The path of the offsets index, in .npy format.
+      dtype: The integer type of the tokens.
+    """
+    self.tokens_path = tokens_path
+    self.offsets_path = offsets_path
+    self.dtype = np.dtype(dtype)
+    # Lazily instantiated.
+    self._tokens = None
+    self._offsets = None
+
+  @property
+  def tokens(self) -> np.ndarray:
+    """The flat array of tokens, memory-mapped from disk."""
+    if self._tokens is None:
+      if self.tokens_path.stat().st_size:
+        self._tokens = np.memmap(self.tokens_path, dtype=self.dtype, mode='r')
+      else:
+        # np.memmap cannot map an empty file.
+        self._tokens = np.array([], dtype=self.dtype)
+    return self._tokens
+
+  @property
+  def offsets(self) -> np.ndarray:
+    """The array of contentfile offsets into the tokens array."""
+    if self._offsets is None:
+      self._offsets = np.load(str(self.offsets_path), mmap_mode='r')
+    return self._offsets
+
+  @property
+  def num_files(self) -> int:
+    """The number of contentfiles in the store."""
+    return len(self.offsets) - 1
+
+  @property
+  def token_count(self) -> int:
+    """The total number of tokens in the store, including EOF markers."""
+    return int(self.offsets[-1])
+
+  def GetTokens(self, shuffle: bool) -> np.ndarray:
+    """Return the tokens of the entire corpus.
+
+    Args:
+      shuffle: If true, randomize order of contentfiles. The contentfiles are
+        permuted using the offsets index, so that the returned array is the
+        only copy made of the corpus. Else, a zero-copy view of the store is
+        returned.
+
+    Returns:
+      A 1D array of tokens.
+    """
+    if not shuffle:
+      return self.tokens[:self.token_count]
+    tokens, offsets = self.tokens, self.offsets
+    shuffled = np.empty(self.token_count, dtype=self.dtype)
+    i = 0
+    for j in np.random.permutation(self.num_files):
+      start, end = offsets[j], offsets[j + 1]
+      shuffled[i:i + end - start] = tokens[start:end]
+      i += end - start
+    return shuffled
+
+  def Exists(self) -> bool:
+    """Return whether the store has been written."""
+    return self.tokens_path.is_file() and self.offsets_path.is_file()
+
+  def Write(self, session: sqlutil.Session) -> int:
+    """Write the token store from a session of an EncodedContentFiles database.
+
+    Contentfiles are streamed from the database, so that at most a single
+    encoded contentfile is held in memory at a time. The files are written to
+    temporary paths and renamed once complete, so that an interrupted write
+    never produces a partial store.
+
+    Args:
+      session: A session of an EncodedContentFiles database.
+
+    Returns:
+      The ID of the last contentfile in the store, or -1 if the store is
+      empty.
+    """
+    tmp_tokens_path = self.tokens_path.parent / (
+        self.tokens_path.name + '.tmp')
+    with open(tmp_tokens_path, 'wb') as f:
+      last_id, offsets = self._WriteTokens(session, f, -1, [0])
+    self._WriteOffsets(offsets)
+    os.rename(tmp_tokens_path, self.tokens_path)
+    self._tokens = None
+    self._offsets = None
+    return last_id
+
+  def Append(self, session: sqlutil.Session, after_id: int) -> int:
+    """Append new contentfiles to the token store.
+
+    Only contentfiles with an ID greater than after_id are appended. The offsets
+    index is replaced once the tokens have been appended, so an interrupted
+    append leaves the store unchanged, save for unindexed trailing tokens which
+    are ignored.
+
+    Args:
+      session: A session of an EncodedContentFiles database.
+      after_id: The ID of the last contentfile in the store, as returned by
+        Write() or Append().
+
+    Returns:
+      The ID of the last contentfile in the store.
+    """
+    offsets = [int(x) for x in self.offsets]
+    with open(self.tokens_path, 'r+b') as f:
+      # Discard any trailing tokens from an interrupted append.
+      f.truncate(offsets[-1] * self.dtype.itemsize)
+      f.seek(0, os.SEEK_END)
+      last_id, offsets = self._WriteTokens(session, f, after_id, offsets)
+    self._WriteOffsets(offsets)
+    self._tokens = None
+    self._offsets = None
+    return last_id
+
+  def Remove(self) -> None:
+    """Remove the token store files, if they exist."""
+    for path in [self.tokens_path, self.offsets_path]:
+      if path.is_file():
+        path.unlink()
+    self._tokens = None
+    self._offsets = None
+
+  def _WriteTokens(self, session: sqlutil.Session, f, after_id: int,
+                   offsets: typing.List[int]
+                   ) -> typing.Tuple[int, typing.List[int]]:
+    """Write the tokens of contentfiles with ID greater than after_id to f.
+
+    Returns:
+      A tuple of the last written ID, and the extended offsets list.
+    """
+    last_id = after_id
+    query = session.query(
+        EncodedContentFile.id, EncodedContentFile.data).filter(
+        EncodedContentFile.id > after_id).order_by(
+        EncodedContentFile.id).yield_per(1000)
+    for last_id, data in query:
+      array = np.frombuffer(data, dtype=np.int32).astype(self.dtype)
+      array.tofile(f)
+      offsets.append(offsets[-1] + len(array))
+    return last_id, offsets
+
+  def _WriteOffsets(self, offsets: typing.List[int]) -> None:
+    """Atomically replace the offsets index."""
+    # np.save() appends a .npy suffix to paths which do not already have one,
+    # so write to a file object.
+    tmp_offsets_path = self.offsets_path.parent / (
+        self.offsets_path.name + '.tmp')
+    with open(tmp_offsets_path, 'wb') as f:
+      np.save(f, np.array(offsets, dtype=np.int64))
+    os.rename(tmp_offsets_path, self.offsets_path)
 
 
 class EncodedContentFiles(sqlutil.Database):
@@ -116,16 +345,19 @@ class EncodedContentFiles(sqlutil.Database):
   def __init__(self, path: pathlib.Path):
     super(EncodedContentFiles, self).__init__(
         f'sqlite:///{path.absolute()}', Base)
+    self.token_store_dir = path.absolute().parent
 
   def Create(self, p: preprocessed.PreprocessedContentFiles,
              atomizer: atomizers.AtomizerBase,
-             contentfile_separator: str) -> bool:
+             contentfile_separator: str, incremental: bool = False) -> bool:
     """Populate the encoded contentfiles database.
 
     Args:
       p: A PreprocessedContentFiles database.
       atomizer: An AtomizerBase instance.
       contentfile_separator: The contentfile separator.
+      incremental: If true, update the database and token store with the
+        changes to the PreprocessedContentFiles database since the last call.
 
     Returns:
       True if work was done, else False.
@@ -133,13 +365,53 @@ class EncodedContentFiles(sqlutil.Database):
     Raises:
       EmptyCorpusException: If the PreprocessedContentFiles database has
         no files.
+      VocabError: If incremental, and new files contain tokens which are not
+        in the vocabulary of the atomizer.
     """
     with self.Session() as session:
-      if not self.IsDone(session):
+      if incremental:
+        if self.RemoveStaleFiles(session, p):
+          # Removed files cannot be removed from the token store.
+          self.GetTokenStore(session).Remove()
+        num_vocab_errors = self.Import(session, p, atomizer,
+                                       contentfile_separator)
+        if num_vocab_errors:
+          raise errors.VocabError(
+              f'{num_vocab_errors} new content files contain tokens which are '
+              'not in the vocabulary of the corpus. Create a new corpus to '
+              'derive a new vocabulary.')
+        if not self.IsDone(session):
+          self.SetDone(session)
+        session.commit()
+      elif not self.IsDone(session):
         self.Import(session, p, atomizer, contentfile_separator)
         self.SetDone(session)
         session.commit()
 
+      token_store = self.GetTokenStore(session)
+      last_id = session.query(Meta.value).filter(
+          Meta.key == 'token_store_last_id').scalar()
+      if incremental and last_id is None:
+        # Token stores written before incremental updates were supported do
+        # not record their last ID, so cannot be appended to.
+        token_store.Remove()
+      start_time = time.time()
+      if not token_store.Exists():
+        dtype = TokenStoreDtype(atomizer.vocab_size)
+        session.merge(Meta(key='token_store_dtype', value=dtype.name))
+        session.commit()
+        last_id = self.GetTokenStore(session).Write(session)
+        session.merge(Meta(key='token_store_last_id', value=str(last_id)))
+        session.commit()
+        logging.info('Wrote %s token store in %s ms.', dtype.name,
+                     humanize.intcomma(int((time.time() - start_time) * 1000)))
+      elif incremental:
+        last_id = token_store.Append(session, int(last_id))
+        session.merge(Meta(key='token_store_last_id', value=str(last_id)))
+        session.commit()
+        logging.info('Appended to token store in %s ms.',
+                     humanize.intcomma(int((time.time() - start_time) * 1000)))
+
       # Logging output.
       num_files = session.query(EncodedContentFile).count()
       token_count, total_walltime, total_time, = session.query(
@@ -169,6 +441,30 @@ class EncodedContentFiles(sqlutil.Database):
     with self.Session() as session:
       return session.query(func.sum(EncodedContentFile.tokencount)).scalar()
 
+  @property
+  def token_store(self) -> TokenStore:
+    """Return the flat token store of the encoded corpus.
+
+    The store is written by Create().
+    """
+    with self.Session() as session:
+      return self.GetTokenStore(session)
+
+  def GetTokenStore(self, session: sqlutil.Session) -> TokenStore:
+    """Return the flat token store of the encoded corpus.
+
+    Args:
+      session: A database session.
+
+    Returns:
+      A TokenStore instance. The store may not yet have been written.
+    """
+    dtype = session.query(Meta.value).filter(
+        Meta.key == 'token_store_dtype').scalar()
+    return TokenStore(self.token_store_dir / 'tokens.bin',
+                      self.token_store_dir / 'offsets.npy',
+                      dtype or np.int32)
+
   def IsDone(self, session: sqlutil.Session):
     if session.query(Meta).filter(Meta.key == 'done').first():
       return True
@@ -181,41 +477,172 @@ class EncodedContentFiles(sqlutil.Database):
   def Import(self, session: sqlutil.Session,
              preprocessed_db: preprocessed.PreprocessedContentFiles,
              atomizer: atomizers.AtomizerBase,
-             contentfile_separator: str) -> None:
+             contentfile_separator: str, chunk_size: int = 256) -> int:
+    """Encode the preprocessed files which have not already been encoded.
+
+    The IDs of files to encode are streamed from the preprocessed database in
+    chunks, and each chunk is encoded by a worker process which reads the texts
+    itself. The atomizer is sent once to each worker, so the memory use of the
+    calling process is independent of the size of the corpus.
+
+    Files which contain tokens that are not in the vocabulary of the atomizer
+    are not encoded.
+
+    Args:
+      session: A database session.
+      preprocessed_db: The PreprocessedContentFiles database to encode.
+      atomizer: The atomizer to encode using.
+      contentfile_separator: The end-of-file marker.
+      chunk_size: The number of files to encode per job.
+
+    Returns:
+      The number of files which could not be encoded.
+
+    Raises:
+      EmptyCorpusException: If the PreprocessedContentFiles database has
+        no files.
+    """
     with preprocessed_db.Session() as p_session:
-      query = p_session.query(preprocessed.PreprocessedContentFile).filter(
-          preprocessed.PreprocessedContentFile.preprocessing_succeeded == True,
-          ~preprocessed.PreprocessedContentFile.id.in_(
-              session.query(EncodedContentFile.id).all()))
-      jobs = [
-        internal_pb2.EncoderWorker(
-            id=x.id, text=x.text, contentfile_separator=contentfile_separator,
-            pickled_atomizer=pickle.dumps(atomizer))
-        for x in query
-      ]
-      if not jobs:
+      succeeded = p_session.query(
+          preprocessed.PreprocessedContentFile.id).filter(
+          preprocessed.PreprocessedContentFile.preprocessing_succeeded == True)
+      total_count = succeeded.count()
+      if not total_count:
         raise errors.EmptyCorpusException(
             "Pre-processed corpus contains no files: "
             f"'{preprocessed_db.url}'")
+      todo_count = max(
+          total_count - session.query(EncodedContentFile).count(), 0)
 
       logging.info('Encoding %s of %s preprocessed files',
-                   humanize.intcomma(query.count()),
-                   humanize.intcomma(p_session.query(
-                       preprocessed.PreprocessedContentFile).filter(
-                       preprocessed.PreprocessedContentFile.preprocessing_succeeded == True).count()))
-      pool = multiprocessing.Pool()
-      bar = progressbar.ProgressBar(max_value=len(jobs))
+                   humanize.intcomma(todo_count),
+                   humanize.intcomma(total_count))
+      if not todo_count:
+        return 0
+      jobs = self._GetEncoderJobs(
+          session, succeeded.order_by(preprocessed.PreprocessedContentFile.id),
+          chunk_size)
+      processes = multiprocessing.cpu_count()
+      pool = multiprocessing.Pool(
+          processes=processes, initializer=EncoderWorkerInit,
+          initargs=(preprocessed_db.url, pickle.dumps(atomizer),
+                    contentfile_separator))
+      bar = progressbar.ProgressBar(max_value=max(todo_count, 1))
       last_commit = time.time()
       wall_time_start = time.time()
-      for encoded_cf in bar(pool.imap_unordered(EncoderWorker, jobs)):
+      num_vocab_errors = 0
+      # The results of jobs, or the exceptions which they raised, in the order
+      # in which they complete.
+      results = queue.Queue()
+
+      def AddResult() -> None:
+        """Add the encoded files of the next job to complete."""
+        nonlocal last_commit, num_vocab_errors, wall_time_start
+        result = results.get()
+        if isinstance(result, Exception):
+          raise result
+        encoded_cfs, job_vocab_errors = result
+        num_vocab_errors += job_vocab_errors
         wall_time_end = time.time()
-        # TODO(cec): Remove the if check once EncoderWorker no longer returns
-        # None on atomizer encode error.
-        if encoded_cf:
-          encoded_cf.wall_time_ms = int(
-              (wall_time_end - wall_time_start) * 1000)
+        # Attribute the wall time of a chunk evenly across its files.
+        wall_time_ms = int((wall_time_end - wall_time_start) * 1000 /
+                           max(len(encoded_cfs), 1))
+        for encoded_cf in encoded_cfs:
+          encoded_cf.wall_time_ms = wall_time_ms
           session.add(encoded_cf)
+        bar.update(min(bar.value + len(encoded_cfs), bar.max_value))
         wall_time_start = wall_time_end
         if wall_time_end - last_commit > 10:
           session.commit()
           last_commit = wall_time_end
+
+      try:
+        # The database sessions may only be used from this thread, so jobs are
+        # read from the cursor here and submitted to the pool one at a time,
+        # rather than letting the pool consume the job iterator itself. A
+        # bounded number of jobs are kept outstanding, so that the workers are
+        # always busy but the calling process does not buffer every job.
+        max_outstanding = processes * 4
+        outstanding = 0
+        for job in jobs:
+          if outstanding == max_outstanding:
+            AddResult()
+            outstanding -= 1
+          pool.apply_async(EncoderWorker, (job,), callback=results.put,
+                           error_callback=results.put)
+          outstanding += 1
+        for _ in range(outstanding):
+          AddResult()
+      finally:
+        pool.close()
+        pool.join()
+      bar.finish()
+    return num_vocab_errors
+
+  def RemoveStaleFiles(self, session: sqlutil.Session,
+                       preprocessed_db: preprocessed.PreprocessedContentFiles
+                      ) -> int:
+    """Remove encoded files which are no longer in the preprocessed database.
+
+    Args:
+      session: A database session.
+      preprocessed_db: The PreprocessedContentFiles database.
+
+    Returns:
+      The number of removed files.
+    """
+    stale_ids = []
+    with preprocessed_db.Session() as p_session:
+      query = session.query(EncodedContentFile.id).order_by(
+          EncodedContentFile.id)
+      ids = [id_ for id_, in query]
+      for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        current = set(id_ for id_, in p_session.query(
+            preprocessed.PreprocessedContentFile.id).filter(
+            preprocessed.PreprocessedContentFile.id.in_(chunk),
+            preprocessed.PreprocessedContentFile.preprocessing_succeeded ==
+            True))
+        stale_ids += [id_ for id_ in chunk if id_ not in current]
+    for i in range(0, len(stale_ids), 500):
+      session.query(EncodedContentFile).filter(
+          EncodedContentFile.id.in_(stale_ids[i:i + 500])).delete(
+          synchronize_session=False)
+    if stale_ids:
+      logging.info('Removed %s stale encoded files',
+                   humanize.intcomma(len(stale_ids)))
+    return len(stale_ids)
+
+  @staticmethod
+  def _GetEncoderJobs(
+      session: sqlutil.Session, query: sql.orm.Query,
+      chunk_size: int) -> typing.Iterator[typing.List[int]]:
+    """Yield chunks of IDs from a query which have not already been encoded.
+
+    Args:
+      session: A database session.
+      query: A query of PreprocessedContentFile IDs.
+      chunk_size: The maximum number of IDs per chunk.
+
+    Returns:
+      An iterator over lists of IDs.
+    """
+    chunk = []
+    for id_, in query.yield_per(chunk_size):
+      chunk.append(id_)
+      if len(chunk) == chunk_size:
+        chunk = _FilterEncodedIds(session, chunk)
+        if chunk:
+          yield chunk
+        chunk = []
+    chunk = _FilterEncodedIds(session, chunk)
+    if chunk:
+      yield chunk
+
+
+def _FilterEncodedIds(session: sqlutil.Session,
+                      ids: typing.List[int]) -> typing.List[int]:
+  """Return the IDs which are not yet in an EncodedContentFiles database."""
+  encoded_ids = set(id_ for id_, in session.query(EncodedContentFile.id).filter(
+      EncodedContentFile.id.in_(ids)))
+  return [id_ for id_ in ids if id_ not in encoded_ids]
@@ -133,6 +133,226 @@ def test_EncodedContentFiles_empty_preprocessed_db(
       temp_db.Create(p, abc_atomizer, '\n\n')
 
 
+def _AddPreprocessedFiles(db: preprocessed.PreprocessedContentFiles,
+                          texts, succeeded: bool = True, start_id: int = 1):
+  """Add preprocessed content files with the given texts to a database."""
+  with db.Session(commit=True) as session:
+    for i, text in enumerate(texts, start_id):
+      session.add(preprocessed.PreprocessedContentFile(
+          id=i, input_relpath=f'{i}.txt', input_sha256=b'0' * 32,
+          input_charcount=len(text), input_linecount=1, sha256=b'0' * 32,
+          charcount=len(text), linecount=1, text=text,
+          preprocessing_succeeded=succeeded, preprocess_time_ms=0,
+          wall_time_ms=0))
+
+
+def test_EncodedContentFiles_Import(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that all successfully preprocessed files are encoded."""
+  with tempfile.TemporaryDirectory() as d:
+    p = preprocessed.PreprocessedContentFiles(
+        pathlib.Path(d) / 'preprocessed.db')
+    _AddPreprocessedFiles(p, ['ab', 'cde', 'a', 'bb', 'e'])
+    _AddPreprocessedFiles(p, ['fail'], succeeded=False, start_id=6)
+    with temp_db.Session(commit=True) as session:
+      temp_db.Import(session, p, abc_atomizer, 'a', chunk_size=2)
+  with temp_db.Session() as session:
+    encoded_cfs = session.query(encoded.EncodedContentFile).order_by(
+        encoded.EncodedContentFile.id).all()
+    assert [1, 2, 3, 4, 5] == [cf.id for cf in encoded_cfs]
+    np.testing.assert_array_equal(
+        abc_atomizer.AtomizeString('cdea'), encoded_cfs[1].indices_array)
+    assert [2, 3, 1, 2, 1] == [cf.tokencount for cf in encoded_cfs]
+
+
+def test_EncodedContentFiles_Import_skips_encoded_files(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that files which are already encoded are not re-encoded."""
+  with tempfile.TemporaryDirectory() as d:
+    p = preprocessed.PreprocessedContentFiles(
+        pathlib.Path(d) / 'preprocessed.db')
+    _AddPreprocessedFiles(p, ['ab', 'cde', 'a'])
+    with temp_db.Session(commit=True) as session:
+      session.add(encoded.EncodedContentFile.FromPreprocessed(
+          preprocessed.PreprocessedContentFile(id=2, text='e'),
+          abc_atomizer, 'a'))
+    with temp_db.Session(commit=True) as session:
+      temp_db.Import(session, p, abc_atomizer, 'a', chunk_size=1)
+  with temp_db.Session() as session:
+    assert 3 == session.query(encoded.EncodedContentFile).count()
+    # The existing encoding of file 2 is unchanged.
+    assert 1 == session.query(encoded.EncodedContentFile.tokencount).filter(
+        encoded.EncodedContentFile.id == 2).scalar()
+
+
+def test_EncodedContentFiles_Import_more_jobs_than_outstanding(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer, monkeypatch):
+  """Test that jobs are submitted as outstanding jobs complete."""
+  # One worker process may have at most four outstanding jobs.
+  monkeypatch.setattr(encoded.multiprocessing, 'cpu_count', lambda: 1)
+  with tempfile.TemporaryDirectory() as d:
+    p = preprocessed.PreprocessedContentFiles(
+        pathlib.Path(d) / 'preprocessed.db')
+    _AddPreprocessedFiles(p, ['a', 'b', 'c', 'd', 'e'] * 5)
+    with temp_db.Session(commit=True) as session:
+      temp_db.Import(session, p, abc_atomizer, 'a', chunk_size=2)
+  with temp_db.Session() as session:
+    assert list(range(1, 26)) == [id_ for id_, in session.query(
+        encoded.EncodedContentFile.id).order_by(encoded.EncodedContentFile.id)]
+
+
+def test_EncodedContentFiles_Import_vocab_error(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that files which cannot be encoded are skipped."""
+  with tempfile.TemporaryDirectory() as d:
+    p = preprocessed.PreprocessedContentFiles(
+        pathlib.Path(d) / 'preprocessed.db')
+    _AddPreprocessedFiles(p, ['ab', 'xyz', 'a'])
+    with temp_db.Session(commit=True) as session:
+      assert 1 == temp_db.Import(session, p, abc_atomizer, 'a', chunk_size=2)
+  with temp_db.Session() as session:
+    assert [1, 3] == [id_ for id_, in session.query(
+        encoded.EncodedContentFile.id).order_by(encoded.EncodedContentFile.id)]
+
+
+def test_EncodedContentFiles_Create_incremental_vocab_error(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that new files must be encoded using the existing vocabulary."""
+  with tempfile.TemporaryDirectory() as d:
+    p = preprocessed.PreprocessedContentFiles(
+        pathlib.Path(d) / 'preprocessed.db')
+    _AddPreprocessedFiles(p, ['ab', 'a'])
+    temp_db.Create(p, abc_atomizer, 'a', incremental=True)
+    _AddPreprocessedFiles(p, ['b', 'xyz', 'xy'], start_id=3)
+    with pytest.raises(errors.VocabError) as e_info:
+      temp_db.Create(p, abc_atomizer, 'a', incremental=True)
+  assert str(e_info.value).startswith('2 new content files contain tokens')
+  # None of the new files are encoded.
+  assert 2 == temp_db.size
+
+
+# TokenStoreDtype() tests.
+
+def test_TokenStoreDtype_small_vocabulary():
+  """Test that a 16 bit type is used for vocabularies of up to 2^16 tokens."""
+  assert encoded.TokenStoreDtype(100) == np.uint16
+  assert encoded.TokenStoreDtype(2 ** 16 - 1) == np.uint16
+
+
+def test_TokenStoreDtype_large_vocabulary():
+  """Test that a 32 bit type is used for vocabularies of 2^16 tokens or more."""
+  assert encoded.TokenStoreDtype(2 ** 16) == np.int32
+
+
+# TokenStore tests.
+
+def test_TokenStore_Write_tokens(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that token store contains the encoded files in order of ID."""
+  with temp_db.Session(commit=True) as session:
+    session.add(encoded.EncodedContentFile.FromPreprocessed(
+        preprocessed.PreprocessedContentFile(id=2, text='cde'),
+        abc_atomizer, 'a'))
+    session.add(encoded.EncodedContentFile.FromPreprocessed(
+        preprocessed.PreprocessedContentFile(id=1, text='bb'),
+        abc_atomizer, 'a'))
+  with temp_db.Session() as session:
+    store = temp_db.GetTokenStore(session)
+    assert not store.Exists()
+    store.Write(session)
+  assert store.Exists()
+  np.testing.assert_array_equal(
+      np.array([1, 1, 0, 2, 3, 4, 0]), store.GetTokens(shuffle=False))
+  np.testing.assert_array_equal(np.array([0, 3, 7]), store.offsets)
+  assert store.num_files == 2
+  assert store.token_count == 7
+
+
+def test_TokenStore_GetTokens_shuffle(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that shuffling permutes whole files."""
+  with temp_db.Session(commit=True) as session:
+    for i, text in enumerate(['bb', 'cc', 'dd', 'ee']):
+      session.add(encoded.EncodedContentFile.FromPreprocessed(
+          preprocessed.PreprocessedContentFile(id=i, text=text),
+          abc_atomizer, 'a'))
+  with temp_db.Session() as session:
+    store = temp_db.GetTokenStore(session)
+    store.Write(session)
+  shuffled = store.GetTokens(shuffle=True)
+  assert len(shuffled) == 12
+  files = set(tuple(x) for x in shuffled.reshape(4, 3))
+  assert files == {(1, 1, 0), (2, 2, 0), (3, 3, 0), (4, 4, 0)}
+
+
+def test_TokenStore_empty(temp_db: encoded.EncodedContentFiles):
+  """Test that an empty token store can be written and read."""
+  with temp_db.Session() as session:
+    store = temp_db.GetTokenStore(session)
+    store.Write(session)
+  assert not len(store.GetTokens(shuffle=False))
+  assert not len(store.GetTokens(shuffle=True))
+  assert store.num_files == 0
+
+
+def test_TokenStore_Append(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that appended files are added to the end of the store."""
+  with temp_db.Session(commit=True) as session:
+    session.add(encoded.EncodedContentFile.FromPreprocessed(
+        preprocessed.PreprocessedContentFile(id=1, text='bb'),
+        abc_atomizer, 'a'))
+  with temp_db.Session() as session:
+    store = temp_db.GetTokenStore(session)
+    assert 1 == store.Write(session)
+  with temp_db.Session(commit=True) as session:
+    session.add(encoded.EncodedContentFile.FromPreprocessed(
+        preprocessed.PreprocessedContentFile(id=2, text='cde'),
+        abc_atomizer, 'a'))
+  with temp_db.Session() as session:
+    assert 2 == store.Append(session, 1)
+    # Appending without new files is a no-op.
+    assert 2 == store.Append(session, 2)
+  np.testing.assert_array_equal(
+      np.array([1, 1, 0, 2, 3, 4, 0]), store.GetTokens(shuffle=False))
+  np.testing.assert_array_equal(np.array([0, 3, 7]), store.offsets)
+
+
+def test_TokenStore_Append_ignores_unindexed_tokens(
+    temp_db: encoded.EncodedContentFiles,
+    abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """Test that tokens from an interrupted append are discarded."""
+  with temp_db.Session(commit=True) as session:
+    session.add(encoded.EncodedContentFile.FromPreprocessed(
+        preprocessed.PreprocessedContentFile(id=1, text='bb'),
+        abc_atomizer, 'a'))
+  with temp_db.Session() as session:
+    store = temp_db.GetTokenStore(session)
+    store.Write(session)
+  with open(store.tokens_path, 'ab') as f:
+    np.array([4, 4], dtype=store.dtype).tofile(f)
+  store = encoded.TokenStore(store.tokens_path, store.offsets_path,
+                             store.dtype)
+  np.testing.assert_array_equal(
+      np.array([1, 1, 0]), store.GetTokens(shuffle=False))
+  with temp_db.Session(commit=True) as session:
+    session.add(encoded.EncodedContentFile.FromPreprocessed(
+        preprocessed.PreprocessedContentFile(id=2, text='c'),
+        abc_atomizer, 'a'))
+  with temp_db.Session() as session:
+    store.Append(session, 1)
+  np.testing.assert_array_equal(
+      np.array([1, 1, 0, 2, 0]), store.GetTokens(shuffle=False))
+
+
 def main(argv):
   """Main entry point."""
   del argv
@@ -20,6 +20,7 @@ from sqlalchemy.ext import declarative
 from sqlalchemy.sql import func
 
 from deeplearning.clgen import errors
+from deeplearning.clgen.corpuses import preprocessing_cache
 from deeplearning.clgen.preprocessors import preprocessors
 from deeplearning.clgen.proto import corpus_pb2
 from deeplearning.clgen.proto import internal_pb2
@@ -31,6 +32,9 @@ FLAGS = flags.FLAGS
 
 Base = declarative.declarative_base()
 
+# Errors which are raised if a preprocessor times out.
+_TIMEOUT_ERRORS = (errors.ClangTimeout, errors.GPUVerifyTimeoutException)
+
 
 class Meta(Base):
   __tablename__ = 'meta'
@@ -67,6 +71,10 @@ class PreprocessedContentFile(Base):
   wall_time_ms: int = sql.Column(sql.Integer, nullable=False)
   date_added: datetime.datetime = sql.Column(sql.DateTime, nullable=False,
                                              default=datetime.datetime.utcnow)
+  # True if pre-processing failed because a preprocessor timed out. This is not
+  # stored in the database. Timeouts may be transient, so the outcome is not
+  # added to the pre-processing cache.
+  preprocessing_timed_out: bool = False
 
   @property
   def input_sha256_hex(self) -> str:
@@ -81,25 +89,48 @@ class PreprocessedContentFile(Base):
   @classmethod
   def FromContentFile(
       cls, contentfile_root: pathlib.Path, relpath: pathlib.Path,
-      preprocessors_: typing.List[str]) -> 'PreprocessedContentFile':
-    """Instantiate a PreprocessedContentFile."""
+      preprocessors_: typing.List[str],
+      cached: typing.Optional[typing.Tuple[str, bool]] = None,
+      input_sha256: typing.Optional[bytes] = None
+  ) -> 'PreprocessedContentFile':
+    """Instantiate a PreprocessedContentFile.
+
+    Args:
+      contentfile_root: The root directory of the content files.
+      relpath: The path of the content file, relative to contentfile_root.
+      preprocessors_: The list of preprocessors to run.
+      cached: An optional tuple of pre-processed text and pre-processing
+        outcome, as returned by PreprocessingCache.Get(). If provided, the
+        preprocessors are not run.
+      input_sha256: The sha256 of the content file, if the caller has already
+        computed it.
+
+    Returns:
+      A PreprocessedContentFile instance.
+    """
     start_time = time.time()
     preprocessing_succeeded = False
+    preprocessing_timed_out = False
     try:
       with open(contentfile_root / relpath) as f:
         input_text = f.read()
-      text = preprocessors.Preprocess(input_text, preprocessors_)
-      preprocessing_succeeded = True
+      if cached:
+        text, preprocessing_succeeded = cached
+      else:
+        text = preprocessors.Preprocess(input_text, preprocessors_)
+        preprocessing_succeeded = True
     except UnicodeDecodeError as e:
       text = 'Unicode error'
     except errors.BadCodeException as e:
       text = str(e)
+      preprocessing_timed_out = isinstance(e, _TIMEOUT_ERRORS)
     end_time = time.time()
     preprocess_time_ms = int((end_time - start_time) * 1000)
     input_text_stripped = input_text.strip()
-    return cls(
+    preprocessed_cf = cls(
         input_relpath=relpath,
-        input_sha256=GetFileSha256(contentfile_root / relpath),
+        input_sha256=(input_sha256 or
+                      GetFileSha256(contentfile_root / relpath)),
         input_charcount=len(input_text_stripped),
         input_linecount=len(input_text_stripped.split('\n')),
         sha256=hashlib.sha256(text.encode('utf-8')).digest(),
@@ -111,13 +142,52 @@ class PreprocessedContentFile(Base):
         wall_time_ms=preprocess_time_ms,  # The outer-loop may change this.
         date_added=datetime.datetime.utcnow(),
     )
+    preprocessed_cf.preprocessing_timed_out = preprocessing_timed_out
+    return preprocessed_cf
+
+
+# The state of a pre-processor worker process, set by PreprocessorWorkerInit().
+_preprocessor_worker_state = {}
+
+
+def PreprocessorWorkerInit(
+    preprocessing_cache_path: typing.Optional[str],
+    toolchain: typing.Optional[str] = None) -> None:
+  """Initialize a pre-processor worker process.
+
+  Args:
+    preprocessing_cache_path: The path of a PreprocessingCache database to read
+      from, or None to disable the cache.
+    toolchain: The fingerprint of the preprocessors, as returned by
+      preprocessing_cache.ToolchainFingerprint(). Required if
+      preprocessing_cache_path is set.
+  """
+  _preprocessor_worker_state['preprocessing_cache'] = (
+      preprocessing_cache.PreprocessingCache(
+          pathlib.Path(preprocessing_cache_path), 0)
+      if preprocessing_cache_path else None)
+  _preprocessor_worker_state['toolchain'] = toolchain
 
 
 def PreprocessorWorker(
-    job: internal_pb2.PreprocessorWorker) -> PreprocessedContentFile:
-  """The inner loop of a parallelizable pre-processing job."""
+    job: internal_pb2.PreprocessorWorker
+) -> typing.Tuple[PreprocessedContentFile, bool]:
+  """The inner loop of a parallelizable pre-processing job.
+
+  Returns:
+    A tuple of the pre-processed content file, and whether the pre-processed
+    text was read from the pre-processing cache.
+  """
+  contentfile_root = pathlib.Path(job.contentfile_root)
+  input_sha256 = GetFileSha256(contentfile_root / job.relpath)
+  cache = _preprocessor_worker_state.get('preprocessing_cache')
+  cached = None
+  if cache:
+    cached = cache.Get(cache.Key(input_sha256, job.preprocessors,
+                                 _preprocessor_worker_state['toolchain']))
   return PreprocessedContentFile.FromContentFile(
-      pathlib.Path(job.contentfile_root), job.relpath, job.preprocessors)
+      contentfile_root, job.relpath, job.preprocessors, cached=cached,
+      input_sha256=input_sha256), cached is not None
 
 
 class PreprocessedContentFiles(sqlutil.Database):
@@ -127,11 +197,24 @@ class PreprocessedContentFiles(sqlutil.Database):
     super(PreprocessedContentFiles, self).__init__(
         f'sqlite:///{path.absolute()}', Base)
 
-  def Create(self, config: corpus_pb2.Corpus):
+  def Create(self, config: corpus_pb2.Corpus,
+             preprocessing_cache_: typing.Optional[
+               preprocessing_cache.PreprocessingCache] = None):
+    """Populate the pre-processed contentfiles database.
+
+    For incremental corpuses, the database is updated with the changes to the
+    content files every time this is called.
+
+    Args:
+      config: A Corpus proto.
+      preprocessing_cache_: An optional cache of pre-processed texts which is
+        shared across corpuses.
+    """
     with self.Session() as session:
-      if not self.IsDone(session):
-        self.Import(session, config)
-        self.SetDone(session)
+      if config.incremental or not self.IsDone(session):
+        self.Import(session, config, preprocessing_cache_)
+        if not self.IsDone(session):
+          self.SetDone(session)
         session.commit()
 
       # Logging output.
@@ -148,6 +231,10 @@ class PreprocessedContentFiles(sqlutil.Database):
           func.sum(PreprocessedContentFile.charcount),
           func.sum(PreprocessedContentFile.linecount),
       ).filter(PreprocessedContentFile.preprocessing_succeeded == True).first()
+      cache_hits = int(session.query(Meta.value).filter(
+          Meta.key == 'preprocessing_cache_hits').scalar() or 0)
+      cache_misses = int(session.query(Meta.value).filter(
+          Meta.key == 'preprocessing_cache_misses').scalar() or 0)
     logging.info('Content files: %s chars, %s lines, %s files.',
                  humanize.intcomma(input_chars),
                  humanize.intcomma(input_lines),
@@ -155,6 +242,11 @@ class PreprocessedContentFiles(sqlutil.Database):
     logging.info('Pre-processed %s files in %s ms (%.2fx speedup).',
                  num_input_files, humanize.intcomma(total_walltime),
                  (total_time or 0) / (total_walltime or 1))
+    if cache_hits + cache_misses:
+      logging.info('Pre-processing cache: %s hits, %s misses '
+                   '(%.1f%% hit rate).', humanize.intcomma(cache_hits),
+                   humanize.intcomma(cache_misses),
+                   cache_hits / (cache_hits + cache_misses) * 100)
     logging.info('Pre-processing discard rate: %.1f%% (%s files).',
                  (1 - (num_files / max(num_input_files, 1))) * 100,
                  humanize.intcomma(num_input_files - num_files))
@@ -172,11 +264,24 @@ class PreprocessedContentFiles(sqlutil.Database):
     session.add(Meta(key='done', value='yes'))
 
   def Import(self, session: sqlutil.Session,
-             config: corpus_pb2.Corpus) -> None:
+             config: corpus_pb2.Corpus,
+             preprocessing_cache_: typing.Optional[
+               preprocessing_cache.PreprocessingCache] = None) -> None:
     with self.GetContentFileRoot(config) as contentfile_root:
       relpaths = set(self.GetImportRelpaths(contentfile_root))
-      done = set(
-          [x[0] for x in session.query(PreprocessedContentFile.input_relpath)])
+      if config.incremental:
+        done = self._RemoveStaleContentFiles(session, contentfile_root,
+                                             relpaths)
+        # IDs are never reused, so that encoded files which were derived from
+        # removed rows can be identified.
+        next_id = max(
+            int(session.query(Meta.value).filter(
+                Meta.key == 'next_id').scalar() or 0),
+            (session.query(func.max(PreprocessedContentFile.id)).scalar() or
+             0) + 1)
+      else:
+        done = set([x[0] for x in session.query(
+            PreprocessedContentFile.input_relpath)])
       todo = relpaths - done
       logging.info('Preprocessing %s of %s content files',
                    humanize.intcomma(len(todo)),
@@ -186,19 +291,102 @@ class PreprocessedContentFiles(sqlutil.Database):
             contentfile_root=str(contentfile_root),
             relpath=t, preprocessors=config.preprocessor)
         for t in todo]
-      pool = multiprocessing.Pool()
+      toolchain = (
+        preprocessing_cache.ToolchainFingerprint(config.preprocessor)
+        if preprocessing_cache_ else None)
+      pool = multiprocessing.Pool(
+          initializer=PreprocessorWorkerInit,
+          initargs=(preprocessing_cache_.url[len('sqlite:///'):]
+                    if preprocessing_cache_ else None, toolchain))
       bar = progressbar.ProgressBar(max_value=len(jobs))
       last_commit = time.time()
       wall_time_start = time.time()
-      for preprocessed_cf in bar(pool.imap_unordered(PreprocessorWorker, jobs)):
-        wall_time_end = time.time()
-        preprocessed_cf.wall_time_ms = (
-          int((wall_time_end - wall_time_start) * 1000))
-        wall_time_start = wall_time_end
-        session.add(preprocessed_cf)
-        if wall_time_end - last_commit > 10:
-          session.commit()
-          last_commit = wall_time_end
+      cache_hits, cache_misses = 0, 0
+      # The keys of cache hits which have not yet been marked as used.
+      touched = []
+      with contextlib.ExitStack() as stack:
+        cache_session = (stack.enter_context(preprocessing_cache_.Session())
+                         if preprocessing_cache_ else None)
+        for preprocessed_cf, cache_hit in bar(
+            pool.imap_unordered(PreprocessorWorker, jobs)):
+          wall_time_end = time.time()
+          preprocessed_cf.wall_time_ms = (
+            int((wall_time_end - wall_time_start) * 1000))
+          wall_time_start = wall_time_end
+          if config.incremental:
+            preprocessed_cf.id = next_id
+            next_id += 1
+          session.add(preprocessed_cf)
+          if cache_session:
+            key = preprocessing_cache_.Key(preprocessed_cf.input_sha256,
+                                           config.preprocessor, toolchain)
+            if cache_hit:
+              cache_hits += 1
+              touched.append(key)
+            else:
+              cache_misses += 1
+              if not preprocessed_cf.preprocessing_timed_out:
+                preprocessing_cache_.Put(
+                    cache_session, key, preprocessed_cf.text,
+                    preprocessed_cf.preprocessing_succeeded)
+          if wall_time_end - last_commit > 10:
+            session.commit()
+            if cache_session:
+              preprocessing_cache_.Touch(cache_session, touched)
+              touched = []
+              cache_session.commit()
+            last_commit = wall_time_end
+        if cache_session:
+          preprocessing_cache_.Touch(cache_session, touched)
+          preprocessing_cache_.Evict(cache_session)
+          cache_session.commit()
+          self._AddPreprocessingCacheStats(session, cache_hits, cache_misses)
+      if config.incremental:
+        session.merge(Meta(key='next_id', value=str(next_id)))
+
+  @staticmethod
+  def _RemoveStaleContentFiles(session: sqlutil.Session,
+                               contentfile_root: pathlib.Path,
+                               relpaths: typing.Set[str]) -> typing.Set[str]:
+    """Remove the rows of content files which have been removed or changed.
+
+    A content file has changed if the checksum of the input file differs from
+    the checksum of when it was pre-processed.
+
+    Args:
+      session: A database session.
+      contentfile_root: The root directory of the content files.
+      relpaths: The relative paths of the current content files.
+
+    Returns:
+      The set of relative paths of the content files which are unchanged.
+    """
+    unchanged, stale_ids = set(), []
+    query = session.query(PreprocessedContentFile.id,
+                          PreprocessedContentFile.input_relpath,
+                          PreprocessedContentFile.input_sha256)
+    for id_, relpath, input_sha256 in query:
+      if (relpath in relpaths and
+          GetFileSha256(contentfile_root / relpath) == input_sha256):
+        unchanged.add(relpath)
+      else:
+        stale_ids.append(id_)
+    for i in range(0, len(stale_ids), 500):
+      session.query(PreprocessedContentFile).filter(
+          PreprocessedContentFile.id.in_(stale_ids[i:i + 500])).delete(
+          synchronize_session=False)
+    logging.info('Removed %s stale content files',
+                 humanize.intcomma(len(stale_ids)))
+    return unchanged
+
+  @staticmethod
+  def _AddPreprocessingCacheStats(session: sqlutil.Session, hits: int,
+                                  misses: int) -> None:
+    """Accumulate the pre-processing cache hit and miss counts."""
+    for key, count in [('preprocessing_cache_hits', hits),
+                       ('preprocessing_cache_misses', misses)]:
+      previous = session.query(Meta.value).filter(Meta.key == key).scalar()
+      session.merge(Meta(key=key, value=str(int(previous or 0) + count)))
 
   @contextlib.contextmanager
   def GetContentFileRoot(self, config: corpus_pb2.Corpus) -> pathlib.Path:
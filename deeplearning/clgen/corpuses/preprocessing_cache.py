@@ -0,0 +1,221 @@
+"""A content-addressed cache of pre-processed content files.
+
+Pre-processing is expensive, and the same content files are commonly
+pre-processed for many corpuses. This cache stores the output of a
+pre-processing pipeline, keyed by the checksum of the input file, the list
+of preprocessors, and a fingerprint of the preprocessors' implementation, so
+that it can be shared across corpuses.
+"""
+import hashlib
+import inspect
+import pathlib
+import sys
+import time
+import types
+import typing
+
+import sqlalchemy as sql
+from absl import flags
+from absl import logging
+from sqlalchemy.ext import declarative
+from sqlalchemy.sql import func
+
+from deeplearning.clgen.preprocessors import preprocessors
+from labm8 import sqlutil
+
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer(
+    'clgen_preprocessing_cache_size_mb', 1024,
+    'The maximum size of the pre-processing cache which is shared across '
+    'corpuses, in megabytes. When the cache exceeds this size, the least '
+    'recently used entries are evicted. A value of 0 disables the cache.')
+
+Base = declarative.declarative_base()
+
+# The maximum number of keys in a single IN clause. Older versions of SQLite
+# limit the number of host parameters in a query to 999.
+_MAX_KEYS_PER_QUERY = 500
+
+# The top level packages of the modules which are included in a toolchain
+# fingerprint. See ToolchainFingerprint().
+_FINGERPRINT_PACKAGES = {'compilers', 'deeplearning'}
+
+
+class PreprocessingCacheEntry(Base):
+  """The output of a pre-processing pipeline for a single input file."""
+  __tablename__ = 'entries'
+
+  # The hexadecimal checksum of the input file, preprocessors, and toolchain,
+  # as returned by PreprocessingCache.Key().
+  key: str = sql.Column(sql.String(64), primary_key=True)
+  text: str = sql.Column(sql.UnicodeText(), nullable=False)
+  preprocessing_succeeded: bool = sql.Column(sql.Boolean, nullable=False)
+  # The number of bytes of the UTF-8 encoded text.
+  size: int = sql.Column(sql.Integer, nullable=False)
+  # The number of milliseconds since the epoch that the entry was last used.
+  last_access: int = sql.Column(sql.Integer, nullable=False, index=True)
+
+
+class PreprocessingCache(sqlutil.Database):
+  """A size-bounded, least-recently-used cache of pre-processed texts."""
+
+  def __init__(self, path: pathlib.Path, max_size: int):
+    """Instantiate a pre-processing cache.
+
+    Args:
+      path: The path of the cache database.
+      max_size: The maximum total size of cached texts, in bytes.
+    """
+    super(PreprocessingCache, self).__init__(
+        f'sqlite:///{path.absolute()}', Base)
+    self.max_size = max_size
+
+  @staticmethod
+  def Key(input_sha256: bytes, preprocessors_: typing.List[str],
+          toolchain: str) -> str:
+    """Return the cache key for an input file and pre-processing pipeline.
+
+    Args:
+      input_sha256: The sha256 digest of the input file.
+      preprocessors_: The list of preprocessors which are applied to the file.
+      toolchain: The fingerprint of the preprocessors, as returned by
+        ToolchainFingerprint().
+
+    Returns:
+      A 64 character hexadecimal string.
+    """
+    hash_ = hashlib.sha256(input_sha256)
+    hash_.update('\n'.join(preprocessors_).encode('utf-8'))
+    hash_.update(toolchain.encode('utf-8'))
+    return hash_.hexdigest()
+
+  def Get(self, key: str) -> typing.Optional[typing.Tuple[str, bool]]:
+    """Look up a cache entry.
+
+    This does not modify the cache. Use Touch() to mark entries as used.
+
+    Args:
+      key: The key of the entry, as returned by Key().
+
+    Returns:
+      A tuple of the pre-processed text and whether pre-processing succeeded,
+      or None if the key is not in the cache.
+    """
+    with self.Session() as session:
+      return session.query(
+          PreprocessingCacheEntry.text,
+          PreprocessingCacheEntry.preprocessing_succeeded).filter(
+          PreprocessingCacheEntry.key == key).first()
+
+  def Put(self, session: sqlutil.Session, key: str, text: str,
+          preprocessing_succeeded: bool) -> None:
+    """Add an entry to the cache, replacing any existing entry.
+
+    Args:
+      session: A session of this database.
+      key: The key of the entry, as returned by Key().
+      text: The pre-processed text.
+      preprocessing_succeeded: Whether pre-processing succeeded.
+    """
+    session.merge(PreprocessingCacheEntry(
+        key=key, text=text, preprocessing_succeeded=preprocessing_succeeded,
+        size=len(text.encode('utf-8')), last_access=_NowMs()))
+
+  def Touch(self, session: sqlutil.Session, keys: typing.List[str]) -> None:
+    """Mark cache entries as used now.
+
+    Args:
+      session: A session of this database.
+      keys: The keys of the entries.
+    """
+    now = _NowMs()
+    for i in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+      session.query(PreprocessingCacheEntry).filter(
+          PreprocessingCacheEntry.key.in_(
+              keys[i:i + _MAX_KEYS_PER_QUERY])).update(
+          {'last_access': now}, synchronize_session=False)
+
+  def Evict(self, session: sqlutil.Session) -> int:
+    """Evict least recently used entries until the cache fits in max_size.
+
+    Args:
+      session: A session of this database.
+
+    Returns:
+      The number of evicted entries.
+    """
+    size = session.query(func.sum(PreprocessingCacheEntry.size)).scalar() or 0
+    if size <= self.max_size:
+      return 0
+    evict = []
+    query = session.query(
+        PreprocessingCacheEntry.key, PreprocessingCacheEntry.size).order_by(
+        PreprocessingCacheEntry.last_access).yield_per(1000)
+    for key, entry_size in query:
+      if size <= self.max_size:
+        break
+      evict.append(key)
+      size -= entry_size
+    for i in range(0, len(evict), _MAX_KEYS_PER_QUERY):
+      session.query(PreprocessingCacheEntry).filter(
+          PreprocessingCacheEntry.key.in_(
+              evict[i:i + _MAX_KEYS_PER_QUERY])).delete(
+          synchronize_session=False)
+    logging.info('Evicted %d entries from pre-processing cache', len(evict))
+    return len(evict)
+
+
+def ToolchainFingerprint(preprocessors_: typing.List[str]) -> str:
+  """Return a fingerprint of the implementation of a pre-processing pipeline.
+
+  The fingerprint covers the source code of the modules which implement the
+  preprocessors, and of the modules in this repository which they use, and the
+  size and modification time of the files which those modules reference, such
+  as the clang binary. Changing a preprocessor or upgrading the toolchain
+  changes the fingerprint, so that texts which were pre-processed by an older
+  version are not read from the cache.
+
+  Args:
+    preprocessors_: The list of preprocessors.
+
+  Returns:
+    A 64 character hexadecimal string.
+
+  Raises:
+    UserError: If the requested preprocessors cannot be loaded.
+  """
+  hash_ = hashlib.sha256()
+  todo = [inspect.getmodule(preprocessors.GetPreprocessorFunction(p))
+          for p in sorted(set(preprocessors_))]
+  visited = set()
+  while todo:
+    module = todo.pop()
+    if module is None or module.__name__ in visited:
+      continue
+    visited.add(module.__name__)
+    hash_.update(module.__name__.encode('utf-8'))
+    if getattr(module, '__file__', None):
+      hash_.update(pathlib.Path(module.__file__).read_bytes())
+    for name, value in sorted(vars(module).items()):
+      if isinstance(value, types.ModuleType):
+        dependency = value
+      elif inspect.isfunction(value) or inspect.isclass(value):
+        dependency = sys.modules.get(value.__module__)
+      elif isinstance(value, pathlib.Path) and value.is_file():
+        stat = value.stat()
+        hash_.update(
+            f'{name}={value}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+        continue
+      else:
+        continue
+      if (dependency and
+          dependency.__name__.split('.')[0] in _FINGERPRINT_PACKAGES):
+        todo.append(dependency)
+  return hash_.hexdigest()
+
+
+def _NowMs() -> int:
+  """Return the number of milliseconds since the epoch."""
+  return int(time.time() * 1000)
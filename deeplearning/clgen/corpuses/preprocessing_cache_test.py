@@ -0,0 +1,242 @@
+"""Unit tests for //deeplearning/clgen/corpuses/preprocessing_cache.py."""
+import pathlib
+import sys
+import tempfile
+
+import pytest
+from absl import app
+
+from deeplearning.clgen.corpuses import preprocessed
+from deeplearning.clgen.corpuses import preprocessing_cache
+from deeplearning.clgen.proto import corpus_pb2
+from deeplearning.clgen.proto import internal_pb2
+
+
+# A cheap preprocessor which does not require any external tools.
+STRIP_EMPTY_LINES = (
+  'deeplearning.clgen.preprocessors.common:StripDuplicateEmptyLines')
+
+
+@pytest.fixture(scope='function')
+def cache() -> preprocessing_cache.PreprocessingCache:
+  """A test fixture which returns an empty cache."""
+  with tempfile.TemporaryDirectory() as d:
+    yield preprocessing_cache.PreprocessingCache(
+        pathlib.Path(d) / 'cache.db', 1024)
+
+
+# A module which defines preprocessors for testing. TOOL is a file which is
+# referenced by the module, like the clang binary of the clang preprocessors.
+TEST_PREPROCESSORS_MODULE = """
+import pathlib
+
+from deeplearning.clgen import errors
+from deeplearning.clgen.preprocessors import public
+
+TOOL = pathlib.Path(__file__).parent / 'tool'
+
+
+@public.clgen_preprocessor
+def Timeout(text: str) -> str:
+  if text == 'timeout':
+    raise errors.ClangTimeout('Clang timed out after 60s')
+  if text == 'error':
+    raise errors.ClangException('Clang failed')
+  return text
+"""
+
+
+@pytest.fixture(scope='function')
+def test_preprocessors(monkeypatch) -> pathlib.Path:
+  """A test fixture which returns the directory of a preprocessors module."""
+  with tempfile.TemporaryDirectory() as d:
+    d = pathlib.Path(d)
+    (d / 'preprocessing_cache_test_preprocessors.py').write_text(
+        TEST_PREPROCESSORS_MODULE)
+    (d / 'tool').write_text('version 1')
+    monkeypatch.syspath_prepend(str(d))
+    yield d
+    sys.modules.pop('preprocessing_cache_test_preprocessors', None)
+
+
+def test_PreprocessingCache_Key_preprocessors():
+  """Test that keys depend on the list of preprocessors."""
+  key = preprocessing_cache.PreprocessingCache.Key
+  assert key(b'a', ['a', 'b'], 't') == key(b'a', ['a', 'b'], 't')
+  assert key(b'a', ['a', 'b'], 't') != key(b'a', ['b', 'a'], 't')
+  assert key(b'a', ['a', 'b'], 't') != key(b'a', ['a'], 't')
+  assert key(b'a', ['a'], 't') != key(b'b', ['a'], 't')
+  assert 64 == len(key(b'a', [], 't'))
+
+
+def test_PreprocessingCache_Key_toolchain():
+  """Test that keys depend on the toolchain fingerprint."""
+  key = preprocessing_cache.PreprocessingCache.Key
+  assert key(b'a', ['a'], 't') != key(b'a', ['a'], 'u')
+
+
+def test_ToolchainFingerprint_preprocessors(test_preprocessors):
+  """Test that the fingerprint depends on the preprocessors' modules."""
+  del test_preprocessors
+  fingerprint = preprocessing_cache.ToolchainFingerprint
+  assert fingerprint([STRIP_EMPTY_LINES]) == fingerprint([STRIP_EMPTY_LINES])
+  assert 64 == len(fingerprint([STRIP_EMPTY_LINES]))
+  assert fingerprint([STRIP_EMPTY_LINES]) != fingerprint(
+      [STRIP_EMPTY_LINES, 'preprocessing_cache_test_preprocessors:Timeout'])
+
+
+def test_ToolchainFingerprint_toolchain_upgrade(test_preprocessors):
+  """Test that the fingerprint changes if a referenced file changes."""
+  preprocessor = 'preprocessing_cache_test_preprocessors:Timeout'
+  before = preprocessing_cache.ToolchainFingerprint([preprocessor])
+  (test_preprocessors / 'tool').write_text('version 2.0')
+  assert preprocessing_cache.ToolchainFingerprint([preprocessor]) != before
+
+
+def test_ToolchainFingerprint_source_change(test_preprocessors):
+  """Test that the fingerprint changes if a preprocessor module changes."""
+  preprocessor = 'preprocessing_cache_test_preprocessors:Timeout'
+  before = preprocessing_cache.ToolchainFingerprint([preprocessor])
+  path = test_preprocessors / 'preprocessing_cache_test_preprocessors.py'
+  path.write_text(path.read_text() + '\n# A change.\n')
+  assert preprocessing_cache.ToolchainFingerprint([preprocessor]) != before
+
+
+def test_PreprocessingCache_Get_miss(
+    cache: preprocessing_cache.PreprocessingCache):
+  """Test that Get() returns None for a missing key."""
+  assert cache.Get('0' * 64) is None
+
+
+def test_PreprocessingCache_Put_Get(
+    cache: preprocessing_cache.PreprocessingCache):
+  """Test that Get() returns an entry added by Put()."""
+  with cache.Session(commit=True) as session:
+    cache.Put(session, 'a', 'hello', True)
+    cache.Put(session, 'b', 'error', False)
+  assert ('hello', True) == tuple(cache.Get('a'))
+  assert ('error', False) == tuple(cache.Get('b'))
+
+
+def test_PreprocessingCache_Evict_under_max_size(
+    cache: preprocessing_cache.PreprocessingCache):
+  """Test that nothing is evicted if the cache fits in max_size."""
+  with cache.Session(commit=True) as session:
+    cache.Put(session, 'a', 'x' * 1024, True)
+    assert 0 == cache.Evict(session)
+  assert cache.Get('a')
+
+
+def test_PreprocessingCache_Evict_least_recently_used(
+    cache: preprocessing_cache.PreprocessingCache):
+  """Test that the least recently used entries are evicted first."""
+  with cache.Session(commit=True) as session:
+    cache.Put(session, 'a', 'x' * 400, True)
+    cache.Put(session, 'b', 'x' * 400, True)
+    cache.Put(session, 'c', 'x' * 400, True)
+    session.query(preprocessing_cache.PreprocessingCacheEntry).update(
+        {'last_access': 0})
+    cache.Touch(session, ['a', 'c'])
+    assert 1 == cache.Evict(session)
+  assert cache.Get('a')
+  assert cache.Get('b') is None
+  assert cache.Get('c')
+
+
+def test_PreprocessedContentFiles_Create_cache_hits(
+    cache: preprocessing_cache.PreprocessingCache):
+  """Test that a second corpus with the same files is read from the cache."""
+  with tempfile.TemporaryDirectory() as d:
+    d = pathlib.Path(d)
+    (d / 'contentfiles').mkdir()
+    (d / 'contentfiles' / 'a.txt').write_text('a\n\n\nb')
+    (d / 'contentfiles' / 'b.txt').write_text('c')
+    config = corpus_pb2.Corpus(local_directory=str(d / 'contentfiles'),
+                               preprocessor=[STRIP_EMPTY_LINES])
+
+    first = preprocessed.PreprocessedContentFiles(d / 'first.db')
+    first.Create(config, cache)
+    second = preprocessed.PreprocessedContentFiles(d / 'second.db')
+    second.Create(config, cache)
+
+    with first.Session() as session:
+      first_texts = sorted(
+          x.text for x in session.query(preprocessed.PreprocessedContentFile))
+      assert '0' == session.query(preprocessed.Meta.value).filter(
+          preprocessed.Meta.key == 'preprocessing_cache_hits').scalar()
+      assert '2' == session.query(preprocessed.Meta.value).filter(
+          preprocessed.Meta.key == 'preprocessing_cache_misses').scalar()
+    with second.Session() as session:
+      second_texts = sorted(
+          x.text for x in session.query(preprocessed.PreprocessedContentFile))
+      assert '2' == session.query(preprocessed.Meta.value).filter(
+          preprocessed.Meta.key == 'preprocessing_cache_hits').scalar()
+      assert '0' == session.query(preprocessed.Meta.value).filter(
+          preprocessed.Meta.key == 'preprocessing_cache_misses').scalar()
+    assert ['a\n\nb', 'c'] == first_texts
+    assert first_texts == second_texts
+
+
+def test_PreprocessedContentFiles_Create_timeouts_not_cached(
+    cache: preprocessing_cache.PreprocessingCache, test_preprocessors):
+  """Test that files which time out are pre-processed again."""
+  with tempfile.TemporaryDirectory() as d:
+    d = pathlib.Path(d)
+    (d / 'contentfiles').mkdir()
+    (d / 'contentfiles' / 'a.txt').write_text('timeout')
+    (d / 'contentfiles' / 'b.txt').write_text('error')
+    (d / 'contentfiles' / 'c.txt').write_text('c')
+    config = corpus_pb2.Corpus(
+        local_directory=str(d / 'contentfiles'),
+        preprocessor=['preprocessing_cache_test_preprocessors:Timeout'])
+
+    preprocessed.PreprocessedContentFiles(d / 'first.db').Create(config, cache)
+    second = preprocessed.PreprocessedContentFiles(d / 'second.db')
+    second.Create(config, cache)
+
+    # Only the rejection which is not a timeout, and the success, are cached.
+    with cache.Session() as session:
+      assert 2 == session.query(
+          preprocessing_cache.PreprocessingCacheEntry).count()
+    with second.Session() as session:
+      assert '2' == session.query(preprocessed.Meta.value).filter(
+          preprocessed.Meta.key == 'preprocessing_cache_hits').scalar()
+      assert '1' == session.query(preprocessed.Meta.value).filter(
+          preprocessed.Meta.key == 'preprocessing_cache_misses').scalar()
+
+
+def test_PreprocessorWorker_hashes_file_once(
+    cache: preprocessing_cache.PreprocessingCache, monkeypatch):
+  """Test that a pre-processing job hashes its content file once."""
+  hashed = []
+  get_file_sha256 = preprocessed.GetFileSha256
+
+  def GetFileSha256(path: pathlib.Path) -> bytes:
+    hashed.append(path)
+    return get_file_sha256(path)
+
+  monkeypatch.setattr(preprocessed, 'GetFileSha256', GetFileSha256)
+  monkeypatch.setattr(preprocessed, '_preprocessor_worker_state', {})
+  with tempfile.TemporaryDirectory() as d:
+    d = pathlib.Path(d)
+    (d / 'a.txt').write_text('a\n\n\nb')
+    preprocessed.PreprocessorWorkerInit(cache.url[len('sqlite:///'):],
+                                        'toolchain')
+    cf, cache_hit = preprocessed.PreprocessorWorker(
+        internal_pb2.PreprocessorWorker(contentfile_root=str(d),
+                                        relpath='a.txt',
+                                        preprocessors=[STRIP_EMPTY_LINES]))
+  assert [d / 'a.txt'] == hashed
+  assert not cache_hit
+  assert 'a\n\nb' == cf.text
+
+
+def main(argv):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError('Unrecognized command line flags.')
+  sys.exit(pytest.main([__file__, '-v']))
+
+
+if __name__ == '__main__':
+  app.run(main)
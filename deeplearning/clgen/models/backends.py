@@ -1,4 +1,5 @@
 """Neural network backends for CLgen models."""
+import itertools
 import typing
 
 import numpy as np
@@ -8,10 +9,18 @@ from deeplearning.clgen import samplers
 from deeplearning.clgen.corpuses import atomizers
 from deeplearning.clgen.proto import model_pb2
 from labm8 import cache
+from labm8 import labdate
 
 
 FLAGS = flags.FLAGS
 
+flags.DEFINE_bool(
+    'clgen_continuous_batching', False,
+    'If set, sample using continuous batching. Rather than waiting for every '
+    'sample in a batch to complete before starting a new batch, the slot of '
+    'each completed sample is immediately reset to the start text and begins '
+    'a new sample.')
+
 
 class BackendBase(object):
   """The base class for a language model backend.
@@ -24,6 +33,8 @@ class BackendBase(object):
     self.config = config
     self.cache = fs_cache
     self.atomizer = atomizer
+    # The random number generator used for sampling. Set by InitSampling().
+    self.rng = np.random.RandomState()
 
   def Train(self, corpus: 'Corpus') -> None:
     """Train the backend."""
@@ -46,3 +57,171 @@ class BackendBase(object):
       A numpy array of int32 values with shape (batch_size,).
     """
     raise NotImplementedError
+
+  def ResetSampleRows(self, sampler: samplers.Sampler,
+                      rows: np.ndarray) -> None:
+    """Reset samples in the current sample batch to the seeded start state.
+
+    The reset rows continue sampling from the state produced by the start text
+    in InitSampleBatch(), without re-seeding the model. Only called after
+    InitSampleBatch().
+
+    Args:
+      sampler: The sampler to sample using.
+      rows: An array of the row numbers of the samples to reset.
+    """
+    raise NotImplementedError
+
+  def SampleBatch(self, sampler: samplers.Sampler,
+                  atomizer: atomizers.AtomizerBase,
+                  batch_size: int) -> typing.Iterator[model_pb2.Sample]:
+    """Sample a batch until every sample in the batch is complete.
+
+    Only called after InitSampling().
+
+    Args:
+      sampler: The sampler to sample using.
+      atomizer: The atomizer to decode completed samples using.
+      batch_size: The number of samples in the batch.
+
+    Returns:
+      An iterator over Sample protos, in the order that they are completed.
+    """
+    state = samplers.SampleBatchState(sampler, batch_size)
+    start_time = labdate.MillisecondsTimestamp()
+    wall_time_start = start_time
+
+    self.InitSampleBatch(sampler, batch_size)
+
+    # Sampling loop. Continues until all samples in the batch are done.
+    while not state.done.all():
+      indices = self.SampleNextIndices(sampler, batch_size)
+      for i in state.Append(indices):
+        end_time = labdate.MillisecondsTimestamp()
+        yield model_pb2.Sample(
+            text=atomizer.DeatomizeIndices(state.GetSampleIndices(i)),
+            sample_start_epoch_ms_utc=start_time,
+            sample_time_ms=end_time - start_time,
+            wall_time_ms=end_time - wall_time_start,
+            num_tokens=int(state.num_tokens[i]))
+        wall_time_start = labdate.MillisecondsTimestamp()
+
+  def SampleContinuous(self, sampler: samplers.Sampler,
+                       atomizer: atomizers.AtomizerBase,
+                       batch_size: int) -> typing.Iterator[model_pb2.Sample]:
+    """Sample endlessly using continuous batching.
+
+    As soon as a sample in the batch is complete, its slot is reset using
+    ResetSampleRows() and begins a new sample, so that no slot in the batch is
+    idle while waiting for the longest sample to complete. Only called after
+    InitSampling().
+
+    Args:
+      sampler: The sampler to sample using.
+      atomizer: The atomizer to decode completed samples using.
+      batch_size: The number of samples in the batch.
+
+    Returns:
+      An endless iterator over Sample protos, in the order that they are
+      completed.
+    """
+    state = samplers.SampleBatchState(sampler, batch_size)
+    # Per-slot bookkeeping of the time that the current sample began.
+    start_times = np.full(
+        batch_size, labdate.MillisecondsTimestamp(), dtype=np.int64)
+    wall_time_start = labdate.MillisecondsTimestamp()
+
+    self.InitSampleBatch(sampler, batch_size)
+
+    while True:
+      indices = self.SampleNextIndices(sampler, batch_size)
+      completed = state.Append(indices)
+      for i in completed:
+        end_time = labdate.MillisecondsTimestamp()
+        yield model_pb2.Sample(
+            text=atomizer.DeatomizeIndices(state.GetSampleIndices(i)),
+            sample_start_epoch_ms_utc=int(start_times[i]),
+            sample_time_ms=end_time - int(start_times[i]),
+            wall_time_ms=end_time - wall_time_start,
+            num_tokens=int(state.num_tokens[i]))
+        wall_time_start = labdate.MillisecondsTimestamp()
+      if len(completed):
+        state.ResetRows(completed)
+        self.ResetSampleRows(sampler, completed)
+        start_times[completed] = labdate.MillisecondsTimestamp()
+
+  def SampleBatches(
+      self, sampler: samplers.Sampler, atomizer: atomizers.AtomizerBase,
+      batch_size: int) -> typing.Iterator[typing.Iterator[model_pb2.Sample]]:
+    """Sample an endless sequence of batches.
+
+    If --clgen_continuous_batching is set, each batch is the next batch_size
+    samples produced by SampleContinuous(). Else, each batch is produced by a
+    call to SampleBatch(). Only called after InitSampling().
+
+    Args:
+      sampler: The sampler to sample using.
+      atomizer: The atomizer to decode completed samples using.
+      batch_size: The number of samples in a batch.
+
+    Returns:
+      An endless iterator over batches, where each batch is an iterator over
+      batch_size Sample protos.
+    """
+    if FLAGS.clgen_continuous_batching:
+      samples = self.SampleContinuous(sampler, atomizer, batch_size)
+      while True:
+        yield itertools.islice(samples, batch_size)
+    else:
+      while True:
+        yield self.SampleBatch(sampler, atomizer, batch_size)
+
+
+def WeightedPick(probabilities: np.ndarray, temperature: float,
+                 rng: np.random.RandomState, top_k: int = 0,
+                 top_p: float = 0) -> np.ndarray:
+  """Make a weighted choice from each row of a batch of predictions.
+
+  Every row is sampled in a single vectorized operation, by inverting the
+  cumulative distribution of each row at a uniformly random point.
+
+  Args:
+    probabilities: An array of shape (batch_size, vocab_size) of predicted
+      probabilities.
+    temperature: The sampling temperature. Probabilities are raised to the
+      power of 1 / temperature and renormalized before sampling.
+    rng: The random number generator to sample using.
+    top_k: If > 0, sample only from the top_k most probable indices of each
+      row.
+    top_p: If in the range (0, 1), sample only from the smallest set of most
+      probable indices of each row whose cumulative probability is at least
+      top_p.
+
+  Returns:
+    An array of shape (batch_size,) of sampled indices.
+  """
+  with np.errstate(divide='ignore'):
+    logits = np.log(np.asarray(probabilities, dtype=np.float64)) / temperature
+  # Subtract the maximum of each row before exponentiating for numerical
+  # stability.
+  weights = np.exp(logits - logits.max(axis=1, keepdims=True))
+  batch_size, vocab_size = weights.shape
+  if 0 < top_k < vocab_size:
+    kth_largest = np.partition(weights, -top_k, axis=1)[:, -top_k, None]
+    weights[weights < kth_largest] = 0
+  weights /= weights.sum(axis=1, keepdims=True)
+  if 0 < top_p < 1:
+    rows = np.arange(batch_size)[:, None]
+    order = np.argsort(-weights, axis=1)
+    sorted_weights = weights[rows, order]
+    # Keep every index for which the cumulative probability of the more probable
+    # indices is less than top_p. This always keeps the most probable index.
+    keep = np.zeros_like(weights, dtype=bool)
+    keep[rows, order] = (
+        np.cumsum(sorted_weights, axis=1) - sorted_weights) < top_p
+    weights[~keep] = 0
+  cumulative_weights = np.cumsum(weights, axis=1)
+  thresholds = rng.random_sample((batch_size, 1)) * cumulative_weights[:, -1:]
+  indices = np.sum(cumulative_weights <= thresholds, axis=1)
+  # Guard against floating point rounding error in the cumulative sum.
+  return np.minimum(indices, vocab_size - 1)
@@ -0,0 +1,164 @@
+"""Unit tests for //deeplearning/clgen/models/backends.py."""
+import sys
+import typing
+
+import numpy as np
+import pytest
+from absl import app
+from absl import flags
+
+from deeplearning.clgen import samplers
+from deeplearning.clgen.corpuses import atomizers
+from deeplearning.clgen.models import backends
+from deeplearning.clgen.proto import sampler_pb2
+
+
+FLAGS = flags.FLAGS
+
+
+class MockBackend(backends.BackendBase):
+  """A backend which samples a fixed sequence of indices per row."""
+
+  def __init__(self, atomizer: atomizers.AtomizerBase,
+               rows: typing.List[str]):
+    super(MockBackend, self).__init__(None, None, atomizer)
+    self.rows = rows
+    self.positions = None
+    self.reset_rows = []
+
+  def InitSampleBatch(self, sampler: samplers.Sampler, batch_size: int) -> None:
+    self.positions = np.zeros(batch_size, dtype=np.int32)
+
+  def SampleNextIndices(self, sampler: samplers.Sampler, batch_size: int):
+    indices = self.atomizer.AtomizeString(''.join(
+        row[p % len(row)] for row, p in zip(self.rows, self.positions)))
+    self.positions += 1
+    return indices
+
+  def ResetSampleRows(self, sampler: samplers.Sampler,
+                      rows: np.ndarray) -> None:
+    self.reset_rows += list(rows)
+
+
+@pytest.fixture(scope='function')
+def abc_atomizer() -> atomizers.AsciiCharacterAtomizer:
+  """A test fixture which returns a simple atomizer."""
+  return atomizers.AsciiCharacterAtomizer.FromText('abc')
+
+
+@pytest.fixture(scope='function')
+def maxlen_sampler(abc_sampler_config: sampler_pb2.Sampler,
+                   abc_atomizer: atomizers.AsciiCharacterAtomizer):
+  """A test fixture which returns a sampler which produces 4 token samples."""
+  abc_sampler_config.start_text = 'a'
+  abc_sampler_config.ClearField('termination_criteria')
+  abc_sampler_config.termination_criteria.add().maxlen.CopyFrom(
+      sampler_pb2.MaxTokenLength(maximum_tokens_in_sample=4))
+  sampler = samplers.Sampler(abc_sampler_config)
+  sampler.Specialize(abc_atomizer)
+  return sampler
+
+
+# BackendBase.SampleBatch() tests.
+
+def test_BackendBase_SampleBatch(abc_atomizer, maxlen_sampler):
+  """Test that every sample in the batch is produced once."""
+  backend = MockBackend(abc_atomizer, ['b', 'c'])
+  samples = list(backend.SampleBatch(maxlen_sampler, abc_atomizer, 2))
+  assert [s.text for s in samples] == ['abbb', 'accc']
+  assert [s.num_tokens for s in samples] == [4, 4]
+
+
+# BackendBase.SampleContinuous() tests.
+
+def test_BackendBase_SampleContinuous(abc_atomizer, maxlen_sampler):
+  """Test that completed rows are reset and begin new samples."""
+  backend = MockBackend(abc_atomizer, ['b', 'c'])
+  stream = backend.SampleContinuous(maxlen_sampler, abc_atomizer, 2)
+  samples = [next(stream) for _ in range(6)]
+  assert [s.text for s in samples] == ['abbb', 'accc'] * 3
+  assert backend.reset_rows == [0, 1, 0, 1]
+
+
+def test_BackendBase_SampleBatches_continuous(abc_atomizer, maxlen_sampler):
+  """Test that continuous batching produces batches of batch_size samples."""
+  FLAGS.clgen_continuous_batching = True
+  try:
+    backend = MockBackend(abc_atomizer, ['b', 'c'])
+    batches = backend.SampleBatches(maxlen_sampler, abc_atomizer, 2)
+    assert [s.text for s in next(batches)] == ['abbb', 'accc']
+    assert [s.text for s in next(batches)] == ['abbb', 'accc']
+  finally:
+    FLAGS.clgen_continuous_batching = False
+
+
+# WeightedPick() tests.
+
+def test_WeightedPick_output_shape():
+  """Test that WeightedPick() returns one index per row."""
+  rng = np.random.RandomState(0)
+  indices = backends.WeightedPick(np.full((5, 4), 0.25), 1.0, rng)
+  assert indices.shape == (5,)
+  assert ((0 <= indices) & (indices < 4)).all()
+
+
+def test_WeightedPick_zero_probability():
+  """Test that indices with zero probability are never picked."""
+  rng = np.random.RandomState(0)
+  probabilities = np.tile(np.array([0, 0.5, 0, 0.5]), (1000, 1))
+  indices = backends.WeightedPick(probabilities, 0.5, rng)
+  assert set(indices) == {1, 3}
+
+
+def test_WeightedPick_reproducible():
+  """Test that the same seed produces the same indices."""
+  probabilities = np.random.dirichlet(np.ones(10), size=100)
+  a = backends.WeightedPick(probabilities, 0.8, np.random.RandomState(1))
+  b = backends.WeightedPick(probabilities, 0.8, np.random.RandomState(1))
+  np.testing.assert_array_equal(a, b)
+
+
+def test_WeightedPick_distribution():
+  """Test that indices are drawn in proportion to the tempered probability."""
+  rng = np.random.RandomState(0)
+  probabilities = np.tile(np.array([0.2, 0.8]), (20000, 1))
+  # With temperature 0.5, probabilities are squared: 0.04 : 0.64.
+  indices = backends.WeightedPick(probabilities, 0.5, rng)
+  assert np.mean(indices) == pytest.approx(0.64 / 0.68, abs=0.01)
+
+
+def test_WeightedPick_top_k():
+  """Test that only the k most probable indices are picked."""
+  rng = np.random.RandomState(0)
+  probabilities = np.tile(np.array([0.1, 0.4, 0.2, 0.3]), (1000, 1))
+  indices = backends.WeightedPick(probabilities, 1.0, rng, top_k=2)
+  assert set(indices) == {1, 3}
+
+
+def test_WeightedPick_top_p():
+  """Test that only the most probable indices within the nucleus are picked."""
+  rng = np.random.RandomState(0)
+  probabilities = np.tile(np.array([0.1, 0.4, 0.2, 0.3]), (1000, 1))
+  indices = backends.WeightedPick(probabilities, 1.0, rng, top_p=0.6)
+  assert set(indices) == {1, 3}
+  # The most probable index is always kept.
+  indices = backends.WeightedPick(probabilities, 1.0, rng, top_p=0.01)
+  assert set(indices) == {1}
+
+
+def test_benchmark_WeightedPick(benchmark):
+  """Benchmark WeightedPick() for a batch of 64 over a vocabulary of 100."""
+  rng = np.random.RandomState(0)
+  probabilities = np.random.dirichlet(np.ones(100), size=64)
+  benchmark(backends.WeightedPick, probabilities, 0.8, rng)
+
+
+def main(argv):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError('Unrecognized command line flags.')
+  sys.exit(pytest.main([__file__, '-v']))
+
+
+if __name__ == '__main__':
+  app.run(main)
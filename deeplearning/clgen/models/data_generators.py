@@ -72,15 +72,18 @@ def BatchGenerator(
     if epoch_num and training_opts.shuffle_corpus_contentfiles_between_epochs:
       x, y, steps_per_epoch = GetTrainingCorpus(corpus, training_opts)
 
-    # Roll so that we don't need to reset model states over epochs.
-    x_epoch = np.split(np.roll(x, -epoch_num, axis=0), steps_per_epoch, axis=1)
-    y_epoch = np.split(np.roll(y, -epoch_num, axis=0), steps_per_epoch, axis=1)
+    # Roll so that we don't need to reset model states over epochs. Rather than
+    # rolling the entire corpus, we select the rows of each batch in rolled
+    # order, so that only one batch is copied out of the corpus at a time.
+    rows = np.roll(np.arange(training_opts.batch_size), -epoch_num)
+    seq_len = training_opts.sequence_length
     # Per-batch inner loop.
     for batch_num in range(steps_per_epoch):
+      cols = slice(batch_num * seq_len, (batch_num + 1) * seq_len)
       batch = DataBatch(
-          X=x_epoch[batch_num],
+          X=x[:, cols][rows],
           # Lazy one-hot encoding.
-          y=OneHotEncode(y_epoch[batch_num], corpus.vocab_size))
+          y=OneHotEncode(y[:, cols][rows], corpus.vocab_size))
       if not batch_num and not epoch_num:
         LogBatchTelemetry(batch, steps_per_epoch, training_opts.num_epochs)
       yield batch
@@ -96,11 +99,12 @@ class TensorflowBatchGenerator(object):
     # Lazily instantiated.
     self.encoded_corpus = None
     self.num_batches = 0
-    self.batches = None
+    self.xdata = None
+    self.ydata = None
     self.CreateBatches()
 
     LogBatchTelemetry(
-        self.batches[0], self.num_batches, self.training_opts.num_epochs)
+        self.GetBatch(0), self.num_batches, self.training_opts.num_epochs)
 
   def CreateBatches(self) -> None:
     start_time = time.time()
@@ -122,34 +126,48 @@ class TensorflowBatchGenerator(object):
       raise errors.UserError(
           "Not enough data. Use a smaller sequence_length and batch_size")
 
-    # split into batches
+    # split into batches. The x and y arrays are views of the encoded corpus,
+    # which is not copied.
     clipped_corpus_length = self.num_batches * batch_size * sequence_length
-    clipped_corpus = self.encoded_corpus[:clipped_corpus_length]
-    xdata = clipped_corpus
-    ydata = np.copy(clipped_corpus)
-
-    # Wrap-around.
-    ydata[:-1] = xdata[1:]
-    ydata[-1] = xdata[0]
-    self.batches = [
-      DataBatch(x, y) for x, y in zip(
-          np.split(xdata.reshape(batch_size, -1), self.num_batches, 1),
-          np.split(ydata.reshape(batch_size, -1), self.num_batches, 1)
-      )
-    ]
+    self.xdata = self.encoded_corpus[:clipped_corpus_length].reshape(
+        batch_size, -1)
+    if len(self.encoded_corpus) > clipped_corpus_length:
+      ydata = self.encoded_corpus[1:clipped_corpus_length + 1]
+    else:
+      ydata = np.append(self.encoded_corpus[1:], self.encoded_corpus[:1])
+    self.ydata = ydata.reshape(batch_size, -1)
     logging.info(
         'Encoded corpus of %s tokens (clipped last %s tokens) in %s ms.',
         humanize.intcomma(clipped_corpus_length),
         humanize.intcomma(len(self.encoded_corpus) - clipped_corpus_length),
         humanize.intcomma(int((time.time() - start_time) * 1000)))
 
+  def GetBatch(self, batch_num: int) -> DataBatch:
+    """Return a batch by index.
+
+    Args:
+      batch_num: The index of the batch, in the range [0, num_batches).
+
+    Returns:
+      X, Y DataBatch.
+    """
+    sequence_length = self.training_opts.sequence_length
+    cols = slice(batch_num * sequence_length,
+                 (batch_num + 1) * sequence_length)
+    x, y = self.xdata[:, cols], self.ydata[:, cols]
+    if batch_num == self.num_batches - 1:
+      # Wrap-around. The final y value is the first x value.
+      y = np.copy(y)
+      y[-1, -1] = self.xdata[0, 0]
+    return DataBatch(x, y)
+
   def NextBatch(self) -> DataBatch:
     """Fetch next batch.
 
     Returns:
       X, Y DataBatch.
     """
-    batch = self.batches[self.i]
+    batch = self.GetBatch(self.i)
     self.i += 1
     assert 0 <= self.i <= self.num_batches
     return batch
@@ -45,6 +45,26 @@ def test_BatchGenerator_batch_size_too_large(abc_model_config):
   assert ('') == str(e_info.value)
 
 
+# TensorflowBatchGenerator tests.
+
+def test_TensorflowBatchGenerator_batches(abc_model_config):
+  """Test that y batches are x batches shifted by one token."""
+  opt = abc_model_config.training
+  opt.batch_size = 2
+  opt.sequence_length = 3
+  corpus = CorpusMock(corpus_length=13)
+  corpus.GetTrainingData = lambda shuffle: np.arange(13, dtype=np.uint16)
+  generator = data_generators.TensorflowBatchGenerator(corpus, opt)
+  assert generator.num_batches == 2
+  x, y = generator.NextBatch()
+  np.testing.assert_array_equal(np.array([[0, 1, 2], [6, 7, 8]]), x)
+  np.testing.assert_array_equal(np.array([[1, 2, 3], [7, 8, 9]]), y)
+  x, y = generator.NextBatch()
+  np.testing.assert_array_equal(np.array([[3, 4, 5], [9, 10, 11]]), x)
+  # Wrap-around.
+  np.testing.assert_array_equal(np.array([[4, 5, 6], [10, 11, 0]]), y)
+
+
 # OneHotEncode() tests.
 
 def test_OneHotEncode_empty_input():
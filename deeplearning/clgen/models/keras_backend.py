@@ -41,6 +41,8 @@ class KerasBackend(backends.BackendBase):
 
     self.inference_indices = None
     self.inference_model = None
+    # The inference model states after seeding with the sampler start text.
+    self.seeded_states = None
 
   def GetTrainingModel(self) -> 'keras.models.Sequential':
     """Get the Keras model."""
@@ -176,11 +178,14 @@ class KerasBackend(backends.BackendBase):
   def InitSampling(self, sampler: samplers.Sampler,
                    seed: typing.Optional[int] = None) -> int:
     self.inference_model, batch_size = self.GetInferenceModel()
-    if seed is not None:
-      np.random.seed(seed)
+    self.rng = np.random.RandomState(seed)
     return batch_size
 
   def InitSampleBatch(self, sampler: samplers.Sampler, batch_size: int) -> None:
+    # Deferred importing of Keras so that we don't have to activate the
+    # TensorFlow backend every time we import this module.
+    from keras import backend as K
+
     self.inference_model.reset_states()
     # Set internal states from seed text.
     for index in sampler.encoded_start_text[:-1]:
@@ -189,17 +194,39 @@ class KerasBackend(backends.BackendBase):
       self.inference_model.predict(x)
 
     self.inference_indices = sampler.encoded_start_text[-1]
+    self.seeded_states = [
+      K.get_value(state) for state in self.inference_model_states]
+
+  def ResetSampleRows(self, sampler: samplers.Sampler,
+                      rows: np.ndarray) -> None:
+    # Deferred importing of Keras so that we don't have to activate the
+    # TensorFlow backend every time we import this module.
+    from keras import backend as K
+
+    for state, seeded_state in zip(self.inference_model_states,
+                                   self.seeded_states):
+      value = K.get_value(state)
+      value[rows] = seeded_state[rows]
+      K.set_value(state, value)
+    self.inference_indices[rows] = sampler.encoded_start_text[-1]
+
+  @property
+  def inference_model_states(self) -> typing.List['tf.Variable']:
+    """The state variables of the stateful layers of the inference model."""
+    return [state for layer in self.inference_model.layers
+            if getattr(layer, 'stateful', False) for state in layer.states]
 
   def SampleNextIndices(self, sampler: samplers.Sampler, batch_size: int):
-    # Predict the next index for the entire batch.
-    x = np.array([self.inference_indices] * batch_size)
+    # Predict the next index for the entire batch. The previous indices are
+    # either a single start text index, or one index per sample.
+    x = np.zeros((batch_size, 1), dtype=np.int32)
+    x[:, 0] = self.inference_indices
     # Input shape: (bath_size, 1).
     probabilities = self.inference_model.predict(x)
     # Output shape: (batch_size, 1, vocab_size).
-    self.inference_indices = [
-      WeightedPick(p.squeeze(), sampler.temperature)
-      for p in probabilities
-    ]
+    self.inference_indices = backends.WeightedPick(
+        probabilities.reshape(batch_size, -1), sampler.temperature, self.rng,
+        top_k=sampler.top_k, top_p=sampler.top_p)
     return self.inference_indices
 
   def InferenceManifest(self) -> typing.List[pathlib.Path]:
@@ -229,13 +256,3 @@ class KerasBackend(backends.BackendBase):
   def is_trained(self) -> bool:
     """Return whether the model has previously been trained."""
     return len(self.epoch_checkpoints) >= self.config.training.num_epochs
-
-
-def WeightedPick(predictions: np.ndarray, temperature: float) -> int:
-  """Make a weighted choice from a predictions array."""
-  predictions = np.log(np.asarray(predictions).astype('float64')) / temperature
-  predictions_exp = np.exp(predictions)
-  # Normalize the probabilities.
-  predictions = predictions_exp / np.sum(predictions_exp)
-  predictions = np.random.multinomial(1, predictions, 1)
-  return np.argmax(predictions)
@@ -26,6 +26,8 @@ class MockSampler(object):
     self.encoded_start_text = np.array([1, 2, 3])
     self.tokenized_start_text = ['a', 'b', 'c']
     self.temperature = 1.0
+    self.top_k = 0
+    self.top_p = 0
     self.hash = hash
     self.batch_size = batch_size
 
@@ -39,6 +41,16 @@ class MockSampler(object):
     """Crude 'maxlen' mock."""
     return len(sample_in_progress) >= 10
 
+  @staticmethod
+  def InitBatchState(batch_size):
+    """Sampler.InitBatchState() mock."""
+    pass
+
+  @staticmethod
+  def BatchIsComplete(indices, num_tokens):
+    """Crude 'maxlen' mock."""
+    return num_tokens >= 10
+
 
 @pytest.fixture(scope='function')
 def abc_keras_model_config(abc_model_config: model_pb2.Model):
@@ -184,14 +196,6 @@ def test_KerasBackend_GetInferenceModel_predict_output_shape(
   assert (batch_size, 1, m.corpus.vocab_size) == probabilities.shape
 
 
-# WeightedPick() tests.
-
-def test_WeightedPick_output_range():
-  """Test that WeightedPick() returns an integer index into array"""
-  a = [1, 2, 3, 4]
-  assert 0 <= keras_backend.WeightedPick(np.array(a), 1.0) <= len(a)
-
-
 # Benchmarks.
 
 def test_benchmark_KerasBackend_Train_already_trained(
@@ -3,7 +3,6 @@ import pathlib
 import typing
 
 import humanize
-import numpy as np
 from absl import flags
 from absl import logging
 
@@ -83,44 +82,10 @@ class PreTrainedModel(object):
     sample_start_time = labdate.MillisecondsTimestamp()
     # Per-sample batch outer loop. Continues until we have as many samples
     # as we want.
-    while True:
-      samples_in_progress = [
-        sampler.tokenized_start_text.copy()
-        for _ in range(batch_size)]
-      done = np.zeros(batch_size, dtype=np.bool)
-      start_time = labdate.MillisecondsTimestamp()
-      wall_time_start = start_time
-
-      self.backend.InitSampleBatch(sampler, batch_size)
-
-      # Sampling loop. Continues until all samples in the batch are done.
-      while True:
-        indices = self.backend.SampleNextIndices(sampler, batch_size)
-
-        # Iterate over all samples in batch to determine whether they're
-        # done.
-        for i in range(batch_size):
-          if done[i]:
-            continue
-
-          token = atomizer.decoder[indices[i]]
-          samples_in_progress[i].append(token)
-          if sampler.SampleIsComplete(samples_in_progress[i]):
-            end_time = labdate.MillisecondsTimestamp()
-            done[i] = 1
-            sample = model_pb2.Sample(
-                text=''.join(samples_in_progress[i]),
-                sample_start_epoch_ms_utc=start_time,
-                sample_time_ms=end_time - start_time,
-                wall_time_ms=end_time - wall_time_start,
-                num_tokens=len(samples_in_progress[i]))
-            sample_count += 1
-            yield sample
-            wall_time_start = labdate.MillisecondsTimestamp()
-
-        # Complete the batch.
-        if done.all():
-          break
+    for batch in self.backend.SampleBatches(sampler, atomizer, batch_size):
+      for sample in batch:
+        sample_count += 1
+        yield sample
 
       # Complete sampling. Note that sample_count starts at 1.
       if sample_count > min_num_samples:
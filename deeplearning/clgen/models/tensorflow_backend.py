@@ -49,6 +49,8 @@ class TensorFlowBackend(backends.BackendBase):
     self.inference_sess = None
     self.inference_state = None
     self.inference_indices = None
+    # The model state after seeding with the sampler start text.
+    self.seeded_state = None
 
   def InitTfGraph(self, inference: bool) -> 'tf':
     """Instantiate a TensorFlow graph for training or inference.
@@ -335,8 +337,8 @@ class TensorFlowBackend(backends.BackendBase):
       del self.inference_sess
 
     # Seed the RNG.
+    self.rng = np.random.RandomState(seed)
     if seed is not None:
-      np.random.seed(seed)
       self.inference_tf.set_random_seed(seed)
 
     self.inference_tf = self.InitTfGraph(inference=True)
@@ -362,7 +364,7 @@ class TensorFlowBackend(backends.BackendBase):
   def InitSampleBatch(self, sampler: samplers.Sampler, batch_size: int) -> None:
     self.inference_state = self.inference_sess.run(
         self.cell.zero_state(batch_size, self.inference_tf.float32))
-    self.inference_indices = np.zeros((batch_size, 1))
+    self.inference_indices = np.zeros((batch_size, 1), dtype=np.int32)
 
     # Seed the model state with the starting text.
     for symbol in sampler.encoded_start_text[:-1]:
@@ -373,6 +375,13 @@ class TensorFlowBackend(backends.BackendBase):
       }
       [self.inference_state] = self.inference_sess.run([self.final_state], feed)
     self.inference_indices[:] = sampler.encoded_start_text[-1]
+    self.seeded_state = self.inference_state
+
+  def ResetSampleRows(self, sampler: samplers.Sampler,
+                      rows: np.ndarray) -> None:
+    self.inference_state = ResetStateRows(
+        self.inference_state, self.seeded_state, rows)
+    self.inference_indices[rows] = sampler.encoded_start_text[-1]
 
   def SampleNextIndices(self, sampler: samplers.Sampler, batch_size: int):
     # Sample distribution to pick next symbol.
@@ -382,9 +391,10 @@ class TensorFlowBackend(backends.BackendBase):
     }
     [predictions, self.inference_state] = self.inference_sess.run(
         [self.probs, self.final_state], feed)
-    self.inference_indices[:, 0] = [
-      WeightedPick(p, sampler.temperature) for p in predictions]
-    return [i[0] for i in self.inference_indices]
+    self.inference_indices[:, 0] = backends.WeightedPick(
+        predictions, sampler.temperature, self.rng, top_k=sampler.top_k,
+        top_p=sampler.top_p)
+    return self.inference_indices[:, 0]
 
   @property
   def is_trained(self) -> bool:
@@ -397,11 +407,26 @@ class TensorFlowBackend(backends.BackendBase):
     return self.config.training.num_epochs in epoch_nums
 
 
-def WeightedPick(predictions: np.ndarray, temperature: float) -> np.ndarray:
-  """Make a weighted choice from a predictions array."""
-  predictions = np.log(np.asarray(predictions).astype('float64')) / temperature
-  predictions_exp = np.exp(predictions)
-  # Normalize the probabilities.
-  predictions = predictions_exp / np.sum(predictions_exp)
-  predictions = np.random.multinomial(1, predictions, 1)
-  return np.argmax(predictions)
+def ResetStateRows(state, seeded_state, rows: np.ndarray):
+  """Reset rows of a (possibly nested) RNN state to a seeded state.
+
+  Args:
+    state: The current state, as returned by a session run of the final state.
+      This is either an array of shape (batch_size, ...), or a tuple of states,
+      e.g. an LSTMStateTuple per layer.
+    seeded_state: The state to reset to, with the same structure as state.
+    rows: An array of the row numbers to reset.
+
+  Returns:
+    A new state, with the same structure as state.
+  """
+  if isinstance(state, np.ndarray):
+    state = np.copy(state)
+    state[rows] = seeded_state[rows]
+    return state
+  children = [ResetStateRows(s, seeded, rows)
+              for s, seeded in zip(state, seeded_state)]
+  if hasattr(state, '_fields'):
+    # A namedtuple, such as LSTMStateTuple.
+    return type(state)(*children)
+  return type(state)(children)
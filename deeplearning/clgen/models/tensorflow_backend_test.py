@@ -1,4 +1,5 @@
 """Unit tests for //deeplearning/clgen/models/tensorflow_backend.py."""
+import collections
 import sys
 
 import checksumdir
@@ -25,6 +26,8 @@ class MockSampler(object):
     self.encoded_start_text = np.array([1, 2, 3])
     self.tokenized_start_text = ['a', 'b', 'c']
     self.temperature = 1.0
+    self.top_k = 0
+    self.top_p = 0
     self.hash = hash
 
   @staticmethod
@@ -37,6 +40,16 @@ class MockSampler(object):
     """Crude 'maxlen' mock."""
     return len(sample_in_progress) >= 10
 
+  @staticmethod
+  def InitBatchState(batch_size):
+    """Sampler.InitBatchState() mock."""
+    pass
+
+  @staticmethod
+  def BatchIsComplete(indices, num_tokens):
+    """Crude 'maxlen' mock."""
+    return num_tokens >= 10
+
 
 @pytest.fixture(scope='function')
 def abc_tensorflow_model_config(abc_model_config: model_pb2.Model):
@@ -191,13 +204,30 @@ def test_TensorFlowBackend_Sample_inexact_multiple_of_batch_size(
   assert len(m.Sample(MockSampler(), 4)) == 6
 
 
-# WeightedPick() tests.
-
-@pytest.mark.skip(reason='TODO(cec): Update for new WeightedPick().')
-def test_WeightedPick_output_range():
-  """Test that WeightedPick() returns an integer index into array"""
-  a = [1, 2, 3, 4]
-  assert 0 <= tensorflow_backend.WeightedPick(np.array(a), 1.0) <= len(a)
+# ResetStateRows() tests.
+
+def test_ResetStateRows_array():
+  """Test that rows of an array state are reset."""
+  state = np.array([[1, 1], [2, 2], [3, 3]])
+  seeded_state = np.zeros((3, 2))
+  new_state = tensorflow_backend.ResetStateRows(
+      state, seeded_state, np.array([0, 2]))
+  np.testing.assert_array_equal(np.array([[0, 0], [2, 2], [0, 0]]), new_state)
+
+
+def test_ResetStateRows_nested():
+  """Test that the structure of a nested state is preserved."""
+  StateTuple = collections.namedtuple('StateTuple', ['c', 'h'])
+  state = (StateTuple(np.ones((2, 3)), np.ones((2, 3))),)
+  seeded_state = (StateTuple(np.zeros((2, 3)), np.zeros((2, 3))),)
+  new_state = tensorflow_backend.ResetStateRows(
+      state, seeded_state, np.array([1]))
+  assert isinstance(new_state, tuple)
+  assert isinstance(new_state[0], StateTuple)
+  np.testing.assert_array_equal(np.array([[1, 1, 1], [0, 0, 0]]),
+                                new_state[0].h)
+  # The input state is not modified.
+  np.testing.assert_array_equal(np.ones((2, 3)), state[0].h)
 
 
 # Benchmarks.
@@ -17,6 +17,20 @@
 // nothing is rewritten, exit with status code
 #define E_NO_INPUT 204
 
+// Server mode:
+//
+//     ./rewriter -server /path/to/input.cl -extra-arg=... --
+//
+// Rather than reading the source file from disk, read a sequence of sources
+// from stdin, and rewrite each one in turn as if it were the source file. This
+// amortizes the cost of process startup across many sources. Each request is
+// the decimal number of bytes in the source, followed by a newline, then the
+// source. Each response is a header line of the form
+// "<status> <output_size> <diagnostics_size>", followed by the rewritten
+// source and the compiler diagnostics. Status is the exit code that the
+// rewriter would have returned for that source.
+
+#include <iostream>
 #include <map>
 #include <memory>
 #include <set>
@@ -31,6 +45,7 @@
 #include "clang/Frontend/ASTConsumers.h"
 #include "clang/Frontend/CompilerInstance.h"
 #include "clang/Frontend/FrontendActions.h"
+#include "clang/Frontend/TextDiagnosticPrinter.h"
 #include "clang/Rewrite/Core/Rewriter.h"
 #include "clang/Tooling/CommonOptionsParser.h"
 #include "clang/Tooling/Tooling.h"
@@ -81,10 +96,19 @@ const std::string gb_prefix = "gb_";
 namespace rewriter {
 
 // global state
-static clang::Rewriter rewriter;
+// Reset by rewrite() for each source.
+static std::unique_ptr<clang::Rewriter> rewriter;
 
 static llvm::cl::OptionCategory _tool_category("clgen");
 
+static llvm::cl::opt<bool> _server_mode(
+    "server",
+    llvm::cl::desc("Read a sequence of sources to rewrite from stdin"),
+    llvm::cl::cat(_tool_category));
+
+// The rewritten main file, set once the translation unit has been visited.
+static std::string _output;
+
 // function rewrite counters
 static unsigned int _fn_decl_rewrites_counter = 0;
 static unsigned int _fn_call_rewrites_counter = 0;
@@ -161,7 +185,7 @@ std::string get_next_name(rewrite_table_t& rewrites,
 
 class RewriterVisitor : public clang::RecursiveASTVisitor<RewriterVisitor> {
  private:
-  std::unique_ptr<clang::ASTContext> _context;  // additional AST info
+  clang::ASTContext* _context;  // additional AST info
 
   // identifier rewrite tables. There's one table to rewrite function names,
   // one table to rewrite global variables, and one table for each user
@@ -227,8 +251,8 @@ class RewriterVisitor : public clang::RecursiveASTVisitor<RewriterVisitor> {
  public:
   explicit RewriterVisitor(clang::CompilerInstance *ci)
       : _context(&(ci->getASTContext())) {
-    rewriter.setSourceMgr(_context->getSourceManager(),
-                          _context->getLangOpts());
+    rewriter->setSourceMgr(_context->getSourceManager(),
+                           _context->getLangOpts());
   }
 
   virtual ~RewriterVisitor() {}
@@ -237,25 +261,25 @@ class RewriterVisitor : public clang::RecursiveASTVisitor<RewriterVisitor> {
 
   void rewrite_fn_name(clang::FunctionDecl *const func,
                        const std::string& replacement) {
-   rewriter.ReplaceText(func->getLocation(), replacement);
+   rewriter->ReplaceText(func->getLocation(), replacement);
    ++_fn_call_rewrites_counter;
   }
 
   void rewrite_fn_name(clang::CallExpr *const call,
                        const std::string& replacement) {
-   rewriter.ReplaceText(call->getLocStart(), replacement);
+   rewriter->ReplaceText(call->getLocStart(), replacement);
    ++_fn_call_rewrites_counter;
   }
 
   void rewrite_var_name(clang::DeclRefExpr *const ref,
                         const std::string& replacement) {
-    rewriter.ReplaceText(ref->getLocStart(), replacement);
+    rewriter->ReplaceText(ref->getLocStart(), replacement);
     ++_var_use_rewrites_counter;
   }
 
   void rewrite_var_name(clang::VarDecl *const decl,
                         const std::string& replacement) {
-    rewriter.ReplaceText(decl->getLocation(), replacement);
+    rewriter->ReplaceText(decl->getLocation(), replacement);
     ++_var_decl_rewrites_counter;
   }
 
@@ -394,19 +418,26 @@ class RewriterVisitor : public clang::RecursiveASTVisitor<RewriterVisitor> {
 
 class RewriterASTConsumer : public clang::ASTConsumer {
  private:
-  RewriterVisitor *visitor;
+  RewriterVisitor visitor;
 
  public:
   // override the constructor in order to pass CI
   explicit RewriterASTConsumer(clang::CompilerInstance *ci)
-      : visitor(new RewriterVisitor(ci))
+      : visitor(ci)
   { }
 
   // override this to call our RewriterVisitor on the entire source file
   virtual void HandleTranslationUnit(clang::ASTContext &Context) {
     // use ASTContext to get the TranslationUnitDecl, which is
     // a single Decl that collectively represents the entire source file
-    visitor->TraverseDecl(Context.getTranslationUnitDecl());
+    visitor.TraverseDecl(Context.getTranslationUnitDecl());
+
+    // Render the rewritten main file while the source manager is still alive.
+    if (isRewritten()) {
+      llvm::raw_string_ostream out(_output);
+      const auto& id = rewriter->getSourceMgr().getMainFileID();
+      rewriter->getEditBuffer(id).write(out);
+    }
   }
 };
 
@@ -420,40 +451,91 @@ class RewriterFrontendAction : public clang::ASTFrontendAction {
 };
 
 
-}  // namespace rewriter
-
-
-// let's get shit done!
+// Rewrite the source files of a tool. The rewritten main file is stored in
+// _output. Returns the exit status of the rewriter.
 //
-int main(int argc, const char** argv) {
-  clang::tooling::CommonOptionsParser op(argc, argv, rewriter::_tool_category);
-  clang::tooling::ClangTool tool(op.getCompilations(), op.getSourcePathList());
+int rewrite(clang::tooling::ClangTool& tool) {
+  // Reset the global state, so that sources may be rewritten repeatedly.
+  rewriter = llvm::make_unique<clang::Rewriter>();
+  _output.clear();
+  _fn_decl_rewrites_counter = 0;
+  _fn_call_rewrites_counter = 0;
+  _var_decl_rewrites_counter = 0;
+  _var_use_rewrites_counter = 0;
 
   const auto result = tool.run(
       clang::tooling::newFrontendActionFactory<
-        rewriter::RewriterFrontendAction>().get());
-
-  const auto& id = rewriter::rewriter.getSourceMgr().getMainFileID();
+        RewriterFrontendAction>().get());
 
 #ifdef VERBOSE
-  if (!rewriter::isRewritten()) {
+  if (!isRewritten()) {
     llvm::errs() << "fatal: nothing to rewrite!";
     return E_NO_INPUT;
   }
 
-  llvm::errs() << "\nRewrote " << rewriter::_fn_decl_rewrites_counter
+  llvm::errs() << "\nRewrote " << _fn_decl_rewrites_counter
                << " function declarations\n"
-               << "Rewrote " << rewriter::_fn_call_rewrites_counter
+               << "Rewrote " << _fn_call_rewrites_counter
                << " function calls\n\n"
-               << "Rewrote " << rewriter::_var_decl_rewrites_counter
+               << "Rewrote " << _var_decl_rewrites_counter
                << " variable declarations\n"
-               << "Rewrote " << rewriter::_var_use_rewrites_counter
+               << "Rewrote " << _var_use_rewrites_counter
                << " variable uses\n";
 #else  // not VERBOSE
-  if (!rewriter::isRewritten())
+  if (!isRewritten())
     return E_NO_INPUT;
 #endif  // VERBOSE
 
-  rewriter::rewriter.getEditBuffer(id).write(llvm::outs());
+  return result;
+}
+
+
+// Rewrite sources read from stdin until EOF. See the usage notes at the top
+// of this file for the protocol.
+//
+int serve(const clang::tooling::CommonOptionsParser& op) {
+  const auto& path = op.getSourcePathList().front();
+  std::ios::sync_with_stdio(false);
+
+  std::string header;
+  while (std::getline(std::cin, header)) {
+    std::string source(std::stoul(header), '\0');
+    if (!std::cin.read(&source[0], source.size()))
+      return 1;
+
+    std::string diagnostics;
+    llvm::raw_string_ostream diagnostics_stream(diagnostics);
+    clang::TextDiagnosticPrinter printer(
+        diagnostics_stream, new clang::DiagnosticOptions());
+
+    clang::tooling::ClangTool tool(op.getCompilations(), {path});
+    tool.mapVirtualFile(path, source);
+    tool.setDiagnosticConsumer(&printer);
+    const auto status = rewrite(tool);
+    diagnostics_stream.flush();
+
+    llvm::outs() << status << ' ' << _output.size() << ' '
+                 << diagnostics.size() << '\n' << _output << diagnostics;
+    llvm::outs().flush();
+  }
+  return 0;
+}
+
+
+}  // namespace rewriter
+
+
+// let's get shit done!
+//
+int main(int argc, const char** argv) {
+  clang::tooling::CommonOptionsParser op(argc, argv, rewriter::_tool_category);
+
+  if (rewriter::_server_mode)
+    return rewriter::serve(op);
+
+  clang::tooling::ClangTool tool(op.getCompilations(), op.getSourcePathList());
+  const auto result = rewriter::rewrite(tool);
+  if (result != E_NO_INPUT)
+    llvm::outs() << rewriter::_output;
   return result;
 }
@@ -1,7 +1,11 @@
 """Python entry point to the clang_rewriter binary."""
+import atexit
 import os
+import pathlib
+import select
 import subprocess
 import tempfile
+import time
 import typing
 
 from absl import flags
@@ -13,6 +17,13 @@ from labm8 import bazelutil
 
 FLAGS = flags.FLAGS
 
+flags.DEFINE_boolean(
+    'clgen_rewriter_server', False,
+    'If set, NormalizeIdentifiers() sends sources to a long-lived '
+    'clang_rewriter process, rather than starting a new process for every '
+    'source. One rewriter process is started per process and set of '
+    'compiler flags.')
+
 CLGEN_REWRITER = bazelutil.DataPath(
     'phd/deeplearning/clgen/preprocessors/clang_rewriter')
 assert CLGEN_REWRITER.is_file()
@@ -25,6 +36,145 @@ if bazelutil.DataPath('llvm_linux', must_exist=False).is_dir():
   CLGEN_REWRITER_ENV['LD_PRELOAD'] = f'{libclang}:{liblto}'
 
 
+# If there was nothing to rewrite, rewriter exits with error code:
+EUGLY_CODE = 204
+
+
+class RewriterServer(object):
+  """A long-lived clang_rewriter process which rewrites many sources.
+
+  The server is started lazily on the first call to Rewrite(), and restarted if
+  it is killed because of a timeout or if it crashes.
+  """
+
+  def __init__(self, suffix: str, cflags: typing.List[str]):
+    """Instantiate a rewriter server.
+
+    Args:
+      suffix: The suffix of the source files, e.g. '.c' for C programs.
+      cflags: A list of flags to be passed to clang.
+    """
+    self.suffix = suffix
+    self.cflags = cflags
+    self.process = None
+    self.pid = None
+    self.tempdir = None
+
+  def Start(self) -> None:
+    """Start the rewriter process."""
+    self.tempdir = tempfile.TemporaryDirectory(prefix='clgen_rewriter_')
+    # The source file does not exist. Its contents are read from stdin.
+    path = pathlib.Path(self.tempdir.name) / f'input{self.suffix}'
+    cmd = [str(CLGEN_REWRITER), '-server', str(path)] + [
+      '-extra-arg=' + x for x in self.cflags] + ['--']
+    logging.debug('$ %s', ' '.join(cmd))
+    # Diagnostics are returned in responses, so stderr can be discarded.
+    self.process = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, env=CLGEN_REWRITER_ENV)
+    self.pid = os.getpid()
+
+  def Stop(self) -> None:
+    """Kill the rewriter process, if it is running."""
+    # A forked child must not kill the server of its parent process.
+    if self.process and self.pid == os.getpid():
+      self.process.kill()
+      self.process.wait()
+      self.tempdir.cleanup()
+    self.process = None
+    self.tempdir = None
+
+  def Rewrite(self, text: str,
+              timeout_seconds: int) -> typing.Tuple[int, str, str]:
+    """Rewrite a source.
+
+    Args:
+      text: The source code to rewrite.
+      timeout_seconds: The number of seconds to allow before killing the
+        rewriter.
+
+    Returns:
+      A tuple of the rewriter exit status, the rewritten source, and the
+      compiler diagnostics.
+
+    Raises:
+      ClangTimeout: If the rewriter fails to complete within timeout_seconds.
+      ClangException: If the rewriter process crashes.
+    """
+    if self.pid != os.getpid() or not self.process:
+      self.process = None
+      self.Start()
+    deadline = time.time() + timeout_seconds
+    data = text.encode('utf-8')
+    try:
+      self.process.stdin.write(f'{len(data)}\n'.encode('utf-8') + data)
+      self.process.stdin.flush()
+      header = self._ReadLine(deadline)
+      status, output_size, diagnostics_size = [int(x) for x in header.split()]
+      output = self._Read(output_size, deadline)
+      diagnostics = self._Read(diagnostics_size, deadline)
+    except TimeoutError:
+      self.Stop()
+      raise errors.ClangTimeout(
+          f'clang_rewriter failed to complete after {timeout_seconds}s')
+    except (BrokenPipeError, EOFError, ValueError):
+      self.Stop()
+      raise errors.ClangException('clang_rewriter server exited unexpectedly')
+    return (status, output.decode('utf-8', errors='replace'),
+            diagnostics.decode('utf-8', errors='replace'))
+
+  def _Read(self, size: int, deadline: float) -> bytes:
+    """Read exactly size bytes from the rewriter before the deadline."""
+    fd = self.process.stdout.fileno()
+    chunks = []
+    while size:
+      if not select.select([fd], [], [], max(deadline - time.time(), 0))[0]:
+        raise TimeoutError
+      chunk = os.read(fd, size)
+      if not chunk:
+        raise EOFError
+      chunks.append(chunk)
+      size -= len(chunk)
+    return b''.join(chunks)
+
+  def _ReadLine(self, deadline: float) -> bytes:
+    """Read a newline-terminated line from the rewriter before the deadline."""
+    line = []
+    while True:
+      char = self._Read(1, deadline)
+      if char == b'\n':
+        return b''.join(line)
+      line.append(char)
+
+
+# Rewriter servers, keyed by suffix and cflags.
+_rewriter_servers: typing.Dict[typing.Tuple[str, typing.Tuple[str, ...]],
+                               RewriterServer] = {}
+
+
+def GetRewriterServer(suffix: str, cflags: typing.List[str]) -> RewriterServer:
+  """Return the rewriter server of this process for a suffix and cflags.
+
+  Args:
+    suffix: The suffix of the source files, e.g. '.c' for C programs.
+    cflags: A list of flags to be passed to clang.
+
+  Returns:
+    A RewriterServer instance.
+  """
+  key = (suffix, tuple(cflags))
+  if key not in _rewriter_servers:
+    _rewriter_servers[key] = RewriterServer(suffix, cflags)
+  return _rewriter_servers[key]
+
+
+@atexit.register
+def _StopRewriterServers() -> None:
+  """Kill all rewriter servers of this process."""
+  for server in _rewriter_servers.values():
+    server.Stop()
+
+
 def NormalizeIdentifiers(text: str, suffix: str, cflags: typing.List[str],
                          timeout_seconds: int = 60) -> str:
   """Normalize identifiers in source code.
@@ -50,6 +200,13 @@ def NormalizeIdentifiers(text: str, suffix: str, cflags: typing.List[str],
     RewriterException: If rewriter found nothing to rewrite.
     ClangTimeout: If rewriter fails to complete within timeout_seconds.
   """
+  if FLAGS.clgen_rewriter_server:
+    returncode, stdout, stderr = GetRewriterServer(suffix, cflags).Rewrite(
+        text, timeout_seconds)
+    if returncode == EUGLY_CODE:
+      raise errors.RewriterException(stderr)
+    return stdout
+
   with tempfile.NamedTemporaryFile('w', suffix=suffix) as f:
     f.write(text)
     f.flush()
@@ -64,8 +221,6 @@ def NormalizeIdentifiers(text: str, suffix: str, cflags: typing.List[str],
                                universal_newlines=True, env=CLGEN_REWRITER_ENV)
     stdout, stderr = process.communicate()
     logging.debug(stderr)
-  # If there was nothing to rewrite, rewriter exits with error code:
-  EUGLY_CODE = 204
   if process.returncode == EUGLY_CODE:
     # Propagate the error:
     raise errors.RewriterException(stderr)
@@ -127,6 +127,64 @@ void A(int a, char** b) {
 """
 
 
+# Rewriter server tests.
+
+@pytest.fixture(scope='function')
+def rewriter_server():
+  """A test fixture which enables the rewriter server."""
+  FLAGS.clgen_rewriter_server = True
+  yield
+  FLAGS.clgen_rewriter_server = False
+
+
+def test_NormalizeIdentifiers_server_small_c_program(rewriter_server):
+  """Test the output of a small program using the rewriter server."""
+  for _ in range(3):
+    assert normalizer.NormalizeIdentifiers("""
+int main(int argc, char** argv) {}
+""", '.c', []) == """
+int A(int a, char** b) {}
+"""
+
+
+def test_NormalizeIdentifiers_server_state_reset(rewriter_server):
+  """Test that identifier names are not shared between sources."""
+  assert normalizer.NormalizeIdentifiers(
+      'int foo(int bar) { return bar; }', '.c', []) == (
+      'int A(int a) { return a; }')
+  assert normalizer.NormalizeIdentifiers(
+      'int car(int cdr) { return cdr; }', '.c', []) == (
+      'int A(int a) { return a; }')
+
+
+def test_NormalizeIdentifiers_server_small_cl_program(rewriter_server):
+  """Test the output of a small OpenCL program using the rewriter server."""
+  assert normalizer.NormalizeIdentifiers("""
+kernel void foo(global int* bar) {}
+""", '.cl', []) == """
+kernel void A(global int* a) {}
+"""
+
+
+def test_NormalizeIdentifiers_server_empty_c_file(rewriter_server):
+  """Test that RewriterException is raised on an empty file."""
+  with pytest.raises(errors.RewriterException):
+    normalizer.NormalizeIdentifiers('', '.c', [])
+  # The server is still usable after an error.
+  assert normalizer.NormalizeIdentifiers(
+      'int foo() {}', '.c', []) == 'int A() {}'
+
+
+def test_RewriterServer_timeout_restarts(rewriter_server):
+  """Test that a server which times out is killed and restarted."""
+  server = normalizer.GetRewriterServer('.c', [])
+  with pytest.raises(errors.ClangTimeout):
+    server.Rewrite('int foo() {}', 0)
+  assert server.process is None
+  assert normalizer.NormalizeIdentifiers(
+      'int foo() {}', '.c', []) == 'int A() {}'
+
+
 # Benchmarks.
 
 def test_benchmark_NormalizeIdentifiers_c_hello_world(benchmark):
@@ -141,6 +199,19 @@ int main(int argc, char** argv) {
 """, '.c', [])
 
 
+def test_benchmark_NormalizeIdentifiers_server_c_hello_world(
+    benchmark, rewriter_server):
+  """Benchmark NormalizeIdentifiers using the rewriter server."""
+  benchmark(normalizer.NormalizeIdentifiers, """
+#include <stdio.h>
+
+int main(int argc, char** argv) {
+  printf("Hello, world!\\n");
+  return 0;
+}
+""", '.c', [])
+
+
 def main(argv):
   """Main entry point."""
   del argv
@@ -5,6 +5,7 @@ determines the shape of the generated samples.
 """
 import typing
 
+import numpy as np
 from absl import flags
 
 from deeplearning.clgen import errors
@@ -36,6 +37,13 @@ def AssertConfigIsValid(config: sampler_pb2.Sampler) -> sampler_pb2.Sampler:
                                  'Sampler.batch_size must be > 0')
     pbutil.AssertFieldConstraint(config, 'temperature_micros', lambda x: 0 < x,
                                  'Sampler.temperature_micros must be > 0')
+    if config.HasField('top_k'):
+      pbutil.AssertFieldConstraint(config, 'top_k', lambda x: 0 < x,
+                                   'Sampler.top_k must be > 0')
+    if config.HasField('top_p_micros'):
+      pbutil.AssertFieldConstraint(
+          config, 'top_p_micros', lambda x: 0 < x <= 1000000,
+          'Sampler.top_p_micros must be in range (0, 1000000]')
     return config
   except pbutil.ProtoValueError as e:
     raise errors.UserError(e)
@@ -47,6 +55,12 @@ class TerminationCriterionBase(object):
   A TerminationCriterion is an object with a single public function
   SampleIsComplete(), which accepts as its sole argument a sample-in-progress,
   and returns whether to stop sampling.
+
+  For batched sampling, the InitBatchState() and BatchIsComplete() methods
+  provide an incremental equivalent of SampleIsComplete() which operates on
+  vocabulary indices rather than decoded tokens. Any state required to evaluate
+  the criterion is updated with each new index, so that the cost of a sampling
+  step does not depend on the length of the samples.
   """
 
   def Specialize(self, atomizer: atomizers.AtomizerBase) -> None:
@@ -73,6 +87,50 @@ class TerminationCriterionBase(object):
     """
     raise NotImplementedError('abstract class')
 
+  def InitBatchState(self, encoded_start_text: np.ndarray,
+                     batch_size: int) -> None:
+    """Initialize the incremental state for a batch of samples.
+
+    Only called after Specialize().
+
+    Args:
+      encoded_start_text: The encoded start text which every sample in the batch
+        begins with.
+      batch_size: The number of samples in the batch.
+    """
+    pass
+
+  def BatchIsComplete(self, indices: np.ndarray,
+                      num_tokens: np.ndarray) -> np.ndarray:
+    """Determine whether to stop sampling, for a batch of samples.
+
+    Only called after InitBatchState().
+
+    Args:
+      indices: An array of shape (batch_size,) of the vocabulary indices which
+        have just been appended to each sample in the batch.
+      num_tokens: An array of shape (batch_size,) of the number of tokens in
+        each sample, including the new index.
+
+    Returns:
+      An array of shape (batch_size,) of bools, which are True for samples which
+      are "complete".
+    """
+    raise NotImplementedError('abstract class')
+
+  def ResetBatchState(self, encoded_start_text: np.ndarray,
+                      rows: np.ndarray) -> None:
+    """Reset the incremental state of samples in a batch to the start text.
+
+    Only called after InitBatchState().
+
+    Args:
+      encoded_start_text: The encoded start text which every sample in the batch
+        begins with.
+      rows: An array of the row numbers of the samples to reset.
+    """
+    pass
+
 
 class MaxlenTerminationCriterion(TerminationCriterionBase):
   """A termination criterion which limits the maximum length of a sample."""
@@ -89,6 +147,11 @@ class MaxlenTerminationCriterion(TerminationCriterionBase):
     """Determine whether to stop sampling."""
     return len(sample_in_progress) >= self.max_len
 
+  def BatchIsComplete(self, indices: np.ndarray,
+                      num_tokens: np.ndarray) -> np.ndarray:
+    """Determine whether to stop sampling, for a batch of samples."""
+    return num_tokens >= self.max_len
+
 
 class SymmetricalTokenDepthCriterion(TerminationCriterionBase):
   """A termination criterion which counts symmetrical token depth.
@@ -113,6 +176,12 @@ class SymmetricalTokenDepthCriterion(TerminationCriterionBase):
       raise errors.UserError(e)
     if self.left_token == self.right_token:
       raise errors.UserError('SymmetricalTokenDepth tokens must be different')
+    # Set in Specialize().
+    self.left_index = None
+    self.right_index = None
+    # Set in InitBatchState().
+    self.left_token_count = None
+    self.right_token_count = None
 
   def Specialize(self, atomizer: atomizers.AtomizerBase) -> None:
     """Specialize a termination criteria to a vocabulary.
@@ -140,6 +209,8 @@ class SymmetricalTokenDepthCriterion(TerminationCriterionBase):
       raise errors.InvalidSymtokTokens(
           'Sampler symmetrical depth tokens cannot be encoded using the '
           'corpus vocabulary')
+    self.left_index = l[0]
+    self.right_index = r[0]
 
   def SampleIsComplete(self, sample_in_progress: typing.List[str]) -> bool:
     """Determine whether to stop sampling."""
@@ -157,6 +228,36 @@ class SymmetricalTokenDepthCriterion(TerminationCriterionBase):
       return False
     return left_token_count - right_token_count == 0
 
+  def InitBatchState(self, encoded_start_text: np.ndarray,
+                     batch_size: int) -> None:
+    """Initialize the running token counts for a batch of samples."""
+    self.left_token_count = np.full(
+        batch_size, np.count_nonzero(encoded_start_text == self.left_index),
+        dtype=np.int32)
+    self.right_token_count = np.full(
+        batch_size, np.count_nonzero(encoded_start_text == self.right_index),
+        dtype=np.int32)
+
+  def ResetBatchState(self, encoded_start_text: np.ndarray,
+                      rows: np.ndarray) -> None:
+    """Reset the running token counts of samples in a batch."""
+    self.left_token_count[rows] = np.count_nonzero(
+        encoded_start_text == self.left_index)
+    self.right_token_count[rows] = np.count_nonzero(
+        encoded_start_text == self.right_index)
+
+  def BatchIsComplete(self, indices: np.ndarray,
+                      num_tokens: np.ndarray) -> np.ndarray:
+    """Determine whether to stop sampling, for a batch of samples."""
+    is_right = indices == self.right_index
+    self.left_token_count += indices == self.left_index
+    self.right_token_count += is_right
+    # A sample is complete when the last token is a depth decrease token and
+    # either the depth is balanced, or we have descended into negative depth
+    # without ever starting balancing the tokens.
+    return is_right & ((self.left_token_count == 0) |
+                       (self.left_token_count == self.right_token_count))
+
 
 def GetTerminationCriteria(
     config: typing.List[sampler_pb2.SampleTerminationCriterion]) \
@@ -212,6 +313,9 @@ class Sampler(object):
     self.terminators = GetTerminationCriteria(self.config.termination_criteria)
     self.start_text = self.config.start_text
     self.temperature = self.config.temperature_micros / 1e6
+    # Distribution truncation is disabled when these values are zero.
+    self.top_k = self.config.top_k
+    self.top_p = self.config.top_p_micros / 1e6
     self.batch_size = self.config.batch_size
     # Set in Specialize().
     self.encoded_start_text = None
@@ -254,6 +358,48 @@ class Sampler(object):
     """
     return any(t.SampleIsComplete(sample_in_progress) for t in self.terminators)
 
+  def InitBatchState(self, batch_size: int) -> None:
+    """Initialize the termination criteria for a batch of samples.
+
+    Must call Specialize() first.
+
+    Args:
+      batch_size: The number of samples in the batch.
+    """
+    for terminator in self.terminators:
+      terminator.InitBatchState(self.encoded_start_text, batch_size)
+
+  def ResetBatchState(self, rows: np.ndarray) -> None:
+    """Reset the termination criteria of samples in a batch.
+
+    Args:
+      rows: An array of the row numbers of the samples to reset.
+    """
+    for terminator in self.terminators:
+      terminator.ResetBatchState(self.encoded_start_text, rows)
+
+  def BatchIsComplete(self, indices: np.ndarray,
+                      num_tokens: np.ndarray) -> np.ndarray:
+    """Determine whether to stop sampling, for a batch of samples.
+
+    Every termination criterion is evaluated, so that their incremental state
+    remains up to date.
+
+    Args:
+      indices: An array of shape (batch_size,) of the vocabulary indices which
+        have just been appended to each sample in the batch.
+      num_tokens: An array of shape (batch_size,) of the number of tokens in
+        each sample, including the new index.
+
+    Returns:
+      An array of shape (batch_size,) of bools, which are True for samples which
+      are "complete".
+    """
+    complete = np.zeros(len(indices), dtype=bool)
+    for terminator in self.terminators:
+      complete |= terminator.BatchIsComplete(indices, num_tokens)
+    return complete
+
   @staticmethod
   def _ComputeHash(config: sampler_pb2.Sampler) -> str:
     """Compute sampler hash.
@@ -270,3 +416,77 @@ class Sampler(object):
 
   def __ne__(self, rhs) -> bool:
     return not self.__eq__(rhs)
+
+
+class SampleBatchState(object):
+  """The state of a batch of samples in progress.
+
+  Samples are stored as rows of an array of vocabulary indices, and termination
+  criteria are evaluated incrementally on the indices, so that the cost of a
+  sampling step scales with the batch size rather than the length of the
+  samples. Samples are decoded only once they are complete.
+  """
+
+  def __init__(self, sampler: Sampler, batch_size: int):
+    """Instantiate the state for a new batch of samples.
+
+    Args:
+      sampler: A sampler which has been specialized to a vocabulary.
+      batch_size: The number of samples in the batch.
+    """
+    self.sampler = sampler
+    self.batch_size = batch_size
+    start_len = len(sampler.encoded_start_text)
+    # The array of tokens grows as required by Append().
+    self.indices = np.zeros((batch_size, max(2 * start_len, 256)),
+                            dtype=np.int32)
+    self.indices[:, :start_len] = sampler.encoded_start_text
+    self.num_tokens = np.full(batch_size, start_len, dtype=np.int32)
+    self.done = np.zeros(batch_size, dtype=bool)
+    sampler.InitBatchState(batch_size)
+
+  def ResetRows(self, rows: np.ndarray) -> None:
+    """Reset samples in the batch so that they begin a new sample.
+
+    Args:
+      rows: An array of the row numbers of the samples to reset.
+    """
+    start_len = len(self.sampler.encoded_start_text)
+    self.indices[rows, :start_len] = self.sampler.encoded_start_text
+    self.num_tokens[rows] = start_len
+    self.done[rows] = False
+    self.sampler.ResetBatchState(rows)
+
+  def Append(self, indices: np.ndarray) -> np.ndarray:
+    """Append the next index to every sample in the batch.
+
+    Indices for samples which are already complete are ignored.
+
+    Args:
+      indices: An array of shape (batch_size,) of vocabulary indices.
+
+    Returns:
+      An array of the row numbers of the samples which were completed by this
+      step.
+    """
+    indices = np.asarray(indices, dtype=np.int32)
+    if self.num_tokens.max() == self.indices.shape[1]:
+      self.indices = np.concatenate(
+          (self.indices, np.zeros_like(self.indices)), axis=1)
+    active = ~self.done
+    self.indices[np.arange(self.batch_size), self.num_tokens] = indices
+    self.num_tokens += active
+    complete = self.sampler.BatchIsComplete(indices, self.num_tokens) & active
+    self.done |= complete
+    return np.flatnonzero(complete)
+
+  def GetSampleIndices(self, row: int) -> np.ndarray:
+    """Return the vocabulary indices of a sample.
+
+    Args:
+      row: The row number of the sample in the batch.
+
+    Returns:
+      A 1D array of vocabulary indices.
+    """
+    return self.indices[row, :self.num_tokens[row]]
@@ -8,6 +8,7 @@ from absl import app
 
 from deeplearning.clgen import errors
 from deeplearning.clgen import samplers
+from deeplearning.clgen.corpuses import atomizers
 from deeplearning.clgen.proto import sampler_pb2
 
 
@@ -77,6 +78,28 @@ def test_AssertConfigIsValid_invalid_temperature_micros(abc_sampler_config):
   assert "Sampler.temperature_micros must be > 0" == str(e_info.value)
 
 
+def test_AssertConfigIsValid_invalid_top_k(abc_sampler_config):
+  """Test that an error is thrown if top_k is set and < 1."""
+  abc_sampler_config.top_k = 0
+  with pytest.raises(errors.UserError) as e_info:
+    samplers.Sampler(abc_sampler_config)
+  assert "Sampler.top_k must be > 0" == str(e_info.value)
+
+
+def test_AssertConfigIsValid_invalid_top_p_micros(abc_sampler_config):
+  """Test that an error is thrown if top_p_micros is out of range."""
+  abc_sampler_config.top_p_micros = 0
+  with pytest.raises(errors.UserError) as e_info:
+    samplers.Sampler(abc_sampler_config)
+  assert "Sampler.top_p_micros must be in range (0, 1000000]" == str(
+      e_info.value)
+  abc_sampler_config.top_p_micros = 1000001
+  with pytest.raises(errors.UserError) as e_info:
+    samplers.Sampler(abc_sampler_config)
+  assert "Sampler.top_p_micros must be in range (0, 1000000]" == str(
+      e_info.value)
+
+
 # MaxlenTerminationCriterion tests.
 
 def test_MaxlenTerminationCriterion_invalid_maximum_tokens_in_sample():
@@ -179,6 +202,35 @@ def test_SymmetrcalTokenDepthCriterion_SampleIsComplete_reverse_order():
   assert t.SampleIsComplete(['-', 'a', 'b', 'c', '+', '+', '-'])
 
 
+def test_SymmetricalTokenDepthCriterion_BatchIsComplete_equivalence():
+  """Test that BatchIsComplete() matches SampleIsComplete() for each row."""
+  t = samplers.SymmetricalTokenDepthCriterion(sampler_pb2.SymmetricalTokenDepth(
+      depth_increase_token='+', depth_decrease_token='-'))
+  atomizer = atomizers.AsciiCharacterAtomizer.FromText('+-abc')
+  t.Specialize(atomizer)
+  samples = ['+-', '-+a-', 'a+b+c--', '++-a-b-', '-+-']
+  start_text = atomizer.AtomizeString('a')
+  t.InitBatchState(start_text, len(samples))
+  for step in range(max(len(x) for x in samples)):
+    tokens = [x[step] if step < len(x) else 'a' for x in samples]
+    complete = t.BatchIsComplete(
+        atomizer.AtomizeString(''.join(tokens)),
+        np.full(len(samples), step + 2))
+    for i, sample in enumerate(samples):
+      if step < len(sample):
+        sample_in_progress = ['a'] + list(sample[:step + 1])
+        assert complete[i] == t.SampleIsComplete(sample_in_progress)
+
+
+def test_MaxlenTerminationCriterion_BatchIsComplete():
+  """Test BatchIsComplete() returns expected values."""
+  t = samplers.MaxlenTerminationCriterion(
+      sampler_pb2.MaxTokenLength(maximum_tokens_in_sample=3))
+  np.testing.assert_array_equal(
+      np.array([False, False, True, True]),
+      t.BatchIsComplete(np.zeros(4), np.array([1, 2, 3, 4])))
+
+
 # Sampler tests.
 
 def test_Sampler_config_type_error():
@@ -201,6 +253,22 @@ def test_Sampler_temperature(abc_sampler_config: sampler_pb2.Sampler):
   assert pytest.approx(1.0) == s.temperature
 
 
+def test_Sampler_top_k_top_p_unset(abc_sampler_config: sampler_pb2.Sampler):
+  """Test that top_k and top_p are disabled when not set."""
+  s = samplers.Sampler(abc_sampler_config)
+  assert 0 == s.top_k
+  assert 0 == s.top_p
+
+
+def test_Sampler_top_k_top_p(abc_sampler_config: sampler_pb2.Sampler):
+  """Test that top_k and top_p are set from Sampler proto."""
+  abc_sampler_config.top_k = 10
+  abc_sampler_config.top_p_micros = 900000
+  s = samplers.Sampler(abc_sampler_config)
+  assert 10 == s.top_k
+  assert pytest.approx(0.9) == s.top_p
+
+
 def test_Sampler_batch_size(abc_sampler_config: sampler_pb2.Sampler):
   """Test that batch_size is set from Sampler proto."""
   abc_sampler_config.batch_size = 99
@@ -262,6 +330,70 @@ def test_Sampler_Specialize_encoded_start_text(
   np.testing.assert_array_equal(np.array([1]), s.encoded_start_text)
 
 
+# SampleBatchState tests.
+
+def test_SampleBatchState_Append(abc_sampler_config: sampler_pb2.Sampler):
+  """Test that samples are completed and decoded independently."""
+  abc_sampler_config.start_text = 'a'
+  abc_sampler_config.ClearField('termination_criteria')
+  abc_sampler_config.termination_criteria.add().maxlen.CopyFrom(
+      sampler_pb2.MaxTokenLength(maximum_tokens_in_sample=3))
+  abc_sampler_config.termination_criteria.add().symtok.CopyFrom(
+      sampler_pb2.SymmetricalTokenDepth(
+          depth_increase_token='+', depth_decrease_token='-'))
+  s = samplers.Sampler(abc_sampler_config)
+  atomizer = atomizers.AsciiCharacterAtomizer.FromText('+-abc')
+  s.Specialize(atomizer)
+  state = samplers.SampleBatchState(s, 3)
+  # Negative depth completes the first sample.
+  assert list(state.Append(atomizer.AtomizeString('-+b'))) == [0]
+  # Maximum length completes the second and third samples.
+  assert list(state.Append(atomizer.AtomizeString('cac'))) == [1, 2]
+  assert state.done.all()
+  assert atomizer.DeatomizeIndices(state.GetSampleIndices(0)) == 'a-'
+  assert atomizer.DeatomizeIndices(state.GetSampleIndices(1)) == 'a+a'
+  assert atomizer.DeatomizeIndices(state.GetSampleIndices(2)) == 'abc'
+
+
+def test_SampleBatchState_Append_grows(abc_sampler_config: sampler_pb2.Sampler):
+  """Test that samples can grow beyond the initial size of the array."""
+  abc_sampler_config.start_text = 'a'
+  abc_sampler_config.ClearField('termination_criteria')
+  abc_sampler_config.termination_criteria.add().maxlen.CopyFrom(
+      sampler_pb2.MaxTokenLength(maximum_tokens_in_sample=1000))
+  s = samplers.Sampler(abc_sampler_config)
+  atomizer = atomizers.AsciiCharacterAtomizer.FromText('abc')
+  s.Specialize(atomizer)
+  state = samplers.SampleBatchState(s, 2)
+  for _ in range(998):
+    assert not list(state.Append(np.array([1, 2])))
+  assert list(state.Append(np.array([1, 2]))) == [0, 1]
+  assert atomizer.DeatomizeIndices(state.GetSampleIndices(0)) == 'a' + 'b' * 999
+
+
+def test_SampleBatchState_ResetRows(abc_sampler_config: sampler_pb2.Sampler):
+  """Test that reset samples begin again from the start text."""
+  abc_sampler_config.start_text = 'a'
+  abc_sampler_config.ClearField('termination_criteria')
+  abc_sampler_config.termination_criteria.add().symtok.CopyFrom(
+      sampler_pb2.SymmetricalTokenDepth(
+          depth_increase_token='+', depth_decrease_token='-'))
+  s = samplers.Sampler(abc_sampler_config)
+  atomizer = atomizers.AsciiCharacterAtomizer.FromText('+-abc')
+  s.Specialize(atomizer)
+  state = samplers.SampleBatchState(s, 2)
+  assert not list(state.Append(atomizer.AtomizeString('++')))
+  assert list(state.Append(atomizer.AtomizeString('-b'))) == [0]
+  assert list(state.Append(atomizer.AtomizeString('--'))) == [1]
+  state.ResetRows(np.array([0, 1]))
+  assert not state.done.any()
+  assert atomizer.DeatomizeIndices(state.GetSampleIndices(0)) == 'a'
+  # The depth counters are reset, so a single depth increase is not balanced.
+  assert not list(state.Append(atomizer.AtomizeString('++')))
+  assert list(state.Append(atomizer.AtomizeString('-c'))) == [0]
+  assert atomizer.DeatomizeIndices(state.GetSampleIndices(0)) == 'a+-'
+
+
 def main(argv):
   """Main entry point."""
   if len(argv) > 1:
@@ -2,7 +2,9 @@
 """
 import contextlib
 import pathlib
+import typing
 
+import sqlalchemy as sql
 from absl import flags
 from absl import logging
 from sqlalchemy import orm
@@ -15,7 +17,6 @@ import deeplearning.deepsmith.testbed
 import deeplearning.deepsmith.testcase
 import deeplearning.deepsmith.testcase
 import deeplearning.deepsmith.toolchain
-import labm8.sqlutil
 from deeplearning.deepsmith import db
 from deeplearning.deepsmith.proto import datastore_pb2
 from deeplearning.deepsmith.proto import deepsmith_pb2
@@ -111,99 +112,134 @@ class DataStore(object):
     """
     del response
     with self.Session(commit=True) as session:
-      for testcase in request.testcases:
-        self._AddOneTestcase(session, testcase)
+      deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(
+          session, list(request.testcases))
 
-  def _AddOneTestcase(self, session: db.session_t,
-                      proto: deepsmith_pb2.Testcase) -> None:
-    """Record a single Testcase in the database.
+  def _BuildTestcaseRequestQuery(
+      self, session: db.session_t,
+      request: datastore_pb2.GetTestcasesRequest) -> db.query_t:
+    """Build a query for the testcases which match a request.
+
+    Testcases with results or pending results on the requested testbed are
+    excluded using NOT EXISTS anti-joins, which are served by the
+    <testcase_id, testbed_id> unique indexes of the results and pending_results
+    tables.
+
+    Args:
+      session: A database session.
+      request: The request.
+
+    Returns:
+      A query for Testcase instances.
     """
-    deeplearning.deepsmith.testcase.Testcase.GetOrAdd(session, proto)
-
-  def _BuildTestcaseRequestQuery(self, session, request) -> db.query_t:
-    def _FilterToolchainGeneratorHarness(q):
-      if request.HasField('toolchain'):
-        toolchain = labm8.sqlutil.GetOrAdd(session,
-                                           deeplearning.deepsmith.toolchain.Toolchain,
-                                           name=request.toolchain)
-        if not toolchain:
-          raise LookupError
-        q = q.filter(
-            deeplearning.deepsmith.testcase.Testcase.toolchain_id == toolchain.id)
-
-      # Filter by generator.
-      if request.HasField('generator'):
-        generator = session.query(
-            deeplearning.deepsmith.generator.Generator).filter(
-            deeplearning.deepsmith.generator.Generator.name ==
-            request.generator.name,
-            deeplearning.deepsmith.generator.Generator.version ==
-            request.generator.version).first()
-        if not generator:
-          raise LookupError
-        q = q.filter(
-            deeplearning.deepsmith.testcase.Testcase.generator_id == generator.id)
-
-      # Filter by generator.
-      if request.has_harness:
-        harness = session.query(deeplearning.deepsmith.harness.Harness).filter(
-            deeplearning.deepsmith.harness.Harness.name == request.harness.name,
-            deeplearning.deepsmith.harness.Harness.version ==
-            request.harness.version).first()
-        if not harness:
-          raise LookupError
-        q = q.filter(
-            deeplearning.deepsmith.testcase.Testcase.harnessid == harness.id)
-
-      return q
-
-    q = session.query(deeplearning.deepsmith.testcase.Testcase)
-    q = _FilterToolchainGeneratorHarness(q)
-
-    testbed_id = None
+    testcase_t = deeplearning.deepsmith.testcase.Testcase
+
+    # The components of the request are resolved to IDs using GetOrAdd(). New
+    # components match no testcases, and are discarded with the session.
+    q = session.query(testcase_t)
+    if request.HasField('toolchain'):
+      toolchain = deeplearning.deepsmith.toolchain.Toolchain.GetOrAdd(
+          session, request.toolchain)
+      session.flush()
+      q = q.filter(testcase_t.toolchain_id == toolchain.id)
+
+    if request.HasField('generator'):
+      generator = deeplearning.deepsmith.generator.Generator.GetOrAdd(
+          session, request.generator)
+      session.flush()
+      q = q.filter(testcase_t.generator_id == generator.id)
+
+    if request.HasField('harness'):
+      harness = deeplearning.deepsmith.harness.Harness.GetOrAdd(
+          session, request.harness)
+      session.flush()
+      q = q.filter(testcase_t.harness_id == harness.id)
+
     if request.HasField('testbed'):
-      toolchain = labm8.sqlutil.GetOrAdd(session,
-                                         deeplearning.deepsmith.toolchain.Toolchain,
-                                         name=request.testbed)
-      testbed = labm8.sqlutil.GetOrAdd(session,
-                                       deeplearning.deepsmith.testbed.Testbed,
-                                       toolchain=toolchain,
-                                       name=request.testbed.toolchain,
-                                       version=request.testbed.version)
-      testbed_id = testbed.id
-
-    if testbed_id and not request.include_testcases_with_results:
-      q2 = session.query(deeplearning.deepsmith.result.Result.testcase_id).join(
-          deeplearning.deepsmith.testcase.Testcase).filter(
-          deeplearning.deepsmith.result.Result.testbed_id == testbed_id)
-      q2 = _FilterToolchainGeneratorHarness(q2)
-      q = q.filter(~deeplearning.deepsmith.testcase.Testcase.id.in_(q2))
-
-    if testbed_id and not request.include_testcases_with_pending_results:
-      q2 = session.query(
-          deeplearning.deepsmith.result.PendingResult.testcase_id).join(
-          deeplearning.deepsmith.testcase.Testcase).filter(
-          deeplearning.deepsmith.result.PendingResult.testbed_id == testbed_id)
-      q2 = _FilterToolchainGeneratorHarness(q2)
-      q = q.filter(~deeplearning.deepsmith.testcase.Testcase.id.in_(q2))
+      testbed = deeplearning.deepsmith.testbed.Testbed.GetOrAdd(
+          session, request.testbed)
+      session.flush()
+      if not request.include_testcases_with_results:
+        result_t = deeplearning.deepsmith.result.Result
+        q = q.filter(~sql.exists().where(sql.and_(
+            result_t.testcase_id == testcase_t.id,
+            result_t.testbed_id == testbed.id)))
+      if not request.include_testcases_with_pending_results:
+        pending_result_t = deeplearning.deepsmith.result.PendingResult
+        q = q.filter(~sql.exists().where(sql.and_(
+            pending_result_t.testcase_id == testcase_t.id,
+            pending_result_t.testbed_id == testbed.id)))
 
     return q
 
+  def _BuildTestcasePageQuery(
+      self, session: db.session_t,
+      request: datastore_pb2.GetTestcasesRequest) -> db.query_t:
+    """Build a query for a page of the testcases which match a request.
+
+    Pages are selected using the testcase ID as a key, rather than an offset,
+    so that the cost of a page does not grow with the number of pages before
+    it, and testcases which are excluded after a page has been read do not
+    cause later testcases to be skipped.
+    """
+    testcase_t = deeplearning.deepsmith.testcase.Testcase
+    return self._BuildTestcaseRequestQuery(session, request) \
+      .filter(testcase_t.id > request.after_testcase_id) \
+      .order_by(testcase_t.id) \
+      .limit(request.max_num_testcases_to_return)
+
   def GetTestcases(self, request: datastore_pb2.GetTestcasesRequest,
                    response: datastore_pb2.GetTestcasesResponse) -> None:
-    """Request testcases."""
-    with self.Session(commit=False) as session:
-      # Validate request parameters.
-      if request.max_num_testcases < 1:
-        raise InvalidRequest(
-            f'max_num_testcases must be >= 1, not {request.max_num_testcases}')
+    """Request testcases.
 
-      q = self._BuildTestcaseRequestQuery(session, request)
-      q.limit(request.max_num_testcases)
+    Testcases are returned in order of their IDs, one page of at most
+    max_num_testcases_to_return testcases at a time. To request the next page,
+    set after_testcase_id of the request to the last_testcase_id of the
+    response.
 
+    Raises:
+      InvalidRequest: If max_num_testcases_to_return is not positive.
+    """
+    # Validate request parameters.
+    if request.max_num_testcases_to_return < 1:
+      raise InvalidRequest('max_num_testcases_to_return must be >= 1, not '
+                           f'{request.max_num_testcases_to_return}')
+
+    with self.Session(commit=False) as session:
       if request.return_testcases:
-        response.testcases = [testcase.ToProto() for testcase in q]
+        page = self._BuildTestcasePageQuery(session, request).all()
+        response.testcases.extend(testcase.ToProto() for testcase in page)
+        if page:
+          response.last_testcase_id = page[-1].id
 
       if request.return_total_matching_count:
-        q2 = self._BuildTestcaseRequestQuery(session, request)
-        response.total_matching_count = q2.count()
+        q = self._BuildTestcaseRequestQuery(session, request)
+        response.total_matching_count = q.count()
+
+  def IterTestcases(self, request: datastore_pb2.GetTestcasesRequest
+                    ) -> typing.Iterator[deepsmith_pb2.Testcase]:
+    """Iterate over all of the testcases which match a request.
+
+    Testcases are read one page of max_num_testcases_to_return testcases at a
+    time, so that callers may start running testcases before all of them have
+    been read.
+
+    Args:
+      request: The request. The after_testcase_id field is ignored.
+
+    Returns:
+      An iterator of Testcase messages.
+    """
+    request_copy = datastore_pb2.GetTestcasesRequest()
+    request_copy.CopyFrom(request)
+    request = request_copy
+    request.return_testcases = True
+    request.return_total_matching_count = False
+    request.after_testcase_id = 0
+    while True:
+      response = datastore_pb2.GetTestcasesResponse()
+      self.GetTestcases(request, response)
+      yield from response.testcases
+      if len(response.testcases) < request.max_num_testcases_to_return:
+        break
+      request.after_testcase_id = response.last_testcase_id
@@ -0,0 +1,227 @@
+"""Tests for //deeplearning/deepsmith:datastore."""
+import datetime
+import os
+import pathlib
+import re
+import sys
+import typing
+
+import pytest
+from absl import app
+
+import deeplearning.deepsmith.result
+import deeplearning.deepsmith.testbed
+import deeplearning.deepsmith.testcase
+from deeplearning.deepsmith import datastore
+from deeplearning.deepsmith import db
+from deeplearning.deepsmith.proto import datastore_pb2
+from deeplearning.deepsmith.proto import deepsmith_pb2
+from labm8 import pbutil
+
+
+# The path of a DataStore config for a local PostgreSQL server, used to test
+# query plans. If not set, PostgreSQL tests are skipped.
+_POSTGRESQL_CONFIG_ENV = 'DEEPSMITH_TEST_POSTGRESQL_CONFIG'
+
+
+def _MakeTestcaseProto(i: int, harness: str = 'harness'
+                       ) -> deepsmith_pb2.Testcase:
+  return deepsmith_pb2.Testcase(
+      toolchain='cpp',
+      generator=deepsmith_pb2.Generator(name='generator'),
+      harness=deepsmith_pb2.Harness(name=harness),
+      inputs={'src': f'void main() {{ return {i}; }}'},
+  )
+
+
+def _MakeTestbedProto(name: str = 'clang') -> deepsmith_pb2.Testbed:
+  return deepsmith_pb2.Testbed(toolchain='cpp', name=name)
+
+
+def _AddTestcases(ds: datastore.DataStore, n: int) -> typing.List[int]:
+  """Add n testcases and return their IDs."""
+  with ds.Session(commit=True) as s:
+    return deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(
+        s, [_MakeTestcaseProto(i) for i in range(n)])
+
+
+def _AddResult(ds: datastore.DataStore, i: int,
+               testbed: deepsmith_pb2.Testbed) -> None:
+  with ds.Session(commit=True) as s:
+    deeplearning.deepsmith.result.Result.GetOrAddMany(s, [
+      deepsmith_pb2.Result(testcase=_MakeTestcaseProto(i), testbed=testbed,
+                           outcome=deepsmith_pb2.Result.PASS)])
+
+
+def _AddPendingResult(ds: datastore.DataStore, testcase_id: int,
+                      testbed: deepsmith_pb2.Testbed) -> None:
+  with ds.Session(commit=True) as s:
+    testbed = deeplearning.deepsmith.testbed.Testbed.GetOrAdd(s, testbed)
+    s.flush()
+    s.add(deeplearning.deepsmith.result.PendingResult(
+        testcase_id=testcase_id, testbed_id=testbed.id,
+        deadline=datetime.datetime.utcnow()))
+
+
+def _GetTestcases(ds: datastore.DataStore, **kwargs
+                  ) -> datastore_pb2.GetTestcasesResponse:
+  request = datastore_pb2.GetTestcasesRequest(**kwargs)
+  response = datastore_pb2.GetTestcasesResponse()
+  ds.GetTestcases(request, response)
+  return response
+
+
+def test_GetTestcases_invalid_max_num_testcases(ds: datastore.DataStore):
+  """Test that the number of testcases to return must be positive."""
+  with pytest.raises(datastore.InvalidRequest):
+    _GetTestcases(ds, max_num_testcases_to_return=0)
+
+
+def test_GetTestcases_pages(ds: datastore.DataStore):
+  """Test that testcases are returned in pages of the requested size."""
+  ids = _AddTestcases(ds, 5)
+  response = _GetTestcases(ds, max_num_testcases_to_return=2,
+                           return_total_matching_count=True)
+  assert list(response.testcases) == [_MakeTestcaseProto(0),
+                                      _MakeTestcaseProto(1)]
+  assert response.last_testcase_id == ids[1]
+  assert response.total_matching_count == 5
+
+  response = _GetTestcases(ds, max_num_testcases_to_return=2,
+                           after_testcase_id=ids[1])
+  assert list(response.testcases) == [_MakeTestcaseProto(2),
+                                      _MakeTestcaseProto(3)]
+  response = _GetTestcases(ds, max_num_testcases_to_return=2,
+                           after_testcase_id=ids[3])
+  assert list(response.testcases) == [_MakeTestcaseProto(4)]
+  response = _GetTestcases(ds, max_num_testcases_to_return=2,
+                           after_testcase_id=ids[4])
+  assert not response.testcases
+  assert not response.HasField('last_testcase_id')
+
+
+def test_GetTestcases_count_only(ds: datastore.DataStore):
+  """Test that the count of matching testcases is not limited to a page."""
+  _AddTestcases(ds, 5)
+  response = _GetTestcases(ds, max_num_testcases_to_return=1,
+                           return_testcases=False,
+                           return_total_matching_count=True)
+  assert not response.testcases
+  assert response.total_matching_count == 5
+
+
+def test_GetTestcases_filter_harness(ds: datastore.DataStore):
+  """Test that testcases are filtered by harness."""
+  _AddTestcases(ds, 3)
+  with ds.Session(commit=True) as s:
+    deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(
+        s, [_MakeTestcaseProto(10, harness='other')])
+  response = _GetTestcases(ds, harness=deepsmith_pb2.Harness(name='other'),
+                           return_total_matching_count=True)
+  assert list(response.testcases) == [_MakeTestcaseProto(10, harness='other')]
+  assert response.total_matching_count == 1
+  response = _GetTestcases(ds, harness=deepsmith_pb2.Harness(name='unknown'),
+                           toolchain='cpp')
+  assert not response.testcases
+
+
+def test_GetTestcases_excludes_testcases_with_results(
+    ds: datastore.DataStore):
+  """Test that testcases with results on the testbed are not returned."""
+  ids = _AddTestcases(ds, 4)
+  _AddResult(ds, 1, _MakeTestbedProto())
+  _AddResult(ds, 2, _MakeTestbedProto('gcc'))
+  _AddPendingResult(ds, ids[3], _MakeTestbedProto())
+
+  response = _GetTestcases(ds, testbed=_MakeTestbedProto(),
+                           return_total_matching_count=True)
+  assert list(response.testcases) == [_MakeTestcaseProto(0),
+                                      _MakeTestcaseProto(2)]
+  assert response.total_matching_count == 2
+
+  response = _GetTestcases(ds, testbed=_MakeTestbedProto(),
+                           include_testcases_with_results=True)
+  assert len(response.testcases) == 3
+  response = _GetTestcases(ds, testbed=_MakeTestbedProto(),
+                           include_testcases_with_pending_results=True)
+  assert len(response.testcases) == 3
+  response = _GetTestcases(ds, testbed=_MakeTestbedProto('unknown'))
+  assert len(response.testcases) == 4
+
+
+def test_IterTestcases(ds: datastore.DataStore):
+  """Test that all matching testcases are returned, in order."""
+  _AddTestcases(ds, 7)
+  _AddResult(ds, 3, _MakeTestbedProto())
+  request = datastore_pb2.GetTestcasesRequest(
+      testbed=_MakeTestbedProto(), max_num_testcases_to_return=2)
+  assert list(ds.IterTestcases(request)) == [
+    _MakeTestcaseProto(i) for i in (0, 1, 2, 4, 5, 6)]
+
+
+# Query plan tests.
+
+
+def _PageQuerySql(ds: datastore.DataStore, session: db.session_t) -> str:
+  """Return the SQL of a query for a page of testcases to run on a testbed."""
+  request = datastore_pb2.GetTestcasesRequest(
+      toolchain='cpp', harness=deepsmith_pb2.Harness(name='harness'),
+      testbed=_MakeTestbedProto(), after_testcase_id=1)
+  q = ds._BuildTestcasePageQuery(session, request)
+  return str(q.statement.compile(dialect=session.get_bind().dialect,
+                                 compile_kwargs={'literal_binds': True}))
+
+
+def test_GetTestcases_sqlite_query_plan(ds: datastore.DataStore):
+  """Test that a page of testcases is selected without table scans."""
+  with ds.Session() as s:
+    plan = [row[-1] for row in
+            s.execute(f'EXPLAIN QUERY PLAN {_PageQuerySql(ds, s)}')]
+  plan_str = '\n'.join(plan)
+  # The anti-joins use an index of the results and pending results tables.
+  for table in ('results', 'pending_results'):
+    assert re.search(rf'SEARCH {table} USING (COVERING )?INDEX \S+ '
+                     r'\(testcase_id=\? AND testbed_id=\?\)', plan_str)
+  assert not [p for p in plan if p.startswith('SCAN results')]
+  assert not [p for p in plan if p.startswith('SCAN pending_results')]
+  # The page is read in primary key order, starting at the key.
+  assert 'SEARCH testcases USING INTEGER PRIMARY KEY (rowid>?)' in plan_str
+  assert 'TEMP B-TREE' not in plan_str
+
+
+@pytest.fixture(scope='function')
+def postgresql_ds() -> datastore.DataStore:
+  """A test fixture which returns a datastore on a local PostgreSQL server."""
+  if not os.environ.get(_POSTGRESQL_CONFIG_ENV):
+    pytest.skip(f'{_POSTGRESQL_CONFIG_ENV} not set')
+  config = pbutil.FromFile(pathlib.Path(os.environ[_POSTGRESQL_CONFIG_ENV]),
+                           datastore_pb2.DataStore())
+  assert config.HasField('postgresql')
+  assert config.testonly
+  db.DestroyTestonlyEngine(config)
+  yield datastore.DataStore(config)
+  db.DestroyTestonlyEngine(config)
+
+
+def test_GetTestcases_postgresql_query_plan(postgresql_ds: datastore.DataStore):
+  """Test that a page of testcases is selected using anti-joins on indexes."""
+  _AddTestcases(postgresql_ds, 10)
+  with postgresql_ds.Session() as s:
+    # The tables are small, so sequential scans must be disabled for the
+    # planner to choose the indexes.
+    s.execute('SET enable_seqscan = off')
+    plan = '\n'.join(row[0] for row in
+                     s.execute(f'EXPLAIN {_PageQuerySql(postgresql_ds, s)}'))
+  assert 'Anti Join' in plan
+  assert 'Seq Scan on results' not in plan
+  assert 'Seq Scan on pending_results' not in plan
+  assert 'Seq Scan on testcases' not in plan
+
+
+def main(argv):  # pylint: disable=missing-docstring
+  del argv
+  sys.exit(pytest.main([__file__, '-v']))
+
+
+if __name__ == '__main__':
+  app.run(main)
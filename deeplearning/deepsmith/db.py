@@ -1,12 +1,15 @@
 """Database backend.
 """
 import datetime
+import hashlib
 import pathlib
+import typing
 
 import sqlalchemy as sql
 from absl import flags
 from absl import logging
 from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 
 from deeplearning.deepsmith.proto import datastore_pb2
@@ -28,6 +31,11 @@ query_t = sql.orm.query.Query
 # The SQLAlchemy base table.
 Base = declarative_base()
 
+# The maximum number of values in a single IN clause, or rows in a single
+# multi-row INSERT. Older versions of SQLite limit the number of host
+# parameters in a query to 999.
+MAX_ROWS_PER_QUERY = 500
+
 
 class InvalidDatabaseConfig(ValueError):
   """Raise if the datastore config contains invalid values."""
@@ -211,6 +219,31 @@ class StringTable(Table):
 
     return GetOrAdd(session, cls, string=string)
 
+  @classmethod
+  def GetOrAddMany(cls, session: session_t,
+                   strings: typing.Iterable[str]) -> typing.Dict[str, int]:
+    """Look up the IDs of many strings, adding those which do not exist.
+
+    This is a batched equivalent of GetOrAdd(), which resolves the strings using
+    a small number of queries, rather than one or two queries per string.
+
+    Args:
+      session: A database session.
+      strings: The strings.
+
+    Returns:
+      A map from string to ID.
+
+    Raises:
+      StringTooLongError: If any of the strings are too long.
+    """
+    rows = {}
+    for string in strings:
+      if len(string) > cls.maxlen:
+        raise StringTooLongError(cls, string, cls.maxlen)
+      rows[string] = {'string': string}
+    return GetOrAddIds(session, cls, cls.string, rows)
+
   def TruncatedString(self, n=80):
     """Return the truncated first 'n' characters of the string.
 
@@ -231,6 +264,131 @@ class StringTable(Table):
     return self.TruncatedString(n=52)
 
 
+def InsertIgnore(session: session_t, table: sql.Table,
+                 rows: typing.List[typing.Dict[str, typing.Any]]) -> None:
+  """Insert rows into a table, skipping rows which violate a unique constraint.
+
+  Rows are inserted in batches using a single multi-row statement per batch.
+  Column defaults are applied as for ORM inserts.
+
+  Args:
+    session: A database session.
+    table: The table to insert into.
+    rows: The rows to insert, as maps from column name to value.
+
+  Raises:
+    NotImplementedError: If the database backend is not supported.
+  """
+  if not rows:
+    return
+  dialect = session.get_bind().dialect.name
+  if dialect == 'postgresql':
+    statement = postgresql.insert(table).on_conflict_do_nothing()
+  elif dialect == 'mysql':
+    statement = table.insert().prefix_with('IGNORE')
+  elif dialect == 'sqlite':
+    statement = table.insert().prefix_with('OR IGNORE')
+  else:
+    raise NotImplementedError(f'unsupported database engine {dialect}')
+  for i in range(0, len(rows), MAX_ROWS_PER_QUERY):
+    session.execute(statement, rows[i:i + MAX_ROWS_PER_QUERY])
+
+
+def GetOrAddIds(session: session_t, model, key_column: sql.Column,
+                rows: typing.Dict[typing.Any, typing.Dict[str, typing.Any]]
+                ) -> typing.Dict[typing.Any, int]:
+  """Look up the IDs of many rows, adding those which do not exist.
+
+  This is a batched equivalent of labm8.sqlutil.GetOrAdd() for tables which
+  have a unique key column. Existing rows are resolved with IN queries, and the
+  remaining rows are inserted with InsertIgnore(), so that rows added
+  concurrently by another client are not duplicated.
+
+  Args:
+    session: A database session.
+    model: The database table class, which must have an integer 'id' column.
+    key_column: A unique column of the table.
+    rows: A map from key column value to the values of the row.
+
+  Returns:
+    A map from key column value to row ID.
+  """
+  ids = _SelectIds(session, model, key_column, list(rows.keys()))
+  missing = [key for key in rows if key not in ids]
+  if missing:
+    InsertIgnore(session, model.__table__, [rows[key] for key in missing])
+    ids.update(_SelectIds(session, model, key_column, missing))
+  return ids
+
+
+def _SelectIds(session: session_t, model, key_column: sql.Column,
+               keys: typing.List[typing.Any]) -> typing.Dict[typing.Any, int]:
+  """Return a map from key column value to ID for the keys which exist."""
+  ids = {}
+  for i in range(0, len(keys), MAX_ROWS_PER_QUERY):
+    query = session.query(key_column, model.id).filter(
+        key_column.in_(keys[i:i + MAX_ROWS_PER_QUERY]))
+    ids.update(query)
+  return ids
+
+
+def Md5Set(name_values: typing.Dict[str, str]) -> bytes:
+  """Return the ID of a set of <name, value> pairs.
+
+  This is the md5 of the concatenated names and values, in name order.
+  """
+  md5 = hashlib.md5()
+  for name in sorted(name_values):
+    md5.update((name + name_values[name]).encode('utf-8'))
+  return md5.digest()
+
+
+def GetOrAddNameValuePairIds(
+    session: session_t, model, name_model, value_model,
+    name_values: typing.List[typing.Dict[str, str]]
+) -> typing.Dict[typing.Tuple[str, str], int]:
+  """Look up the IDs of many <name, value> pairs, adding those which do not
+  exist.
+
+  Args:
+    session: A database session.
+    model: The table of pairs, which has a unique (name_id, value_id)
+      constraint.
+    name_model: The table of names.
+    value_model: The table of values.
+    name_values: A list of maps of names to values.
+
+  Returns:
+    A map from <name, value> pair to ID.
+  """
+  pairs = set()
+  for name_value in name_values:
+    pairs.update(name_value.items())
+  name_ids = name_model.GetOrAddMany(session, set(n for n, _ in pairs))
+  value_ids = value_model.GetOrAddMany(session, set(v for _, v in pairs))
+  id_pairs = {(name_ids[n], value_ids[v]): (n, v) for n, v in pairs}
+
+  def _SelectIds(wanted):
+    ids = {}
+    value_ids_ = sorted(set(v for _, v in wanted))
+    for i in range(0, len(value_ids_), MAX_ROWS_PER_QUERY):
+      query = session.query(model.name_id, model.value_id, model.id).filter(
+          model.value_id.in_(value_ids_[i:i + MAX_ROWS_PER_QUERY]))
+      for name_id, value_id, id_ in query:
+        if (name_id, value_id) in wanted:
+          ids[(name_id, value_id)] = id_
+    return ids
+
+  ids = _SelectIds(id_pairs)
+  missing = [pair for pair in id_pairs if pair not in ids]
+  if missing:
+    InsertIgnore(session, model.__table__, [
+      {'name_id': name_id, 'value_id': value_id}
+      for name_id, value_id in missing])
+    ids.update(_SelectIds(set(missing)))
+  return {id_pairs[pair]: id_ for pair, id_ in ids.items()}
+
+
 def MakeEngine(config: datastore_pb2.DataStore) -> sql.engine.Engine:
   """Instantiate a database engine.
 
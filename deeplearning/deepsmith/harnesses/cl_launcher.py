@@ -81,6 +81,8 @@ class ClLauncherHarness(harness.HarnessBase,
     self.envs = envs
     self.testbeds = [OpenClEnvironmentToTestbed(e) for e in envs]
     self.ids = [e.ids() for e in envs]
+    self.executors = harness.MakeTestbedExecutors(
+        self.config, [e.device_type for e in envs])
 
     # Logging output.
     for testbed in self.testbeds:
@@ -108,10 +110,13 @@ class ClLauncherHarness(harness.HarnessBase,
       return response
 
     testbed_idx = self.testbeds.index(request.testbed)
-    for i, testcase in enumerate(request.testcases):
-      result = RunTestcase(
-          self.envs[testbed_idx], self.testbeds[testbed_idx], testcase,
-          list(self.config.opts))
+    results = harness.RunTestcases(
+        self.executors[testbed_idx],
+        lambda t: RunTestcase(
+            self.envs[testbed_idx], self.testbeds[testbed_idx], t,
+            list(self.config.opts)),
+        request.testcases)
+    for i, result in enumerate(results):
       logging.info('Testcase %d: %s.', i + 1,
                    deepsmith_pb2.Result.Outcome.Name(result.outcome))
       response.results.extend([result])
@@ -2,6 +2,7 @@ import copy
 import pathlib
 import subprocess
 import tempfile
+import threading
 import time
 import typing
 from concurrent import futures
@@ -101,6 +102,11 @@ class CldriveHarness(harness.HarnessBase,
     self.envs = envs
     self.testbeds = [OpenClEnvironmentToTestbed(e) for e in envs]
     self.ids = [e.ids() for e in envs]
+    self.executors = harness.MakeTestbedExecutors(
+        self.config, [e.device_type for e in envs])
+    # A driver is compiled once per OpenCL environment, on first use.
+    self.drivers = [GenericDriver(*ids, cflags=self.config.driver_cflag)
+                    for ids in self.ids]
 
     # Logging output.
     for testbed in self.testbeds:
@@ -127,10 +133,13 @@ class CldriveHarness(harness.HarnessBase,
       return response
 
     testbed_idx = self.testbeds.index(request.testbed)
-    for i, testcase in enumerate(request.testcases):
-      result = RunTestcase(
-          self.envs[testbed_idx], self.testbeds[testbed_idx], testcase,
-          self.config.driver_cflag)
+    results = harness.RunTestcases(
+        self.executors[testbed_idx],
+        lambda t: RunTestcase(
+            self.envs[testbed_idx], self.testbeds[testbed_idx], t,
+            self.config.driver_cflag, self.drivers[testbed_idx]),
+        request.testcases)
+    for i, result in enumerate(results):
       logging.info('Testcase %d: %s.', i + 1,
                    deepsmith_pb2.Result.Outcome.Name(result.outcome))
       response.results.extend([result])
@@ -164,8 +173,23 @@ def OpenClEnvironmentToTestbed(
 def RunTestcase(opencl_environment: env.OpenCLEnvironment,
                 testbed: deepsmith_pb2.Testbed,
                 testcase: deepsmith_pb2.Testcase,
-                cflags: typing.List[str]) -> deepsmith_pb2.Result:
-  """Run a testcase."""
+                cflags: typing.List[str],
+                generic_driver: typing.Optional['GenericDriver'] = None
+                ) -> deepsmith_pb2.Result:
+  """Run a testcase.
+
+  Args:
+    opencl_environment: The OpenCL environment to run the testcase in.
+    testbed: The testbed of the OpenCL environment.
+    testcase: The testcase to run.
+    cflags: Additional flags to compile the driver with.
+    generic_driver: A generic driver for the OpenCL environment. If provided,
+      the testcase is run by this driver, rather than by generating and
+      compiling a driver for the testcase. The results are the same.
+
+  Returns:
+    A Result message.
+  """
   if testcase.toolchain != 'opencl':
     raise ValueError(f"Unsupported testcase toolchain: '{testcase.toolchain}'")
   if testcase.harness.name != 'cldrive':
@@ -173,18 +197,26 @@ def RunTestcase(opencl_environment: env.OpenCLEnvironment,
   result = deepsmith_pb2.Result()
   result.testbed.CopyFrom(testbed)
   platform_id, device_id = opencl_environment.ids()
-  driver = MakeDriver(
-      testcase, True if testbed.opts['opencl_opt'] == 'enabled' else False)
+  optimizations = testbed.opts['opencl_opt'] == 'enabled'
+  if generic_driver:
+    driver = MakeDriverInput(testcase, optimizations)
+  else:
+    driver = MakeDriver(testcase, optimizations)
   # MakeDriver() annotates the testcase, so we must only set the testcase field
   # of the output result after we have called it.
   result.testcase.CopyFrom(testcase)
-  # Get a temporary file to write and run the driver from.
+  # Get a temporary file to write and run the driver, or its input, from.
   with tempfile.NamedTemporaryFile(prefix='deepsmith_', delete=False) as f:
     path = pathlib.Path(f.name)
   try:
-    CompileDriver(driver, path, platform_id, device_id, cflags=cflags)
+    if generic_driver:
+      path.write_bytes(driver)
+      cmd = [str(generic_driver.GetBinary()), f.name]
+    else:
+      CompileDriver(driver, path, platform_id, device_id, cflags=cflags)
+      cmd = [f.name]
     timeout = testcase.harness.opts.get('timeout_seconds', '60')
-    cmd = ['timeout', '-s9', timeout, f.name]
+    cmd = ['timeout', '-s9', timeout] + cmd
     start_time = labdate.GetUtcMillisecondsNow()
     proc = opencl_environment.Exec(cmd)
     end_time = labdate.GetUtcMillisecondsNow()
@@ -207,16 +239,25 @@ def RunTestcase(opencl_environment: env.OpenCLEnvironment,
   return result
 
 
-def MakeDriver(testcase: deepsmith_pb2.Testcase,
-               optimizations: bool) -> str:
-  """Generate a self-contained C program for the given test case.
+def _EmitDriver(testcase: deepsmith_pb2.Testcase, optimizations: bool,
+                emit: typing.Callable[..., typing.Union[str, bytes]]
+               ) -> typing.Union[str, bytes]:
+  """Generate a driver for a testcase, downgrading it if it cannot be run.
+
+  A compile-and-run driver is generated if possible. If not, e.g. because no
+  inputs can be generated for the kernel arguments, a driver which only
+  compiles and creates the kernel is generated, and failing that a driver which
+  only compiles the program. The testcase's 'driver_type' invariant option is
+  set to the type of driver generated.
 
   Args:
     testcase: The testcase to generate a driver for. Requires three inputs:
       'src', 'gsize', and 'lsize'.
+    optimizations: Whether to enable OpenCL optimizations.
+    emit: The cgen function which generates the driver, e.g. cgen.emit_c.
 
   Returns:
-    A string of C code.
+    The return value of emit.
 
   Raises:
     ValueError: In case the testcase is missing the required gsize, lsize, and
@@ -241,24 +282,121 @@ def MakeDriver(testcase: deepsmith_pb2.Testcase,
         src=src, size=size,
         data_generator=data.Generator.ARANGE,
         scalar_val=size)
-    src = cgen.emit_c(
+    driver_ = emit(
         src=src, inputs=inputs, gsize=gsize, lsize=lsize,
         optimizations=optimizations)
     testcase.invariant_opts['driver_type'] = 'compile_and_run'
-  except Exception:
+  except Exception as e:
+    logging.info('Cannot generate compile-and-run driver: %s', e)
     # Create a compile-only stub if not possible.
     try:
-      src = cgen.emit_c(
+      driver_ = emit(
           src=src, inputs=None, gsize=None, lsize=None,
           compile_only=True, optimizations=optimizations)
       testcase.invariant_opts['driver_type'] = 'compile_and_create_kernel'
-    except Exception:
+    except Exception as e:
+      logging.info('Cannot generate compile-and-create-kernel driver: %s', e)
       # Create a compiler-only stub without creating kernel.
-      src = cgen.emit_c(
+      driver_ = emit(
           src=src, inputs=None, gsize=None, lsize=None,
           compile_only=True, create_kernel=False, optimizations=optimizations)
       testcase.invariant_opts['driver_type'] = 'compile_only'
-  return src
+  return driver_
+
+
+def MakeDriver(testcase: deepsmith_pb2.Testcase,
+               optimizations: bool) -> str:
+  """Generate a self-contained C program for the given test case.
+
+  Args:
+    testcase: The testcase to generate a driver for. Requires three inputs:
+      'src', 'gsize', and 'lsize'.
+    optimizations: Whether to enable OpenCL optimizations.
+
+  Returns:
+    A string of C code.
+
+  Raises:
+    ValueError: In case the testcase is missing the required gsize, lsize, and
+      src inputs.
+  """
+  return _EmitDriver(testcase, optimizations, cgen.emit_c)
+
+
+def MakeDriverInput(testcase: deepsmith_pb2.Testcase,
+                    optimizations: bool) -> bytes:
+  """Generate the input of a GenericDriver for the given test case.
+
+  Running a GenericDriver on this input is equivalent to running the driver
+  generated by MakeDriver(), and the testcase is annotated in the same way.
+
+  Args:
+    testcase: The testcase to generate a driver input for. Requires three
+      inputs: 'src', 'gsize', and 'lsize'.
+    optimizations: Whether to enable OpenCL optimizations.
+
+  Returns:
+    The driver input.
+
+  Raises:
+    ValueError: In case the testcase is missing the required gsize, lsize, and
+      src inputs.
+  """
+  return _EmitDriver(testcase, optimizations, cgen.emit_generic_input)
+
+
+class GenericDriver(object):
+  """A driver which is compiled once, and reads testcases at runtime.
+
+  Compiling a driver takes longer than running most testcases. Rather than
+  generating and compiling a driver for every testcase (see MakeDriver()), a
+  GenericDriver is compiled once per OpenCL environment, and the kernel and
+  inputs of each testcase are passed to it in a file (see MakeDriverInput()).
+  """
+
+  def __init__(self, platform_id: int, device_id: int,
+               cflags: typing.List[str] = None):
+    """Instantiate a generic driver.
+
+    The driver is not compiled until GetBinary() is first called.
+
+    Args:
+      platform_id: The OpenCL platform ID.
+      device_id: The OpenCL device ID.
+      cflags: Additional flags to compile the driver with.
+    """
+    self.platform_id = platform_id
+    self.device_id = device_id
+    self.cflags = list(cflags or [])
+    self._tempdir = None
+    self._binary = None
+    self._error = None
+    # Guards compilation, since testcases may be run concurrently.
+    self._lock = threading.Lock()
+
+  def GetBinary(self) -> pathlib.Path:
+    """Get the path of the driver binary, compiling it if required.
+
+    Returns:
+      The path of the driver binary.
+
+    Raises:
+      DriverCompilationError: If the driver fails to compile.
+    """
+    with self._lock:
+      if self._error:
+        raise self._error
+      if not self._binary:
+        self._tempdir = tempfile.TemporaryDirectory(prefix='deepsmith_')
+        try:
+          self._binary = CompileDriver(
+              cgen.emit_generic_c(),
+              pathlib.Path(self._tempdir.name) / 'driver',
+              self.platform_id, self.device_id, cflags=self.cflags)
+        except DriverCompilationError as e:
+          self._error = e
+          raise
+      return self._binary
 
 
 def CompileDriver(src: str, output_path: pathlib.Path,
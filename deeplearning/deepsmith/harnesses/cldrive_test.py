@@ -4,6 +4,7 @@ import subprocess
 import sys
 import tempfile
 
+import numpy as np
 import pytest
 from absl import app
 from absl import flags
@@ -14,6 +15,8 @@ from deeplearning.deepsmith.harnesses import cldrive
 from deeplearning.deepsmith.proto import deepsmith_pb2
 from deeplearning.deepsmith.proto import harness_pb2
 from deeplearning.deepsmith.proto import service_pb2
+from gpu.cldrive import cgen
+from gpu.cldrive import driver
 from gpu.oclgrind import oclgrind
 
 
@@ -230,6 +233,74 @@ def test_MakeDriver_CompileDriver_hello_world():
   )
 
 
+def _EmitC(src: str, inputs, size: int, d: pathlib.Path,
+           binary_inputs: bool) -> str:
+  """Generate a driver, writing its inputs file to d if binary_inputs."""
+  inputs_file = None
+  if binary_inputs:
+    inputs_file = str(d / 'inputs.bin')
+    pathlib.Path(inputs_file).write_bytes(cgen.emit_c_inputs(src, inputs))
+  return cgen.emit_c(src, inputs, driver.NDRange(size, 1, 1),
+                     driver.NDRange(1, 1, 1), inputs_file=inputs_file)
+
+
+def test_CompileDriver_binary_inputs_bit_identical():
+  """Test that drivers with an inputs file produce the same outputs."""
+  src = """
+kernel void A(global float* a, global int* b, const int c) {
+  a[get_global_id(0)] = a[get_global_id(0)] * 3 + b[get_global_id(0)] + c;
+}
+"""
+  rng = np.random.RandomState(0)
+  inputs = [(rng.randn(256) * 1e6).astype(np.float32),
+            rng.randint(-2 ** 20, 2 ** 20, size=256, dtype=np.int32),
+            np.array([5], dtype=np.int32)]
+  outputs = []
+  with tempfile.TemporaryDirectory() as d:
+    for binary_inputs in (False, True):
+      binary = cldrive.CompileDriver(
+          _EmitC(src, inputs, 256, pathlib.Path(d), binary_inputs),
+          pathlib.Path(d) / 'exe', 0, 0, timeout_seconds=60)
+      proc = oclgrind.Exec([str(binary)])
+      assert 'done.\n' in proc.stderr
+      outputs.append(proc.stdout)
+  assert outputs[0] == outputs[1]
+  assert outputs[0].split('\n')[-2].startswith('global float * a: ')
+
+
+def test_CompileDriver_binary_inputs_file_argument():
+  """Test that the inputs file can be overridden at runtime."""
+  src = 'kernel void A(global int* a) {a[get_global_id(0)] += 10;}'
+  inputs = [np.arange(4, dtype=np.int32)]
+  with tempfile.TemporaryDirectory() as d:
+    binary = cldrive.CompileDriver(
+        _EmitC(src, inputs, 4, pathlib.Path(d), True),
+        pathlib.Path(d) / 'exe', 0, 0, timeout_seconds=60)
+    path = pathlib.Path(d) / 'other.bin'
+    path.write_bytes(cgen.emit_c_inputs(src, [inputs[0] * 2]))
+    proc = oclgrind.Exec([str(binary), '-i', str(path)])
+    assert proc.stdout.split('\n')[-2] == 'global int * a: 10 12 14 16'
+    # An inputs file for different buffer sizes is rejected.
+    path.write_bytes(cgen.emit_c_inputs(src, [np.arange(8, dtype=np.int32)]))
+    proc = oclgrind.Exec([str(binary), '-i', str(path)])
+    assert proc.returncode
+    assert 'fatal: malformed inputs file' in proc.stderr
+
+
+@pytest.mark.parametrize('size', [2 ** 10, 2 ** 14, 2 ** 17])
+@pytest.mark.parametrize('binary_inputs', [False, True])
+def test_benchmark_CompileDriver_buffer_size(benchmark, size: int,
+                                             binary_inputs: bool):
+  """Benchmark driver compile time against the size of the input buffers."""
+  src = 'kernel void A(global int* a, global float* b) {}'
+  inputs = [np.arange(size, dtype=np.int32),
+            np.arange(size, dtype=np.float32)]
+  with tempfile.TemporaryDirectory() as d:
+    c = _EmitC(src, inputs, size, pathlib.Path(d), binary_inputs)
+    benchmark(cldrive.CompileDriver, c, pathlib.Path(d) / 'exe', 0, 0,
+              timeout_seconds=600)
+
+
 def test_MakeDriver_optimizations_on():
   """Test that OpenCL optimizations are enabled when requested."""
   testcase = deepsmith_pb2.Testcase(inputs={
@@ -256,6 +327,98 @@ def test_MakeDriver_optimizations_off():
       'clBuildProgram(program, 0, NULL, "-cl-opt-disable", NULL, NULL);' in src)
 
 
+# MakeDriverInput() tests.
+
+
+def test_MakeDriverInput_ValueError_no_gsize():
+  """Test that ValueError is raised if gsize input not set."""
+  testcase = deepsmith_pb2.Testcase(inputs={
+    'lsize': "1,1,1",
+    'src': "kernel void A() {}"
+  })
+  with pytest.raises(ValueError) as e_ctx:
+    cldrive.MakeDriverInput(testcase, True)
+  assert "Field not set: 'Testcase.inputs[\"gsize\"]'" == str(e_ctx.value)
+
+
+def test_MakeDriverInput_ValueError_no_src():
+  """Test that ValueError is raised if src input not set."""
+  testcase = deepsmith_pb2.Testcase(inputs={
+    'lsize': "1,1,1",
+    'gsize': "1,1,1",
+  })
+  with pytest.raises(ValueError) as e_ctx:
+    cldrive.MakeDriverInput(testcase, True)
+  assert "Field not set: 'Testcase.inputs[\"src\"]'" == str(e_ctx.value)
+
+
+def test_MakeDriverInput_optimizations():
+  """Test that the optimizations flag is set in the driver input."""
+  testcase = deepsmith_pb2.Testcase(inputs={
+    'lsize': "1,1,1",
+    'gsize': "1,1,1",
+    'src': 'kernel void A() {}'
+  })
+  assert cldrive.MakeDriverInput(testcase, True).startswith(b'1\n1 1 1\n')
+  assert cldrive.MakeDriverInput(testcase, False).startswith(b'1\n0 1 1\n')
+
+
+def test_MakeDriverInput_driver_type_compile_and_run():
+  """Test that a runnable testcase is annotated with its driver type."""
+  testcase = deepsmith_pb2.Testcase(inputs={
+    'lsize': "1,1,1",
+    'gsize': "1,1,1",
+    'src': 'kernel void A(global int* a) {}'
+  })
+  driver_input = cldrive.MakeDriverInput(testcase, True)
+  assert 'compile_and_run' == testcase.invariant_opts['driver_type']
+  assert b'global int * a' in driver_input
+
+
+def test_MakeDriverInput_driver_type_matches_MakeDriver():
+  """Test that MakeDriverInput() and MakeDriver() annotate testcases equally."""
+  for src in ['kernel void A(global int* a) {}', 'kernel void A(', 'abc']:
+    a = deepsmith_pb2.Testcase(inputs={
+      'lsize': "1,1,1",
+      'gsize': "1,1,1",
+      'src': src,
+    })
+    b = deepsmith_pb2.Testcase()
+    b.CopyFrom(a)
+    cldrive.MakeDriver(a, True)
+    cldrive.MakeDriverInput(b, True)
+    assert a.invariant_opts['driver_type']
+    assert a == b
+
+
+def test_GenericDriver_hello_world():
+  """An end-to-end test of a generic driver."""
+  testcase = deepsmith_pb2.Testcase(inputs={
+    'lsize': '1,1,1',
+    'gsize': '1,1,1',
+    'src': 'kernel void A(global int* a) {a[get_global_id(0)] += 10;}'
+  })
+  generic_driver = cldrive.GenericDriver(0, 0)
+  with tempfile.TemporaryDirectory() as d:
+    path = pathlib.Path(d) / 'input'
+    path.write_bytes(cldrive.MakeDriverInput(testcase, True))
+    proc = oclgrind.Exec([str(generic_driver.GetBinary()), str(path)])
+  assert '[cldrive] OpenCL optimizations: on\n' in proc.stderr
+  assert '[cldrive] Kernel: "A"\n' in proc.stderr
+  assert 'done.\n' in proc.stderr
+  assert proc.stdout.split('\n')[-2].startswith(
+      'global int * a: 10 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20 ')
+
+
+def test_GenericDriver_GetBinary_invalid_cflags():
+  """Test that compilation errors are raised on every call to GetBinary()."""
+  generic_driver = cldrive.GenericDriver(0, 0, cflags=['--not_a_real_flag'])
+  with pytest.raises(cldrive.DriverCompilationError):
+    generic_driver.GetBinary()
+  with pytest.raises(cldrive.DriverCompilationError):
+    generic_driver.GetBinary()
+
+
 # CldriveHarness() tests.
 
 def test_CldriveHarness_oclgrind_testbed():
@@ -274,6 +437,29 @@ def test_CldriveHarness_oclgrind_testbed():
   assert harness.testbeds[1].opts['opencl_opt'] == 'disabled'
 
 
+def test_CldriveHarness_max_parallel_testcases():
+  """Test that a worker pool is created per testbed."""
+  config = harness_pb2.CldriveHarness()
+  config.opencl_env.extend([gpu.cldrive.env.OclgrindOpenCLEnvironment().name,
+                            gpu.cldrive.env.OclgrindOpenCLEnvironment().name])
+  config.opencl_opt.extend([True, False])
+  config.max_parallel_testcases.extend([1, 4])
+  harness = cldrive.CldriveHarness(config)
+  assert len(harness.executors) == 2
+  assert harness.executors[0]._max_workers == 1
+  assert harness.executors[1]._max_workers == 4
+
+
+def test_CldriveHarness_max_parallel_testcases_length_mismatch():
+  """Test that ValueError is raised if max_parallel_testcases is invalid."""
+  config = harness_pb2.CldriveHarness()
+  config.opencl_env.extend([gpu.cldrive.env.OclgrindOpenCLEnvironment().name])
+  config.opencl_opt.extend([True])
+  config.max_parallel_testcases.extend([1, 4])
+  with pytest.raises(ValueError):
+    cldrive.CldriveHarness(config)
+
+
 def test_CldriveHarness_RunTestcases_no_testbed():
   """Test that invalid request params returned if no testbed requested."""
   config = harness_pb2.CldriveHarness()
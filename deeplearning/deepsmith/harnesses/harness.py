@@ -1,8 +1,15 @@
+import multiprocessing
+import typing
+from concurrent import futures
+
 from absl import flags
 
 from deeplearning.deepsmith import services
+from deeplearning.deepsmith.proto import deepsmith_pb2
 from deeplearning.deepsmith.proto import harness_pb2
+from labm8 import labdate
 from labm8 import pbutil
+from labm8 import system
 
 
 FLAGS = flags.FLAGS
@@ -26,3 +33,97 @@ class HarnessBase(services.ServiceBase):
   def RunTestcases(self, request: harness_pb2.RunTestcasesRequest,
                    context) -> harness_pb2.RunTestcasesResponse:
     raise NotImplementedError('abstract class')
+
+
+def GetMaxParallelTestcases(device_type: str) -> int:
+  """Return the default number of testcases to run concurrently on a device.
+
+  Testcases on CPUs and emulators (e.g. oclgrind) run on the host's cores, so
+  as many testcases may run as there are cores. Other devices, e.g. GPUs, run
+  one testcase at a time.
+
+  Args:
+    device_type: The type of OpenCL device, e.g. 'CPU', 'GPU', or 'Emulator'.
+
+  Returns:
+    The maximum number of concurrent testcases.
+  """
+  if device_type in {'CPU', 'Emulator'}:
+    return multiprocessing.cpu_count()
+  return 1
+
+
+def MakeTestbedExecutors(config: pbutil.ProtocolBuffer,
+                         device_types: typing.List[str]
+                        ) -> typing.List[futures.ThreadPoolExecutor]:
+  """Create a pool of workers for each testbed of a harness.
+
+  Each testbed has its own pool of workers, which is shared by all requests, so
+  that the limit on concurrent testcases is per-testbed.
+
+  Args:
+    config: The harness config. If its 'max_parallel_testcases' field is set,
+      it contains the number of workers of each testbed. Else the default of
+      GetMaxParallelTestcases() is used.
+    device_types: The OpenCL device type of each testbed.
+
+  Returns:
+    An executor for each testbed.
+
+  Raises:
+    ValueError: If 'max_parallel_testcases' is set, and there is not one value
+      per testbed.
+  """
+  name = type(config).__name__
+  if config.max_parallel_testcases:
+    if len(config.max_parallel_testcases) != len(device_types):
+      raise ValueError(
+          f'{name}.opencl_env and {name}.max_parallel_testcases lists are not '
+          'the same length:\n'
+          f'    {name}.opencl_env = {config.opencl_env}\n'
+          f'    {name}.max_parallel_testcases = '
+          f'{config.max_parallel_testcases}')
+    max_parallel_testcases = list(config.max_parallel_testcases)
+  else:
+    max_parallel_testcases = [
+      GetMaxParallelTestcases(device_type) for device_type in device_types]
+  return [futures.ThreadPoolExecutor(max_workers=n)
+          for n in max_parallel_testcases]
+
+
+def RunTestcases(
+    executor: futures.Executor,
+    run_testcase: typing.Callable[[deepsmith_pb2.Testcase],
+                                  deepsmith_pb2.Result],
+    testcases: typing.Iterable[deepsmith_pb2.Testcase]
+) -> typing.Iterator[deepsmith_pb2.Result]:
+  """Run testcases using an executor.
+
+  The time that each testcase spent waiting for a worker is recorded as a
+  'queue' profiling event of its result.
+
+  Args:
+    executor: The executor to run testcases with. The number of workers of the
+      executor determines the number of testcases which run concurrently.
+    run_testcase: A callback which runs a testcase and returns its result.
+    testcases: The testcases to run.
+
+  Returns:
+    An iterator over results, in the same order as the testcases.
+  """
+  submit_time = labdate.MillisecondsTimestamp()
+
+  def _RunTestcase(testcase: deepsmith_pb2.Testcase) -> deepsmith_pb2.Result:
+    start_time = labdate.MillisecondsTimestamp()
+    result = run_testcase(testcase)
+    event = result.profiling_events.add()
+    event.client = system.HOSTNAME
+    event.type = 'queue'
+    event.duration_ms = start_time - submit_time
+    event.event_start_epoch_ms = submit_time
+    return result
+
+  # Submit all of the testcases before waiting on any of them.
+  pending = [executor.submit(_RunTestcase, t) for t in testcases]
+  for future in pending:
+    yield future.result()
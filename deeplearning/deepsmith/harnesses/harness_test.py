@@ -0,0 +1,140 @@
+"""Unit tests for //deeplearning/deepsmith/harnesses/harness.py."""
+import sys
+import threading
+import time
+from concurrent import futures
+
+import pytest
+from absl import app
+
+from deeplearning.deepsmith.harnesses import harness
+from deeplearning.deepsmith.proto import deepsmith_pb2
+from deeplearning.deepsmith.proto import harness_pb2
+
+
+def _MakeTestcases(n: int):
+  """Return a list of n testcases, with a unique 'src' input."""
+  return [deepsmith_pb2.Testcase(inputs={'src': str(i)}) for i in range(n)]
+
+
+def _EchoTestcase(testcase: deepsmith_pb2.Testcase) -> deepsmith_pb2.Result:
+  """A run_testcase callback which returns the testcase as a result."""
+  return deepsmith_pb2.Result(testcase=testcase)
+
+
+# GetMaxParallelTestcases() tests.
+
+def test_GetMaxParallelTestcases_gpu():
+  """Test that GPUs run one testcase at a time."""
+  assert 1 == harness.GetMaxParallelTestcases('GPU')
+
+
+def test_GetMaxParallelTestcases_cpu():
+  """Test that CPUs and emulators run multiple testcases."""
+  assert harness.GetMaxParallelTestcases('CPU') >= 1
+  assert harness.GetMaxParallelTestcases('Emulator') >= 1
+
+
+# MakeTestbedExecutors() tests.
+
+def test_MakeTestbedExecutors_default():
+  """Test that the default number of workers depends on the device type."""
+  executors = harness.MakeTestbedExecutors(
+      harness_pb2.CldriveHarness(), ['GPU', 'CPU'])
+  assert [e._max_workers for e in executors] == [
+    1, harness.GetMaxParallelTestcases('CPU')]
+
+
+def test_MakeTestbedExecutors_max_parallel_testcases():
+  """Test that the number of workers of each testbed can be set."""
+  config = harness_pb2.ClLauncherHarness(max_parallel_testcases=[3, 2])
+  executors = harness.MakeTestbedExecutors(config, ['GPU', 'GPU'])
+  assert [e._max_workers for e in executors] == [3, 2]
+
+
+def test_MakeTestbedExecutors_length_mismatch():
+  """Test that ValueError is raised if max_parallel_testcases is invalid."""
+  config = harness_pb2.ClLauncherHarness(max_parallel_testcases=[3, 2])
+  with pytest.raises(ValueError) as e_ctx:
+    harness.MakeTestbedExecutors(config, ['GPU'])
+  assert str(e_ctx.value).startswith(
+      'ClLauncherHarness.opencl_env and ClLauncherHarness.'
+      'max_parallel_testcases lists are not the same length:')
+
+
+# RunTestcases() tests.
+
+def test_RunTestcases_empty():
+  """Test that no results are returned for no testcases."""
+  with futures.ThreadPoolExecutor(max_workers=4) as executor:
+    assert not list(harness.RunTestcases(executor, _EchoTestcase, []))
+
+
+def test_RunTestcases_result_order():
+  """Test that results are returned in the order of the testcases."""
+
+  def RunTestcase(testcase):
+    # Make earlier testcases take longer than later testcases.
+    time.sleep((10 - int(testcase.inputs['src'])) / 1000)
+    return _EchoTestcase(testcase)
+
+  testcases = _MakeTestcases(10)
+  with futures.ThreadPoolExecutor(max_workers=4) as executor:
+    results = list(harness.RunTestcases(executor, RunTestcase, testcases))
+  assert [r.testcase for r in results] == testcases
+
+
+def test_RunTestcases_queue_profiling_event():
+  """Test that a queue profiling event is added to each result."""
+  with futures.ThreadPoolExecutor(max_workers=1) as executor:
+    results = list(harness.RunTestcases(
+        executor, _EchoTestcase, _MakeTestcases(3)))
+  for result in results:
+    assert 1 == len(result.profiling_events)
+    assert 'queue' == result.profiling_events[0].type
+    assert result.profiling_events[0].duration_ms >= 0
+    assert result.profiling_events[0].event_start_epoch_ms
+
+
+def test_RunTestcases_max_workers():
+  """Test that no more testcases run concurrently than there are workers."""
+  lock = threading.Lock()
+  running = [0]
+  max_running = [0]
+
+  def RunTestcase(testcase):
+    with lock:
+      running[0] += 1
+      max_running[0] = max(max_running[0], running[0])
+    time.sleep(.01)
+    with lock:
+      running[0] -= 1
+    return _EchoTestcase(testcase)
+
+  with futures.ThreadPoolExecutor(max_workers=2) as executor:
+    results = list(harness.RunTestcases(
+        executor, RunTestcase, _MakeTestcases(8)))
+  assert 8 == len(results)
+  assert 2 == max_running[0]
+
+
+def test_RunTestcases_exception():
+  """Test that an error raised by a testcase is raised to the caller."""
+
+  def RunTestcase(testcase):
+    raise ValueError('Unsupported testcase')
+
+  with futures.ThreadPoolExecutor(max_workers=2) as executor:
+    with pytest.raises(ValueError):
+      list(harness.RunTestcases(executor, RunTestcase, _MakeTestcases(2)))
+
+
+def main(argv):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError('Unrecognized command line flags.')
+  sys.exit(pytest.main([__file__, '-v']))
+
+
+if __name__ == '__main__':
+  app.run(main)
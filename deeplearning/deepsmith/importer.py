@@ -0,0 +1,200 @@
+"""Bulk import of Result and Testcase protos to the datastore.
+
+Proto files are parsed in a pool of worker processes and added to the
+datastore in batches using the bulk GetOrAddMany() methods. Each batch is
+committed in a single transaction, together with a record of the files that it
+contains, so an interrupted import can be re-run and only the files which were
+not committed are imported.
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import os
+import pathlib
+import time
+import typing
+
+import sqlalchemy as sql
+from absl import logging
+from sqlalchemy.dialects import mysql
+
+import deeplearning.deepsmith.result
+import deeplearning.deepsmith.testcase
+from deeplearning.deepsmith import db
+from deeplearning.deepsmith.proto import deepsmith_pb2
+from labm8 import labdate
+from labm8 import pbutil
+
+
+class ImportedFile(db.Table):
+  """A proto file which has been imported."""
+  id_t = sql.Integer
+  __tablename__ = 'imported_files'
+
+  # Columns.
+  id: int = sql.Column(id_t, primary_key=True)
+  date_added: datetime.datetime = sql.Column(
+      sql.DateTime().with_variant(mysql.DATETIME(fsp=3), 'mysql'),
+      nullable=False,
+      default=labdate.GetUtcMillisecondsNow)
+  # The MD5 of the absolute path of the file.
+  path_md5: bytes = sql.Column(
+      sql.Binary(16).with_variant(mysql.BINARY(16), 'mysql'),
+      nullable=False, index=True, unique=True)
+
+  @staticmethod
+  def PathMd5(path: pathlib.Path) -> bytes:
+    """Return the key of a proto file path."""
+    return hashlib.md5(str(path.absolute()).encode('utf-8')).digest()
+
+
+def _ParseProtoFiles(
+    proto_t, paths: typing.List[pathlib.Path]
+) -> typing.List[typing.Tuple[pathlib.Path, typing.Optional[bytes],
+                              typing.Optional[str]]]:
+  """Parse proto files. This runs in a worker process.
+
+  Protos are returned serialized, which is cheaper to send to the parent
+  process than a message object.
+
+  Returns:
+    A list of <path, serialized_proto, error> tuples, one for each path. If a
+    file cannot be parsed, serialized_proto is None and error is set.
+  """
+  parsed = []
+  for path in paths:
+    try:
+      proto = pbutil.FromFile(path, proto_t())
+      parsed.append((path, proto.SerializeToString(), None))
+    except Exception as e:
+      parsed.append((path, None, f'{type(e).__name__}: {e}'))
+  return parsed
+
+
+def _SelectImportedFiles(session: db.session_t,
+                         path_md5s: typing.List[bytes]) -> typing.Set[bytes]:
+  """Return the subset of path_md5s which have been imported."""
+  imported = set()
+  for i in range(0, len(path_md5s), db.MAX_ROWS_PER_QUERY):
+    query = session.query(ImportedFile.path_md5).filter(
+        ImportedFile.path_md5.in_(path_md5s[i:i + db.MAX_ROWS_PER_QUERY]))
+    imported.update(row.path_md5 for row in query)
+  return imported
+
+
+def ImportProtoFiles(ds: 'deeplearning.deepsmith.datastore.DataStore',
+                     paths: typing.Iterable[pathlib.Path], model, proto_t,
+                     batch_size: int = 1000,
+                     max_workers: typing.Optional[int] = None,
+                     delete_after_import: bool = False) -> int:
+  """Import proto files to a datastore.
+
+  Files which have already been imported to the datastore are skipped. Files
+  which cannot be parsed are logged and skipped.
+
+  Args:
+    ds: The datastore to import to.
+    paths: The paths of the proto files.
+    model: The table class to import to, which implements GetOrAddMany().
+    proto_t: The proto class of the files.
+    batch_size: The number of files to import per transaction.
+    max_workers: The number of processes to parse files with. Defaults to the
+      number of CPUs.
+    delete_after_import: If True, files are deleted once they have been
+      committed.
+
+  Returns:
+    The number of files imported.
+
+  Raises:
+    ValueError: If batch_size is not positive.
+  """
+  if batch_size < 1:
+    raise ValueError(f'batch_size must be positive: {batch_size}')
+  max_workers = max_workers or os.cpu_count()
+  paths = list(paths)
+
+  with ds.Session() as session:
+    # The datastore may have been created before this module was imported.
+    ImportedFile.__table__.create(session.get_bind(), checkfirst=True)
+    imported = _SelectImportedFiles(
+        session, [ImportedFile.PathMd5(path) for path in paths])
+  todo = [path for path in paths if ImportedFile.PathMd5(path) not in imported]
+  logging.info('Importing %d %s files, skipping %d imported files', len(todo),
+               proto_t.__name__, len(paths) - len(todo))
+
+  start_time = time.time()
+  import_count = 0
+  with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+    # Bound the number of parsed batches held in memory.
+    pending = set()
+    for i in range(0, len(todo), batch_size):
+      pending.add(executor.submit(
+          _ParseProtoFiles, proto_t, todo[i:i + batch_size]))
+      if len(pending) < 2 * max_workers:
+        continue
+      done, pending = concurrent.futures.wait(
+          pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        import_count += _ImportParsedBatch(
+            ds, model, proto_t, future.result(), delete_after_import)
+      logging.info('Imported %d of %d files (%.1f files/sec)', import_count,
+                   len(todo), import_count / (time.time() - start_time))
+    for future in concurrent.futures.as_completed(pending):
+      import_count += _ImportParsedBatch(
+          ds, model, proto_t, future.result(), delete_after_import)
+
+  elapsed = time.time() - start_time
+  logging.info('Imported %d %s files in %.1f seconds (%.1f files/sec)',
+               import_count, proto_t.__name__, elapsed,
+               import_count / elapsed if elapsed else 0)
+  return import_count
+
+
+def _ImportParsedBatch(
+    ds: 'deeplearning.deepsmith.datastore.DataStore', model, proto_t,
+    parsed: typing.List[typing.Tuple[pathlib.Path, typing.Optional[bytes],
+                                     typing.Optional[str]]],
+    delete_after_import: bool) -> int:
+  """Add a batch of parsed protos and record their files, in one transaction.
+
+  Returns:
+    The number of files imported.
+  """
+  paths, protos = [], []
+  for path, serialized, error in parsed:
+    if error:
+      logging.error('Failed to parse %s: %s', path, error)
+      continue
+    paths.append(path)
+    protos.append(proto_t.FromString(serialized))
+
+  with ds.Session(commit=True) as session:
+    model.GetOrAddMany(session, protos)
+    db.InsertIgnore(session, ImportedFile.__table__, [
+      {'path_md5': ImportedFile.PathMd5(path)} for path in paths])
+
+  if delete_after_import:
+    for path in paths:
+      path.unlink()
+  return len(paths)
+
+
+def ImportResults(ds: 'deeplearning.deepsmith.datastore.DataStore',
+                  paths: typing.Iterable[pathlib.Path], **kwargs) -> int:
+  """Import Result proto files to a datastore.
+
+  See ImportProtoFiles() for the arguments.
+  """
+  return ImportProtoFiles(ds, paths, deeplearning.deepsmith.result.Result,
+                          deepsmith_pb2.Result, **kwargs)
+
+
+def ImportTestcases(ds: 'deeplearning.deepsmith.datastore.DataStore',
+                    paths: typing.Iterable[pathlib.Path], **kwargs) -> int:
+  """Import Testcase proto files to a datastore.
+
+  See ImportProtoFiles() for the arguments.
+  """
+  return ImportProtoFiles(ds, paths, deeplearning.deepsmith.testcase.Testcase,
+                          deepsmith_pb2.Testcase, **kwargs)
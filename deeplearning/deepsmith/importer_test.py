@@ -0,0 +1,111 @@
+"""Tests for //deeplearning/deepsmith:importer."""
+import pathlib
+import sys
+import tempfile
+
+import pytest
+from absl import app
+
+import deeplearning.deepsmith.result
+import deeplearning.deepsmith.testcase
+from deeplearning.deepsmith import importer
+from deeplearning.deepsmith.proto import deepsmith_pb2
+from labm8 import pbutil
+
+
+def _MakeResultProto(i: int) -> deepsmith_pb2.Result:
+  return deepsmith_pb2.Result(
+      testcase=deepsmith_pb2.Testcase(
+          toolchain='cpp',
+          generator=deepsmith_pb2.Generator(name='generator'),
+          harness=deepsmith_pb2.Harness(name='harness'),
+          inputs={'src': f'void main() {{ return {i}; }}'},
+      ),
+      testbed=deepsmith_pb2.Testbed(toolchain='cpp', name='clang'),
+      returncode=0,
+      outputs={'stdout': str(i)},
+      outcome=deepsmith_pb2.Result.PASS,
+  )
+
+
+@pytest.fixture(scope='function')
+def results_dir() -> pathlib.Path:
+  """A test fixture which returns a directory of ten result protos."""
+  with tempfile.TemporaryDirectory(prefix='deepsmith_importer_test_') as d:
+    for i in range(10):
+      pbutil.ToFile(_MakeResultProto(i), pathlib.Path(d) / f'{i}.pbtxt')
+    yield pathlib.Path(d)
+
+
+def _ResultCount(ds) -> int:
+  with ds.Session() as s:
+    return s.query(deeplearning.deepsmith.result.Result).count()
+
+
+def test_ImportResults(ds, results_dir: pathlib.Path):
+  """Test that results are imported in multiple batches."""
+  paths = sorted(results_dir.iterdir())
+  assert importer.ImportResults(ds, paths, batch_size=3, max_workers=2) == 10
+  assert _ResultCount(ds) == 10
+  with ds.Session() as s:
+    outputs = {r.outputs['stdout'] for r in
+               s.query(deeplearning.deepsmith.result.Result)}
+    assert outputs == {str(i) for i in range(10)}
+    assert s.query(importer.ImportedFile).count() == 10
+  # The source files are not deleted.
+  assert len(list(results_dir.iterdir())) == 10
+
+
+def test_ImportTestcases(ds, results_dir: pathlib.Path):
+  """Test that testcases are imported."""
+  for path in results_dir.iterdir():
+    result = pbutil.FromFile(path, deepsmith_pb2.Result())
+    pbutil.ToFile(result.testcase, path)
+  assert importer.ImportTestcases(ds, results_dir.iterdir(), max_workers=1) == 10
+  with ds.Session() as s:
+    assert s.query(deeplearning.deepsmith.testcase.Testcase).count() == 10
+
+
+def test_ImportResults_imported_files_are_skipped(ds,
+                                                  results_dir: pathlib.Path):
+  """Test that an import can be resumed."""
+  paths = sorted(results_dir.iterdir())
+  assert importer.ImportResults(ds, paths[:4], max_workers=1) == 4
+  assert importer.ImportResults(ds, paths, max_workers=1) == 6
+  assert importer.ImportResults(ds, paths, max_workers=1) == 0
+  assert _ResultCount(ds) == 10
+
+
+def test_ImportResults_invalid_files_are_skipped(ds,
+                                                 results_dir: pathlib.Path):
+  """Test that files which cannot be parsed are not imported."""
+  (results_dir / 'invalid.pbtxt').write_text('not a proto')
+  assert importer.ImportResults(ds, results_dir.iterdir(), max_workers=1) == 10
+  assert _ResultCount(ds) == 10
+  # The invalid file is not recorded as imported.
+  with ds.Session() as s:
+    assert s.query(importer.ImportedFile).count() == 10
+
+
+def test_ImportResults_delete_after_import(ds, results_dir: pathlib.Path):
+  """Test that imported files are deleted."""
+  (results_dir / 'invalid.pbtxt').write_text('not a proto')
+  importer.ImportResults(ds, results_dir.iterdir(), batch_size=4,
+                         max_workers=1, delete_after_import=True)
+  assert _ResultCount(ds) == 10
+  assert [p.name for p in results_dir.iterdir()] == ['invalid.pbtxt']
+
+
+def test_ImportProtoFiles_invalid_batch_size(ds):
+  """Test that batch_size must be positive."""
+  with pytest.raises(ValueError):
+    importer.ImportResults(ds, [], batch_size=0)
+
+
+def main(argv):  # pylint: disable=missing-docstring
+  del argv
+  sys.exit(pytest.main([__file__, '-v']))
+
+
+if __name__ == '__main__':
+  app.run(main)
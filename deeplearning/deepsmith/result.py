@@ -9,6 +9,7 @@ import sqlalchemy as sql
 from sqlalchemy import orm
 from sqlalchemy.dialects import mysql
 
+import deeplearning.deepsmith.client
 import deeplearning.deepsmith.testbed
 import deeplearning.deepsmith.testcase
 import labm8.sqlutil
@@ -58,7 +59,9 @@ class Result(db.Table):
 
   # Constraints.
   __table_args__ = (
-    sql.UniqueConstraint('testcase_id', 'testbed_id', name='unique_result'),)
+    sql.UniqueConstraint('testcase_id', 'testbed_id', name='unique_result'),
+    # Used to select the results of a testbed.
+    sql.Index('ix_results_testbed_testcase', 'testbed_id', 'testcase_id'),)
 
   @property
   def outcome(self) -> deepsmith_pb2.Result.Outcome:
@@ -170,6 +173,113 @@ class Result(db.Table):
 
     return result
 
+  @classmethod
+  def GetOrAddMany(cls, session: db.session_t,
+                   protos: typing.List[deepsmith_pb2.Result]
+                   ) -> typing.List[int]:
+    """Add many Results from protocol buffers.
+
+    This is a batched equivalent of GetOrAdd(). Testcases are added using
+    Testcase.GetOrAddMany(), and outputs are resolved and inserted in batches.
+    As with GetOrAdd(), only the first result for a <testcase, testbed> pair is
+    added, and the outputs and profiling events of later results for the same
+    pair are discarded.
+
+    Args:
+      session: A database session.
+      protos: A list of Result messages.
+
+    Returns:
+      The IDs of the results, in the same order as protos.
+    """
+    testcase_ids = deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(
+        session, [proto.testcase for proto in protos])
+
+    # There are few distinct testbeds in a batch, so these are added
+    # individually.
+    testbeds = {}
+    for proto in protos:
+      key = proto.testbed.SerializeToString(deterministic=True)
+      if key not in testbeds:
+        testbeds[key] = deeplearning.deepsmith.testbed.Testbed.GetOrAdd(
+            session, proto.testbed)
+    # Resolve the IDs of the objects added above.
+    session.flush()
+
+    # Only the first result for a <testcase, testbed> pair is added, so the
+    # outputs of other results are not needed.
+    testbed_ids = [
+      testbeds[proto.testbed.SerializeToString(deterministic=True)].id
+      for proto in protos]
+    keys = list(zip(testcase_ids, testbed_ids))
+    result_ids = cls._SelectIdsByKey(session, keys)
+    new_protos = {}
+    for key, proto in zip(keys, protos):
+      if key not in result_ids and key not in new_protos:
+        new_protos[key] = proto
+    if not new_protos:
+      return [result_ids[key] for key in keys]
+
+    output_ids = db.GetOrAddNameValuePairIds(
+        session, ResultOutput, ResultOutputName, ResultOutputValue,
+        [proto.outputs for proto in new_protos.values()])
+    outputset_rows = set()
+    outputset_ids = {}
+    for key, proto in new_protos.items():
+      outputset_ids[key] = db.Md5Set(proto.outputs)
+      outputset_rows.update(
+          (outputset_ids[key], output_ids[(name, value)])
+          for name, value in proto.outputs.items())
+    db.InsertIgnore(session, ResultOutputSet.__table__, [
+      {'id': id_, 'output_id': output_id}
+      for id_, output_id in sorted(outputset_rows)])
+
+    # Rows which violate the unique <testcase, testbed> constraint were added
+    # concurrently by another client, and are ignored.
+    db.InsertIgnore(session, cls.__table__, [{
+      'testcase_id': key[0],
+      'testbed_id': key[1],
+      'returncode': proto.returncode,
+      'outputset_id': outputset_ids[key],
+      'outcome_num': proto.outcome,
+    } for key, proto in new_protos.items()])
+    result_ids.update(cls._SelectIdsByKey(session, list(new_protos)))
+
+    # Add the profiling events of new results.
+    events = [(result_ids[key], event)
+              for key, proto in new_protos.items()
+              for event in proto.profiling_events]
+    client_ids = deeplearning.deepsmith.client.Client.GetOrAddMany(
+        session, set(event.client for _, event in events))
+    type_ids = profiling_event.ProfilingEventType.GetOrAddMany(
+        session, set(event.type for _, event in events))
+    db.InsertIgnore(session, profiling_event.ResultProfilingEvent.__table__, [{
+      'result_id': result_id,
+      'client_id': client_ids[event.client],
+      'type_id': type_ids[event.type],
+      'duration_ms': event.duration_ms,
+      'event_start': labdate.DatetimeFromMillisecondsTimestamp(
+          event.event_start_epoch_ms),
+    } for result_id, event in events])
+
+    return [result_ids[key] for key in keys]
+
+  @classmethod
+  def _SelectIdsByKey(cls, session: db.session_t,
+                      keys: typing.List[typing.Tuple[int, int]]
+                      ) -> typing.Dict[typing.Tuple[int, int], int]:
+    """Return a map from <testcase, testbed> ID pair to result ID."""
+    wanted = set(keys)
+    testcase_ids = sorted(set(key[0] for key in wanted))
+    ids = {}
+    for i in range(0, len(testcase_ids), db.MAX_ROWS_PER_QUERY):
+      query = session.query(cls.testcase_id, cls.testbed_id, cls.id).filter(
+          cls.testcase_id.in_(testcase_ids[i:i + db.MAX_ROWS_PER_QUERY]))
+      for testcase_id, testbed_id, id_ in query:
+        if (testcase_id, testbed_id) in wanted:
+          ids[(testcase_id, testbed_id)] = id_
+    return ids
+
   @classmethod
   def ProtoFromFile(cls, path: pathlib.Path) -> deepsmith_pb2.Result:
     """Instantiate a protocol buffer result from file.
@@ -309,18 +419,40 @@ class ResultOutputValue(db.Table):
     Returns:
       A ResultOutputValue instance.
     """
+    return labm8.sqlutil.GetOrAdd(session, cls, **cls._MakeRow(string))
+
+  @classmethod
+  def GetOrAddMany(cls, session: db.session_t,
+                   strings: typing.Iterable[str]) -> typing.Dict[str, int]:
+    """Look up the IDs of many ResultOutputValues, adding those which do not
+    exist.
+
+    Args:
+      session: A database session.
+      strings: The strings.
+
+    Returns:
+      A map from string to ID.
+    """
+    md5s, rows = {}, {}
+    for string in strings:
+      row = cls._MakeRow(string)
+      md5s[string] = row['original_md5']
+      rows[row['original_md5']] = row
+    ids = db.GetOrAddIds(session, cls, cls.original_md5, rows)
+    return {string: ids[md5] for string, md5 in md5s.items()}
+
+  @classmethod
+  def _MakeRow(cls, string: str) -> typing.Dict[str, typing.Any]:
+    """Return the column values of the entry for a string."""
     original_charcount = len(string)
     original_linecount = string.count('\n')
-    md5_ = hashlib.md5()
-    md5_.update(string.encode('utf-8'))
-    original_md5 = md5_.digest()
+    original_md5 = hashlib.md5(string.encode('utf-8')).digest()
     # Truncate the text, if required. Note that we use the MD5 of the text
     # *after* truncation.
     if original_charcount > cls.max_len:
       truncated = string[:cls.max_len]
-      md5_ = hashlib.md5()
-      md5_.update(truncated.encode('utf-8'))
-      truncated_md5 = md5_.digest()
+      truncated_md5 = hashlib.md5(truncated.encode('utf-8')).digest()
       truncated_linecount = truncated.count('\n')
       truncated_charcount = cls.max_len
     else:
@@ -328,16 +460,16 @@ class ResultOutputValue(db.Table):
       truncated_md5 = original_md5
       truncated_linecount = original_linecount
       truncated_charcount = original_charcount
-    return labm8.sqlutil.GetOrAdd(
-        session, cls,
-        original_md5=original_md5,
-        original_linecount=original_linecount,
-        original_charcount=original_charcount,
-        truncated=True if original_charcount > cls.max_len else False,
-        truncated_value=truncated,
-        truncated_md5=truncated_md5,
-        truncated_linecount=truncated_linecount,
-        truncated_charcount=truncated_charcount, )
+    return {
+      'original_md5': original_md5,
+      'original_linecount': original_linecount,
+      'original_charcount': original_charcount,
+      'truncated': original_charcount > cls.max_len,
+      'truncated_value': truncated,
+      'truncated_md5': truncated_md5,
+      'truncated_linecount': truncated_linecount,
+      'truncated_charcount': truncated_charcount,
+    }
 
   def __repr__(self):
     return self.truncated_value[:50] or ''
@@ -384,5 +516,9 @@ class PendingResult(db.Table):
                                                                      back_populates='pending_results')
 
   # Constraints:
-  __table_args__ = (sql.UniqueConstraint('testcase_id', 'testbed_id',
-                                         name='unique_pending_result'),)
+  __table_args__ = (
+    sql.UniqueConstraint('testcase_id', 'testbed_id',
+                         name='unique_pending_result'),
+    # Used to select the pending results of a testbed.
+    sql.Index('ix_pending_results_testbed_testcase', 'testbed_id',
+              'testcase_id'),)
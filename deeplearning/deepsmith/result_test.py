@@ -380,6 +380,84 @@ def test_duplicate_results_ignored(session):
   assert r3.profiling_events[1].duration_ms == 100
 
 
+def _MakeResultProto(i: int, stdout: str = 'Hello, world!'
+                     ) -> deepsmith_pb2.Result:
+  """Return a result which shares its testbed with others."""
+  return deepsmith_pb2.Result(
+      testcase=deepsmith_pb2.Testcase(
+          toolchain='cpp',
+          generator=deepsmith_pb2.Generator(name='generator'),
+          harness=deepsmith_pb2.Harness(name='harness'),
+          inputs={'src': f'void main() {{ return {i}; }}'},
+          invariant_opts={'config': 'opt'},
+      ),
+      testbed=deepsmith_pb2.Testbed(
+          toolchain='cpp',
+          name='clang',
+          opts={'arch': 'x86_64'},
+      ),
+      returncode=i,
+      outputs={'stdout': stdout, 'stderr': ''},
+      profiling_events=[
+        deepsmith_pb2.ProfilingEvent(
+            client='localhost',
+            type='exec',
+            duration_ms=i,
+            event_start_epoch_ms=1123123123,
+        ),
+      ],
+      outcome=deepsmith_pb2.Result.PASS,
+  )
+
+
+def test_Result_GetOrAddMany_ToProto_equivalence(ds):
+  """Test that results added in bulk are the same as the input protos."""
+  protos = [_MakeResultProto(i) for i in range(3)]
+  with ds.Session(commit=True) as s:
+    ids = deeplearning.deepsmith.result.Result.GetOrAddMany(s, protos)
+  assert len(set(ids)) == 3
+  with ds.Session() as s:
+    for id_, proto in zip(ids, protos):
+      result = s.query(deeplearning.deepsmith.result.Result).filter(
+          deeplearning.deepsmith.result.Result.id == id_).one()
+      assert result.ToProto() == proto
+
+
+def test_Result_GetOrAddMany_GetOrAdd_equivalence(ds):
+  """Test that bulk and single adds resolve to the same result rows."""
+  with ds.Session(commit=True) as s:
+    result = deeplearning.deepsmith.result.Result.GetOrAdd(
+        s, _MakeResultProto(0))
+    s.flush()
+    id_ = result.id
+  with ds.Session(commit=True) as s:
+    ids = deeplearning.deepsmith.result.Result.GetOrAddMany(
+        s, [_MakeResultProto(1), _MakeResultProto(0)])
+  assert ids[1] == id_
+  with ds.Session() as s:
+    assert s.query(deeplearning.deepsmith.result.Result).count() == 2
+    assert s.query(deeplearning.deepsmith.result.ResultOutput).count() == 2
+    assert s.query(deeplearning.deepsmith.result.ResultOutputSet).count() == 2
+
+
+def test_Result_GetOrAddMany_duplicates_ignored(ds):
+  """Test that only the first result for a testcase and testbed is added."""
+  with ds.Session(commit=True) as s:
+    ids = deeplearning.deepsmith.result.Result.GetOrAddMany(
+        s, [_MakeResultProto(0), _MakeResultProto(0, stdout='!')])
+  assert ids[0] == ids[1]
+  with ds.Session() as s:
+    result = s.query(deeplearning.deepsmith.result.Result).one()
+    assert result.outputs['stdout'] == 'Hello, world!'
+    assert len(result.profiling_events) == 1
+
+
+def test_Result_GetOrAddMany_empty(ds):
+  """Test that an empty batch adds nothing."""
+  with ds.Session(commit=True) as s:
+    assert [] == deeplearning.deepsmith.result.Result.GetOrAddMany(s, [])
+
+
 def main(argv):  # pylint: disable=missing-docstring
   del argv
   sys.exit(pytest.main([__file__, '-v']))
@@ -9,6 +9,7 @@ import sqlalchemy as sql
 from sqlalchemy import orm
 from sqlalchemy.dialects import mysql
 
+import deeplearning.deepsmith.client
 import deeplearning.deepsmith.generator
 import deeplearning.deepsmith.harness
 import deeplearning.deepsmith.profiling_event
@@ -211,6 +212,137 @@ class Testcase(db.Table):
 
     return testcase
 
+  @classmethod
+  def GetOrAddMany(cls, session: db.session_t,
+                   protos: typing.List[deepsmith_pb2.Testcase]
+                   ) -> typing.List[int]:
+    """Add many Testcases from protocol buffers.
+
+    This is a batched equivalent of GetOrAdd(). Strings and sets are
+    de-duplicated in memory, existing rows are resolved using a small number of
+    IN queries, and new rows are inserted in batches. As with GetOrAdd(), a
+    testcase which already exists is not added again, and the profiling events
+    of a duplicate testcase are discarded.
+
+    Args:
+      session: A database session.
+      protos: A list of Testcase messages.
+
+    Returns:
+      The IDs of the testcases, in the same order as protos.
+    """
+    # There are few distinct toolchains, generators, and harnesses in a batch,
+    # so these are added individually.
+    toolchains, generators, harnesses = {}, {}, {}
+    for proto in protos:
+      if proto.toolchain not in toolchains:
+        toolchains[proto.toolchain] = (
+          deeplearning.deepsmith.toolchain.Toolchain.GetOrAdd(
+              session, proto.toolchain))
+      key = proto.generator.SerializeToString(deterministic=True)
+      if key not in generators:
+        generators[key] = deeplearning.deepsmith.generator.Generator.GetOrAdd(
+            session, proto.generator)
+      key = proto.harness.SerializeToString(deterministic=True)
+      if key not in harnesses:
+        harnesses[key] = deeplearning.deepsmith.harness.Harness.GetOrAdd(
+            session, proto.harness)
+    # Resolve the IDs of the objects added above.
+    session.flush()
+
+    input_ids = db.GetOrAddNameValuePairIds(
+        session, TestcaseInput, TestcaseInputName, TestcaseInputValue,
+        [proto.inputs for proto in protos])
+    invariant_opt_ids = db.GetOrAddNameValuePairIds(
+        session, TestcaseInvariantOpt, TestcaseInvariantOptName,
+        TestcaseInvariantOptValue, [proto.invariant_opts for proto in protos])
+
+    # Build the sets, and the unique key of every testcase.
+    inputset_rows, invariant_optset_rows = set(), set()
+    keys = []
+    for proto in protos:
+      inputset_id = db.Md5Set(proto.inputs)
+      inputset_rows.update(
+          (inputset_id, input_ids[(name, value)])
+          for name, value in proto.inputs.items())
+      invariant_optset_id = db.Md5Set(proto.invariant_opts)
+      invariant_optset_rows.update(
+          (invariant_optset_id, invariant_opt_ids[(name, value)])
+          for name, value in proto.invariant_opts.items())
+      keys.append((
+        toolchains[proto.toolchain].id,
+        generators[proto.generator.SerializeToString(deterministic=True)].id,
+        harnesses[proto.harness.SerializeToString(deterministic=True)].id,
+        inputset_id, invariant_optset_id))
+    db.InsertIgnore(session, TestcaseInputSet.__table__, [
+      {'id': id_, 'input_id': input_id}
+      for id_, input_id in sorted(inputset_rows)])
+    db.InsertIgnore(session, TestcaseInvariantOptSet.__table__, [
+      {'id': id_, 'invariant_opt_id': invariant_opt_id}
+      for id_, invariant_opt_id in sorted(invariant_optset_rows)])
+
+    # Add the testcases which do not already exist. Only the first occurrence
+    # of a new testcase is added.
+    testcase_ids = cls._SelectIdsByKey(session, keys)
+    new_protos = {}
+    for key, proto in zip(keys, protos):
+      if key not in testcase_ids and key not in new_protos:
+        new_protos[key] = proto
+    if new_protos:
+      session.execute(cls.__table__.insert(), [{
+        'toolchain_id': key[0],
+        'generator_id': key[1],
+        'harness_id': key[2],
+        'inputset_id': key[3],
+        'invariant_optset_id': key[4],
+      } for key in new_protos])
+      testcase_ids.update(cls._SelectIdsByKey(session, list(new_protos)))
+
+      # Add the profiling events of new testcases.
+      events = [(testcase_ids[key], event)
+                for key, proto in new_protos.items()
+                for event in proto.profiling_events]
+      client_ids = deeplearning.deepsmith.client.Client.GetOrAddMany(
+          session, set(event.client for _, event in events))
+      type_ids = (
+        deeplearning.deepsmith.profiling_event.ProfilingEventType.GetOrAddMany(
+            session, set(event.type for _, event in events)))
+      db.InsertIgnore(
+          session,
+          deeplearning.deepsmith.profiling_event.TestcaseProfilingEvent
+            .__table__,
+          [{
+            'testcase_id': testcase_id,
+            'client_id': client_ids[event.client],
+            'type_id': type_ids[event.type],
+            'duration_ms': event.duration_ms,
+            'event_start': labdate.DatetimeFromMillisecondsTimestamp(
+                event.event_start_epoch_ms),
+          } for testcase_id, event in events])
+
+    return [testcase_ids[key] for key in keys]
+
+  @classmethod
+  def _SelectIdsByKey(cls, session: db.session_t,
+                      keys: typing.List[typing.Tuple[int, int, int, bytes,
+                                                     bytes]]
+                      ) -> typing.Dict[typing.Tuple[int, int, int, bytes,
+                                                    bytes], int]:
+    """Return a map from unique key to ID for the testcases which exist."""
+    wanted = set(keys)
+    inputset_ids = sorted(set(key[3] for key in wanted))
+    ids = {}
+    for i in range(0, len(inputset_ids), db.MAX_ROWS_PER_QUERY):
+      query = session.query(
+          cls.toolchain_id, cls.generator_id, cls.harness_id, cls.inputset_id,
+          cls.invariant_optset_id, cls.id).filter(
+          cls.inputset_id.in_(inputset_ids[i:i + db.MAX_ROWS_PER_QUERY]))
+      for row in query:
+        key = tuple(row[:5])
+        if key in wanted:
+          ids[key] = row[5]
+    return ids
+
   @classmethod
   def ProtoFromFile(cls, path: pathlib.Path) -> deepsmith_pb2.Testcase:
     """Instantiate a protocol buffer testcase from file.
@@ -375,6 +507,32 @@ class TestcaseInputValue(db.Table):
                                   linecount=string.count('\n'),
                                   string=string, )
 
+  @classmethod
+  def GetOrAddMany(cls, session: db.session_t,
+                   strings: typing.Iterable[str]) -> typing.Dict[str, int]:
+    """Look up the IDs of many TestcaseInputValues, adding those which do not
+    exist.
+
+    Args:
+      session: A database session.
+      strings: The strings.
+
+    Returns:
+      A map from string to ID.
+    """
+    md5s, rows = {}, {}
+    for string in strings:
+      md5 = hashlib.md5(string.encode('utf-8')).digest()
+      md5s[string] = md5
+      rows[md5] = {
+        'md5': md5,
+        'charcount': len(string),
+        'linecount': string.count('\n'),
+        'string': string,
+      }
+    ids = db.GetOrAddIds(session, cls, cls.md5, rows)
+    return {string: ids[md5] for string, md5 in md5s.items()}
+
   def __repr__(self):
     return self.string[:50] or ''
 
@@ -479,3 +637,4 @@ class TestcaseInvariantOptValue(db.StringTable):
   # Relationships.
   invariant_opts: typing.List[TestcaseInvariantOpt] = orm.relationship(
       TestcaseInvariantOpt, back_populates='value')
+
@@ -10,6 +10,7 @@ import deeplearning.deepsmith.generator
 import deeplearning.deepsmith.harness
 import deeplearning.deepsmith.profiling_event
 import deeplearning.deepsmith.testcase
+from deeplearning.deepsmith.proto import datastore_pb2
 from deeplearning.deepsmith.proto import deepsmith_pb2
 from labm8 import labdate
 
@@ -218,6 +219,79 @@ def test_duplicate_testcases_ignored(session):
   assert t3.profiling_events[1].duration_ms == 100
 
 
+def _MakeTestcaseProto(i: int) -> deepsmith_pb2.Testcase:
+  """Return a testcase which shares all but its source input with others."""
+  return deepsmith_pb2.Testcase(
+      toolchain='cpp',
+      generator=deepsmith_pb2.Generator(name='generator', opts={'a': 'b'}),
+      harness=deepsmith_pb2.Harness(name='harness'),
+      inputs={'src': f'void main() {{ return {i}; }}', 'data': '[1,2]'},
+      invariant_opts={'config': 'opt'},
+      profiling_events=[
+        deepsmith_pb2.ProfilingEvent(
+            client='localhost',
+            type='generate',
+            duration_ms=i,
+            event_start_epoch_ms=1021312312,
+        ),
+      ]
+  )
+
+
+def test_Testcase_GetOrAddMany_ToProto_equivalence(ds):
+  """Test that testcases added in bulk are the same as the input protos."""
+  protos = [_MakeTestcaseProto(i) for i in range(3)]
+  with ds.Session(commit=True) as s:
+    ids = deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(s, protos)
+  assert len(set(ids)) == 3
+  with ds.Session() as s:
+    for id_, proto in zip(ids, protos):
+      testcase = s.query(deeplearning.deepsmith.testcase.Testcase).filter(
+          deeplearning.deepsmith.testcase.Testcase.id == id_).one()
+      assert testcase.ToProto() == proto
+
+
+def test_Testcase_GetOrAddMany_GetOrAdd_equivalence(ds):
+  """Test that bulk and single adds resolve to the same testcase rows."""
+  with ds.Session(commit=True) as s:
+    testcase = deeplearning.deepsmith.testcase.Testcase.GetOrAdd(
+        s, _MakeTestcaseProto(0))
+    s.flush()
+    id_ = testcase.id
+  with ds.Session(commit=True) as s:
+    ids = deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(
+        s, [_MakeTestcaseProto(1), _MakeTestcaseProto(0)])
+  assert ids[1] == id_
+  with ds.Session() as s:
+    assert s.query(deeplearning.deepsmith.testcase.Testcase).count() == 2
+    assert s.query(deeplearning.deepsmith.testcase.TestcaseInput).count() == 3
+    assert s.query(
+        deeplearning.deepsmith.testcase.TestcaseInputSet).count() == 4
+    assert s.query(
+        deeplearning.deepsmith.testcase.TestcaseInvariantOptSet).count() == 1
+
+
+def test_Testcase_GetOrAddMany_duplicates_ignored(ds):
+  """Test that duplicate testcases in a batch are only added once."""
+  first, second = _MakeTestcaseProto(0), _MakeTestcaseProto(0)
+  second.profiling_events[0].duration_ms = -1
+  with ds.Session(commit=True) as s:
+    ids = deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(
+        s, [first, second])
+  assert ids[0] == ids[1]
+  with ds.Session() as s:
+    assert s.query(deeplearning.deepsmith.testcase.Testcase).count() == 1
+    testcase = s.query(deeplearning.deepsmith.testcase.Testcase).one()
+    assert len(testcase.profiling_events) == 1
+    assert testcase.profiling_events[0].duration_ms == 0
+
+
+def test_Testcase_GetOrAddMany_empty(ds):
+  """Test that an empty batch adds nothing."""
+  with ds.Session(commit=True) as s:
+    assert [] == deeplearning.deepsmith.testcase.Testcase.GetOrAddMany(s, [])
+
+
 # Benchmarks.
 
 
@@ -317,6 +391,29 @@ def test_benchmark_Generator_GetOrAdd_existing(session, benchmark):
   benchmark(_AddExistingTestcase, session)
 
 
+def _SubmitTestcases(ds, protos):
+  """Submit testcases to a datastore which contains the same testcases."""
+  request = datastore_pb2.SubmitTestcasesRequest(testcases=protos)
+  ds.SubmitTestcases(request, datastore_pb2.SubmitTestcasesResponse())
+
+
+def _SubmitTestcasesOneByOne(ds, protos):
+  """Submit testcases to a datastore using one GetOrAdd() per testcase."""
+  with ds.Session(commit=True) as s:
+    for proto in protos:
+      deeplearning.deepsmith.testcase.Testcase.GetOrAdd(s, proto)
+
+
+def test_benchmark_DataStore_SubmitTestcases(ds, benchmark):
+  protos = [_MakeTestcaseProto(i) for i in range(250)]
+  benchmark(_SubmitTestcases, ds, protos)
+
+
+def test_benchmark_Testcase_GetOrAdd_one_by_one(ds, benchmark):
+  protos = [_MakeTestcaseProto(i) for i in range(250)]
+  benchmark(_SubmitTestcasesOneByOne, ds, protos)
+
+
 def main(argv):  # pylint: disable=missing-docstring
   del argv
   sys.exit(pytest.main([__file__, '-v']))
@@ -19,6 +19,11 @@ FLAGS = flags.FLAGS
 flags.DEFINE_integer(
     'runtime_num_runs', 10,
     'The number of times to execute a binary to get its runtime.')
+flags.DEFINE_string(
+    'random_opt_cache_dir', None,
+    'A directory to cache the results of opt, compile and exec steps in, '
+    'which is shared between runs. If not set, results are cached only for '
+    'the lifetime of an environment.')
 
 # A list of all environments registered in this file.
 ENVIRONMENTS = [
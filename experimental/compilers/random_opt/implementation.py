@@ -20,6 +20,7 @@ from compilers.llvm import clang
 from compilers.llvm import llvm
 from compilers.llvm import llvm_link
 from compilers.llvm import opt
+from experimental.compilers.random_opt import result_cache
 from experimental.compilers.random_opt.proto import random_opt_pb2
 from labm8 import crypto
 from labm8 import jsonutil
@@ -82,6 +83,15 @@ class Environment(gym.Env):
     if self.config.HasField('eval_cmd'):
       self.eval_cmd = self._MakeVariableSubstitution(self.config.eval_cmd)
 
+    # A cache of opt, compile, and exec results which is shared across
+    # episodes. If --random_opt_cache_dir is set, the cache is persisted
+    # between runs, and shared by all environments which use the directory.
+    if FLAGS.random_opt_cache_dir:
+      cache_dir = pathlib.Path(FLAGS.random_opt_cache_dir)
+    else:
+      cache_dir = self.working_dir / 'cache'
+    self.cache = result_cache.ResultCache(cache_dir)
+
   def reset(self):
     """Reset the environment."""
     raise NotImplementedError
@@ -145,6 +155,88 @@ class Environment(gym.Env):
     else:
       return True
 
+  def RunOptPasses(self, input_path: pathlib.Path, output_path: pathlib.Path,
+                   opt_passes: typing.List[str]) -> None:
+    """Run opt passes on bytecode, using the cached output if possible.
+
+    Args:
+      input_path: The input bytecode.
+      output_path: The output bytecode to write.
+      opt_passes: The list of opt passes to run.
+
+    Raises:
+      LlvmError: If opt fails.
+    """
+    checksum = result_cache.BytecodeChecksum(input_path)
+    cached = self.cache.GetOpt(checksum, opt_passes)
+    if cached is None:
+      try:
+        opt.RunOptPassOnBytecode(input_path, output_path, opt_passes)
+      except opt.OptException as e:
+        self.cache.PutOpt(checksum, opt_passes, error=str(e))
+        raise
+      self.cache.PutOpt(checksum, opt_passes, bytecode_path=output_path)
+    elif cached.error is not None:
+      raise opt.OptException(cached.error)
+    else:
+      shutil.copyfile(cached.bytecode_path, output_path)
+
+  def CompileBinary(self, bytecode_path: pathlib.Path,
+                    binary_path: pathlib.Path) -> None:
+    """Compile bytecode to a binary, using the cached binary if possible.
+
+    Args:
+      bytecode_path: The bytecode to compile.
+      binary_path: The binary to write.
+
+    Raises:
+      LlvmError: If compilation fails.
+    """
+    checksum = result_cache.BytecodeChecksum(bytecode_path)
+    cached = self.cache.GetBinary(checksum)
+    if cached is None:
+      try:
+        clang.Compile([bytecode_path], binary_path, copts=['-O0'])
+      except clang.ClangException as e:
+        self.cache.PutBinary(checksum, error=str(e))
+        raise
+      self.cache.PutBinary(checksum, binary_path=binary_path)
+    elif cached.error is not None:
+      raise clang.ClangException(cached.error)
+    else:
+      shutil.copy(cached.binary_path, binary_path)
+
+  def RunAndValidateBinary(
+      self, bytecode_path: pathlib.Path) -> result_cache.ExecResult:
+    """Get the runtimes of the binary and validate it.
+
+    The binary must have been compiled from bytecode_path. If the outcome of
+    executing a binary compiled from identical bytecode is cached, the binary
+    is not executed.
+
+    Args:
+      bytecode_path: The bytecode which the binary was compiled from.
+
+    Returns:
+      An ExecResult.
+    """
+    checksum = result_cache.BytecodeChecksum(bytecode_path)
+    exec_key = '\n'.join([
+      self.config.setup_cmd, self.config.exec_cmd, self.config.eval_cmd,
+      str(FLAGS.runtime_num_runs)])
+    cached = self.cache.GetExec(checksum, exec_key)
+    if cached is not None:
+      return cached
+    try:
+      runtimes = self.GetRuntimes()
+      status = 'PASS' if self.BinaryIsValid() else 'EVAL_FAILED'
+      result = result_cache.ExecResult(status, runtimes, None)
+    except ValueError as e:
+      result = result_cache.ExecResult(
+          'EXEC_FAILED', [], text.truncate(str(e), 255))
+    self.cache.PutExec(checksum, exec_key, result)
+    return result
+
   def ToProto(self) -> pbutil.ProtocolBuffer:
     """Return proto representation of environment."""
     raise NotImplementedError
@@ -261,8 +353,8 @@ EPISODE #{len(self.episodes)}, STEP #{len(self.episodes[-1].step) - 1}:
 
     # Run the pass.
     try:
-      opt.RunOptPassOnBytecode(self.working_bytecode_path, temp_bytecode,
-                               list(step.opt_pass))
+      self.RunOptPasses(self.working_bytecode_path, temp_bytecode,
+                        list(step.opt_pass))
     except llvm.LlvmError as e:
       step.status = random_opt_pb2.Step.OPT_FAILED
       step.status_msg = text.truncate(str(e), 255)
@@ -275,7 +367,7 @@ EPISODE #{len(self.episodes)}, STEP #{len(self.episodes[-1].step) - 1}:
       os.rename(str(temp_bytecode), str(self.working_bytecode_path))
       # Compile a new binary.
       try:
-        clang.Compile([self.working_bytecode_path], temp_binary, copts=['-O0'])
+        self.CompileBinary(self.working_bytecode_path, temp_binary)
         step.binary_changed = BinariesAreEqual(temp_binary, self.binary_path)
         os.rename(str(temp_binary), str(self.binary_path))
       except llvm.LlvmError as e:
@@ -284,24 +376,21 @@ EPISODE #{len(self.episodes)}, STEP #{len(self.episodes[-1].step) - 1}:
 
     if step.status == random_opt_pb2.Step.PASS:
       # Get the binary runtime.
-      try:
-        step.binary_runtime_ms.extend(self.GetRuntimes())
-      except ValueError as e:
-        step.status = random_opt_pb2.Step.EXEC_FAILED
-        step.status_msg = text.truncate(str(e), 255)
+      exec_result = self.RunAndValidateBinary(self.working_bytecode_path)
+      step.binary_runtime_ms.extend(exec_result.runtimes)
+      step.status = random_opt_pb2.Step.Status.Value(exec_result.status)
+      if exec_result.error:
+        step.status_msg = exec_result.error
 
     if step.status == random_opt_pb2.Step.PASS:
-      if self.BinaryIsValid():
-        step.speedup = (
-            (sum(self.episodes[-1].step[-1].binary_runtime_ms) / len(
-                self.episodes[-1].step[-1].binary_runtime_ms)) /
-            (sum(step.binary_runtime_ms) / len(step.binary_runtime_ms)))
-        step.total_speedup = (
-            (sum(self.episodes[-1].step[0].binary_runtime_ms) / len(
-                self.episodes[-1].step[0].binary_runtime_ms)) / (
-                sum(step.binary_runtime_ms) / len(step.binary_runtime_ms)))
-      else:
-        step.status = random_opt_pb2.Step.EVAL_FAILED
+      step.speedup = (
+          (sum(self.episodes[-1].step[-1].binary_runtime_ms) / len(
+              self.episodes[-1].step[-1].binary_runtime_ms)) /
+          (sum(step.binary_runtime_ms) / len(step.binary_runtime_ms)))
+      step.total_speedup = (
+          (sum(self.episodes[-1].step[0].binary_runtime_ms) / len(
+              self.episodes[-1].step[0].binary_runtime_ms)) / (
+              sum(step.binary_runtime_ms) / len(step.binary_runtime_ms)))
 
     step.reward = self.Reward(step.status, step.speedup)
     step.total_reward = self.episodes[-1].step[-1].total_reward + step.reward
@@ -418,8 +507,8 @@ class LlvmOptDelayedRewardEnv(LlvmOptEnv):
     # Run the full list of passes and update working_bytecode file.
     try:
       all_passes = [step.opt_pass for step in self.episodes[-1].step[1:]]
-      opt.RunOptPassOnBytecode(self.bytecode_path, self.working_dir / 'temp.ll',
-                               all_passes)
+      self.RunOptPasses(self.bytecode_path, self.working_dir / 'temp.ll',
+                        all_passes)
       step.bytecode_changed = BytecodesAreEqual(self.working_dir / 'temp.ll',
                                                 self.working_bytecode_path)
       shutil.copyfile(self.working_dir / 'temp.ll', self.working_bytecode_path)
@@ -440,20 +529,18 @@ class LlvmOptDelayedRewardEnv(LlvmOptEnv):
         start_time_epoch_ms=start_ms,
     )
     try:
-      clang.Compile([self.working_bytecode_path], self.binary_path,
-                    copts=['-O0'])
-      try:
-        runtimes = self.GetRuntimes()
-        self.episodes[-1].binary_runtime_ms.extend(runtimes)
-        if self.BinaryIsValid():
-          step.reward = self.runtime_reward(sum(runtimes) / len(runtimes))
-        else:
-          self.episodes[-1].outcome = (
-            random_opt_pb2.DelayedRewardEpisode.EVAL_FAILED)
-          step.reward = self.eval_failed_reward
-      except ValueError as e:
-        self.episodes[-1].outcome = random_opt_pb2.Step.EXEC_FAILED
-        self.episodes[-1].outcome_error_msg = text.truncate(str(e), 255)
+      self.CompileBinary(self.working_bytecode_path, self.binary_path)
+      exec_result = self.RunAndValidateBinary(self.working_bytecode_path)
+      self.episodes[-1].binary_runtime_ms.extend(exec_result.runtimes)
+      self.episodes[-1].outcome = (
+        random_opt_pb2.DelayedRewardEpisode.Outcome.Value(exec_result.status))
+      if exec_result.status == 'PASS':
+        step.reward = self.runtime_reward(
+            sum(exec_result.runtimes) / len(exec_result.runtimes))
+      elif exec_result.status == 'EVAL_FAILED':
+        step.reward = self.eval_failed_reward
+      else:
+        self.episodes[-1].outcome_error_msg = exec_result.error
         step.reward = self.exec_failed_reward
     except clang.ClangException as e:
       self.episodes[-1].outcome = (
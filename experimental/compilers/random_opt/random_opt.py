@@ -1,5 +1,7 @@
 """Random optimizer."""
+import functools
 import pathlib
+import sys
 import typing
 
 import gym
@@ -9,6 +11,7 @@ from absl import logging
 
 from experimental.compilers.random_opt import environments
 from experimental.compilers.random_opt import implementation as implementation
+from experimental.compilers.random_opt import vector_env
 from labm8 import pbutil
 
 
@@ -26,6 +29,14 @@ flags.DEFINE_integer(
 flags.DEFINE_boolean(
     'render', True,
     'Render the environment after every step.')
+flags.DEFINE_integer(
+    'num_envs', 1,
+    'The number of environments to step concurrently. If greater than one, '
+    'each environment runs --num_episodes episodes in its own process.')
+flags.DEFINE_boolean(
+    'pin_cpus', True,
+    'When --num_envs is greater than one, pin each environment to a CPU so '
+    'that concurrent runtime measurements do not interfere.')
 flags.DEFINE_string(
     'proto_out', '/tmp/phd/experimental/compilers/random_opt/random_opt.pbtxt',
     'The output path to write experiment proto to.')
@@ -37,7 +48,8 @@ def Render(env: gym.Env) -> None:
     env.render()
 
 
-def ToFile(env: implementation.Environment) -> None:
+def ToFile(env: typing.Union[implementation.Environment,
+                              vector_env.VectorEnv]) -> None:
   """Save environment to file --proto_out."""
   out_path = pathlib.Path(FLAGS.proto_out)
   out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -45,11 +57,48 @@ def ToFile(env: implementation.Environment) -> None:
   logging.info('Wrote experimental results to: %s', out_path)
 
 
+def RunVectorizedEpisodes(env: vector_env.VectorEnv) -> None:
+  """Run --num_episodes random walk episodes in every environment."""
+  for i in range(FLAGS.num_episodes):
+    env.reset()
+    if FLAGS.render:
+      env.render(sys.stdout)
+    active = [True] * env.num_envs
+    for _ in range(FLAGS.max_steps):
+      results = env.step([env.action_space.sample() if is_active else None
+                          for is_active in active])
+      if FLAGS.render:
+        env.render(sys.stdout)
+      active = [result is not None and not result[2] for result in results]
+      if not any(active):
+        break
+    else:
+      # Explicitly stop the episodes which did not naturally end.
+      env.step([len(env.config.candidate_pass) if is_active else None
+                for is_active in active])
+    logging.info('Completed episode %d of %d in %d environments, '
+                 '%.2f steps per second', i + 1, FLAGS.num_episodes,
+                 env.num_envs, env.StepsPerSecond())
+
+
 def main(argv: typing.List[str]):
   """Main entry point."""
   if len(argv) > 1:
     raise app.UsageError("Unknown arguments: '{}'.".format(' '.join(argv[1:])))
 
+  if FLAGS.num_envs > 1:
+    logging.info('Generating %d environments %s ...', FLAGS.num_envs,
+                 FLAGS.env)
+    env = vector_env.VectorEnv(functools.partial(gym.make, FLAGS.env),
+                               FLAGS.num_envs, pin_cpus=FLAGS.pin_cpus)
+    try:
+      RunVectorizedEpisodes(env)
+      ToFile(env)
+    finally:
+      env.close()
+    logging.info('Done.')
+    return
+
   logging.info('Generating environment %s ...', FLAGS.env)
   env = gym.make(FLAGS.env)
   logging.info('Starting %d random walk episodes of %d steps each ...',
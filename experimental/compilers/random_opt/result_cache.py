@@ -0,0 +1,224 @@
+"""A persistent cache of the results of opt, compile and exec steps.
+
+Reinforcement learning agents frequently revisit the same states, i.e. produce
+the same bytecode from a sequence of passes. This cache stores the result of
+each expensive step of an environment, keyed by the checksum of its input, so
+that revisited states need not re-run opt, clang, or the binary.
+
+The cache is a directory of files, which may be shared by multiple
+environments and processes:
+
+    <root>/opt/<key>.ll     The output bytecode of a successful opt run.
+    <root>/opt/<key>.err    The error message of a failed opt run.
+    <root>/binary/<key>     The binary compiled from bytecode.
+    <root>/binary/<key>.err The error message of a failed compilation.
+    <root>/exec/<key>.json  The outcome of executing and evaluating a binary.
+"""
+import json
+import os
+import pathlib
+import tempfile
+import typing
+
+from labm8 import crypto
+
+
+class OptResult(typing.NamedTuple):
+  """The result of running opt passes on bytecode."""
+  # The path of the output bytecode, if opt succeeded.
+  bytecode_path: typing.Optional[pathlib.Path]
+  # The error message, if opt failed.
+  error: typing.Optional[str]
+
+
+class CompileResult(typing.NamedTuple):
+  """The result of compiling bytecode to a binary."""
+  # The path of the binary, if compilation succeeded.
+  binary_path: typing.Optional[pathlib.Path]
+  # The error message, if compilation failed.
+  error: typing.Optional[str]
+
+
+class ExecResult(typing.NamedTuple):
+  """The outcome of executing and evaluating a binary."""
+  # The name of the status, one of {PASS,EXEC_FAILED,EVAL_FAILED}.
+  status: str
+  # The runtimes of the binary, in milliseconds.
+  runtimes: typing.List[int]
+  # The error message, if execution failed.
+  error: typing.Optional[str]
+
+
+def BytecodeChecksum(path: pathlib.Path) -> str:
+  """Return the checksum of a bytecode file.
+
+  The '; ModuleID' comment on the first line records the path of the file
+  which the bytecode was produced from, so it is excluded from the checksum.
+
+  Args:
+    path: The path of an LLVM bytecode file.
+
+  Returns:
+    A hex sha256 checksum.
+  """
+  with open(path, 'rb') as f:
+    bytecode = f.read()
+  if bytecode.startswith(b'; ModuleID'):
+    bytecode = bytecode[bytecode.find(b'\n') + 1:]
+  return crypto.sha256(bytecode)
+
+
+class ResultCache(object):
+  """A content-addressed cache of opt, compile and exec results."""
+
+  def __init__(self, path: pathlib.Path):
+    """Instantiate a cache.
+
+    Args:
+      path: The root directory of the cache. It is created if it does not
+        exist.
+    """
+    self.path = path
+    for subdir in ('opt', 'binary', 'exec'):
+      (self.path / subdir).mkdir(parents=True, exist_ok=True)
+
+  def GetOpt(self, bytecode_checksum: str,
+             opt_passes: typing.List[str]) -> typing.Optional[OptResult]:
+    """Look up the result of running opt passes on bytecode.
+
+    Args:
+      bytecode_checksum: The checksum of the input bytecode, as returned by
+        BytecodeChecksum().
+      opt_passes: The list of opt passes.
+
+    Returns:
+      An OptResult, or None if the result is not cached.
+    """
+    key = self._OptKey(bytecode_checksum, opt_passes)
+    entry = self._Get('opt', f'{key}.ll', f'{key}.err')
+    return OptResult(*entry) if entry else None
+
+  def PutOpt(self, bytecode_checksum: str, opt_passes: typing.List[str],
+             bytecode_path: typing.Optional[pathlib.Path] = None,
+             error: typing.Optional[str] = None) -> None:
+    """Record the result of running opt passes on bytecode.
+
+    Args:
+      bytecode_checksum: The checksum of the input bytecode.
+      opt_passes: The list of opt passes.
+      bytecode_path: The path of the output bytecode, if opt succeeded. The
+        file is copied into the cache.
+      error: The error message, if opt failed.
+    """
+    key = self._OptKey(bytecode_checksum, opt_passes)
+    self._Put('opt', f'{key}.ll', f'{key}.err', bytecode_path, error)
+
+  def GetBinary(
+      self, bytecode_checksum: str) -> typing.Optional[CompileResult]:
+    """Look up the result of compiling bytecode.
+
+    Args:
+      bytecode_checksum: The checksum of the bytecode.
+
+    Returns:
+      A CompileResult, or None if the result is not cached.
+    """
+    entry = self._Get('binary', bytecode_checksum, f'{bytecode_checksum}.err')
+    return CompileResult(*entry) if entry else None
+
+  def PutBinary(self, bytecode_checksum: str,
+                binary_path: typing.Optional[pathlib.Path] = None,
+                error: typing.Optional[str] = None) -> None:
+    """Record the result of compiling bytecode.
+
+    Args:
+      bytecode_checksum: The checksum of the bytecode.
+      binary_path: The path of the binary, if compilation succeeded. The file
+        is copied into the cache.
+      error: The error message, if compilation failed.
+    """
+    self._Put('binary', bytecode_checksum, f'{bytecode_checksum}.err',
+              binary_path, error)
+
+  def GetExec(self, bytecode_checksum: str,
+              exec_key: str) -> typing.Optional[ExecResult]:
+    """Look up the outcome of executing a binary.
+
+    Args:
+      bytecode_checksum: The checksum of the bytecode which the binary was
+        compiled from.
+      exec_key: A string which identifies how the binary is executed and
+        evaluated, e.g. the commands and number of runs.
+
+    Returns:
+      An ExecResult, or None if the result is not cached.
+    """
+    key = self._ExecKey(bytecode_checksum, exec_key)
+    path = self.path / 'exec' / f'{key}.json'
+    if not path.is_file():
+      return None
+    with open(path) as f:
+      return ExecResult(**json.load(f))
+
+  def PutExec(self, bytecode_checksum: str, exec_key: str,
+              result: ExecResult) -> None:
+    """Record the outcome of executing a binary.
+
+    Args:
+      bytecode_checksum: The checksum of the bytecode which the binary was
+        compiled from.
+      exec_key: A string which identifies how the binary is executed.
+      result: The outcome.
+    """
+    key = self._ExecKey(bytecode_checksum, exec_key)
+    self._WriteAtomic(self.path / 'exec' / f'{key}.json',
+                      json.dumps(result._asdict()).encode('utf-8'))
+
+  @staticmethod
+  def _OptKey(bytecode_checksum: str, opt_passes: typing.List[str]) -> str:
+    return crypto.sha256_str('\n'.join([bytecode_checksum] + list(opt_passes)))
+
+  @staticmethod
+  def _ExecKey(bytecode_checksum: str, exec_key: str) -> str:
+    return crypto.sha256_str(f'{bytecode_checksum}\n{exec_key}')
+
+  def _Get(self, subdir: str, name: str, error_name: str
+           ) -> typing.Optional[typing.Tuple[typing.Optional[pathlib.Path],
+                                             typing.Optional[str]]]:
+    """Look up an entry which is either a file or an error message."""
+    path = self.path / subdir / name
+    if path.is_file():
+      return path, None
+    error_path = self.path / subdir / error_name
+    if error_path.is_file():
+      return None, error_path.read_text()
+    return None
+
+  def _Put(self, subdir: str, name: str, error_name: str,
+           path: typing.Optional[pathlib.Path],
+           error: typing.Optional[str]) -> None:
+    """Add an entry which is either a file or an error message."""
+    if (path is None) == (error is None):
+      raise ValueError('Exactly one of path and error must be set')
+    if path is None:
+      self._WriteAtomic(self.path / subdir / error_name, error.encode('utf-8'))
+    else:
+      with open(path, 'rb') as f:
+        self._WriteAtomic(self.path / subdir / name, f.read(),
+                          mode=os.stat(path).st_mode)
+
+  @staticmethod
+  def _WriteAtomic(path: pathlib.Path, data: bytes,
+                   mode: typing.Optional[int] = None) -> None:
+    """Write a file so that concurrent readers never see partial contents."""
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp_')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      if mode is not None:
+        os.chmod(temp_path, mode)
+      os.replace(temp_path, path)
+    except Exception:
+      os.unlink(temp_path)
+      raise
+
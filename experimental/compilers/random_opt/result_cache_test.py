@@ -0,0 +1,109 @@
+"""Unit tests for //experimental/compilers/random_opt/result_cache.py."""
+import pathlib
+import stat
+import sys
+import tempfile
+import typing
+
+import pytest
+from absl import app
+from absl import flags
+
+from experimental.compilers.random_opt import result_cache
+
+
+FLAGS = flags.FLAGS
+
+
+@pytest.fixture(scope='function')
+def tempdir() -> pathlib.Path:
+  """Test fixture which returns a temporary directory."""
+  with tempfile.TemporaryDirectory(prefix='result_cache_test_') as d:
+    yield pathlib.Path(d)
+
+
+@pytest.fixture(scope='function')
+def cache(tempdir: pathlib.Path) -> result_cache.ResultCache:
+  """Test fixture which returns an empty cache."""
+  return result_cache.ResultCache(tempdir / 'cache')
+
+
+def test_BytecodeChecksum_ignores_module_id(tempdir: pathlib.Path):
+  """Test that the ModuleID line does not affect the checksum."""
+  (tempdir / 'a.ll').write_text("; ModuleID = '/tmp/a/a.ll'\nfoo\n")
+  (tempdir / 'b.ll').write_text("; ModuleID = '/tmp/b/b.ll'\nfoo\n")
+  (tempdir / 'c.ll').write_text("; ModuleID = '/tmp/a/a.ll'\nbar\n")
+  assert (result_cache.BytecodeChecksum(tempdir / 'a.ll') ==
+          result_cache.BytecodeChecksum(tempdir / 'b.ll'))
+  assert (result_cache.BytecodeChecksum(tempdir / 'a.ll') !=
+          result_cache.BytecodeChecksum(tempdir / 'c.ll'))
+
+
+def test_ResultCache_GetOpt_miss(cache: result_cache.ResultCache):
+  """Test that a missing entry returns None."""
+  assert cache.GetOpt('0' * 64, ['-mem2reg']) is None
+
+
+def test_ResultCache_PutOpt_GetOpt(cache: result_cache.ResultCache,
+                                   tempdir: pathlib.Path):
+  """Test that cached opt output is keyed by input checksum and passes."""
+  (tempdir / 'out.ll').write_text('output')
+  cache.PutOpt('a', ['-mem2reg'], bytecode_path=tempdir / 'out.ll')
+  cache.PutOpt('a', ['-dce'], error='opt failed')
+
+  result = cache.GetOpt('a', ['-mem2reg'])
+  assert result.error is None
+  assert result.bytecode_path.read_text() == 'output'
+  assert result.bytecode_path != tempdir / 'out.ll'
+  assert cache.GetOpt('a', ['-dce']) == (None, 'opt failed')
+  assert cache.GetOpt('b', ['-mem2reg']) is None
+  assert cache.GetOpt('a', ['-mem2reg', '-dce']) is None
+
+
+def test_ResultCache_PutOpt_requires_path_or_error(
+    cache: result_cache.ResultCache, tempdir: pathlib.Path):
+  """Test that exactly one of the output path and error must be set."""
+  (tempdir / 'out.ll').write_text('output')
+  with pytest.raises(ValueError):
+    cache.PutOpt('a', ['-dce'])
+  with pytest.raises(ValueError):
+    cache.PutOpt('a', ['-dce'], bytecode_path=tempdir / 'out.ll', error='e')
+
+
+def test_ResultCache_PutBinary_preserves_mode(
+    cache: result_cache.ResultCache, tempdir: pathlib.Path):
+  """Test that cached binaries remain executable."""
+  (tempdir / 'binary').write_bytes(b'\x7fELF')
+  (tempdir / 'binary').chmod(0o755)
+  cache.PutBinary('a', binary_path=tempdir / 'binary')
+  result = cache.GetBinary('a')
+  assert result.binary_path.read_bytes() == b'\x7fELF'
+  assert result.binary_path.stat().st_mode & stat.S_IXUSR
+
+
+def test_ResultCache_PutExec_GetExec(cache: result_cache.ResultCache):
+  """Test that exec results are keyed by bytecode and exec key."""
+  result = result_cache.ExecResult('PASS', [1, 2, 3], None)
+  cache.PutExec('a', 'cmd', result)
+  assert cache.GetExec('a', 'cmd') == result
+  assert cache.GetExec('a', 'other_cmd') is None
+  assert cache.GetExec('b', 'cmd') is None
+
+
+def test_ResultCache_is_persistent(tempdir: pathlib.Path):
+  """Test that a new cache instance reads existing entries."""
+  result = result_cache.ExecResult('EXEC_FAILED', [], 'timeout')
+  result_cache.ResultCache(tempdir).PutExec('a', 'cmd', result)
+  assert result_cache.ResultCache(tempdir).GetExec('a', 'cmd') == result
+
+
+def main(argv: typing.List[str]):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError("Unknown arguments: '{}'.".format(' '.join(argv[1:])))
+  sys.exit(pytest.main([__file__, '-vv']))
+
+
+if __name__ == '__main__':
+  flags.FLAGS(['argv[0]', '-v=1'])
+  app.run(main)
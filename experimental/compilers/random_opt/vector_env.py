@@ -0,0 +1,235 @@
+"""Step multiple random_opt environments concurrently.
+
+A VectorEnv runs K independent environments, each in its own worker process
+and working directory, and exposes batched reset() and step() methods. Each
+worker is pinned to a CPU, and the affinity is inherited by the commands that
+it runs, so that the runtimes measured by concurrent environments do not
+interfere.
+"""
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import typing
+
+from absl import logging
+
+from labm8 import pbutil
+
+
+# The type of the value returned by an environment's step() method.
+step_t = typing.Tuple[typing.Any, float, bool, typing.Dict[str, typing.Any]]
+
+
+def _Worker(connection: multiprocessing.connection.Connection,
+            env_fn: typing.Callable[[], typing.Any],
+            cpu: typing.Optional[int]) -> None:
+  """The main loop of a worker process.
+
+  Commands are received as <name, argument> tuples, and the result of each
+  command is sent back as an <exception, value> tuple.
+  """
+  try:
+    if cpu is not None:
+      os.sched_setaffinity(0, {cpu})
+    env = env_fn()
+    connection.send((None, (env.action_space, env.config)))
+  except Exception as e:
+    connection.send((e, None))
+    return
+
+  while True:
+    try:
+      command, arg = connection.recv()
+    except EOFError:
+      # The parent process has exited.
+      break
+    if command == 'close':
+      break
+    try:
+      if command == 'reset':
+        value = env.reset()
+      elif command == 'step':
+        value = env.step(arg)
+      elif command == 'seed':
+        value = env.seed(arg)
+      elif command == 'render':
+        value = env.render(io.StringIO()).getvalue()
+      elif command == 'to_proto':
+        value = env.ToProto()
+      else:
+        raise ValueError(f"Unknown command: '{command}'")
+      connection.send((None, value))
+    except Exception as e:
+      connection.send((e, None))
+  connection.close()
+
+
+class VectorEnv(object):
+  """A batch of independent environments, each in a worker process."""
+
+  def __init__(self, env_fn: typing.Callable[[], typing.Any], num_envs: int,
+               cpus: typing.Optional[typing.List[int]] = None,
+               pin_cpus: bool = True):
+    """Instantiate a vectorized environment.
+
+    Args:
+      env_fn: A callable which returns a new environment, e.g.
+        functools.partial(gym.make, 'LLVM-queens-8x8-v0'). It is called in
+        each worker process.
+      num_envs: The number of environments.
+      cpus: The CPUs to pin workers to. Worker i is pinned to cpus[i %
+        len(cpus)]. Defaults to the CPUs that this process may run on.
+      pin_cpus: If False, workers are not pinned to CPUs.
+
+    Raises:
+      ValueError: If num_envs is not positive.
+      Exception: If an environment cannot be created, the exception raised
+        by env_fn.
+    """
+    self._connections = []
+    self._workers = []
+    if num_envs < 1:
+      raise ValueError(f'num_envs must be positive: {num_envs}')
+    self.num_envs = num_envs
+
+    if pin_cpus:
+      cpus = cpus or sorted(os.sched_getaffinity(0))
+      if num_envs > len(cpus):
+        logging.warning('Running %d environments on %d CPUs. Measured '
+                        'runtimes may interfere', num_envs, len(cpus))
+      self.cpus = [cpus[i % len(cpus)] for i in range(num_envs)]
+    else:
+      self.cpus = [None] * num_envs
+
+    for cpu in self.cpus:
+      parent_connection, child_connection = multiprocessing.Pipe()
+      worker = multiprocessing.Process(
+          target=_Worker, args=(child_connection, env_fn, cpu), daemon=True)
+      worker.start()
+      child_connection.close()
+      self._connections.append(parent_connection)
+      self._workers.append(worker)
+
+    try:
+      spaces = self._Receive(self._connections)
+    except Exception:
+      self.close()
+      raise
+    # All environments are created by the same env_fn, so they share an
+    # action space and config.
+    self.action_space, self.config = spaces[0]
+
+    # Telemetry.
+    self.num_steps = 0
+    self.step_seconds = 0.0
+
+  def reset(self) -> None:
+    """Reset all environments."""
+    self._Send('reset', [None] * self.num_envs)
+
+  def step(self, actions: typing.List[typing.Optional[int]]
+           ) -> typing.List[typing.Optional[step_t]]:
+    """Perform a step in each environment.
+
+    The environments step concurrently.
+
+    Args:
+      actions: A list of num_envs actions. If an action is None, the
+        corresponding environment does not take a step.
+
+    Returns:
+      A list of num_envs step_t tuples, or None for environments which did not
+      take a step.
+
+    Raises:
+      ValueError: If the number of actions is not num_envs.
+    """
+    if len(actions) != self.num_envs:
+      raise ValueError(
+          f'Expected {self.num_envs} actions, received {len(actions)}')
+    start_time = time.time()
+    results = self._Send('step', actions, skip_none=True)
+    self.step_seconds += time.time() - start_time
+    self.num_steps += sum(1 for action in actions if action is not None)
+    return results
+
+  def seed(self, seed: typing.Optional[int] = None) -> typing.List[typing.Any]:
+    """Re-seed the environments. Environment i is seeded with seed + i."""
+    seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+    return self._Send('seed', seeds)
+
+  def render(self, outfile=None) -> typing.List[str]:
+    """Render the environments.
+
+    Args:
+      outfile: If set, the text wrapper to write the string representations to.
+
+    Returns:
+      A list of string representations, one for each environment.
+    """
+    renders = self._Send('render', [None] * self.num_envs)
+    if outfile:
+      for i, render in enumerate(renders):
+        outfile.write(f'ENVIRONMENT #{i + 1}:\n{render}')
+    return renders
+
+  def ToProto(self) -> pbutil.ProtocolBuffer:
+    """Return the proto representation of all environments.
+
+    Returns:
+      An experiment proto with the episodes of all environments, in order.
+    """
+    protos = self._Send('to_proto', [None] * self.num_envs)
+    for proto in protos[1:]:
+      protos[0].episode.extend(proto.episode)
+    return protos[0]
+
+  def StepsPerSecond(self) -> float:
+    """Return the number of environment steps taken per second of step()."""
+    return self.num_steps / self.step_seconds if self.step_seconds else 0
+
+  def close(self) -> None:
+    """Stop the worker processes."""
+    for connection in self._connections:
+      try:
+        connection.send(('close', None))
+      except (BrokenPipeError, EOFError):
+        pass
+    for worker in self._workers:
+      worker.join()
+    for connection in self._connections:
+      connection.close()
+    self._connections = []
+    self._workers = []
+
+  def __del__(self):
+    self.close()
+
+  def _Send(self, command: str, args: typing.List[typing.Any],
+            skip_none: bool = False) -> typing.List[typing.Any]:
+    """Send a command to every worker and wait for the results.
+
+    If skip_none is True, the command is not sent to workers whose argument is
+    None, and their result is None.
+    """
+    connections = []
+    for connection, arg in zip(self._connections, args):
+      if skip_none and arg is None:
+        continue
+      connection.send((command, arg))
+      connections.append(connection)
+    values = iter(self._Receive(connections))
+    return [None if skip_none and arg is None else next(values)
+            for arg in args]
+
+  @staticmethod
+  def _Receive(connections: typing.List[multiprocessing.connection.Connection]
+               ) -> typing.List[typing.Any]:
+    """Receive a result from each connection, raising any exception."""
+    results = [connection.recv() for connection in connections]
+    for exception, _ in results:
+      if exception is not None:
+        raise exception
+    return [value for _, value in results]
@@ -0,0 +1,177 @@
+"""Unit tests for //experimental/compilers/random_opt/vector_env.py."""
+import io
+import os
+import sys
+import typing
+
+import pytest
+from absl import app
+from absl import flags
+
+from experimental.compilers.random_opt import vector_env
+from experimental.compilers.random_opt.proto import random_opt_pb2
+
+
+FLAGS = flags.FLAGS
+
+
+class MockActionSpace(object):
+  """A mock action space."""
+
+  def __init__(self, n: int):
+    self.n = n
+
+
+class MockEnv(object):
+  """A mock environment which records the steps taken."""
+
+  def __init__(self):
+    self.action_space = MockActionSpace(3)
+    self.config = random_opt_pb2.Environment(candidate_pass=['-a', '-b'])
+    self.episodes = []
+
+  def reset(self):
+    self.episodes.append(random_opt_pb2.Episode())
+
+  def step(self, action: int):
+    if action < 0:
+      raise ValueError(f"Unknown action: '{action}'")
+    self.episodes[-1].step.add(opt_pass=[str(action)])
+    info = {'pid': os.getpid(), 'cpus': os.sched_getaffinity(0)}
+    return None, action, action == 2, info
+
+  def seed(self, seed=None):
+    return [seed]
+
+  def render(self, outfile):
+    outfile.write(f'{len(self.episodes[-1].step)} steps\n')
+    return outfile
+
+  def ToProto(self):
+    return random_opt_pb2.Experiment(env=self.config, episode=self.episodes)
+
+
+def BrokenEnv():
+  """An environment constructor which raises an error."""
+  raise OSError('broken')
+
+
+@pytest.fixture(scope='function')
+def env() -> vector_env.VectorEnv:
+  """A test fixture which returns a vectorized environment of three envs."""
+  env = vector_env.VectorEnv(MockEnv, 3, pin_cpus=False)
+  yield env
+  env.close()
+
+
+def test_VectorEnv_invalid_num_envs():
+  """Test that an error is raised if num_envs is not positive."""
+  with pytest.raises(ValueError):
+    vector_env.VectorEnv(MockEnv, 0)
+
+
+def test_VectorEnv_env_fn_raises_error():
+  """Test that an error in an environment constructor is raised."""
+  with pytest.raises(OSError) as e_ctx:
+    vector_env.VectorEnv(BrokenEnv, 2)
+  assert str(e_ctx.value) == 'broken'
+
+
+def test_VectorEnv_action_space_and_config(env: vector_env.VectorEnv):
+  """Test that the action space and config are copied from the workers."""
+  assert env.action_space.n == 3
+  assert list(env.config.candidate_pass) == ['-a', '-b']
+
+
+def test_VectorEnv_step(env: vector_env.VectorEnv):
+  """Test that each environment steps in a separate process."""
+  env.reset()
+  results = env.step([0, 1, 2])
+  assert [r[1:3] for r in results] == [(0, False), (1, False), (2, True)]
+  pids = {r[3]['pid'] for r in results}
+  assert len(pids) == 3
+  assert os.getpid() not in pids
+  assert env.num_steps == 3
+
+
+def test_VectorEnv_step_skips_none(env: vector_env.VectorEnv):
+  """Test that environments with a None action do not step."""
+  env.reset()
+  results = env.step([None, 1, None])
+  assert results[0] is None
+  assert results[1][1] == 1
+  assert results[2] is None
+  assert env.num_steps == 1
+  assert env.render() == ['0 steps\n', '1 steps\n', '0 steps\n']
+
+
+def test_VectorEnv_step_wrong_number_of_actions(env: vector_env.VectorEnv):
+  """Test that an error is raised if the number of actions is wrong."""
+  env.reset()
+  with pytest.raises(ValueError):
+    env.step([0, 1])
+
+
+def test_VectorEnv_step_error_is_raised(env: vector_env.VectorEnv):
+  """Test that an error raised by an environment is raised by step()."""
+  env.reset()
+  with pytest.raises(ValueError) as e_ctx:
+    env.step([0, -1, 0])
+  assert str(e_ctx.value) == "Unknown action: '-1'"
+  # The environments are still usable.
+  assert len(env.step([0, 0, 0])) == 3
+
+
+def test_VectorEnv_seed(env: vector_env.VectorEnv):
+  """Test that environments are given different seeds."""
+  assert env.seed(10) == [[10], [11], [12]]
+
+
+def test_VectorEnv_render_outfile(env: vector_env.VectorEnv):
+  """Test rendering to a file."""
+  env.reset()
+  buf = io.StringIO()
+  env.render(buf)
+  assert buf.getvalue().startswith('ENVIRONMENT #1:\n0 steps\n')
+
+
+def test_VectorEnv_ToProto(env: vector_env.VectorEnv):
+  """Test that the episodes of all environments are combined."""
+  env.reset()
+  env.step([0, 1, 2])
+  env.reset()
+  proto = env.ToProto()
+  assert len(proto.episode) == 6
+  assert [len(e.step) for e in proto.episode] == [1, 0, 1, 0, 1, 0]
+
+
+def test_VectorEnv_StepsPerSecond(env: vector_env.VectorEnv):
+  """Test that the step rate is reported."""
+  assert env.StepsPerSecond() == 0
+  env.reset()
+  env.step([0, 0, 0])
+  assert env.StepsPerSecond() > 0
+
+
+def test_VectorEnv_pin_cpus():
+  """Test that workers are pinned to CPUs."""
+  cpu = sorted(os.sched_getaffinity(0))[0]
+  env = vector_env.VectorEnv(MockEnv, 2, cpus=[cpu])
+  try:
+    assert env.cpus == [cpu, cpu]
+    env.reset()
+    assert [r[3]['cpus'] for r in env.step([0, 0])] == [{cpu}, {cpu}]
+  finally:
+    env.close()
+
+
+def main(argv: typing.List[str]):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError("Unknown arguments: '{}'.".format(' '.join(argv[1:])))
+  sys.exit(pytest.main([__file__, '-vv']))
+
+
+if __name__ == '__main__':
+  flags.FLAGS(['argv[0]', '-v=1'])
+  app.run(main)
@@ -1,7 +1,9 @@
 """A class representing a control flow graph."""
+import functools
 import typing
 
 import networkx as nx
+import numpy as np
 from absl import flags
 
 from experimental.compilers.reachability import reachability_pb2
@@ -67,17 +69,105 @@ class ControlFlowGraph(nx.DiGraph, pbutil.ProtoBackedMixin):
   proto_t = reachability_pb2.ControlFlowGraph
 
   def __init__(self, name: str = "cfg"):
+    # The packed reachability matrix, as computed by _ComputeReachability(),
+    # and the index of each node. These are reset whenever the graph is
+    # modified.
+    self._reachability = None
+    self._node_indices = None
     super(ControlFlowGraph, self).__init__(name=name)
 
   def IsReachable(self, src, dst) -> bool:
     """Return whether dst node is reachable from src."""
-    # TODO(cec): It seems that descendants() does not include self loops, so
-    # test for the node in both descendants and self loops.
-    return dst in nx.descendants(self, src)
+    row = self._ReachabilityRow(src)
+    if dst not in self:
+      return False
+    return bool(row[self._NodeIndices()[dst]])
 
   def Reachables(self, src) -> typing.Iterator[bool]:
     """Return whether each node is reachable from the src node."""
-    return (self.IsReachable(src, dst) for dst in self.nodes)
+    if not self.number_of_nodes():
+      return iter([])
+    return iter(self._ReachabilityRow(src).tolist())
+
+  def ReachabilityMatrix(self) -> np.ndarray:
+    """Return whether each node is reachable from each other node.
+
+    The matrix is computed once, and cached until the graph is modified. As
+    with IsReachable(), a node is not reachable from itself, even if it is part
+    of a cycle.
+
+    Returns:
+      An array of shape [n, n] and dtype bool, where n is the number of nodes,
+      and element [i, j] is whether the j-th node is reachable from the i-th
+      node, in the order of the nodes attribute.
+    """
+    n = self.number_of_nodes()
+    return np.unpackbits(self._GetReachability(), axis=1)[:, :n].astype(bool)
+
+  def _NodeIndices(self) -> typing.Dict[typing.Any, int]:
+    """Return a map from nodes to their index in the nodes attribute."""
+    if self._node_indices is None:
+      self._node_indices = {node: i for i, node in enumerate(self.nodes)}
+    return self._node_indices
+
+  def _ReachabilityRow(self, src) -> np.ndarray:
+    """Return whether each node is reachable from src, as an array of bool."""
+    if src not in self:
+      raise nx.NetworkXError(f"The node {src} is not in the graph.")
+    row = self._GetReachability()[self._NodeIndices()[src]]
+    return np.unpackbits(row)[:self.number_of_nodes()].astype(bool)
+
+  def _GetReachability(self) -> np.ndarray:
+    """Return the packed reachability matrix, computing it if required."""
+    if self._reachability is None:
+      self._reachability = self._ComputeReachability()
+    return self._reachability
+
+  def _ComputeReachability(self) -> np.ndarray:
+    """Compute the transitive closure of the graph.
+
+    Nodes in a strongly connected component can all reach each other, and every
+    node reachable from any of them. The graph is condensed to a DAG of its
+    strongly connected components, which is visited in reverse topological
+    order. The set of nodes reachable from a component is the union of the sets
+    reachable from its successors, plus their members. Sets are stored as rows
+    of bits, so a union is a bitwise or of bytes.
+
+    Returns:
+      A uint8 array of shape [n, ceil(n / 8)], where the bits of row i are
+      whether each node is reachable from the i-th node.
+    """
+    n = self.number_of_nodes()
+    index = self._NodeIndices()
+    condensed = nx.condensation(self)
+    members = [[index[node] for node in condensed.nodes[c]['members']]
+               for c in range(condensed.number_of_nodes())]
+
+    # The packed set of members of each component.
+    member_bits = np.zeros((len(members), n), dtype=np.uint8)
+    for c, component_members in enumerate(members):
+      member_bits[c, component_members] = 1
+    member_bits = np.packbits(member_bits, axis=1)
+
+    # The packed set of nodes reachable from each component.
+    component_bits = np.zeros_like(member_bits)
+    for c in reversed(list(nx.topological_sort(condensed))):
+      successors = list(condensed.successors(c))
+      if successors:
+        component_bits[c] = np.bitwise_or.reduce(
+            component_bits[successors] | member_bits[successors], axis=0)
+      # The members of a cycle can reach each other.
+      if len(members[c]) > 1:
+        component_bits[c] |= member_bits[c]
+
+    reachability = np.empty((n, member_bits.shape[1]), dtype=np.uint8)
+    for c, component_members in enumerate(members):
+      reachability[component_members] = component_bits[c]
+    # A node is never reachable from itself.
+    diagonal = np.arange(n)
+    reachability[diagonal, diagonal // 8] &= ~(
+        np.uint8(0x80) >> (diagonal % 8).astype(np.uint8))
+    return reachability
 
   def ValidateControlFlowGraph(self, strict: bool = True) -> 'ControlFlowGraph':
     """Return true if the graph is a valid control flow graph.
@@ -263,3 +353,23 @@ class ControlFlowGraph(nx.DiGraph, pbutil.ProtoBackedMixin):
     return hash((tuple(self.nodes), tuple(self.edges),
                  tuple([str(self.nodes[n]) for n in self.nodes]),
                  tuple([str(self.edges[i, j]) for i, j in self.edges])))
+
+
+def _ResetsReachability(method):
+  """Decorate a graph method so that it resets the cached reachability."""
+
+  @functools.wraps(method)
+  def Wrapped(self, *args, **kwargs):
+    self._reachability = None
+    self._node_indices = None
+    return method(self, *args, **kwargs)
+
+  return Wrapped
+
+
+# Wrap the methods of nx.DiGraph which modify the graph structure.
+for _method_name in ('add_node', 'add_nodes_from', 'remove_node',
+                     'remove_nodes_from', 'add_edge', 'add_edges_from',
+                     'remove_edge', 'remove_edges_from', 'clear'):
+  setattr(ControlFlowGraph, _method_name,
+          _ResetsReachability(getattr(nx.DiGraph, _method_name)))
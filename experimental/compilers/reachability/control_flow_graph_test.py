@@ -3,6 +3,7 @@ import sys
 import typing
 
 import networkx as nx
+import numpy as np
 import pytest
 from absl import app
 from absl import flags
@@ -82,6 +83,92 @@ def test_ControlFlowGraph_Reachables_back_edge():
   assert list(g.Reachables(2)) == [False, False, False]
 
 
+def test_ControlFlowGraph_Reachables_non_existent_node_raises_error():
+  """Test that Reachables() raises an error for a missing node."""
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_edge(0, 1)
+  with pytest.raises(nx.exception.NetworkXError):
+    list(g.Reachables(2))
+
+
+def test_ControlFlowGraph_IsReachable_non_existent_dst():
+  """Test that a missing destination node is not reachable."""
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_edge(0, 1)
+  assert not g.IsReachable(0, 2)
+
+
+def test_ControlFlowGraph_Reachables_self_loop():
+  """Test that a self loop does not make a node reachable from itself."""
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_edge(0, 0)
+  g.add_edge(0, 1)
+  assert list(g.Reachables(0)) == [False, True]
+
+
+def test_ControlFlowGraph_ReachabilityMatrix_empty_graph():
+  """Test the reachability matrix of an empty graph."""
+  g = control_flow_graph.ControlFlowGraph()
+  assert g.ReachabilityMatrix().shape == (0, 0)
+
+
+def test_ControlFlowGraph_ReachabilityMatrix_back_edge():
+  """Test the reachability matrix of a graph with a back edge."""
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_edge(0, 1)
+  g.add_edge(1, 0)
+  g.add_edge(1, 2)
+  assert g.ReachabilityMatrix().tolist() == [
+    [False, True, True],
+    [True, False, True],
+    [False, False, False],
+  ]
+
+
+def test_ControlFlowGraph_ReachabilityMatrix_reset_on_add_edge():
+  """Test that adding an edge invalidates the cached reachability."""
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_edge(0, 1)
+  g.add_node(2)
+  assert not g.IsReachable(0, 2)
+  g.add_edge(1, 2)
+  assert g.IsReachable(0, 2)
+  assert g.ReachabilityMatrix().shape == (3, 3)
+
+
+def test_ControlFlowGraph_ReachabilityMatrix_reset_on_remove_edge():
+  """Test that removing an edge invalidates the cached reachability."""
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_edge(0, 1)
+  g.add_edge(1, 2)
+  assert g.IsReachable(0, 2)
+  g.remove_edge(1, 2)
+  assert not g.IsReachable(0, 2)
+
+
+def _RandomGraph(num_nodes: int, num_edges: int,
+                 seed: int) -> control_flow_graph.ControlFlowGraph:
+  """Generate a random graph, which may contain cycles and self loops."""
+  rand = np.random.RandomState(seed)
+  g = control_flow_graph.ControlFlowGraph()
+  g.add_nodes_from(rand.permutation(num_nodes).tolist())
+  for src, dst in rand.randint(num_nodes, size=(num_edges, 2)).tolist():
+    g.add_edge(src, dst)
+  return g
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_ControlFlowGraph_ReachabilityMatrix_equals_descendants(seed: int):
+  """Test that the reachability matrix matches nx.descendants()."""
+  g = _RandomGraph(50, 75, seed)
+  nodes = list(g.nodes)
+  expected = [[dst in nx.descendants(g, src) for dst in nodes]
+              for src in nodes]
+  assert g.ReachabilityMatrix().tolist() == expected
+  for src, row in zip(nodes, expected):
+    assert list(g.Reachables(src)) == row
+
+
 def test_ControlFlowGraph_validate_empty_graph():
   """Test that empty graph is invalid."""
   g = control_flow_graph.ControlFlowGraph()
@@ -507,6 +594,26 @@ def test_ControlFlowGraph_node_attribute_changes_hash():
   assert hash(g1) != hash(g2)
 
 
+# Benchmarks.
+
+@pytest.mark.parametrize('num_nodes', [10, 100, 1000])
+def test_benchmark_ControlFlowGraph_ReachabilityMatrix(benchmark,
+                                                       num_nodes: int):
+  """Benchmark computing the reachability of all nodes in a graph."""
+  # Use a fresh graph for every round, so that the reachability is not cached.
+  benchmark.pedantic(
+      control_flow_graph.ControlFlowGraph.ReachabilityMatrix,
+      setup=lambda: ((_RandomGraph(num_nodes, num_nodes * 2, 0),), {}),
+      rounds=10)
+
+
+@pytest.mark.parametrize('num_nodes', [10, 100, 1000])
+def test_benchmark_descendants(benchmark, num_nodes: int):
+  """Benchmark nx.descendants() for all nodes, for comparison."""
+  g = _RandomGraph(num_nodes, num_nodes * 2, 0)
+  benchmark(lambda: [nx.descendants(g, node) for node in g.nodes])
+
+
 def main(argv: typing.List[str]):
   """Main entry point."""
   if len(argv) > 1:
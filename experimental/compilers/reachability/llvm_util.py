@@ -1,15 +1,19 @@
 """Utility code for working with LLVM."""
 
+import collections
 import multiprocessing
 import pathlib
 import re
 import tempfile
+import time
 import typing
+from concurrent import futures
 
 import pydot
 import pyparsing
 from absl import app
 from absl import flags
+from absl import logging
 
 from compilers.llvm import opt
 from experimental.compilers.reachability import control_flow_graph as cfg
@@ -79,24 +83,79 @@ def GetBasicBlockNameFromLabel(label: str):
   return label.split('\n')[0][len('"{'):].split(":")[0]
 
 
-def ControlFlowGraphFromDotSource(
-    dot_source: str) -> cfg.ControlFlowGraph:
-  """Create a control flow graph from an LLVM-generated dot file.
+class ParsedDot(typing.NamedTuple):
+  """The components of a dot graph which are used to build a CFG."""
+  # The name of the graph, including quotes.
+  name: str
+  # A list of (name, label) tuples, in the order that nodes are declared. The
+  # label includes quotes, and is None if the node has no label.
+  nodes: typing.List[typing.Tuple[str, typing.Optional[str]]]
+  # A list of (source, destination) tuples. The source may include a port
+  # suffix, e.g. 'Node0x7f86c670c590:s0'.
+  edges: typing.List[typing.Tuple[str, str]]
+
+
+# Regular expressions which match the lines of the dot files generated by the
+# LLVM -dot-cfg pass.
+_QUOTED = r'"(?:[^"\\]|\\.)*"'
+_DOT_GRAPH_RE = re.compile(r'^digraph (' + _QUOTED + r') \{$')
+_DOT_GRAPH_LABEL_RE = re.compile(r'^label=' + _QUOTED + r';$')
+_DOT_NODE_RE = re.compile(r'^(\w+) \[(.*)\];$')
+_DOT_NODE_LABEL_RE = re.compile(r'(?:^|,)label=(' + _QUOTED + r')')
+_DOT_EDGE_RE = re.compile(r'^(\w+(?::\w+)?) -> (\w+)(?: \[.*\])?;$')
 
-  The control flow graph generated from the dot source is not guaranteed to
-  be valid. That is, it may contain fusible basic blocks. This can happen if
-  the creating the graph from unoptimized bytecode. To disable this generate
-  the bytecode with optimizations enabled, e.g. clang -emit-llvm -O3 -S ...
+
+def ParseLlvmDotCfg(dot_source: str) -> typing.Optional[ParsedDot]:
+  """Parse a dot file generated by the LLVM -dot-cfg pass.
+
+  This is a fast alternative to pydot, which is slow for large graphs. It
+  supports only the subset of the dot language which LLVM generates.
 
   Args:
     dot_source: The dot source generated by the LLVM -dot-cfg pass.
 
   Returns:
-    A ControlFlowGraph instance.
+    A ParsedDot tuple, or None if the dot source uses features of the dot
+    language which this parser does not support.
+  """
+  lines = [line.strip() for line in dot_source.strip().split('\n')]
+  lines = [line for line in lines if line]
+  if len(lines) < 2 or lines[-1] != '}':
+    return None
+  graph_match = _DOT_GRAPH_RE.match(lines[0])
+  if not graph_match:
+    return None
+  nodes, edges = [], []
+  for line in lines[1:-1]:
+    edge_match = _DOT_EDGE_RE.match(line)
+    if edge_match:
+      edges.append((edge_match.group(1), edge_match.group(2)))
+      continue
+    node_match = _DOT_NODE_RE.match(line)
+    if node_match:
+      label_match = _DOT_NODE_LABEL_RE.search(node_match.group(2))
+      if not label_match:
+        return None
+      nodes.append((node_match.group(1), label_match.group(1)))
+      continue
+    if _DOT_GRAPH_LABEL_RE.match(line):
+      continue
+    return None
+  return ParsedDot(name=graph_match.group(1), nodes=nodes, edges=edges)
+
+
+def ParseDotWithPydot(dot_source: str) -> ParsedDot:
+  """Parse a dot file using pydot.
+
+  Args:
+    dot_source: A dot source.
+
+  Returns:
+    A ParsedDot tuple.
 
   Raises:
     pyparsing.ParseException: If dotfile could not be parsed.
-    ValueError: If dotfile could not be interpretted / is malformed.
+    ValueError: If dotfile does not contain exactly one graph.
   """
   try:
     parsed_dots = pydot.graph_from_dot_data(dot_source)
@@ -107,39 +166,64 @@ def ControlFlowGraphFromDotSource(
     raise ValueError(f"Expected 1 Dot in source, found {len(parsed_dots)}")
 
   dot = parsed_dots[0]
+  return ParsedDot(
+      name=dot.get_name(),
+      nodes=[(node.get_name(), node.get_attributes().get('label'))
+             for node in dot.get_nodes()],
+      edges=[(edge.get_source(), edge.get_destination())
+             for edge in dot.get_edges()])
+
+
+def ControlFlowGraphFromDotSource(
+    dot_source: str) -> cfg.ControlFlowGraph:
+  """Create a control flow graph from an LLVM-generated dot file.
+
+  The control flow graph generated from the dot source is not guaranteed to
+  be valid. That is, it may contain fusible basic blocks. This can happen if
+  the creating the graph from unoptimized bytecode. To disable this generate
+  the bytecode with optimizations enabled, e.g. clang -emit-llvm -O3 -S ...
+
+  Args:
+    dot_source: The dot source generated by the LLVM -dot-cfg pass.
+
+  Returns:
+    A ControlFlowGraph instance.
 
-  graph_re_match = re.match(r"\"CFG for '(\w+)' function\"", dot.get_name())
+  Raises:
+    pyparsing.ParseException: If dotfile could not be parsed.
+    ValueError: If dotfile could not be interpretted / is malformed.
+  """
+  # Fall back to pydot if the dot source is not in the format that we expect
+  # from LLVM.
+  dot = ParseLlvmDotCfg(dot_source) or ParseDotWithPydot(dot_source)
+
+  graph_re_match = re.match(r"\"CFG for '(\w+)' function\"", dot.name)
   if not graph_re_match:
-    raise ValueError(f"Could not interpret graph name '{dot.get_name()}'")
+    raise ValueError(f"Could not interpret graph name '{dot.name}'")
 
   # Create the ControlFlowGraph instance.
   graph = cfg.ControlFlowGraph(name=graph_re_match.group(1))
 
   # Create the nodes and build a map from node names to indices.
   node_name_to_index_map = {}
-  for i, node in enumerate(dot.get_nodes()):
-    if node.get_name() in node_name_to_index_map:
-      raise ValueError(f"Duplicate node name! '{node.get_name()}'")
-    node_name_to_index_map[node.get_name()] = i
+  for i, (node_name, label) in enumerate(dot.nodes):
+    if node_name in node_name_to_index_map:
+      raise ValueError(f"Duplicate node name! '{node_name}'")
+    if label is None:
+      raise ValueError(f"Node has no label! '{node_name}'")
+    node_name_to_index_map[node_name] = i
     # TODO(cec): Add node label code string.
-    graph.add_node(
-        i, name=GetBasicBlockNameFromLabel(node.get_attributes()['label']))
-
-  def NodeIndex(node: pydot.Node) -> int:
-    """Get the index of a node."""
-    return node_name_to_index_map[node.get_name()]
+    graph.add_node(i, name=GetBasicBlockNameFromLabel(label))
 
   first_node_name = sorted(node_name_to_index_map.keys())[0]
-  entry_block = dot.get_node(first_node_name)[0]
-  graph.nodes[NodeIndex(entry_block)]['entry'] = True
+  graph.nodes[node_name_to_index_map[first_node_name]]['entry'] = True
 
-  def IsExitNode(node: pydot.Node) -> bool:
-    """Determine if the given node is an exit block.
+  def IsExitNode(label: str) -> bool:
+    """Determine if the given node label is of an exit block.
 
     In LLVM bytecode, an exit block is one in which the final instruction begins
     with 'ret '. There should be only one exit block per graph.
     """
-    label = node.get_attributes().get('label', '')
     # Node labels use \l to escape newlines.
     label_lines = label.split('\l')
     # The very last line is just a closing brace.
@@ -147,24 +231,22 @@ def ControlFlowGraphFromDotSource(
     return last_line_with_instructions.lstrip().startswith('ret ')
 
   # Set the exit node.
-  exit_nodes = []
-  for node in dot.get_nodes():
-    if IsExitNode(node):
-      exit_nodes.append(node)
+  exit_nodes = [i for i, (_, label) in enumerate(dot.nodes)
+                if IsExitNode(label)]
 
   if len(exit_nodes) != 1:
     raise ValueError("Couldn't find an exit block")
 
-  graph.nodes[NodeIndex(exit_nodes[0])]['exit'] = True
+  graph.nodes[exit_nodes[0]]['exit'] = True
 
-  for edge in dot.get_edges():
+  for edge_source, edge_destination in dot.edges:
     # In the dot file, an edge looks like this:
     #     Node0x7f86c670c590:s0 -> Node0x7f86c65001a0;
     # We split the :sX suffix from the source to get the node name.
     # TODO(cec): We're currently throwing away the subrecord information and
     # True/False labels on edges. We may want to preserve that here.
-    src = node_name_to_index_map[edge.get_source().split(':')[0]]
-    dst = node_name_to_index_map[edge.get_destination()]
+    src = node_name_to_index_map[edge_source.split(':')[0]]
+    dst = node_name_to_index_map[edge_destination]
     graph.add_edge(src, dst)
 
   return graph
@@ -186,74 +268,122 @@ class ControlFlowGraphFromDotSourceError(ValueError):
     self.error = error
 
 
-def _DotCfgsFromBytecodeToQueue(bytecode: str,
-                                queue: multiprocessing.Queue) -> None:
-  """Process a bytecode and submit the dot source or the exception."""
-  try:
-    queue.put(list(DotCfgsFromBytecode(bytecode)))
-  except Exception as e:
-    queue.put(DotCfgsFromBytecodeError(bytecode, e))
+class ExceptionBuffer(Exception):
+  """A meta-exception that is used to buffer multiple errors to be raised."""
+
+  def __init__(self, errors):
+    self.errors = errors
 
 
-def _ControlFlowGraphFromDotSourceToQueue(dot: str,
-                                          queue: multiprocessing.Queue) -> None:
-  """Process a dot source and submit the CFG or the exception."""
+def _ControlFlowGraphsFromBytecode(
+    bytecode: str
+) -> typing.Tuple[typing.List[typing.Union[cfg.ControlFlowGraph, ValueError]],
+                  typing.Dict[str, float]]:
+  """Create the control flow graphs of a bytecode, capturing errors.
+
+  This is the unit of work of ControlFlowGraphsFromBytecodes(), and runs in a
+  worker process.
+
+  Args:
+    bytecode: The LLVM bytecode to create CFGs from.
+
+  Returns:
+    A tuple of a list of CFGs and errors, and a dictionary of the number of
+    seconds spent in each stage.
+  """
+  start_time = time.time()
   try:
-    queue.put(ControlFlowGraphFromDotSource(dot))
+    dots = list(DotCfgsFromBytecode(bytecode))
   except Exception as e:
-    queue.put(ControlFlowGraphFromDotSourceError(dot, e))
+    return [DotCfgsFromBytecodeError(bytecode, e)], {
+      'dot_cfgs': time.time() - start_time}
+  timings = {'dot_cfgs': time.time() - start_time}
 
+  start_time = time.time()
+  graphs = []
+  for dot in dots:
+    try:
+      graphs.append(ControlFlowGraphFromDotSource(dot))
+    except Exception as e:
+      graphs.append(ControlFlowGraphFromDotSourceError(dot, e))
+  timings['control_flow_graphs'] = time.time() - start_time
+  return graphs, timings
 
-class ExceptionBuffer(Exception):
-  """A meta-exception that is used to buffer multiple errors to be raised."""
 
-  def __init__(self, errors):
-    self.errors = errors
+def ControlFlowGraphsFromBytecodes(
+    bytecodes: typing.Iterator[str],
+    max_workers: typing.Optional[int] = None
+) -> typing.Iterator[cfg.ControlFlowGraph]:
+  """Create control flow graphs from LLVM bytecodes.
 
+  Bytecodes are processed by a pool of worker processes. Bytecodes are read
+  from the input iterator only as workers become available, and graphs are
+  yielded as soon as they are created, so memory usage does not grow with the
+  number of bytecodes. Graphs are not yielded in the order of the bytecodes.
 
-def ControlFlowGraphsFromBytecodes(
-    bytecodes: typing.Iterator[str]) -> typing.Iterator[cfg.ControlFlowGraph]:
-  dot_processes = []
-  dot_queue = multiprocessing.Queue()
-  for bytecode in bytecodes:
-    process = multiprocessing.Process(target=_DotCfgsFromBytecodeToQueue,
-                                      args=(bytecode, dot_queue))
-    process.start()
-    dot_processes.append(process)
-
-  cfg_processes = []
-  cfg_queue = multiprocessing.Queue()
+  Args:
+    bytecodes: An iterator of LLVM bytecodes.
+    max_workers: The number of worker processes. If not provided, the number of
+      CPUs is used.
 
-  e = ExceptionBuffer([])
+  Returns:
+    An iterator of control flow graphs.
 
-  for _ in range(len(dot_processes)):
-    dots = dot_queue.get()
-    if isinstance(dots, Exception):
-      e.errors.append(dots)
-    else:
-      for dot in dots:
-        process = multiprocessing.Process(
-            target=_ControlFlowGraphFromDotSourceToQueue, args=(dot, cfg_queue))
-        process.start()
-        cfg_processes.append(process)
-
-  # Get the graphs generated by the CFG processes.
-  for _ in range(len(cfg_processes)):
-    graph = cfg_queue.get()
-    if isinstance(graph, Exception):
-      e.errors.append(graph)
-    else:
+  Raises:
+    ExceptionBuffer: Once all of the bytecodes have been processed, if any
+      bytecode or dot source could not be processed. The errors attribute is a
+      list of DotCfgsFromBytecodeError and ControlFlowGraphFromDotSourceError
+      instances.
+  """
+  max_workers = max_workers or multiprocessing.cpu_count()
+  # The maximum number of bytecodes which are submitted to the pool but not yet
+  # processed. This keeps workers busy while bounding memory usage.
+  max_pending = 2 * max_workers
+  bytecodes = iter(bytecodes)
+  e = ExceptionBuffer([])
+  timings = collections.defaultdict(float)
+  num_bytecodes, num_graphs = 0, 0
+
+  with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    pending = set()
+    for bytecode in bytecodes:
+      pending.add(executor.submit(_ControlFlowGraphsFromBytecode, bytecode))
+      num_bytecodes += 1
+      if len(pending) < max_pending:
+        continue
+      done, pending = futures.wait(
+          pending, return_when=futures.FIRST_COMPLETED)
+      for graph in _ControlFlowGraphsFromFutures(done, e, timings):
+        num_graphs += 1
+        yield graph
+    for graph in _ControlFlowGraphsFromFutures(
+        futures.as_completed(pending), e, timings):
+      num_graphs += 1
       yield graph
 
-  # Make sure that all processes have terminated. They will have, but best to
-  # check.
-  [p.join() for p in dot_processes]
-  [p.join() for p in cfg_processes]
-
+  logging.info(
+      'Created %d control flow graphs from %d bytecodes with %d errors. '
+      'Seconds spent in each stage: %s', num_graphs, num_bytecodes,
+      len(e.errors), ', '.join(f'{k}={v:.3f}' for k, v in timings.items()))
   if e.errors:
     raise e
 
 
+def _ControlFlowGraphsFromFutures(
+    done: typing.Iterable[futures.Future], e: ExceptionBuffer,
+    timings: typing.Dict[str, float]) -> typing.Iterator[cfg.ControlFlowGraph]:
+  """Yield the graphs of completed jobs, buffering errors and timings."""
+  for future in done:
+    graphs, job_timings = future.result()
+    for stage, seconds in job_timings.items():
+      timings[stage] += seconds
+    for graph in graphs:
+      if isinstance(graph, Exception):
+        e.errors.append(graph)
+      else:
+        yield graph
+
+
 def main(argv):
   """Main entry point."""
   if len(argv) > 1:
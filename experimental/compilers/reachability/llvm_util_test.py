@@ -195,6 +195,31 @@ def test_GetBasicBlockNameFromLabel_label():
   assert llvm_util.GetBasicBlockNameFromLabel(label) == "%2"
 
 
+def test_ParseLlvmDotCfg_matches_pydot():
+  """Test that the LLVM dot parser produces the same output as pydot."""
+  assert (llvm_util.ParseLlvmDotCfg(SIMPLE_C_DOT) ==
+          llvm_util.ParseDotWithPydot(SIMPLE_C_DOT))
+
+
+def test_ParseLlvmDotCfg_unsupported_source():
+  """Test that None is returned for dot sources which are not from LLVM."""
+  assert llvm_util.ParseLlvmDotCfg('invalid dot source!') is None
+  assert llvm_util.ParseLlvmDotCfg('digraph G {\n  a -> b -> c;\n}') is None
+  assert llvm_util.ParseLlvmDotCfg('digraph G {\n  a [shape=box];\n}') is None
+
+
+def test_ParseLlvmDotCfg_nodes_and_edges():
+  """Test the nodes and edges of a parsed LLVM dot source."""
+  dot = llvm_util.ParseLlvmDotCfg(SIMPLE_C_DOT)
+  assert dot.name == '"CFG for \'DoSomething\' function"'
+  assert [name for name, _ in dot.nodes] == [
+    'Node0x7f86c670c590', 'Node0x7f86c65001a0', 'Node0x7f86c65001f0',
+    'Node0x7f86c65084b0']
+  assert dot.nodes[3][1].startswith('"{%18:')
+  assert dot.edges[0] == ('Node0x7f86c670c590:s0', 'Node0x7f86c65001a0')
+  assert len(dot.edges) == 4
+
+
 def test_ControlFlowGraphFromDotSource_invalid_source():
   """Test that exception is raised if dot can't be parsed."""
   with pytest.raises(pyparsing.ParseException):
@@ -259,6 +284,15 @@ def test_ControlFlowGraphsFromBytecodes_num_graphs():
   assert len(g) == 6
 
 
+def test_ControlFlowGraphsFromBytecodes_max_workers():
+  """Test that graphs are created by a single worker from an iterator."""
+  g = list(llvm_util.ControlFlowGraphsFromBytecodes(
+      (SIMPLE_C_BYTECODE for _ in range(5)), max_workers=1))
+  assert len(g) == 10
+  assert sorted(x.graph['name'] for x in g) == ['DoSomething'] * 5 + [
+    'main'] * 5
+
+
 def test_ControlFlowGraphsFromBytecodes_one_failure():
   """Errors during construction of CFGs are buffered until complete."""
   # The middle job of the three will throw an opt.optException.
@@ -0,0 +1,279 @@
+"""Generate datasets of unique random control flow graphs.
+
+Each graph is generated from its own random seed, and the seed space is
+partitioned into fixed size ranges which are generated by a pool of worker
+processes. Graphs are de-duplicated in seed order and written to disk in shards
+of ControlFlowGraphSet protos, so that the output for a given range of seeds is
+identical regardless of the number of workers.
+
+Usage:
+
+  bazel run //experimental/compilers/reachability:random_cfg_dataset -- \
+      --random_cfg_dataset_outdir=/tmp/cfgs \
+      --random_cfg_dataset_num_graphs=100000
+"""
+import collections
+import hashlib
+import multiprocessing
+import pathlib
+import typing
+from concurrent import futures
+
+import humanize
+import numpy as np
+from absl import app
+from absl import flags
+from absl import logging
+
+from experimental.compilers.reachability import control_flow_graph as cfg
+from experimental.compilers.reachability import control_flow_graph_generator
+from experimental.compilers.reachability import reachability_pb2
+from labm8 import pbutil
+
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'random_cfg_dataset_outdir', None,
+    'The directory to write the dataset shards to.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_num_graphs', 10000,
+    'The number of unique graphs to generate.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_initial_seed', 0,
+    'The random seed of the first graph.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_num_seeds', None,
+    'If set, the maximum number of seeds to generate graphs from. If the seed '
+    'range is exhausted, fewer than --random_cfg_dataset_num_graphs graphs '
+    'are generated.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_num_nodes_min', 10,
+    'The minimum number of nodes in a graph.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_num_nodes_max', 10,
+    'The maximum number of nodes in a graph.')
+flags.DEFINE_float(
+    'random_cfg_dataset_edge_density', 0.5,
+    'The edge density of generated graphs, in range (0,1].')
+flags.DEFINE_integer(
+    'random_cfg_dataset_graphs_per_shard', 10000,
+    'The maximum number of graphs in each output shard.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_seeds_per_job', 1000,
+    'The number of seeds that are generated by a worker in a single job.')
+flags.DEFINE_integer(
+    'random_cfg_dataset_max_workers', None,
+    'The number of worker processes. Defaults to the number of CPUs.')
+
+# The number of bytes in the digest returned by SuccessorsListHash(). With
+# 64 bits, the probability of a collision in a dataset of 100 million graphs is
+# roughly 1 in 4000.
+_HASH_SIZE = 8
+
+
+def GraphFromSeed(seed: int, num_nodes_min_max: typing.Tuple[int, int],
+                  edge_density: float) -> cfg.ControlFlowGraph:
+  """Generate a random graph from a seed.
+
+  Args:
+    seed: The random seed.
+    num_nodes_min_max: The lower and upper bound on the number of nodes.
+    edge_density: The edge density.
+
+  Returns:
+    A ControlFlowGraph instance named 'cfg_<seed>'.
+  """
+  generator = control_flow_graph_generator.ControlFlowGraphGenerator(
+      np.random.RandomState(seed), num_nodes_min_max, edge_density)
+  graph = generator.GenerateOne()
+  graph.graph['name'] = f'cfg_{seed}'
+  return graph
+
+
+def SuccessorsListHash(graph: cfg.ControlFlowGraph) -> bytes:
+  """Return a compact hash of the structure of a graph.
+
+  Unlike hash(graph), the value is stable across processes and interpreter
+  invocations.
+
+  Args:
+    graph: A graph.
+
+  Returns:
+    A digest of the sorted successor list of each node.
+  """
+  successors = '\n'.join(
+      ' '.join(str(dst) for dst in sorted(graph.successors(src)))
+      for src in sorted(graph.nodes))
+  return hashlib.blake2b(successors.encode('ascii'),
+                         digest_size=_HASH_SIZE).digest()
+
+
+def _GenerateSeedRange(
+    start: int, stop: int, num_nodes_min_max: typing.Tuple[int, int],
+    edge_density: float) -> typing.List[typing.Tuple[bytes, bytes]]:
+  """Generate the graphs for a range of seeds.
+
+  This is the worker function of GenerateShards().
+
+  Returns:
+    A list of <hash, serialized proto> tuples, one for each seed.
+  """
+  graphs = []
+  for seed in range(start, stop):
+    graph = GraphFromSeed(seed, num_nodes_min_max, edge_density)
+    graphs.append(
+        (SuccessorsListHash(graph), graph.ToProto().SerializeToString()))
+  return graphs
+
+
+def _WriteShard(outdir: pathlib.Path, shard_index: int,
+                shard: reachability_pb2.ControlFlowGraphSet) -> pathlib.Path:
+  """Write a shard to a file in outdir.
+
+  The shard is first written to a temporary file, so that a partially written
+  shard is never mistaken for a complete one.
+  """
+  path = outdir / f'shard_{shard_index:05d}.pb'
+  temp_path = path.with_suffix('.tmp')
+  pbutil.ToFile(shard, temp_path)
+  temp_path.rename(path)
+  logging.info('Wrote %s graphs to %s',
+               humanize.intcomma(len(shard.graph)), path)
+  return path
+
+
+def GenerateShards(
+    outdir: pathlib.Path, num_graphs: int,
+    num_nodes_min_max: typing.Tuple[int, int], edge_density: float,
+    initial_seed: int = 0, num_seeds: typing.Optional[int] = None,
+    graphs_per_shard: int = 10000, seeds_per_job: int = 1000,
+    max_workers: typing.Optional[int] = None) -> typing.List[pathlib.Path]:
+  """Generate a dataset of unique random graphs.
+
+  Seeds are generated in order, starting at initial_seed, until num_graphs
+  unique graphs have been generated. A graph is a duplicate if it has the same
+  successor lists as a graph generated from a smaller seed. The output depends
+  only on the arguments which determine the graphs, not on the number of
+  workers.
+
+  Args:
+    outdir: The directory to write shards to.
+    num_graphs: The number of unique graphs to generate.
+    num_nodes_min_max: The lower and upper bound on the number of nodes.
+    edge_density: The edge density.
+    initial_seed: The seed of the first graph.
+    num_seeds: If set, the maximum number of seeds to generate graphs from.
+    graphs_per_shard: The maximum number of graphs in a shard.
+    seeds_per_job: The number of seeds generated by a worker in a single job.
+    max_workers: The number of worker processes. Defaults to the number of
+      CPUs.
+
+  Returns:
+    The paths of the written shards, in order.
+
+  Raises:
+    ValueError: If num_graphs, graphs_per_shard, or seeds_per_job are not
+      positive.
+  """
+  if num_graphs < 1:
+    raise ValueError(f'num_graphs must be positive: {num_graphs}')
+  if graphs_per_shard < 1:
+    raise ValueError(f'graphs_per_shard must be positive: {graphs_per_shard}')
+  if seeds_per_job < 1:
+    raise ValueError(f'seeds_per_job must be positive: {seeds_per_job}')
+  max_workers = max_workers or multiprocessing.cpu_count()
+  stop_seed = None if num_seeds is None else initial_seed + num_seeds
+  outdir.mkdir(parents=True, exist_ok=True)
+
+  hashes = set()
+  paths = []
+  shard = reachability_pb2.ControlFlowGraphSet()
+  num_generated = 0
+
+  with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    # Jobs are submitted in seed order, and their results are consumed in the
+    # same order. The number of pending jobs is bounded so that workers stay
+    # busy without buffering the results of the entire seed space.
+    pending = collections.deque()
+    next_seed = initial_seed
+
+    def SubmitJobs():
+      nonlocal next_seed
+      while (len(pending) < 2 * max_workers and
+             (stop_seed is None or next_seed < stop_seed)):
+        stop = next_seed + seeds_per_job
+        if stop_seed is not None:
+          stop = min(stop, stop_seed)
+        pending.append((next_seed, executor.submit(
+            _GenerateSeedRange, next_seed, stop, num_nodes_min_max,
+            edge_density)))
+        next_seed = stop
+
+    SubmitJobs()
+    while pending and num_generated < num_graphs:
+      start, future = pending.popleft()
+      for seed, (graph_hash, serialized) in enumerate(future.result(), start):
+        if graph_hash in hashes:
+          continue
+        hashes.add(graph_hash)
+        if not shard.graph:
+          shard.initial_random_seed = seed
+        shard.graph.add().MergeFromString(serialized)
+        num_generated += 1
+        if len(shard.graph) == graphs_per_shard:
+          paths.append(_WriteShard(outdir, len(paths), shard))
+          shard = reachability_pb2.ControlFlowGraphSet()
+        if num_generated == num_graphs:
+          break
+      SubmitJobs()
+
+    for _, future in pending:
+      future.cancel()
+
+  if shard.graph:
+    paths.append(_WriteShard(outdir, len(paths), shard))
+  logging.info('Generated %s unique graphs in %s shards',
+               humanize.intcomma(num_generated), len(paths))
+  return paths
+
+
+def ReadShards(
+    outdir: pathlib.Path) -> typing.Iterator[cfg.ControlFlowGraph]:
+  """Read the graphs from the shards written by GenerateShards().
+
+  Args:
+    outdir: The directory containing the shards.
+
+  Returns:
+    An iterator over graphs, in the order that they were generated.
+  """
+  for path in sorted(outdir.glob('shard_*.pb')):
+    shard = pbutil.FromFile(path, reachability_pb2.ControlFlowGraphSet())
+    for proto in shard.graph:
+      yield cfg.ControlFlowGraph.FromProto(proto)
+
+
+def main(argv: typing.List[str]):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError("Unknown arguments: '{}'.".format(' '.join(argv[1:])))
+  if not FLAGS.random_cfg_dataset_outdir:
+    raise app.UsageError('--random_cfg_dataset_outdir must be set')
+
+  GenerateShards(
+      pathlib.Path(FLAGS.random_cfg_dataset_outdir),
+      FLAGS.random_cfg_dataset_num_graphs,
+      (FLAGS.random_cfg_dataset_num_nodes_min,
+       FLAGS.random_cfg_dataset_num_nodes_max),
+      FLAGS.random_cfg_dataset_edge_density,
+      initial_seed=FLAGS.random_cfg_dataset_initial_seed,
+      num_seeds=FLAGS.random_cfg_dataset_num_seeds,
+      graphs_per_shard=FLAGS.random_cfg_dataset_graphs_per_shard,
+      seeds_per_job=FLAGS.random_cfg_dataset_seeds_per_job,
+      max_workers=FLAGS.random_cfg_dataset_max_workers)
+
+
+if __name__ == '__main__':
+  app.run(main)
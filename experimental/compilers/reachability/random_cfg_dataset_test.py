@@ -0,0 +1,115 @@
+"""Unit tests for :random_cfg_dataset."""
+import pathlib
+import sys
+import tempfile
+import typing
+
+import pytest
+from absl import app
+from absl import flags
+
+from experimental.compilers.reachability import random_cfg_dataset
+
+
+FLAGS = flags.FLAGS
+
+
+def test_GraphFromSeed_is_deterministic():
+  """Test that the same seed produces the same graph."""
+  g1 = random_cfg_dataset.GraphFromSeed(5, (5, 10), 0.5)
+  g2 = random_cfg_dataset.GraphFromSeed(5, (5, 10), 0.5)
+  assert g1 == g2
+  assert g1.graph['name'] == 'cfg_5'
+
+
+def test_SuccessorsListHash_equal_graphs():
+  """Test that equal graphs have equal hashes."""
+  g1 = random_cfg_dataset.GraphFromSeed(0, (5, 10), 0.5)
+  g2 = random_cfg_dataset.GraphFromSeed(0, (5, 10), 0.5)
+  assert (random_cfg_dataset.SuccessorsListHash(g1) ==
+          random_cfg_dataset.SuccessorsListHash(g2))
+  assert len(random_cfg_dataset.SuccessorsListHash(g1)) == 8
+
+
+def test_SuccessorsListHash_different_graphs():
+  """Test that graphs with different edges have different hashes."""
+  g = random_cfg_dataset.GraphFromSeed(0, (5, 10), 0.5)
+  h1 = random_cfg_dataset.SuccessorsListHash(g)
+  src, dst = next(iter(g.edges))
+  g.remove_edge(src, dst)
+  assert random_cfg_dataset.SuccessorsListHash(g) != h1
+
+
+def test_GenerateShards_invalid_arguments():
+  """Test that invalid arguments raise errors."""
+  with tempfile.TemporaryDirectory() as d:
+    with pytest.raises(ValueError):
+      random_cfg_dataset.GenerateShards(pathlib.Path(d), 0, (5, 5), 0.5)
+    with pytest.raises(ValueError):
+      random_cfg_dataset.GenerateShards(pathlib.Path(d), 10, (5, 5), 0.5,
+                                        graphs_per_shard=0)
+    with pytest.raises(ValueError):
+      random_cfg_dataset.GenerateShards(pathlib.Path(d), 10, (5, 5), 0.5,
+                                        seeds_per_job=0)
+
+
+def test_GenerateShards_unique_graphs():
+  """Test that the requested number of unique graphs are generated."""
+  with tempfile.TemporaryDirectory() as d:
+    paths = random_cfg_dataset.GenerateShards(
+        pathlib.Path(d), 25, (5, 10), 0.5, graphs_per_shard=10,
+        seeds_per_job=7, max_workers=2)
+    assert [p.name for p in paths] == [
+      'shard_00000.pb', 'shard_00001.pb', 'shard_00002.pb']
+    graphs = list(random_cfg_dataset.ReadShards(pathlib.Path(d)))
+  assert len(graphs) == 25
+  assert len({random_cfg_dataset.SuccessorsListHash(g) for g in graphs}) == 25
+
+
+def test_GenerateShards_duplicates_are_removed():
+  """Test that duplicate graphs are removed, keeping the smallest seed."""
+  # There are few unique graphs with three nodes.
+  with tempfile.TemporaryDirectory() as d:
+    random_cfg_dataset.GenerateShards(
+        pathlib.Path(d), 1000, (3, 3), 0.5, num_seeds=100, seeds_per_job=10,
+        max_workers=2)
+    graphs = list(random_cfg_dataset.ReadShards(pathlib.Path(d)))
+  assert 0 < len(graphs) < 100
+  seeds = [int(g.graph['name'][len('cfg_'):]) for g in graphs]
+  assert seeds == sorted(seeds)
+  assert seeds[0] == 0
+  expected = []
+  hashes = set()
+  for seed in range(100):
+    graph_hash = random_cfg_dataset.SuccessorsListHash(
+        random_cfg_dataset.GraphFromSeed(seed, (3, 3), 0.5))
+    if graph_hash not in hashes:
+      hashes.add(graph_hash)
+      expected.append(seed)
+  assert seeds == expected
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_GenerateShards_output_is_independent_of_workers(max_workers: int):
+  """Test that shards are byte-identical for any number of workers."""
+
+  def Generate(workers: int) -> typing.List[bytes]:
+    with tempfile.TemporaryDirectory() as d:
+      paths = random_cfg_dataset.GenerateShards(
+          pathlib.Path(d), 50, (5, 10), 0.5, initial_seed=10,
+          graphs_per_shard=20, seeds_per_job=5, max_workers=workers)
+      return [p.read_bytes() for p in paths]
+
+  assert Generate(max_workers) == Generate(2)
+
+
+def main(argv: typing.List[str]):
+  """Main entry point."""
+  if len(argv) > 1:
+    raise app.UsageError("Unknown arguments: '{}'.".format(' '.join(argv[1:])))
+  sys.exit(pytest.main([__file__, '-vv']))
+
+
+if __name__ == '__main__':
+  flags.FLAGS(['argv[0]', '-v=1'])
+  app.run(main)
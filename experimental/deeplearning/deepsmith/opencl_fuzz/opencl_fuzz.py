@@ -7,10 +7,13 @@ standard Oclgrind output and used to determine if the result is interesting.
 CLgen and CLSmith generators and harnesses are supported.
 """
 import pathlib
+import queue
 import shutil
 import sys
+import threading
 import time
 import typing
+import uuid
 
 import humanize
 from absl import app
@@ -79,6 +82,20 @@ flags.DEFINE_integer(
 flags.DEFINE_integer(
     'batch_size', 128,
     'The number of test cases to generate and execute in a single batch.')
+flags.DEFINE_bool(
+    'pipelined', True,
+    'If set, testcase generation, execution on the device under test, and '
+    'execution on the gold standard device run concurrently, in separate '
+    'threads. Else, each batch is generated, executed, and difftested in '
+    'turn.')
+flags.DEFINE_integer(
+    'pipeline_queue_size', 2,
+    'The maximum number of batches which may be queued between stages of the '
+    'pipelined testing loop.')
+flags.DEFINE_integer(
+    'pipeline_stats_seconds', 60,
+    'The interval at which to log the throughput and queue depth of each '
+    'stage of the pipelined testing loop.')
 flags.DEFINE_string(
     'rerun_result', None,
     'If --rerun_result points to the path of a Result proto, the result '
@@ -124,7 +141,31 @@ def RunBatch(generator: base_generator.GeneratorServiceBase,
 
   interesting_results = []
 
-  # Generate testcases.
+  testcases = GenerateTestcases(generator, filters, batch_size)
+  results = RunDeviceUnderTest(dut_harness, filters, testcases)
+
+  for i, result in enumerate(results):
+    interesting_result = ResultIsInteresting(
+        result, unary_difftester, gs_difftester, gs_harness, filters)
+    if interesting_result:
+      interesting_results.append(interesting_result)
+
+  return interesting_results
+
+
+def GenerateTestcases(generator: base_generator.GeneratorServiceBase,
+                      filters: difftests.FiltersBase,
+                      batch_size: int) -> typing.List[deepsmith_pb2.Testcase]:
+  """Generate a batch of testcases.
+
+  Args:
+    generator: The generator for testcases.
+    filters: A testcase filters instance.
+    batch_size: The number of testcases to generate.
+
+  Returns:
+    A list of testcases which pass the pre-execution filters.
+  """
   logging.info('Generating %d testcases ...', batch_size)
   req = generator_pb2.GenerateTestcasesRequest()
   req.num_testcases = batch_size
@@ -134,8 +175,23 @@ def RunBatch(generator: base_generator.GeneratorServiceBase,
   if len(res.testcases) - len(testcases):
     logging.info('Discarded %d testcases prior to execution.',
                  len(res.testcases) - len(testcases))
+  return testcases
+
 
-  # Evaluate testcases.
+def RunDeviceUnderTest(dut_harness: base_harness.HarnessBase,
+                       filters: difftests.FiltersBase,
+                       testcases: typing.List[deepsmith_pb2.Testcase]
+                       ) -> typing.List[deepsmith_pb2.Result]:
+  """Execute a batch of testcases on the device under test.
+
+  Args:
+    dut_harness: The device under test.
+    filters: A testcase filters instance.
+    testcases: The testcases to execute.
+
+  Returns:
+    A list of results which pass the post-execution filters.
+  """
   logging.info('Evaluating %d testcases on %s ...', len(testcases),
                dut_harness.testbeds[0].opts['platform'][:12])
   unfiltered_results = RunTestcases(dut_harness, testcases)
@@ -144,14 +200,7 @@ def RunBatch(generator: base_generator.GeneratorServiceBase,
   if len(unfiltered_results) - len(results):
     logging.info('Discarded %d results.',
                  len(unfiltered_results) - len(results))
-
-  for i, result in enumerate(results):
-    interesting_result = ResultIsInteresting(
-        result, unary_difftester, gs_difftester, gs_harness, filters)
-    if interesting_result:
-      interesting_results.append(interesting_result)
-
-  return interesting_results
+  return results
 
 
 def NotInteresting(
@@ -188,6 +237,34 @@ def ResultIsInteresting(result: deepsmith_pb2.Result,
   Returns:
     The result if it is interesting, else None.
   """
+  interesting_result, difftest_result = UnaryTestResult(
+      result, unary_difftester, filters)
+  if not difftest_result:
+    return interesting_result
+
+  # Run testcases against gold standard devices and difftest.
+  gs_result = RunTestcases(gs_harness, [difftest_result.testcase])[0]
+  return GoldStandardTestResult(
+      difftest_result, gs_result, gs_difftester, filters)
+
+
+def UnaryTestResult(result: deepsmith_pb2.Result,
+                    unary_difftester: difftests.UnaryTester,
+                    filters: difftests.FiltersBase
+                    ) -> typing.Tuple[typing.Optional[deepsmith_pb2.Result],
+                                      typing.Optional[deepsmith_pb2.Result]]:
+  """Determine if a result is interesting without a gold standard difftest.
+
+  Args:
+    result: The result to test.
+    unary_difftester: A unary difftester.
+    filters: A set of difftest filters.
+
+  Returns:
+    A tuple of the result if it is interesting, and the result if it must be
+    difftested against the gold standard to determine whether it is
+    interesting. At most one of the tuple elements is not None.
+  """
   # First perform a unary difftest to see if the result is interesting without
   # needing to difftest, such as a compiler crash.
   unary_dt_outcome = unary_difftester([result])[0]
@@ -195,21 +272,35 @@ def ResultIsInteresting(result: deepsmith_pb2.Result,
       unary_dt_outcome != deepsmith_pb2.DifferentialTest.UNKNOWN):
     result.outputs['difftest_outcome'] = (
       deepsmith_pb2.DifferentialTest.Outcome.Name(unary_dt_outcome))
-    return result
+    return result, None
 
   if not (unary_dt_outcome == deepsmith_pb2.DifferentialTest.PASS and
           result.outcome == deepsmith_pb2.Result.PASS):
-    return NotInteresting(result)
+    return NotInteresting(result), None
 
   # Determine whether we can difftest the testcase.
   dt = filters.PreDifftest(deepsmith_pb2.DifferentialTest(result=[result]))
   if not dt:
-    return NotInteresting(result)
-  result = dt.result[0]
+    return NotInteresting(result), None
+  return None, dt.result[0]
 
-  # Run testcases against gold standard devices and difftest.
-  gs_result = RunTestcases(gs_harness, [result.testcase])[0]
 
+def GoldStandardTestResult(result: deepsmith_pb2.Result,
+                           gs_result: deepsmith_pb2.Result,
+                           gs_difftester: difftests.GoldStandardDiffTester,
+                           filters: difftests.FiltersBase
+                           ) -> typing.Optional[deepsmith_pb2.Result]:
+  """Determine if a result is interesting by difftesting a gold standard.
+
+  Args:
+    result: The result to test, as returned by UnaryTestResult().
+    gs_result: The result of the same testcase on the gold standard device.
+    gs_difftester: A golden standard difftester.
+    filters: A set of difftest filters.
+
+  Returns:
+    The result if it is interesting, else None.
+  """
   dt_outcomes = gs_difftester([gs_result, result])
   dt_outcome = dt_outcomes[1]
   logging.info('Differential test outcome: %s.',
@@ -255,13 +346,35 @@ def RunTestcases(harness: base_harness.HarnessBase,
   return res.results
 
 
+def WriteInterestingResult(result: deepsmith_pb2.Result,
+                           interesting_results_dir: pathlib.Path
+                          ) -> pathlib.Path:
+  """Write an interesting result to a new file.
+
+  Files are named by the time that they are written, followed by a random
+  suffix, so that results which are written in the same millisecond, e.g. a
+  batch of results, do not overwrite each other.
+
+  Args:
+    result: The result to write.
+    interesting_results_dir: The directory to write the result to.
+
+  Returns:
+    The path of the written file.
+  """
+  path = interesting_results_dir / (
+      f'{labdate.MillisecondsTimestamp()}_{uuid.uuid4().hex}.pbtxt')
+  pbutil.ToFile(result, path)
+  return path
+
+
 def TestingLoop(min_interesting_results: int, max_testing_time_seconds: int,
                 batch_size: int, generator: base_generator.GeneratorServiceBase,
                 dut_harness: base_harness.HarnessBase,
                 gs_harness: base_harness.HarnessBase,
                 filters: difftests.FiltersBase,
                 interesting_results_dir: pathlib.Path,
-                start_time: float = None) -> None:
+                start_time: float = None) -> int:
   """The main fuzzing loop.
 
   Args:
@@ -278,6 +391,9 @@ def TestingLoop(min_interesting_results: int, max_testing_time_seconds: int,
       the starting time will be the moment that this function is called. Set
       this value if you would like to include initialization overhead in the
       calculated testing time.
+
+  Returns:
+    The number of interesting results written.
   """
   start_time = start_time or time.time()
   interesting_results_dir.mkdir(parents=True, exist_ok=True)
@@ -291,9 +407,7 @@ def TestingLoop(min_interesting_results: int, max_testing_time_seconds: int,
         generator, dut_harness, gs_harness, filters, batch_size)
     num_interesting_results += len(interesting_results)
     for result in interesting_results:
-      pbutil.ToFile(result,
-                    interesting_results_dir /
-                    (str(labdate.MillisecondsTimestamp()) + '.pbtxt'))
+      WriteInterestingResult(result, interesting_results_dir)
 
   logging.info(
       'Stopping after %.2f seconds and %s batches (%.0fms / testcase).\n'
@@ -302,6 +416,225 @@ def TestingLoop(min_interesting_results: int, max_testing_time_seconds: int,
       (((time.time() - start_time) / (batch_num * batch_size)) * 1000),
       num_interesting_results)
   logging.flush()
+  return num_interesting_results
+
+
+class PipelineStage(threading.Thread):
+  """A stage of the pipelined testing loop, which runs in its own thread.
+
+  A stage repeatedly takes a batch from its input queue, processes it, and puts
+  the output batch on its output queue. A stage without an input queue is a
+  source, which produces batches until stopped.
+  """
+
+  def __init__(self, name: str,
+               process: typing.Callable[[typing.Optional[typing.List]],
+                                        typing.List],
+               input_queue: typing.Optional[queue.Queue],
+               output_queue: queue.Queue, stop: threading.Event):
+    """Instantiate a pipeline stage.
+
+    Args:
+      name: The name of the stage.
+      process: A callback which processes an input batch and returns an output
+        batch. For a source stage, the callback is called with None.
+      input_queue: The queue to take input batches from, or None for a source.
+      output_queue: The queue to put output batches on. Empty output batches
+        are not put.
+      stop: An event which is set when the pipeline must stop. The stage sets
+        this event if processing raises an error.
+    """
+    super(PipelineStage, self).__init__(name=name, daemon=True)
+    self.process = process
+    self.input_queue = input_queue
+    self.output_queue = output_queue
+    self.stop = stop
+    # Telemetry.
+    self.num_batches = 0
+    self.num_items = 0
+    self.busy_seconds = 0.0
+    # An error raised by process, if any.
+    self.error = None
+
+  def run(self) -> None:
+    """Run the stage until the stop event is set."""
+    try:
+      while not self.stop.is_set():
+        batch = None
+        if self.input_queue:
+          try:
+            batch = self.input_queue.get(timeout=_QUEUE_POLL_SECONDS)
+          except queue.Empty:
+            continue
+        start_time = time.time()
+        output = self.process(batch)
+        self.busy_seconds += time.time() - start_time
+        self.num_batches += 1
+        self.num_items += len(output if batch is None else batch)
+        if output:
+          self._Put(output)
+    except Exception as e:
+      logging.error("Pipeline stage '%s' failed: %s", self.name, e)
+      self.error = e
+      self.stop.set()
+
+  def _Put(self, output: typing.List) -> None:
+    """Put an output batch, giving up if the pipeline is stopped."""
+    while True:
+      try:
+        self.output_queue.put(output, timeout=_QUEUE_POLL_SECONDS)
+        return
+      except queue.Full:
+        if self.stop.is_set():
+          return
+
+  def Stats(self) -> str:
+    """Return a string summarizing the throughput of the stage."""
+    items_per_second = self.num_items / max(self.busy_seconds, 1e-6)
+    stats = (f'{self.name}: {humanize.intcomma(self.num_items)} items in '
+             f'{self.num_batches} batches, {self.busy_seconds:.1f}s busy '
+             f'({items_per_second:.1f} items / s)')
+    if self.input_queue:
+      stats += f', input queue depth {self.input_queue.qsize()}'
+    return stats
+
+
+# The number of seconds to block on a pipeline queue before checking whether
+# the pipeline has been stopped.
+_QUEUE_POLL_SECONDS = 0.1
+
+
+def PipelinedTestingLoop(min_interesting_results: int,
+                         max_testing_time_seconds: int,
+                         batch_size: int,
+                         generator: base_generator.GeneratorServiceBase,
+                         dut_harness: base_harness.HarnessBase,
+                         gs_harness: base_harness.HarnessBase,
+                         filters: difftests.FiltersBase,
+                         interesting_results_dir: pathlib.Path,
+                         start_time: float = None,
+                         queue_size: int = 2,
+                         stats_seconds: int = 60) -> int:
+  """A fuzzing loop which runs generation and testing concurrently.
+
+  This is equivalent to TestingLoop(), except that the generator, the device
+  under test, and the gold standard device each run in their own thread,
+  connected by bounded queues. Results which need a gold standard difftest are
+  executed on the gold standard device in batches. The throughput of each
+  stage and the depth of its input queue are logged periodically, to show
+  which stage is the bottleneck.
+
+  Args:
+    min_interesting_results: The minimum number of interesting results to find.
+    max_testing_time_seconds: The maximum time allowed to find interesting
+      results.
+    batch_size: The number of testcases to generate in each batch.
+    generator: A testcase generator.
+    dut_harness: The device under test.
+    gs_harness: The device to compare outputs against.
+    filters: A filters instance for testcases.
+    interesting_results_dir: The directory to write interesting results to.
+    start_time: The starting time, as returned by time.time(). If not provided,
+      the starting time will be the moment that this function is called.
+    queue_size: The maximum number of batches queued between stages.
+    stats_seconds: The interval at which to log stage telemetry.
+
+  Returns:
+    The number of interesting results written.
+
+  Raises:
+    Exception: If a stage of the pipeline raises an error.
+  """
+  start_time = start_time or time.time()
+  interesting_results_dir.mkdir(parents=True, exist_ok=True)
+
+  unary_difftester = difftests.UnaryTester()
+  gs_difftester = difftests.GoldStandardDiffTester(
+      difftests.NamedOutputIsEqual('stdout'))
+
+  testcases_queue = queue.Queue(maxsize=queue_size)
+  difftest_queue = queue.Queue(maxsize=queue_size)
+  # Interesting results are never dropped, so this queue is unbounded.
+  interesting_queue = queue.Queue()
+  stop = threading.Event()
+
+  def Generate(_) -> typing.List[deepsmith_pb2.Testcase]:
+    return GenerateTestcases(generator, filters, batch_size)
+
+  def RunDut(testcases: typing.List[deepsmith_pb2.Testcase]
+             ) -> typing.List[deepsmith_pb2.Result]:
+    to_difftest = []
+    for result in RunDeviceUnderTest(dut_harness, filters, testcases):
+      interesting_result, difftest_result = UnaryTestResult(
+          result, unary_difftester, filters)
+      if interesting_result:
+        interesting_queue.put([interesting_result])
+      if difftest_result:
+        to_difftest.append(difftest_result)
+    return to_difftest
+
+  def RunGoldStandard(results: typing.List[deepsmith_pb2.Result]
+                      ) -> typing.List[deepsmith_pb2.Result]:
+    gs_results = RunTestcases(gs_harness, [r.testcase for r in results])
+    interesting_results = [
+      GoldStandardTestResult(result, gs_result, gs_difftester, filters)
+      for result, gs_result in zip(results, gs_results)]
+    return [r for r in interesting_results if r]
+
+  stages = [
+    PipelineStage('generator', Generate, None, testcases_queue, stop),
+    PipelineStage('device_under_test', RunDut, testcases_queue,
+                  difftest_queue, stop),
+    PipelineStage('gold_standard', RunGoldStandard, difftest_queue,
+                  interesting_queue, stop),
+  ]
+  for stage in stages:
+    stage.start()
+
+  def WriteInterestingResults(block: bool) -> int:
+    """Write queued interesting results and return the number written."""
+    try:
+      interesting_results = interesting_queue.get(
+          block=block, timeout=_QUEUE_POLL_SECONDS if block else None)
+    except queue.Empty:
+      return 0
+    for result in interesting_results:
+      WriteInterestingResult(result, interesting_results_dir)
+    return len(interesting_results)
+
+  num_interesting_results = 0
+  last_stats_time = time.time()
+  try:
+    while (num_interesting_results < min_interesting_results and
+           time.time() < start_time + max_testing_time_seconds and
+           not stop.is_set()):
+      num_interesting_results += WriteInterestingResults(block=True)
+      if time.time() > last_stats_time + stats_seconds:
+        last_stats_time = time.time()
+        logging.info('Pipeline stats:\n%s',
+                     '\n'.join(stage.Stats() for stage in stages))
+  finally:
+    # Stop the stages. In-progress batches are allowed to complete, and any
+    # interesting results that they find are recorded.
+    stop.set()
+    for stage in stages:
+      stage.join()
+    while not interesting_queue.empty():
+      num_interesting_results += WriteInterestingResults(block=False)
+
+  for stage in stages:
+    if stage.error:
+      raise stage.error
+
+  num_testcases = stages[0].num_items
+  logging.info(
+      'Stopping after %.2f seconds and %s testcases (%.0fms / testcase).\n'
+      'Found %s interesting results.\nPipeline stats:\n%s',
+      time.time() - start_time, humanize.intcomma(num_testcases),
+      ((time.time() - start_time) / max(num_testcases, 1)) * 1000,
+      num_interesting_results, '\n'.join(stage.Stats() for stage in stages))
+  logging.flush()
+  return num_interesting_results
 
 
 def GetBaseHarnessConfig(config_class):
@@ -544,9 +877,17 @@ def main(argv):
   filters = GetFilters()
   dut_harness = GetDeviceUnderTestHarness()
   gs_harness = GetGoldStandardTestHarness()
-  TestingLoop(FLAGS.min_interesting_results, FLAGS.max_testing_time_seconds,
-              FLAGS.batch_size, generator, dut_harness, gs_harness,
-              filters, interesting_results_dir, start_time=start_time)
+  if FLAGS.pipelined:
+    PipelinedTestingLoop(
+        FLAGS.min_interesting_results, FLAGS.max_testing_time_seconds,
+        FLAGS.batch_size, generator, dut_harness, gs_harness, filters,
+        interesting_results_dir, start_time=start_time,
+        queue_size=FLAGS.pipeline_queue_size,
+        stats_seconds=FLAGS.pipeline_stats_seconds)
+  else:
+    TestingLoop(FLAGS.min_interesting_results, FLAGS.max_testing_time_seconds,
+                FLAGS.batch_size, generator, dut_harness, gs_harness,
+                filters, interesting_results_dir, start_time=start_time)
 
 
 if __name__ == '__main__':
@@ -10,10 +10,12 @@ from absl import app
 from absl import flags
 
 from deeplearning.deepsmith.difftests import difftests
+from deeplearning.deepsmith.generators import generator as base_generator
 from deeplearning.deepsmith.harnesses import cl_launcher
 from deeplearning.deepsmith.harnesses import cldrive
 from deeplearning.deepsmith.harnesses import harness
 from deeplearning.deepsmith.proto import deepsmith_pb2
+from deeplearning.deepsmith.proto import generator_pb2
 from deeplearning.deepsmith.proto import harness_pb2
 from experimental.deeplearning.deepsmith.opencl_fuzz import opencl_fuzz
 from gpu.cldrive import env
@@ -165,6 +167,46 @@ class MockHarness(harness.HarnessBase):
     return self.return_val
 
 
+class MockGenerator(base_generator.GeneratorServiceBase):
+  """A mock generator which returns testcases with sequential sources."""
+
+  def __init__(self):
+    super(MockGenerator, self).__init__(None)
+    self.num_testcases = 0
+
+  def GenerateTestcases(self, request: generator_pb2.GenerateTestcasesRequest,
+                        context) -> generator_pb2.GenerateTestcasesResponse:
+    """Mock method which returns request.num_testcases testcases."""
+    del context
+    response = generator_pb2.GenerateTestcasesResponse()
+    for _ in range(request.num_testcases):
+      response.testcases.add(inputs={'src': str(self.num_testcases)})
+      self.num_testcases += 1
+    return response
+
+
+class MockOutputHarness(harness.HarnessBase):
+  """A mock harness which returns a result with fixed outputs per testcase."""
+
+  def __init__(self, outcome: deepsmith_pb2.Result.Outcome, stdout: str):
+    super(MockOutputHarness, self).__init__(None)
+    self.testbeds = [deepsmith_pb2.Testbed(opts={'platform': 'mock'})]
+    self.outcome = outcome
+    self.stdout = stdout
+    self.RunTestcases_call_requests = []
+
+  def RunTestcases(self, request: harness_pb2.RunTestcasesRequest,
+                   context) -> harness_pb2.RunTestcasesResponse:
+    """Mock method which returns one result per testcase."""
+    del context
+    self.RunTestcases_call_requests.append(request)
+    response = harness_pb2.RunTestcasesResponse()
+    for testcase in request.testcases:
+      response.results.add(testcase=testcase, outcome=self.outcome,
+                           outputs={'stdout': self.stdout, 'stderr': ''})
+    return response
+
+
 # RunTestcases() tests.
 
 @pytest.mark.parametrize("opencl_opt", [True, False])
@@ -467,6 +509,106 @@ def test_ResultIsInteresting_build_timeout():
   assert len(filters.PreDifftest_call_args) == 0
 
 
+def test_UnaryTestResult_pass_needs_difftest():
+  """A passing result must be difftested to determine if it is interesting."""
+  result = deepsmith_pb2.Result(outcome=deepsmith_pb2.Result.PASS)
+  interesting_result, difftest_result = opencl_fuzz.UnaryTestResult(
+      result, difftests.UnaryTester(), MockFilters())
+  assert not interesting_result
+  assert difftest_result == result
+
+
+def test_UnaryTestResult_build_crash():
+  """A build crash is interesting without a difftest."""
+  result = deepsmith_pb2.Result(outcome=deepsmith_pb2.Result.BUILD_CRASH)
+  interesting_result, difftest_result = opencl_fuzz.UnaryTestResult(
+      result, difftests.UnaryTester(), MockFilters())
+  assert interesting_result == result
+  assert not difftest_result
+
+
+# WriteInterestingResult() tests.
+
+
+def test_WriteInterestingResult_same_millisecond(mocker):
+  """Test that results written in the same millisecond have unique files."""
+  mocker.patch.object(opencl_fuzz.labdate, 'MillisecondsTimestamp',
+                      return_value=1000)
+  with tempfile.TemporaryDirectory(prefix='phd_') as d:
+    paths = [opencl_fuzz.WriteInterestingResult(
+        deepsmith_pb2.Result(outputs={'stdout': str(i)}), pathlib.Path(d))
+      for i in range(10)]
+    assert len(set(paths)) == 10
+    assert all(p.name.startswith('1000_') for p in paths)
+    results = [pbutil.FromFile(path, deepsmith_pb2.Result())
+               for path in pathlib.Path(d).iterdir()]
+  assert sorted(r.outputs['stdout'] for r in results) == [
+    str(i) for i in range(10)]
+
+
+# PipelinedTestingLoop() tests.
+
+
+def test_PipelinedTestingLoop_unary_interesting_results():
+  """Results which are interesting without a difftest are recorded."""
+  dut_harness = MockOutputHarness(deepsmith_pb2.Result.BUILD_CRASH, '')
+  gs_harness = MockOutputHarness(deepsmith_pb2.Result.PASS, '')
+  with tempfile.TemporaryDirectory(prefix='phd_') as d:
+    num_results = opencl_fuzz.PipelinedTestingLoop(
+        min_interesting_results=3, max_testing_time_seconds=60, batch_size=4,
+        generator=MockGenerator(), dut_harness=dut_harness,
+        gs_harness=gs_harness, filters=MockFilters(),
+        interesting_results_dir=pathlib.Path(d))
+    results = [pbutil.FromFile(path, deepsmith_pb2.Result())
+               for path in pathlib.Path(d).iterdir()]
+  assert len(results) == num_results
+  assert num_results >= 3
+  for result in results:
+    assert result.outputs['difftest_outcome'] == 'ANOMALOUS_BUILD_FAILURE'
+  # No gold standard difftests were required.
+  assert not gs_harness.RunTestcases_call_requests
+
+
+def test_PipelinedTestingLoop_gold_standard_batches():
+  """Results which differ from the gold standard are recorded."""
+  dut_harness = MockOutputHarness(deepsmith_pb2.Result.PASS, 'a')
+  gs_harness = MockOutputHarness(deepsmith_pb2.Result.PASS, 'b')
+  with tempfile.TemporaryDirectory(prefix='phd_') as d:
+    num_results = opencl_fuzz.PipelinedTestingLoop(
+        min_interesting_results=8, max_testing_time_seconds=60, batch_size=4,
+        generator=MockGenerator(), dut_harness=dut_harness,
+        gs_harness=gs_harness, filters=MockFilters(),
+        interesting_results_dir=pathlib.Path(d))
+    results = [pbutil.FromFile(path, deepsmith_pb2.Result())
+               for path in pathlib.Path(d).iterdir()]
+  assert len(results) == num_results
+  assert num_results >= 8
+  for result in results:
+    assert result.outputs['stdout'] == 'a'
+    assert result.outputs['gs_stdout'] == 'b'
+  # Gold standard testcases are executed in batches.
+  for request in gs_harness.RunTestcases_call_requests:
+    assert len(request.testcases) == 4
+
+
+def test_PipelinedTestingLoop_stage_error():
+  """An error in a pipeline stage is raised."""
+
+  class BrokenGenerator(MockGenerator):
+
+    def GenerateTestcases(self, request, context):
+      raise OSError('broken generator')
+
+  with tempfile.TemporaryDirectory(prefix='phd_') as d:
+    with pytest.raises(OSError):
+      opencl_fuzz.PipelinedTestingLoop(
+          min_interesting_results=1, max_testing_time_seconds=60,
+          batch_size=4, generator=BrokenGenerator(),
+          dut_harness=MockOutputHarness(deepsmith_pb2.Result.PASS, ''),
+          gs_harness=MockOutputHarness(deepsmith_pb2.Result.PASS, ''),
+          filters=MockFilters(), interesting_results_dir=pathlib.Path(d))
+
+
 # UnpackResult() tests.
 
 
@@ -1478,6 +1478,52 @@ class Majority(Base):
   maj_stdout = sql.orm.relationship("Stdout")
 
 
+class DifftestedResult(Base):
+  """
+  A result which has been differential tested.
+
+  There is no foreign key on the result ID, so that the testcases of deleted
+  results can be difftested again.
+  """
+  id_t = Result.id_t
+  __tablename__ = "difftest_results"
+
+  # Fields
+  id = sql.Column(id_t, primary_key=True)
+  testbed_id = sql.Column(Testbed.id_t, nullable=False)
+  testcase_id = sql.Column(Testcase.id_t, nullable=False, index=True)
+
+
+class ResultsMetaTail(Base):
+  """
+  The last result of a testbed and harness, in cumulative time order.
+
+  The results metas of a testbed and harness are ordered by program date,
+  threads, and result ID. New results which are ordered after the tail are
+  appended to the cumulative time, without reading the earlier results.
+  """
+  __tablename__ = "difftest_results_meta_tails"
+
+  # Fields
+  testbed_id = sql.Column(Testbed.id_t, primary_key=True)
+  harness = sql.Column(Harnesses.column_t, primary_key=True)
+  date = sql.Column(sql.DateTime, nullable=False)
+  threads_id = sql.Column(Threads.id_t, nullable=False)
+  result_id = sql.Column(Result.id_t, nullable=False)
+  cumtime = sql.Column(sql.Float, nullable=False)
+
+
+class DirtyTestcase(Base):
+  """
+  A testcase whose majority and classifications must be recomputed.
+  """
+  id_t = Testcase.id_t
+  __tablename__ = "difftest_dirty_testcases"
+
+  # Fields
+  id = sql.Column(id_t, sql.ForeignKey("testcases.id"), primary_key=True)
+
+
 class Reduction(Base):
   id_t = Result.id_t
   __tablename__ = "reductions"
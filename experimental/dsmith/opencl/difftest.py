@@ -18,79 +18,254 @@
 """
 Differential test OpenCL results.
 """
+import collections
 
 from experimental.dsmith.opencl.db import *
 
 
-def difftest():
+# A subquery which selects the IDs of the testcases to difftest.
+DIRTY_TESTCASES = f"SELECT id FROM {DirtyTestcase.__tablename__}"
+
+# A subquery which selects the IDs of the results of the testcases to
+# difftest, including results which have been deleted since they were last
+# difftested.
+DIRTY_RESULTS = f"""\
+SELECT id FROM {Result.__tablename__}
+WHERE testcase_id IN ({DIRTY_TESTCASES})
+UNION
+SELECT id FROM {DifftestedResult.__tablename__}
+WHERE testcase_id IN ({DIRTY_TESTCASES})"""
+
+
+def difftest(full: bool = False):
+  """
+  Differential test results.
+
+  Difftesting is incremental: results metas, majorities, and classifications
+  are only recomputed for the testcases which have new or deleted results
+  since the last run. The outcome is the same as recomputing them for all
+  testcases.
+
+  Arguments:
+      full (bool, optional): If True, recompute the results metas, majorities,
+          and classifications of all testcases.
+  """
   with Session() as s:
+    if not mark_dirty_testcases(s, full=full):
+      print("no new results to difftest")
+      return
     create_results_metas(s)
     create_majorities(s)
     create_classifications(s)
     prune_abf_classifications(s)
     prune_arc_classifications(s)
     prune_awo_classifications(s)
+    clear_dirty_testcases(s)
 
 
-def create_results_metas(s: session_t):
+def insert_ignore() -> str:
   """
-  Create total time and cumulative time for each test case evaluated on each
-  testbed using each harness.
+  Return the INSERT statement which skips rows that violate a unique
+  constraint.
   """
+  return "INSERT IGNORE" if dsmith.DB_ENGINE == "mysql" else "INSERT OR IGNORE"
 
-  class Worker(threading.Thread):
-    """ worker thread to run testcases asynchronously """
-
-    def __init__(self, testbeds_harnesses: List[
-      Tuple['Testbed.id_t', 'Harnesses.column_t']]):
-      self.ndone = 0
-      self.testbeds_harnesses = testbeds_harnesses
-      super(Worker, self).__init__()
 
-    def run(self):
-      """ main loop"""
-      with Session() as s:
-        for testbed_id, harness in self.testbeds_harnesses:
-          self.ndone += 1
-          testbed = s.query(Testbed).filter(Testbed.id == testbed_id).scalar()
-
-          # FIXME: @cumtime variable is not supported by SQLite.
-          s.execute(f"""
-INSERT INTO {ResultMeta.__tablename__} (id, total_time, cumtime)
-SELECT  results.id,
-        results.runtime + programs.generation_time AS total_time,
-        @cumtime := @cumtime + results.runtime + programs.generation_time AS cumtime
+def mark_dirty_testcases(s: session_t, full: bool = False) -> int:
+  """
+  Mark the testcases which have results that have not been difftested, or
+  difftested results which have since been deleted, as dirty.
+
+  Results are recorded as difftested in the same transaction as their
+  testcases are marked dirty. Only the results of dirty testcases are
+  recorded, so a result which is added concurrently is either difftested by
+  this run or marked dirty by the next one. The dirty testcases are cleared
+  only once difftesting has completed, so an interrupted difftest is resumed
+  by the next run.
+
+  Returns:
+      int: The number of dirty testcases.
+  """
+  if full:
+    s.execute(f"DELETE FROM {ResultMeta.__tablename__}")
+    s.execute(f"DELETE FROM {ResultsMetaTail.__tablename__}")
+    s.execute(f"DELETE FROM {Majority.__tablename__}")
+    s.execute(f"DELETE FROM {Classification.__tablename__}")
+    s.execute(f"DELETE FROM {DifftestedResult.__tablename__}")
+
+  print("marking testcases with new results ...")
+  s.execute(f"""
+{insert_ignore()} INTO {DirtyTestcase.__tablename__} (id)
+SELECT DISTINCT testcase_id
 FROM {Result.__tablename__} results
-INNER JOIN {Testcase.__tablename__} testcases ON results.testcase_id = testcases.id
-INNER JOIN {Program.__tablename__} programs ON testcases.program_id = programs.id
-JOIN (SELECT @cumtime := 0) r
-WHERE results.testbed_id = {testbed.id}
-AND testcases.harness = {harness}
-ORDER BY programs.date, testcases.threads_id""")
-          s.commit()
-
-  # break early if we can
-  num_results = s.query(func.count(Result.id)).scalar()
-  num_metas = s.query(func.count(ResultMeta.id)).scalar()
-  if num_results == num_metas:
-    return
+WHERE NOT EXISTS (
+    SELECT 1 FROM {DifftestedResult.__tablename__} difftested
+    WHERE difftested.id = results.id
+)
+""")
+  s.execute(f"""
+{insert_ignore()} INTO {DirtyTestcase.__tablename__} (id)
+SELECT DISTINCT testcase_id
+FROM {DifftestedResult.__tablename__} difftested
+WHERE NOT EXISTS (
+    SELECT 1 FROM {Result.__tablename__} results
+    WHERE results.id = difftested.id
+)
+""")
+  s.execute(f"""
+{insert_ignore()} INTO {DifftestedResult.__tablename__}
+    (id, testbed_id, testcase_id)
+SELECT id, testbed_id, testcase_id
+FROM {Result.__tablename__}
+WHERE testcase_id IN ({DIRTY_TESTCASES})
+""")
+  s.commit()
+
+  return s.query(func.count(DirtyTestcase.id)).scalar()
+
 
+def clear_dirty_testcases(s: session_t) -> None:
+  """
+  Mark all testcases as difftested.
+  """
+  s.execute(f"""
+DELETE FROM {DifftestedResult.__tablename__}
+WHERE testcase_id IN ({DIRTY_TESTCASES})
+AND NOT EXISTS (
+    SELECT 1 FROM {Result.__tablename__} results
+    WHERE results.id = {DifftestedResult.__tablename__}.id
+)
+""")
+  s.execute(f"DELETE FROM {DirtyTestcase.__tablename__}")
+  s.commit()
+
+
+def create_results_metas(s: session_t) -> None:
+  """
+  Create total time and cumulative time for each test case evaluated on each
+  testbed using each harness.
+
+  The cumulative time of a result is the sum of the total times of the results
+  of the same testbed and harness which are ordered before it. New results
+  which are ordered after the tail of their testbed and harness are appended.
+  The results metas of a testbed and harness are only recomputed if it has no
+  tail, if one of its results is deleted, or if a new result is ordered before
+  the tail.
+  """
   print("creating results metas ...")
-  s.execute(f"DELETE FROM {ResultMeta.__tablename__}")
-  testbeds_harnesses = s.query(Result.testbed_id, Testcase.harness) \
-    .join(Testcase) \
-    .group_by(Result.testbed_id, Testcase.harness) \
-    .order_by(Testcase.harness, Result.testbed_id) \
+  new_results = s.query(Result.id, Result.testbed_id, Testcase.harness,
+                        Program.date, Testcase.threads_id,
+                        Result.runtime + Program.generation_time) \
+    .join(Testcase, Result.testcase_id == Testcase.id) \
+    .join(Program, Testcase.program_id == Program.id) \
+    .outerjoin(ResultMeta, Result.id == ResultMeta.id) \
+    .filter(Result.testcase_id.in_(s.query(DirtyTestcase.id)),
+            ResultMeta.id.is_(None)) \
     .all()
+  results_by_group = collections.defaultdict(list)
+  for result_id, testbed_id, harness, date, threads_id, total_time in (
+      new_results):
+    results_by_group[(testbed_id, harness)].append(
+        ((date, threads_id, result_id), total_time))
+
+  deleted_results = ~sql.exists().where(Result.id == DifftestedResult.id)
+  groups_to_recompute = set(
+      s.query(DifftestedResult.testbed_id, Testcase.harness)
+        .join(Testcase, DifftestedResult.testcase_id == Testcase.id)
+        .filter(DifftestedResult.testcase_id.in_(s.query(DirtyTestcase.id)),
+                deleted_results)
+        .distinct())
+  s.execute(f"""
+DELETE FROM {ResultMeta.__tablename__}
+WHERE id IN ({DIRTY_RESULTS})
+AND NOT EXISTS (
+    SELECT 1 FROM {Result.__tablename__} results
+    WHERE results.id = {ResultMeta.__tablename__}.id
+)
+""")
 
-  bar = progressbar.ProgressBar(initial_value=0,
-                                max_value=len(testbeds_harnesses),
+  groups = sorted(set(results_by_group) | groups_to_recompute,
+                  key=lambda group: (group[1], group[0]))
+  bar = progressbar.ProgressBar(initial_value=0, max_value=len(groups),
                                 redirect_stdout=True)
-  worker = Worker(testbeds_harnesses)
-  worker.start()
-  while worker.is_alive():
-    bar.update(min(worker.ndone, len(testbeds_harnesses)))
-    worker.join(0.5)
+  for i, (testbed_id, harness) in enumerate(groups):
+    tail = s.query(ResultsMetaTail) \
+      .filter(ResultsMetaTail.testbed_id == testbed_id,
+              ResultsMetaTail.harness == harness) \
+      .scalar()
+    results = sorted(results_by_group[(testbed_id, harness)])
+    # A testbed and harness without a tail has no results metas, or has
+    # results metas which were created before tails were recorded.
+    if (not tail or (testbed_id, harness) in groups_to_recompute or
+        results[0][0] < (tail.date, tail.threads_id, tail.result_id)):
+      recompute_results_metas(s, testbed_id, harness, tail)
+    else:
+      append_results_metas(s, tail, results)
+    s.commit()
+    bar.update(i + 1)
+
+
+def append_results_metas(
+    s: session_t, tail: ResultsMetaTail,
+    results: List[Tuple[Tuple[datetime.datetime, int, int], float]]) -> None:
+  """
+  Append the results metas of new results to the tail of a testbed and
+  harness.
+
+  Arguments:
+      tail (ResultsMetaTail): The tail, which is updated.
+      results (List[Tuple[Tuple[datetime, int, int], float]]): The sort keys
+          and total times of the new results, in order.
+  """
+  metas = []
+  cumtime = tail.cumtime
+  for (date, threads_id, result_id), total_time in results:
+    cumtime += total_time
+    metas.append({"id": result_id, "total_time": total_time,
+                  "cumtime": cumtime})
+  s.bulk_insert_mappings(ResultMeta, metas)
+  tail.date, tail.threads_id, tail.result_id = results[-1][0]
+  tail.cumtime = cumtime
+
+
+def recompute_results_metas(s: session_t, testbed_id: int,
+                            harness: 'Harnesses.value_t',
+                            tail: ResultsMetaTail = None) -> None:
+  """
+  Recompute the results metas of all results of a testbed and harness.
+
+  Arguments:
+      tail (ResultsMetaTail, optional): The current tail of the testbed and
+          harness, if any.
+  """
+  results = s.query(Result.id) \
+    .join(Testcase, Result.testcase_id == Testcase.id) \
+    .filter(Result.testbed_id == testbed_id,
+            Testcase.harness == harness)
+  s.query(ResultMeta) \
+    .filter(ResultMeta.id.in_(results)) \
+    .delete(synchronize_session=False)
+
+  # Results are ordered by ID to break ties, so that the cumulative times
+  # do not depend on the order in which the database returns them.
+  q = s.query(Program.date, Testcase.threads_id, Result.id,
+              Result.runtime + Program.generation_time) \
+    .join(Testcase, Result.testcase_id == Testcase.id) \
+    .join(Program, Testcase.program_id == Program.id) \
+    .filter(Result.testbed_id == testbed_id,
+            Testcase.harness == harness) \
+    .order_by(Program.date, Testcase.threads_id, Result.id)
+  results = [((date, threads_id, result_id), total_time)
+             for date, threads_id, result_id, total_time in q]
+  if not results:
+    if tail:
+      s.delete(tail)
+    return
+  if not tail:
+    tail = ResultsMetaTail(testbed_id=testbed_id, harness=harness)
+    s.add(tail)
+  tail.cumtime = 0
+  append_results_metas(s, tail, results)
 
 
 def create_majorities(s: session_t) -> None:
@@ -101,16 +276,18 @@ def create_majorities(s: session_t) -> None:
   min_results_for_majority = 3
 
   print("voting on test case majorities ...")
-  s.execute(f"DELETE FROM {Majority.__tablename__}")
+  s.execute(f"""
+DELETE FROM {Majority.__tablename__}
+WHERE id IN ({DIRTY_TESTCASES})
+""")
 
   # Note we have to insert ignore here because there may be ties in the
   # majority outcome or output. E.g. there could be a test case with an even
   # split of 5 '1' outcomes and 5 '3' outcomes. Since there is only a single
   # majority outcome, we order results by outcome number, so that '1' (build
   # failure) will over-rule '6' (pass).
-  insert_ignore = "INSERT IGNORE" if dsmith.DB_ENGINE == "mysql" else "INSERT OR IGNORE"
   s.execute(f"""
-{insert_ignore} INTO {Majority.__tablename__}
+{insert_ignore()} INTO {Majority.__tablename__}
     (id, num_results, maj_outcome, outcome_majsize, maj_stdout_id, stdout_majsize)
 SELECT  result_counts.testcase_id,
         result_counts.num_results,
@@ -122,6 +299,7 @@ FROM (
     SELECT testcase_id, num_results FROM (
         SELECT testcase_id, COUNT(*) AS num_results
         FROM {Result.__tablename__}
+        WHERE testcase_id IN ({DIRTY_TESTCASES})
         GROUP BY testcase_id
     ) s
     WHERE num_results >= {min_results_for_majority}
@@ -133,6 +311,7 @@ JOIN (
         FROM (
             SELECT testcase_id,COUNT(*) as outcome_count
             FROM {Result.__tablename__}
+            WHERE testcase_id IN ({DIRTY_TESTCASES})
             GROUP BY testcase_id, outcome
         ) r
         GROUP BY testcase_id
@@ -140,6 +319,7 @@ JOIN (
     INNER JOIN (
         SELECT testcase_id, outcome, COUNT(*) as outcome_count
         FROM {Result.__tablename__}
+        WHERE testcase_id IN ({DIRTY_TESTCASES})
         GROUP BY testcase_id, outcome
     ) s ON l.testcase_id = s.testcase_id AND l.max_count = s.outcome_count
 ) outcome_majs ON result_counts.testcase_id = outcome_majs.testcase_id
@@ -150,6 +330,7 @@ JOIN (
         FROM (
             SELECT testcase_id, COUNT(*) as stdout_count
             FROM {Result.__tablename__}
+            WHERE testcase_id IN ({DIRTY_TESTCASES})
             GROUP BY testcase_id, stdout_id
         ) r
         GROUP BY testcase_id
@@ -157,6 +338,7 @@ JOIN (
     INNER JOIN (
         SELECT testcase_id, stdout_id, COUNT(*) as stdout_count
         FROM {Result.__tablename__}
+        WHERE testcase_id IN ({DIRTY_TESTCASES})
         GROUP BY testcase_id, stdout_id
     ) s ON l.testcase_id = s.testcase_id AND l.max_count = s.stdout_count
 ) stdout_majs ON outcome_majs.testcase_id = stdout_majs.testcase_id
@@ -169,7 +351,10 @@ def create_classifications(s: session_t) -> None:
   """
   Determine anomalous results.
   """
-  s.execute(f"DELETE FROM {Classification.__tablename__}")
+  s.execute(f"""
+DELETE FROM {Classification.__tablename__}
+WHERE id IN ({DIRTY_RESULTS})
+""")
 
   min_majsize = 7
 
@@ -179,12 +364,14 @@ INSERT INTO {Classification.__tablename__}
 SELECT results.id, {Classifications.BC}
 FROM {Result.__tablename__} results
 WHERE outcome = {Outcomes.BC}
+AND testcase_id IN ({DIRTY_TESTCASES})
 """)
   s.execute(f"""
 INSERT INTO {Classification.__tablename__}
 SELECT results.id, {Classifications.BTO}
 FROM {Result.__tablename__} results
 WHERE outcome = {Outcomes.BTO}
+AND testcase_id IN ({DIRTY_TESTCASES})
 """)
 
   print("determining anomalous build-failures ...")
@@ -196,6 +383,7 @@ INNER JOIN {Majority.__tablename__} majorities ON results.testcase_id = majoriti
 WHERE outcome = {Outcomes.BF}
 AND outcome_majsize >= {min_majsize}
 AND maj_outcome = {Outcomes.PASS}
+AND results.testcase_id IN ({DIRTY_TESTCASES})
 """)
 
   print("determining anomalous runtime crashes ...")
@@ -207,6 +395,7 @@ INNER JOIN {Majority.__tablename__} majorities ON results.testcase_id = majoriti
 WHERE outcome = {Outcomes.RC}
 AND outcome_majsize >= {min_majsize}
 AND maj_outcome = {Outcomes.PASS}
+AND results.testcase_id IN ({DIRTY_TESTCASES})
 """)
 
   print("determining anomylous wrong output classifications ...")
@@ -218,8 +407,9 @@ INNER JOIN {Majority.__tablename__} majorities ON results.testcase_id = majoriti
 WHERE outcome = {Outcomes.PASS}
 AND maj_outcome = {Outcomes.PASS}
 AND outcome_majsize >= {min_majsize}
-AND stdout_majsize >= CEILING(2 * outcome_majsize / 3)
+AND 3 * stdout_majsize >= 2 * outcome_majsize
 AND stdout_id <> maj_stdout_id
+AND results.testcase_id IN ({DIRTY_TESTCASES})
 """)
   s.commit()
 
@@ -228,7 +418,8 @@ def prune_awo_classifications(s: session_t) -> None:
   def testcases_to_verify(session: session_t) -> query_t:
     q = session.query(Result.testcase_id) \
       .join(Classification) \
-      .filter(Classification.classification == Classifications.AWO) \
+      .filter(Classification.classification == Classifications.AWO,
+              Result.testcase_id.in_(session.query(DirtyTestcase.id))) \
       .distinct()
     return session.query(Testcase) \
       .filter(Testcase.id.in_(q)) \
@@ -298,6 +489,7 @@ def prune_abf_classifications(s: session_t) -> None:
       .join(Classification) \
       .join(Stderr) \
       .filter(Classification.classification == Classifications.ABF,
+              Result.testcase_id.in_(s.query(DirtyTestcase.id)),
               Stderr.stderr.like(f"%{like}%"))
     ids_to_delete = [x[0] for x in q]
 
@@ -319,6 +511,9 @@ def prune_abf_classifications(s: session_t) -> None:
   prune_stderr_like("error: variables in function scope cannot be declared")
   prune_stderr_like("error: implicit conversion ")
   prune_stderr_like("Could not find a definition ")
+  # Commit the retractions so that the verification worker, which uses its
+  # own session, does not wait on them.
+  s.commit()
 
   def testcases_to_verify(session: session_t) -> query_t:
     q = session.query(Result.testcase_id) \
@@ -326,6 +521,7 @@ def prune_abf_classifications(s: session_t) -> None:
       .join(Testbed) \
       .join(Platform) \
       .filter(Classification.classification == Classifications.ABF,
+              Result.testcase_id.in_(session.query(DirtyTestcase.id)),
               Platform.opencl == "1.2") \
       .distinct()
     return session.query(Testcase) \
@@ -365,6 +561,7 @@ def prune_arc_classifications(s: session_t) -> None:
       .join(Classification) \
       .join(Stderr) \
       .filter(Classification.classification == Classifications.ARC,
+              Result.testcase_id.in_(s.query(DirtyTestcase.id)),
               Stderr.stderr.like(f"%{like}%"))
     ids_to_delete = [x[0] for x in q]
 
@@ -376,11 +573,15 @@ def prune_arc_classifications(s: session_t) -> None:
         .delete(synchronize_session=False)
 
   prune_stderr_like("clFinish CL_INVALID_COMMAND_QUEUE")
+  # Commit the retractions so that the verification worker, which uses its
+  # own session, does not wait on them.
+  s.commit()
 
   def testcases_to_verify(session: session_t) -> query_t:
     q = session.query(Result.testcase_id) \
       .join(Classification) \
-      .filter(Classification.classification == Classifications.ARC) \
+      .filter(Classification.classification == Classifications.ARC,
+              Result.testcase_id.in_(session.query(DirtyTestcase.id))) \
       .distinct()
     return session.query(Testcase) \
       .filter(Testcase.id.in_(q)) \
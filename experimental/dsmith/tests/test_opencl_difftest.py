@@ -0,0 +1,265 @@
+#
+# Copyright 2017, 2018 Chris Cummins <chrisc.101@gmail.com>.
+#
+# This file is part of DeepSmith.
+#
+# DeepSmith is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# DeepSmith is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# DeepSmith.  If not, see <http://www.gnu.org/licenses/>.
+#
+import datetime
+import os
+import random
+import sys
+import types
+
+import pytest
+import sqlalchemy as sql
+from sqlalchemy import orm
+
+from experimental import dsmith
+
+
+# experimental.dsmith.db_base is not in this tree. Stub the parts of it which
+# the OpenCL database uses, and import the database without the OpenCL
+# package, which imports the generators and harnesses.
+db_base = types.ModuleType("experimental.dsmith.db_base")
+db_base.dsmith = types.SimpleNamespace(DB_ENGINE="sqlite",
+                                       ReprComparable=object)
+db_base.cldrive = types.SimpleNamespace(OpenCLEnvironment=object)
+db_base.Proxy = type("Proxy", (object,), {})
+db_base.session_t = orm.Session
+db_base.query_t = orm.Query
+db_base.make_engine = None
+sys.modules[db_base.__name__] = db_base
+
+opencl = types.ModuleType("experimental.dsmith.opencl")
+opencl.__path__ = [os.path.join(os.path.dirname(dsmith.__file__), "opencl")]
+sys.modules.setdefault(opencl.__name__, opencl)
+
+try:
+  import clgen
+except ImportError:
+  sys.modules["clgen"] = types.ModuleType("clgen")
+
+from experimental.dsmith.opencl import db
+from experimental.dsmith.opencl import difftest
+
+
+# The number of testbeds, which is also the number of results per testcase.
+NUM_TESTBEDS = 9
+
+
+@pytest.fixture
+def opencl_db(tmpdir, monkeypatch):
+  """A fresh OpenCL database, in SQLite."""
+  uri = f"sqlite:///{tmpdir}/opencl.db"
+  monkeypatch.setattr(db_base, "make_engine",
+                      lambda lang: (sql.create_engine(uri), uri))
+  db.init()
+  # Verifying testcases requires oclgrind and GPUVerify.
+  monkeypatch.setattr(db.Testcase, "verify_arc",
+                      lambda self, s: self.id % 4 != 3)
+  monkeypatch.setattr(db.Testcase, "verify_awo",
+                      lambda self, s: self.id % 4 != 0)
+  yield db
+  db.engine.dispose()
+
+
+def populate(s: db.session_t, num_testcases: int) -> None:
+  """Add testbeds and testcases, but no results.
+
+  Testcases with greater IDs have later programs.
+  """
+  for i in range(NUM_TESTBEDS):
+    s.add(db.Platform(id=i + 1, platform="platform", device=f"device {i}",
+                      driver="driver", opencl="2.0" if i < 3 else "1.2",
+                      devtype="GPU", host="host"))
+    s.add(db.Testbed(id=i + 1, platform_id=i + 1, optimizations=True))
+  s.add(db.Threads(id=1, gsize_x=1, gsize_y=1, gsize_z=1,
+                   lsize_x=1, lsize_y=1, lsize_z=1))
+  s.add(db.Threads(id=2, gsize_x=2, gsize_y=1, gsize_z=1,
+                   lsize_x=1, lsize_y=1, lsize_z=1))
+  for i, stdout in enumerate(["A", "B"]):
+    s.add(db.Stdout(id=i + 1, sha1=stdout, stdout=stdout))
+  for i, stderr in enumerate(["", "implicit declaration of function"]):
+    s.add(db.Stderr(id=i + 1, sha1=str(i), linecount=1,
+                    charcount=len(stderr), truncated=False, stderr=stderr))
+  for i in range(num_testcases):
+    # Pairs of programs have the same date, so that the results metas must
+    # break ties between them.
+    s.add(db.Program(id=i + 1, generator=db.Generators.DSMITH, sha1=str(i),
+                     date=(datetime.datetime(2018, 1, 1) +
+                           datetime.timedelta(days=i // 2)),
+                     generation_time=i / 10, linecount=1, charcount=1,
+                     src="kernel void A() {}"))
+    s.add(db.Testcase(id=i + 1, program_id=i + 1, threads_id=1 + i % 2,
+                      harness=db.Harnesses.CLDRIVE if i % 3
+                      else db.Harnesses.CL_LAUNCHER, timeout=60))
+  s.commit()
+
+
+def make_result(testcase_id: int, testbed_id: int) -> db.Result:
+  """Return the result of a testcase on a testbed.
+
+  Each testcase has one anomalous testbed, whose outcome depends on the
+  testcase.
+  """
+  outcome, stdout_id, stderr_id = db.Outcomes.PASS, 1, 1
+  if testbed_id == 1 + testcase_id % NUM_TESTBEDS:
+    outcome, stdout_id, stderr_id = {
+      0: (db.Outcomes.PASS, 2, 1),
+      1: (db.Outcomes.BF, 1, 1),
+      2: (db.Outcomes.BF, 1, 2),
+      3: (db.Outcomes.RC, 1, 1),
+      4: (db.Outcomes.BC, 1, 1),
+      5: (db.Outcomes.BTO, 1, 1),
+    }[testcase_id % 6]
+  return db.Result(testbed_id=testbed_id, testcase_id=testcase_id,
+                   returncode=0, outcome=outcome,
+                   runtime=(testcase_id * testbed_id) % 7 / 3,
+                   stdout_id=stdout_id, stderr_id=stderr_id)
+
+
+def difftest_outputs(s: db.session_t):
+  """Return the contents of the tables which are written by difftest."""
+  return (
+    s.query(db.ResultMeta.id, db.ResultMeta.total_time, db.ResultMeta.cumtime)
+      .order_by(db.ResultMeta.id).all(),
+    s.query(db.Majority.id, db.Majority.num_results, db.Majority.maj_outcome,
+            db.Majority.outcome_majsize, db.Majority.maj_stdout_id,
+            db.Majority.stdout_majsize).order_by(db.Majority.id).all(),
+    s.query(db.Classification.id, db.Classification.classification)
+      .order_by(db.Classification.id).all(),
+  )
+
+
+def test_difftest_incremental_equals_full(opencl_db):
+  with db.Session() as s:
+    populate(s, 24)
+  pairs = [(testcase_id, testbed_id)
+           for testcase_id in range(1, 25)
+           for testbed_id in range(1, NUM_TESTBEDS + 1)]
+  random.Random(0).shuffle(pairs)
+
+  # Difftest after each batch of new results.
+  for i in range(0, len(pairs), len(pairs) // 3):
+    with db.Session(commit=True) as s:
+      s.add_all(make_result(*pair) for pair in pairs[i:i + len(pairs) // 3])
+    difftest.difftest()
+
+  # Deleted results are difftested again, too.
+  with db.Session(commit=True) as s:
+    s.query(db.Result).filter(db.Result.id == 1).delete()
+  difftest.difftest()
+
+  with db.Session() as s:
+    incremental = difftest_outputs(s)
+  difftest.difftest(full=True)
+  with db.Session() as s:
+    full = difftest_outputs(s)
+
+  assert incremental == full
+  metas, majorities, classifications = full
+  assert len(metas) == len(pairs) - 1
+  assert len(majorities) == 24
+  assert ({c for _, c in classifications} ==
+          {db.Classifications.BC, db.Classifications.BTO,
+           db.Classifications.ABF, db.Classifications.ARC,
+           db.Classifications.AWO})
+
+
+def add_results(testcase_ids) -> None:
+  """Add the results of testcases on every testbed."""
+  with db.Session(commit=True) as s:
+    s.add_all(make_result(testcase_id, testbed_id)
+              for testcase_id in testcase_ids
+              for testbed_id in range(1, NUM_TESTBEDS + 1))
+
+
+def test_difftest_appends_results_metas(opencl_db, monkeypatch):
+  """Test that results of later programs are appended to the results metas."""
+  with db.Session() as s:
+    populate(s, 12)
+  recomputed = []
+  recompute_results_metas = difftest.recompute_results_metas
+
+  def RecomputeResultsMetas(s, testbed_id, harness, *args):
+    recomputed.append((testbed_id, harness))
+    recompute_results_metas(s, testbed_id, harness, *args)
+
+  monkeypatch.setattr(difftest, "recompute_results_metas",
+                      RecomputeResultsMetas)
+
+  add_results(range(1, 7))
+  difftest.difftest()
+  # The testbeds and harnesses have no tails yet.
+  assert len(recomputed) == 2 * NUM_TESTBEDS
+  recomputed.clear()
+  add_results(range(7, 13))
+  difftest.difftest()
+  assert not recomputed
+
+  # The results after a deleted result are recomputed.
+  with db.Session(commit=True) as s:
+    s.query(db.Result).filter(db.Result.testcase_id == 1,
+                              db.Result.testbed_id == 1).delete()
+  difftest.difftest()
+  assert recomputed == [(1, db.Harnesses.CL_LAUNCHER)]
+
+  with db.Session() as s:
+    incremental = difftest_outputs(s)
+  difftest.difftest(full=True)
+  with db.Session() as s:
+    assert difftest_outputs(s) == incremental
+
+
+def test_difftest_no_new_results(opencl_db, capsys):
+  with db.Session(commit=True) as s:
+    populate(s, 6)
+    s.add_all(make_result(testcase_id, testbed_id)
+              for testcase_id in range(1, 7)
+              for testbed_id in range(1, NUM_TESTBEDS + 1))
+  difftest.difftest()
+  with db.Session() as s:
+    outputs = difftest_outputs(s)
+    assert not s.query(db.DirtyTestcase).count()
+  capsys.readouterr()
+
+  difftest.difftest()
+
+  assert "no new results to difftest" in capsys.readouterr().out
+  with db.Session() as s:
+    assert difftest_outputs(s) == outputs
+
+
+# Benchmarks.
+
+@pytest.mark.parametrize("num_testcases", [10, 100, 1000])
+def test_benchmark_difftest_new_results(opencl_db, benchmark,
+                                        num_testcases: int):
+  """Benchmark difftesting a batch of new results after a history of them.
+
+  The time should not grow with the number of testcases in the history.
+  """
+  batch_size, rounds = 5, 5
+  with db.Session() as s:
+    populate(s, num_testcases + batch_size * rounds)
+  add_results(range(1, num_testcases + 1))
+  difftest.difftest()
+  batches = iter(range(num_testcases + 1, num_testcases + batch_size * rounds,
+                       batch_size))
+
+  def AddBatch():
+    start = next(batches)
+    add_results(range(start, start + batch_size))
+
+  benchmark.pedantic(difftest.difftest, setup=AddBatch, rounds=rounds)
@@ -1,5 +1,17 @@
-"""OpenCL argument and type handling."""
+"""OpenCL argument and type handling.
+
+Kernel signatures are memoized by the SHA1 of the kernel source, in an
+in-process LRU cache and, optionally, an on-disk store which is shared between
+processes. See GetKernelSignature().
+"""
+import collections
+import hashlib
+import json
+import os
+import pathlib
 import re
+import tempfile
+import threading
 import typing
 
 import numpy as np
@@ -52,8 +64,13 @@ FORMAT_SPECIFIERS = {
   np.dtype("uint8"): "%hd",
 }
 
-# Private OpenCL parser instance.
+# Private OpenCL parser instance. The parser is not thread-safe, so calls to
+# its parse() method must hold _OPENCL_PARSER_LOCK.
 _OPENCL_PARSER = OpenCLCParser()
+_OPENCL_PARSER_LOCK = threading.Lock()
+
+# The maximum number of kernel signatures held in the in-process cache.
+KERNEL_SIGNATURE_CACHE_SIZE = 4096
 
 
 class OpenCLPreprocessError(ValueError):
@@ -90,6 +107,24 @@ class NoKernelError(LookupError):
   pass
 
 
+class ArgDeclaration(typing.NamedTuple):
+  """The declaration of a kernel argument, as written in the source."""
+  # The argument name.
+  name: str
+  # The qualifiers of the argument, e.g. ('const', 'global').
+  quals: typing.Tuple[str, ...]
+  # The names of the argument type, e.g. ('unsigned', 'int').
+  type_names: typing.Tuple[str, ...]
+  # Whether the argument is a pointer.
+  is_pointer: bool
+
+
+class KernelSignature(typing.NamedTuple):
+  """The name and argument declarations of an OpenCL kernel."""
+  name: str
+  args: typing.Tuple[ArgDeclaration, ...]
+
+
 class KernelArg(object):
   """OpenCL kernel argument representation.
 
@@ -99,17 +134,7 @@ class KernelArg(object):
 
   def __init__(self, ast):
     self.ast = ast
-
-    # Determine pointer type.
-    self.is_pointer = isinstance(self.ast.type, PtrDecl)
-    self.address_space = "private"
-
-    self.name = self.ast.name if self.ast.name else ""
-    self.quals = self.ast.quals
-    if len(self.quals):
-      self.quals_str = " ".join(self.quals) + " "
-    else:
-      self.quals_str = ""
+    name = self.ast.name if self.ast.name else ""
 
     # Determine type name.
     try:
@@ -121,9 +146,38 @@ class KernelArg(object):
         type_names = self.ast.type.type.type.names
     except AttributeError as e:  # e.g. structs
       raise ValueError(
-          f"Unsupported data type for argument: '{self.name}'") from e
+          f"Unsupported data type for argument: '{name}'") from e
+
+    self._SetDeclaration(ArgDeclaration(
+        name=name, quals=tuple(self.ast.quals), type_names=tuple(type_names),
+        is_pointer=isinstance(self.ast.type, PtrDecl)))
+
+  @classmethod
+  def FromDeclaration(cls, declaration: ArgDeclaration) -> 'KernelArg':
+    """Construct a kernel argument from a declaration, without an AST.
+
+    Raises:
+      OpenCLValueError: If the argument type or qualifiers are invalid.
+    """
+    arg = cls.__new__(cls)
+    arg.ast = None
+    arg._SetDeclaration(declaration)
+    return arg
+
+  def _SetDeclaration(self, declaration: ArgDeclaration) -> None:
+    """Set the properties of the argument from its declaration."""
+    self.declaration = declaration
+    self.is_pointer = declaration.is_pointer
+    self.address_space = "private"
+
+    self.name = declaration.name
+    self.quals = list(declaration.quals)
+    if len(self.quals):
+      self.quals_str = " ".join(self.quals) + " "
+    else:
+      self.quals_str = ""
 
-    self.typename = " ".join(type_names)
+    self.typename = " ".join(declaration.type_names)
     self.bare_type = self.typename.rstrip('0123456789')
 
     try:
@@ -138,22 +192,22 @@ Supported types are: {{{supported_types_str}}}""")
     # Get address space.
     if self.is_pointer:
       address_quals = []
-      if "local" in self.ast.quals:
+      if "local" in self.quals:
         address_quals.append("local")
 
-      if "__local" in self.ast.quals:
+      if "__local" in self.quals:
         address_quals.append("local")
 
-      if "global" in self.ast.quals:
+      if "global" in self.quals:
         address_quals.append("global")
 
-      if "__global" in self.ast.quals:
+      if "__global" in self.quals:
         address_quals.append("global")
 
-      if "constant" in self.ast.quals:
+      if "constant" in self.quals:
         address_quals.append("constant")
 
-      if "__constant" in self.ast.quals:
+      if "__constant" in self.quals:
         address_quals.append("constant")
 
       err_prefix = ('Pointer argument '
@@ -177,7 +231,7 @@ Supported types are: {{{supported_types_str}}}""")
       self.vector_width = 1
 
   def __repr__(self):
-    s = self.quals if len(self.quals) else []
+    s = list(self.quals)
     s.append(self.typename)
     if self.is_pointer:
       s.append("*")
@@ -250,7 +304,8 @@ def ParseSource(src: str) -> FileAST:
       syntax error, or invalid types.
   """
   try:
-    ast = _OPENCL_PARSER.parse(src)
+    with _OPENCL_PARSER_LOCK:
+      ast = _OPENCL_PARSER.parse(src)
     # Strip pre-procesor line objects and rebuild the AST.
     # See: https://github.com/inducer/pycparserext/issues/27
     children = [x[1] for x in ast.children() if not isinstance(x[1], list)]
@@ -260,6 +315,172 @@ def ParseSource(src: str) -> FileAST:
     raise OpenCLValueError(f"Syntax error: '{e}'") from e
 
 
+def _GetKernelSignatureUncached(src: str) -> KernelSignature:
+  """Extract the signature of a kernel by parsing the source."""
+  visitor = ArgumentExtractor()
+  visitor.visit(ParseSource(src))
+  return KernelSignature(
+      name=visitor.name, args=tuple(arg.declaration for arg in visitor.args))
+
+
+class _KernelSignatureError(typing.NamedTuple):
+  """An error raised when extracting the signature of a kernel."""
+  # The name of the exception class, a key of _CACHED_ERRORS.
+  type_name: str
+  message: str
+
+
+# The errors which are memoized, by class name. An invalid kernel is parsed
+# once, and the error is raised again on later calls.
+_CACHED_ERRORS = {e.__name__: e for e in (
+  OpenCLValueError, MultipleKernelsError, NoKernelError, ValueError,
+  LookupError)}
+
+
+class _KernelSignatureCache(object):
+  """A cache of kernel signatures, keyed by the SHA1 of the kernel source.
+
+  Signatures, or the errors raised when extracting them, are held in an
+  in-process LRU cache, and, if a cache directory is set, in a JSON file per
+  kernel in the directory.
+  """
+
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self.cache_dir: typing.Optional[pathlib.Path] = None
+    self._signatures: typing.Dict[
+      str, typing.Union[KernelSignature, _KernelSignatureError]] = (
+      collections.OrderedDict())
+    self._lock = threading.Lock()
+
+  def Get(self, src: str) -> KernelSignature:
+    """Get the signature of a kernel, extracting it on a cache miss.
+
+    Raises:
+      ValueError: If the signature cannot be extracted.
+      LookupError: If the source does not contain exactly one kernel.
+    """
+    key = hashlib.sha1(src.encode('utf-8')).hexdigest()
+    with self._lock:
+      entry = self._signatures.get(key)
+      if entry is not None:
+        self._signatures.move_to_end(key)
+
+    error = None
+    if entry is None:
+      entry = self._Read(key) if self.cache_dir else None
+      if entry is None:
+        try:
+          entry = _GetKernelSignatureUncached(src)
+        except (ValueError, LookupError) as e:
+          if _CACHED_ERRORS.get(type(e).__name__) is not type(e):
+            raise
+          entry, error = _KernelSignatureError(type(e).__name__, str(e)), e
+        if self.cache_dir:
+          self._Write(key, entry)
+      with self._lock:
+        self._signatures[key] = entry
+        while len(self._signatures) > self.maxsize:
+          self._signatures.popitem(last=False)
+
+    if error:
+      # Raise the original error, with its cause, on a cache miss.
+      raise error
+    if isinstance(entry, _KernelSignatureError):
+      raise _CACHED_ERRORS[entry.type_name](entry.message)
+    return entry
+
+  def Clear(self) -> None:
+    """Empty the in-process cache."""
+    with self._lock:
+      self._signatures.clear()
+
+  def _Read(self, key: str) -> typing.Optional[
+      typing.Union[KernelSignature, _KernelSignatureError]]:
+    """Read a signature or error from the cache directory, if present."""
+    try:
+      with open(self.cache_dir / f'{key}.json') as f:
+        data = json.load(f)
+      if 'error' in data:
+        if data['error']['type'] not in _CACHED_ERRORS:
+          return None
+        return _KernelSignatureError(
+            type_name=data['error']['type'], message=data['error']['message'])
+      return KernelSignature(
+          name=data['name'],
+          args=tuple(ArgDeclaration(
+              name=arg['name'], quals=tuple(arg['quals']),
+              type_names=tuple(arg['type_names']),
+              is_pointer=arg['is_pointer']) for arg in data['args']))
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+
+  def _Write(self, key: str, entry: typing.Union[
+      KernelSignature, _KernelSignatureError]) -> None:
+    """Write a signature or error to the cache directory.
+
+    The file is written atomically, so that processes which share the cache
+    directory never read a partially written entry.
+    """
+    if isinstance(entry, _KernelSignatureError):
+      data = {'error': {'type': entry.type_name, 'message': entry.message}}
+    else:
+      data = {
+        'name': entry.name,
+        'args': [arg._asdict() for arg in entry.args],
+      }
+    self.cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+      os.replace(tmp_path, self.cache_dir / f'{key}.json')
+    except OSError:
+      if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+
+_KERNEL_SIGNATURE_CACHE = _KernelSignatureCache(KERNEL_SIGNATURE_CACHE_SIZE)
+
+
+def SetKernelSignatureCacheDir(path: typing.Optional[pathlib.Path]) -> None:
+  """Set the directory of the on-disk kernel signature store.
+
+  Args:
+    path: The directory to store signatures in, or None to disable the on-disk
+      store. The directory is created if it does not exist.
+  """
+  _KERNEL_SIGNATURE_CACHE.cache_dir = pathlib.Path(path) if path else None
+
+
+def ClearKernelSignatureCache() -> None:
+  """Empty the in-process kernel signature cache."""
+  _KERNEL_SIGNATURE_CACHE.Clear()
+
+
+def GetKernelSignature(src: str) -> KernelSignature:
+  """Extract the name and argument declarations of an OpenCL kernel.
+
+  Signatures are memoized by the hash of the source, so repeated calls for the
+  same kernel, e.g. to generate data for, drive, and then print the outputs of
+  a kernel, parse the source at most once. Errors are memoized too, so an
+  invalid kernel is also parsed only once, and raises on every call.
+
+  Args:
+    src: The OpenCL kernel source.
+
+  Returns:
+    The kernel signature.
+
+  Raises:
+    LookupError: If the source contains no OpenCL kernel definitions, or more
+      than one.
+    ValueError: If the source is not well formed, or if one of the kernel's
+      parameter types are unsupported.
+  """
+  return _KERNEL_SIGNATURE_CACHE.Get(src)
+
+
 def GetKernelArguments(src: str) -> typing.List[KernelArg]:
   """Extract arguments for an OpenCL kernel.
 
@@ -277,7 +498,8 @@ def GetKernelArguments(src: str) -> typing.List[KernelArg]:
   Raises:
     LookupError: If the source contains no OpenCL kernel definitions, or more
       than one.
-    ValueError: If one of the kernel's parameter types are unsupported.
+    ValueError: If the source is not well formed, or if one of the kernel's
+      parameter types are unsupported.
 
   Examples:
     >>> args = GetKernelArguments("void kernel A(global float *a, const int b) {}")
@@ -303,9 +525,8 @@ def GetKernelArguments(src: str) -> typing.List[KernelArg]:
     ...
     NoKernelError
   """
-  visitor = ArgumentExtractor()
-  visitor.visit(ParseSource(src))
-  return visitor.args
+  return [KernelArg.FromDeclaration(declaration)
+          for declaration in GetKernelSignature(src).args]
 
 
 def GetKernelName(src: str) -> str:
@@ -323,6 +544,7 @@ def GetKernelName(src: str) -> str:
     NoKernelError: If the source contains no OpenCL kernel definitions.
     MultipleKernelsError: If the source contains multiple OpenCL kernel
       definitions.
+    OpenCLValueError: If the source is not well formed.
 
   Examples:
     >>> GetKernelName("void kernel foo() {}")
@@ -330,6 +552,11 @@ def GetKernelName(src: str) -> str:
     >>> GetKernelName("void kernel A(global float *a, const int b) {}")
     'A'
   """
+  try:
+    return GetKernelSignature(src).name
+  except ValueError:
+    # The source may contain a kernel with invalid arguments, which has a name.
+    pass
   visitor = ArgumentExtractor(extract_args=False)
   visitor.visit(ParseSource(src))
   if visitor.name:
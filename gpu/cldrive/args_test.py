@@ -1,5 +1,8 @@
 """Unit tests for //gpu/cldrive/args.py."""
+import pathlib
 import sys
+import tempfile
+from concurrent import futures
 
 import pytest
 from absl import app
@@ -205,6 +208,115 @@ def test_GetKernelName_syntax_error():
   assert "Syntax error: ':1:1: before: !'" == str(e_ctx.value)
 
 
+# GetKernelSignature() tests.
+
+@pytest.fixture(scope='function')
+def empty_signature_cache() -> None:
+  """A test fixture which empties the kernel signature cache."""
+  args.ClearKernelSignatureCache()
+  yield
+  args.ClearKernelSignatureCache()
+  args.SetKernelSignatureCacheDir(None)
+
+
+def test_GetKernelSignature_is_memoized(empty_signature_cache, mocker):
+  """Test that a kernel is parsed only once."""
+  del empty_signature_cache
+  spy = mocker.spy(args, '_GetKernelSignatureUncached')
+  src = "kernel void A(global int* a) {}"
+  assert args.GetKernelSignature(src).name == 'A'
+  assert args.GetKernelSignature(src).name == 'A'
+  assert args.GetKernelArguments(src)[0].typename == 'int'
+  assert args.GetKernelName(src) == 'A'
+  assert spy.call_count == 1
+
+
+def test_GetKernelSignature_errors_are_raised(empty_signature_cache, mocker):
+  """Test that errors are raised on every call, but parsed only once."""
+  del empty_signature_cache
+  spy = mocker.spy(args, '_GetKernelSignatureUncached')
+  for _ in range(2):
+    with pytest.raises(args.OpenCLValueError) as e_ctx:
+      args.GetKernelSignature("kernel void A(float* a) {}")
+    assert ("Pointer argument 'float *a' has no address space qualifier" ==
+            str(e_ctx.value))
+  for _ in range(2):
+    with pytest.raises(args.NoKernelError):
+      args.GetKernelSignature("")
+  assert spy.call_count == 2
+
+
+def test_GetKernelSignature_lru_eviction(empty_signature_cache, mocker):
+  """Test that the least recently used signature is evicted."""
+  del empty_signature_cache
+  mocker.patch.object(args._KERNEL_SIGNATURE_CACHE, 'maxsize', 2)
+  spy = mocker.spy(args, '_GetKernelSignatureUncached')
+  srcs = [f"kernel void A{i}() {{}}" for i in range(3)]
+  args.GetKernelSignature(srcs[0])
+  args.GetKernelSignature(srcs[1])
+  args.GetKernelSignature(srcs[0])
+  args.GetKernelSignature(srcs[2])  # Evicts srcs[1].
+  assert spy.call_count == 3
+  args.GetKernelSignature(srcs[0])
+  assert spy.call_count == 3
+  args.GetKernelSignature(srcs[1])
+  assert spy.call_count == 4
+
+
+def test_GetKernelSignature_cache_dir(empty_signature_cache, mocker):
+  """Test that signatures and errors are read from the on-disk store."""
+  del empty_signature_cache
+  src = "typedef int foo;\nkernel void A(global int* a, const foo b) {}"
+  valid_src = src.replace('const foo', 'const int')
+  with tempfile.TemporaryDirectory(prefix='cldrive_args_test_') as d:
+    args.SetKernelSignatureCacheDir(pathlib.Path(d) / 'cache')
+    with pytest.raises(args.OpenCLValueError) as e_ctx:
+      args.GetKernelSignature(src)
+    signature = args.GetKernelSignature(valid_src)
+    assert len(list((pathlib.Path(d) / 'cache').iterdir())) == 2
+
+    args.ClearKernelSignatureCache()
+    mocker.patch.object(args, '_GetKernelSignatureUncached',
+                        side_effect=AssertionError('Source was parsed'))
+    assert args.GetKernelSignature(valid_src) == signature
+    with pytest.raises(args.OpenCLValueError) as e_ctx_cached:
+      args.GetKernelSignature(src)
+    assert str(e_ctx_cached.value) == str(e_ctx.value)
+
+
+def test_GetKernelSignature_body_syntax_error(empty_signature_cache):
+  """Test that syntax errors in the kernel body are raised."""
+  del empty_signature_cache
+  src = "kernel void A(global int* a) { a[0] = ; }"
+  for _ in range(2):
+    with pytest.raises(args.OpenCLValueError) as e_ctx:
+      args.GetKernelArguments(src)
+    assert "Syntax error: ':1:39: before: ;'" == str(e_ctx.value)
+    with pytest.raises(args.OpenCLValueError):
+      args.GetKernelName(src)
+
+
+def test_GetKernelArguments_returns_new_args(empty_signature_cache):
+  """Test that the arguments of a memoized kernel can be modified."""
+  del empty_signature_cache
+  src = "kernel void A(const global int* a) {}"
+  args_ = args.GetKernelArguments(src)
+  args_[0].name = 'b'
+  assert repr(args_[0]) == 'const global int * b'
+  assert repr(args.GetKernelArguments(src)[0]) == 'const global int * a'
+
+
+def test_GetKernelSignature_threads(empty_signature_cache):
+  """Test that concurrent parses return the same signatures as serial parses."""
+  del empty_signature_cache
+  srcs = [f"typedef int foo{i};\nkernel void A{i}(global int* a, "
+          f"const float b) {{ foo{i} c = b * {i}; a[0] = c; }}"
+          for i in range(400)]
+  serial = [args._GetKernelSignatureUncached(src) for src in srcs]
+  with futures.ThreadPoolExecutor(max_workers=16) as executor:
+    assert list(executor.map(args.GetKernelSignature, srcs)) == serial
+
+
 def main(argv):  # pylint: disable=missing-docstring
   del argv
   sys.exit(pytest.main(
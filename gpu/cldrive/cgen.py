@@ -6,9 +6,109 @@ from gpu.cldrive import args as _args
 from gpu.cldrive import driver
 
 
+# C functions for reporting OpenCL errors, shared by the generated drivers.
+_CL_ERROR_C = """\
+const char *clerror_string(cl_int err) {
+    /* written by @Selmar http://stackoverflow.com/a/24336429 */
+    switch(err) {
+        /* run-time and JIT compiler errors */
+        case 0: return "CL_SUCCESS";
+        case -1: return "CL_DEVICE_NOT_FOUND";
+        case -2: return "CL_DEVICE_NOT_AVAILABLE";
+        case -3: return "CL_COMPILER_NOT_AVAILABLE";
+        case -4: return "CL_MEM_OBJECT_ALLOCATION_FAILURE";
+        case -5: return "CL_OUT_OF_RESOURCES";
+        case -6: return "CL_OUT_OF_HOST_MEMORY";
+        case -7: return "CL_PROFILING_INFO_NOT_AVAILABLE";
+        case -8: return "CL_MEM_COPY_OVERLAP";
+        case -9: return "CL_IMAGE_FORMAT_MISMATCH";
+        case -10: return "CL_IMAGE_FORMAT_NOT_SUPPORTED";
+        case -11: return "CL_BUILD_PROGRAM_FAILURE";
+        case -12: return "CL_MAP_FAILURE";
+        case -13: return "CL_MISALIGNED_SUB_BUFFER_OFFSET";
+        case -14: return "CL_EXEC_STATUS_ERROR_FOR_EVENTS_IN_WAIT_LIST";
+        case -15: return "CL_COMPILE_PROGRAM_FAILURE";
+        case -16: return "CL_LINKER_NOT_AVAILABLE";
+        case -17: return "CL_LINK_PROGRAM_FAILURE";
+        case -18: return "CL_DEVICE_PARTITION_FAILED";
+        case -19: return "CL_KERNEL_ARG_INFO_NOT_AVAILABLE";
+
+        /* compile-time errors */
+        case -30: return "CL_INVALID_VALUE";
+        case -31: return "CL_INVALID_DEVICE_TYPE";
+        case -32: return "CL_INVALID_PLATFORM";
+        case -33: return "CL_INVALID_DEVICE";
+        case -34: return "CL_INVALID_CONTEXT";
+        case -35: return "CL_INVALID_QUEUE_PROPERTIES";
+        case -36: return "CL_INVALID_COMMAND_QUEUE";
+        case -37: return "CL_INVALID_HOST_PTR";
+        case -38: return "CL_INVALID_MEM_OBJECT";
+        case -39: return "CL_INVALID_IMAGE_FORMAT_DESCRIPTOR";
+        case -40: return "CL_INVALID_IMAGE_SIZE";
+        case -41: return "CL_INVALID_SAMPLER";
+        case -42: return "CL_INVALID_BINARY";
+        case -43: return "CL_INVALID_BUILD_OPTIONS";
+        case -44: return "CL_INVALID_PROGRAM";
+        case -45: return "CL_INVALID_PROGRAM_EXECUTABLE";
+        case -46: return "CL_INVALID_KERNEL_NAME";
+        case -47: return "CL_INVALID_KERNEL_DEFINITION";
+        case -48: return "CL_INVALID_KERNEL";
+        case -49: return "CL_INVALID_ARG_INDEX";
+        case -50: return "CL_INVALID_ARG_VALUE";
+        case -51: return "CL_INVALID_ARG_SIZE";
+        case -52: return "CL_INVALID_KERNEL_ARGS";
+        case -53: return "CL_INVALID_WORK_DIMENSION";
+        case -54: return "CL_INVALID_WORK_GROUP_SIZE";
+        case -55: return "CL_INVALID_WORK_ITEM_SIZE";
+        case -56: return "CL_INVALID_GLOBAL_OFFSET";
+        case -57: return "CL_INVALID_EVENT_WAIT_LIST";
+        case -58: return "CL_INVALID_EVENT";
+        case -59: return "CL_INVALID_OPERATION";
+        case -60: return "CL_INVALID_GL_OBJECT";
+        case -61: return "CL_INVALID_BUFFER_SIZE";
+        case -62: return "CL_INVALID_MIP_LEVEL";
+        case -63: return "CL_INVALID_GLOBAL_WORK_SIZE";
+        case -64: return "CL_INVALID_PROPERTY";
+        case -65: return "CL_INVALID_IMAGE_DESCRIPTOR";
+        case -66: return "CL_INVALID_COMPILER_OPTIONS";
+        case -67: return "CL_INVALID_LINKER_OPTIONS";
+        case -68: return "CL_INVALID_DEVICE_PARTITION_COUNT";
+
+        /* extension errors */
+        case -1000: return "CL_INVALID_GL_SHAREGROUP_REFERENCE_KHR";
+        case -1001: return "CL_PLATFORM_NOT_FOUND_KHR";
+        case -1002: return "CL_INVALID_D3D10_DEVICE_KHR";
+        case -1003: return "CL_INVALID_D3D10_RESOURCE_KHR";
+        case -1004: return "CL_D3D10_RESOURCE_ALREADY_ACQUIRED_KHR";
+        case -1005: return "CL_D3D10_RESOURCE_NOT_ACQUIRED_KHR";
+
+        default: return "Unknown OpenCL error";
+    }
+}
+
+void check_error(const char* api_call, cl_int err) {
+    if(err != CL_SUCCESS) {
+        fprintf(stderr, "%s %s\\n", api_call, clerror_string(err));
+        exit(1);
+    }
+}
+"""
+
+
+# A str.translate() table of the characters which must be escaped in a C string
+# literal. '?' is escaped so that it cannot start a trigraph, which -std=c99
+# enables.
+_C_STRING_ESCAPES = str.maketrans(
+    {'\\': '\\\\', '"': '\\"', '?': '\\?', '\r': '\\r'})
+
+
 def escape_c_string(s: str) -> str:
-  """ quote and return the given string """
-  return '\n'.join('"{}"'.format(line.replace('"', '\\"'))
+  """Quote a string as C string literals, one per non-empty line.
+
+  The C compiler decodes each literal to the original line, and concatenates
+  adjacent literals without line breaks.
+  """
+  return '\n'.join('"{}"'.format(line.translate(_C_STRING_ESCAPES))
                    for line in s.split('\n') if len(line.strip()))
 
 
@@ -23,7 +123,13 @@ def to_array_str(array):
 
 
 def gen_data_blocks(kernel_args: typing.List[_args.KernelArg],
-                    inputs: np.array):
+                    inputs: np.array, binary_inputs: bool = False):
+  """Generate the C code to set the kernel arguments and print the outputs.
+
+  If binary_inputs is set, buffer contents are read from the inputs file using
+  read_inputs(), in the order of emit_c_inputs(), rather than being written
+  into the code as array literals.
+  """
   setup_c, teardown_c, print_c = [], [], []
   for i, (arg, array) in enumerate(zip(kernel_args, inputs)):
     ctype = _args.OPENCL_TYPES[array.dtype]
@@ -31,24 +137,30 @@ def gen_data_blocks(kernel_args: typing.List[_args.KernelArg],
     format_specifier = _args.FORMAT_SPECIFIERS.get(array.dtype, None)
 
     if arg.is_pointer:
-      array_str = to_array_str(array)
-
       flags = "CL_MEM_COPY_HOST_PTR"
       if arg.is_const:
         flags += " | CL_MEM_READ_ONLY"
       else:
         flags += " | CL_MEM_READ_WRITE"
 
+      if binary_inputs:
+        host_ptr = f"host_{i}"
+        setup_c.append(f"""\
+    {ctype} *host_{i} = ({ctype}*)malloc(sizeof({ctype}) * {array.size});
+    read_inputs(host_{i}, sizeof({ctype}) * {array.size});""")
+      else:
+        host_ptr = f"&host_{i}"
+        setup_c.append(f"""\
+    {ctype} host_{i}[{array.size}] = {to_array_str(array)};""")
       setup_c.append(f"""\
-    {ctype} host_{i}[{array.size}] = {array_str};
-    cl_mem dev_{i} = clCreateBuffer(ctx, {flags}, sizeof({ctype}) * {array.size}, &host_{i}, &err);
+    cl_mem dev_{i} = clCreateBuffer(ctx, {flags}, sizeof({ctype}) * {array.size}, {host_ptr}, &err);
     check_error("clCreateBuffer", err);
     err = clSetKernelArg(kernel, {i}, sizeof(cl_mem), &dev_{i});
     check_error("clSetKernelArg", err);
 """)
       if format_specifier and not arg.is_const:
         teardown_c.append(f"""\
-    err = clEnqueueReadBuffer(queue, dev_{i}, CL_TRUE, 0, sizeof({ctype}) * {array.size}, &host_{i}, 0, NULL, NULL);
+    err = clEnqueueReadBuffer(queue, dev_{i}, CL_TRUE, 0, sizeof({ctype}) * {array.size}, {host_ptr}, 0, NULL, NULL);
     check_error("clEnqueueReadBuffer", err);
 """)
         print_c.append(f"""\
@@ -81,7 +193,8 @@ def emit_c(src: str, inputs: np.array, gsize: typing.Optional[driver.NDRange],
            lsize: typing.Optional[driver.NDRange], timeout: int = -1,
            optimizations: bool = True, profiling: bool = False,
            debug: bool = False, compile_only: bool = False,
-           create_kernel: bool = True) -> np.array:
+           create_kernel: bool = True,
+           inputs_file: typing.Optional[str] = None) -> np.array:
   """
   Generate C code to drive kernel.
 
@@ -110,6 +223,12 @@ def emit_c(src: str, inputs: np.array, gsize: typing.Optional[driver.NDRange],
       If 'compile_only' parameter is set, this parameter determines whether
       to create a kernel object after compilation. This requires a kernel
       name.
+  inputs_file: str, optional
+      If set, the contents of the input buffers are not written into the code,
+      but are read at startup from a binary file produced by emit_c_inputs().
+      This is the path of the file, which may be overridden at runtime using
+      the '-i' argument. The size of the code, and the time and memory taken
+      to compile it, do not then grow with the size of the inputs.
 
   Returns
   -------
@@ -138,11 +257,55 @@ def emit_c(src: str, inputs: np.array, gsize: typing.Optional[driver.NDRange],
 
   clBuildProgram_opts = "NULL" if optimizations else '"-cl-opt-disable"'
 
+  binary_inputs = bool(inputs_file) and not compile_only
+  inputs_usage, inputs_c, inputs_file_c = '', '', ''
+  inputs_option_c, open_inputs_c = '', ''
+  if binary_inputs:
+    inputs_usage = ' [-i <inputs-file>]'
+    inputs_file_c = """
+    const char *inputs_file = INPUTS_FILE;"""
+    inputs_file_string = inputs_file.replace('\\', '\\\\').replace('"', '\\"')
+    inputs_c = f"""
+#ifndef INPUTS_FILE
+# define INPUTS_FILE "{inputs_file_string}"
+#endif
+
+FILE *inputs;
+
+void inputs_error(void) {{
+    fprintf(stderr, "fatal: malformed inputs file\\n");
+    exit(3);
+}}
+
+void read_inputs(void *buf, size_t n) {{
+    if (fread(buf, 1, n, inputs) != n)
+        inputs_error();
+}}
+"""
+    inputs_option_c = """
+        else if (!strcmp(argv[i], "-i"))
+            inputs_file = argv[++i];"""
+    args = _args.GetKernelArguments(src)
+    header = _c_inputs_header(sum(
+        array.nbytes for arg, array in zip(args, inputs) if arg.is_pointer))
+    open_inputs_c = f"""
+    /* Read the input buffers from file */
+    inputs = fopen(inputs_file, "rb");
+    if (inputs == NULL) {{
+        fprintf(stderr, "fatal: Could not open '%s'\\n", inputs_file);
+        return 3;
+    }}
+    char inputs_header[128];
+    if (!fgets(inputs_header, sizeof(inputs_header), inputs) ||
+        strcmp(inputs_header, "{header.decode('utf-8').rstrip()}\\n"))
+        inputs_error();
+"""
+
   c = f"""
 /*
  * Usage:
  *   gcc -std=c99 [-DPLATFORM_ID=<platform-id>] [-DDEVICE_ID=<device-id>] foo.c -lOpenCL
- *   ./a.out [-p <platform-id>] [-d <device-id>]
+ *   ./a.out [-p <platform-id>] [-d <device-id>]{inputs_usage}
  *
  * Host code generated using cldrive <https://github.com/ChrisCummins/cldrive>
  */
@@ -174,93 +337,9 @@ typedef unsigned char bool;
 #endif
 typedef unsigned short ushort;
 
-const char *clerror_string(cl_int err) {{
-    /* written by @Selmar http://stackoverflow.com/a/24336429 */
-    switch(err) {{
-        /* run-time and JIT compiler errors */
-        case 0: return "CL_SUCCESS";
-        case -1: return "CL_DEVICE_NOT_FOUND";
-        case -2: return "CL_DEVICE_NOT_AVAILABLE";
-        case -3: return "CL_COMPILER_NOT_AVAILABLE";
-        case -4: return "CL_MEM_OBJECT_ALLOCATION_FAILURE";
-        case -5: return "CL_OUT_OF_RESOURCES";
-        case -6: return "CL_OUT_OF_HOST_MEMORY";
-        case -7: return "CL_PROFILING_INFO_NOT_AVAILABLE";
-        case -8: return "CL_MEM_COPY_OVERLAP";
-        case -9: return "CL_IMAGE_FORMAT_MISMATCH";
-        case -10: return "CL_IMAGE_FORMAT_NOT_SUPPORTED";
-        case -11: return "CL_BUILD_PROGRAM_FAILURE";
-        case -12: return "CL_MAP_FAILURE";
-        case -13: return "CL_MISALIGNED_SUB_BUFFER_OFFSET";
-        case -14: return "CL_EXEC_STATUS_ERROR_FOR_EVENTS_IN_WAIT_LIST";
-        case -15: return "CL_COMPILE_PROGRAM_FAILURE";
-        case -16: return "CL_LINKER_NOT_AVAILABLE";
-        case -17: return "CL_LINK_PROGRAM_FAILURE";
-        case -18: return "CL_DEVICE_PARTITION_FAILED";
-        case -19: return "CL_KERNEL_ARG_INFO_NOT_AVAILABLE";
-
-        /* compile-time errors */
-        case -30: return "CL_INVALID_VALUE";
-        case -31: return "CL_INVALID_DEVICE_TYPE";
-        case -32: return "CL_INVALID_PLATFORM";
-        case -33: return "CL_INVALID_DEVICE";
-        case -34: return "CL_INVALID_CONTEXT";
-        case -35: return "CL_INVALID_QUEUE_PROPERTIES";
-        case -36: return "CL_INVALID_COMMAND_QUEUE";
-        case -37: return "CL_INVALID_HOST_PTR";
-        case -38: return "CL_INVALID_MEM_OBJECT";
-        case -39: return "CL_INVALID_IMAGE_FORMAT_DESCRIPTOR";
-        case -40: return "CL_INVALID_IMAGE_SIZE";
-        case -41: return "CL_INVALID_SAMPLER";
-        case -42: return "CL_INVALID_BINARY";
-        case -43: return "CL_INVALID_BUILD_OPTIONS";
-        case -44: return "CL_INVALID_PROGRAM";
-        case -45: return "CL_INVALID_PROGRAM_EXECUTABLE";
-        case -46: return "CL_INVALID_KERNEL_NAME";
-        case -47: return "CL_INVALID_KERNEL_DEFINITION";
-        case -48: return "CL_INVALID_KERNEL";
-        case -49: return "CL_INVALID_ARG_INDEX";
-        case -50: return "CL_INVALID_ARG_VALUE";
-        case -51: return "CL_INVALID_ARG_SIZE";
-        case -52: return "CL_INVALID_KERNEL_ARGS";
-        case -53: return "CL_INVALID_WORK_DIMENSION";
-        case -54: return "CL_INVALID_WORK_GROUP_SIZE";
-        case -55: return "CL_INVALID_WORK_ITEM_SIZE";
-        case -56: return "CL_INVALID_GLOBAL_OFFSET";
-        case -57: return "CL_INVALID_EVENT_WAIT_LIST";
-        case -58: return "CL_INVALID_EVENT";
-        case -59: return "CL_INVALID_OPERATION";
-        case -60: return "CL_INVALID_GL_OBJECT";
-        case -61: return "CL_INVALID_BUFFER_SIZE";
-        case -62: return "CL_INVALID_MIP_LEVEL";
-        case -63: return "CL_INVALID_GLOBAL_WORK_SIZE";
-        case -64: return "CL_INVALID_PROPERTY";
-        case -65: return "CL_INVALID_IMAGE_DESCRIPTOR";
-        case -66: return "CL_INVALID_COMPILER_OPTIONS";
-        case -67: return "CL_INVALID_LINKER_OPTIONS";
-        case -68: return "CL_INVALID_DEVICE_PARTITION_COUNT";
-
-        /* extension errors */
-        case -1000: return "CL_INVALID_GL_SHAREGROUP_REFERENCE_KHR";
-        case -1001: return "CL_PLATFORM_NOT_FOUND_KHR";
-        case -1002: return "CL_INVALID_D3D10_DEVICE_KHR";
-        case -1003: return "CL_INVALID_D3D10_RESOURCE_KHR";
-        case -1004: return "CL_D3D10_RESOURCE_ALREADY_ACQUIRED_KHR";
-        case -1005: return "CL_D3D10_RESOURCE_NOT_ACQUIRED_KHR";
-
-        default: return "Unknown OpenCL error";
-    }}
-}}
-
-void check_error(const char* api_call, cl_int err) {{
-    if(err != CL_SUCCESS) {{
-        fprintf(stderr, "%s %s\\n", api_call, clerror_string(err));
-        exit(1);
-    }}
-}}
-
+{_CL_ERROR_C}{inputs_c}
 int help(char **argv) {{
-    printf("Usage: %s [-p <platform-id>] [-d <device-id>]\\n", argv[0]);
+    printf("Usage: %s [-p <platform-id>] [-d <device-id>]{inputs_usage}\\n", argv[0]);
     return 2;
 }}
 
@@ -268,7 +347,7 @@ int main(int argc, char** argv) {{
     int err;
     int platform_id = PLATFORM_ID;
     int device_id = DEVICE_ID;
-    const char *filename = NULL;
+    const char *filename = NULL;{inputs_file_c}
 
     for (int i = 1; i < argc; i++) {{
         if (!strcmp(argv[i], "-h") || !strcmp(argv[i], "--help"))
@@ -278,7 +357,7 @@ int main(int argc, char** argv) {{
         else if (!strcmp(argv[i], "-p"))
             platform_id = atoi(argv[++i]);
         else if (!strcmp(argv[i], "-d"))
-            device_id = atoi(argv[++i]);
+            device_id = atoi(argv[++i]);{inputs_option_c}
         else
             fprintf(stderr, "warning: unrecognized argument '%s'\\n", argv[i]);
     }}
@@ -303,7 +382,7 @@ int main(int argc, char** argv) {{
 
         kernel_src = buf;
     }}
-
+{open_inputs_c}
     cl_uint num_platforms;
     cl_platform_id *platform_ids = (cl_platform_id*)malloc(sizeof(cl_platform_id) * (platform_id + 1));
     err = clGetPlatformIDs(platform_id + 1, platform_ids, &num_platforms);
@@ -389,7 +468,13 @@ int main(int argc, char** argv) {{
 
   if not compile_only:
     args = _args.GetKernelArguments(src)
-    setup_block, teardown_block, print_block = gen_data_blocks(args, inputs)
+    setup_block, teardown_block, print_block = gen_data_blocks(
+        args, inputs, binary_inputs=binary_inputs)
+    if binary_inputs:
+      setup_block += """
+    if (fgetc(inputs) != EOF)
+        inputs_error();
+    fclose(inputs);"""
     c += f"""
 {setup_block}
 
@@ -419,3 +504,425 @@ int main(int argc, char** argv) {{
 }}
 """
   return c
+
+
+# The version of the inputs file format read by the drivers generated by
+# emit_c() with an inputs_file. See emit_c_inputs().
+C_INPUTS_VERSION = 1
+
+
+def emit_c_inputs(src: str, inputs: np.array) -> bytes:
+  """
+  Serialize the input buffers of a kernel for a driver generated by emit_c().
+
+  The inputs file is a header line, followed by the contents of the buffer
+  arguments in argument order, in the native binary format of the host. The
+  header contains the total size of the buffers, which the driver checks
+  before reading them. Scalar arguments are written into the driver code.
+
+  Parameters
+  ----------
+  src : str
+      The OpenCL kernel source.
+  inputs : np.array
+      The input data to the kernel.
+
+  Returns
+  -------
+  bytes
+      The inputs file contents.
+
+  Raises
+  ------
+  ValueError
+      If input types are incorrect.
+  LogicError
+      If the input types do not match OpenCL kernel types.
+  """
+  buffers = [
+    np.ascontiguousarray(array).tobytes()
+    for arg, array in zip(_args.GetKernelArguments(src), inputs)
+    if arg.is_pointer
+  ]
+  return _c_inputs_header(sum(len(b) for b in buffers)) + b''.join(buffers)
+
+
+def _c_inputs_header(nbytes: int) -> bytes:
+  """Return the header line of an inputs file with nbytes of buffers."""
+  return f'cldrive inputs {C_INPUTS_VERSION} {nbytes}\n'.encode('utf-8')
+
+
+# The version of the input format read by the generic driver. See
+# emit_generic_input().
+GENERIC_INPUT_VERSION = 1
+
+# The numpy types which the generic driver can print, and their type codes.
+# Code 0 denotes an argument which is not printed.
+_GENERIC_PRINT_TYPES = {
+  dtype: i + 1 for i, dtype in enumerate(
+      sorted(_args.FORMAT_SPECIFIERS, key=lambda d: d.name))
+}
+
+
+def emit_generic_c() -> str:
+  """
+  Generate C code for a driver which reads the kernel and inputs at runtime.
+
+  Unlike the drivers generated by emit_c(), which have the kernel and its
+  inputs compiled in, a generic driver need only be compiled once for an
+  OpenCL device. It reads a file produced by emit_generic_input() (or stdin,
+  if the file is '-'), and produces the same output as the equivalent
+  emit_c() driver.
+
+  Returns
+  -------
+  str
+      Code which can be compiled using a C compiler to drive kernels.
+  """
+  print_cases = '\n'.join(
+      f'            case {code}: printf(" {_args.FORMAT_SPECIFIERS[dtype]}", '
+      f'(({_args.OPENCL_TYPES[dtype]} *)data)[i]); break;'
+      for dtype, code in sorted(_GENERIC_PRINT_TYPES.items(),
+                                key=lambda x: x[1]))
+  return f"""
+/*
+ * A generic cldrive host driver, which reads the kernel and its inputs at
+ * runtime.
+ *
+ * Host code generated using cldrive <https://github.com/ChrisCummins/cldrive>
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#ifdef __APPLE__
+#include <OpenCL/opencl.h>
+#else
+#include <CL/cl.h>
+#endif
+
+#ifndef PLATFORM_ID
+# define PLATFORM_ID 0
+#endif
+
+#ifndef DEVICE_ID
+# define DEVICE_ID 0
+#endif
+
+#ifndef __APPLE__
+typedef unsigned char bool;
+#endif
+typedef unsigned short ushort;
+
+{_CL_ERROR_C}
+FILE *input;
+
+void read_error(void) {{
+    fprintf(stderr, "fatal: malformed driver input\\n");
+    exit(3);
+}}
+
+/* Read a line of whitespace separated integers. */
+void read_sizes(size_t *values, int n) {{
+    char line[1024];
+    char *ptr = line;
+    int count;
+    if (!fgets(line, sizeof(line), input))
+        read_error();
+    for (int i = 0; i < n; i++) {{
+        if (sscanf(ptr, "%zu%n", &values[i], &count) != 1)
+            read_error();
+        ptr += count;
+    }}
+}}
+
+size_t read_size(void) {{
+    size_t value;
+    read_sizes(&value, 1);
+    return value;
+}}
+
+/* Read a newline terminated block of n bytes. */
+char *read_bytes(size_t n) {{
+    char *buf = (char*)malloc(n + 1);
+    if (n && fread(buf, 1, n, input) != n)
+        read_error();
+    if (fgetc(input) != '\\n')
+        read_error();
+    buf[n] = 0;
+    return buf;
+}}
+
+void print_array(const char *label, size_t type, const void *data,
+                 size_t count) {{
+    printf("%s:", label);
+    for (int i = 0; i < count; i++) {{
+        switch (type) {{
+{print_cases}
+            default: read_error();
+        }}
+    }}
+    printf("\\n");
+}}
+
+struct arg {{
+    size_t is_pointer;
+    size_t is_const;
+    size_t print_type;
+    size_t size;
+    size_t count;
+    char *label;
+    char *data;
+    cl_mem dev;
+}};
+
+int main(int argc, char** argv) {{
+    int err;
+    int platform_id = PLATFORM_ID;
+    int device_id = DEVICE_ID;
+
+    if (argc != 2) {{
+        printf("Usage: %s <input-file>\\n", argv[0]);
+        return 2;
+    }}
+    input = strcmp(argv[1], "-") ? fopen(argv[1], "rb") : stdin;
+    if (input == NULL) {{
+        fprintf(stderr, "fatal: Could not open '%s'\\n", argv[1]);
+        return 3;
+    }}
+
+    if (read_size() != {GENERIC_INPUT_VERSION})
+        read_error();
+    size_t mode[3];
+    read_sizes(mode, 3);
+    const size_t optimizations = mode[0];
+    const size_t create_kernel = mode[1];
+    const size_t run = mode[2];
+    const char *kernel_src = read_bytes(read_size());
+    const char *expected_kernel_name = read_bytes(read_size());
+    size_t ndrange[6];
+    read_sizes(ndrange, 6);
+    const size_t num_args = read_size();
+    struct arg *args = (struct arg*)malloc(sizeof(struct arg) * (num_args + 1));
+    for (size_t i = 0; i < num_args; i++) {{
+        size_t header[6];
+        read_sizes(header, 6);
+        args[i].is_pointer = header[0];
+        args[i].is_const = header[1];
+        args[i].print_type = header[2];
+        args[i].size = header[3];
+        args[i].count = header[4];
+        args[i].label = read_bytes(header[5]);
+        args[i].data = read_bytes(args[i].size * args[i].count);
+    }}
+    if (input != stdin)
+        fclose(input);
+
+    cl_uint num_platforms;
+    cl_platform_id *platform_ids = (cl_platform_id*)malloc(sizeof(cl_platform_id) * (platform_id + 1));
+    err = clGetPlatformIDs(platform_id + 1, platform_ids, &num_platforms);
+    check_error("clGetPlatformIDs", err);
+
+    if (num_platforms <= platform_id) {{
+        fprintf(stderr, "Platform ID %d not found\\n", platform_id);
+        return 1;
+    }}
+    cl_platform_id cl_platform_id = platform_ids[platform_id];
+
+    char strbuf[256];
+    err = clGetPlatformInfo(cl_platform_id, CL_PLATFORM_NAME, sizeof(strbuf), strbuf, NULL);
+    check_error("clGetPlatformInfo", err);
+    fprintf(stderr, "[cldrive] Platform: %s\\n", strbuf);
+
+    cl_uint num_devices;
+    cl_device_id *device_ids = (cl_device_id*)malloc(sizeof(cl_device_id) * (device_id + 1));
+    err = clGetDeviceIDs(cl_platform_id, CL_DEVICE_TYPE_ALL, device_id + 1, device_ids, &num_devices);
+    check_error("clGetDeviceIDs", err);
+
+    if (num_devices <= device_id) {{
+        fprintf(stderr, "Device ID %d not found\\n", device_id);
+        return 1;
+    }}
+    cl_device_id cl_device_id = device_ids[device_id];
+
+    err = clGetDeviceInfo(cl_device_id, CL_DEVICE_NAME, sizeof(strbuf), strbuf, NULL);
+    check_error("clGetDeviceInfo", err);
+    fprintf(stderr, "[cldrive] Device: %s\\n", strbuf);
+
+    cl_context ctx = clCreateContext(NULL, 1, &cl_device_id, NULL, NULL, &err);
+    check_error("clCreateContext", err);
+
+    cl_command_queue queue = clCreateCommandQueue(ctx, cl_device_id, 0, &err);
+    check_error("clCreateCommandQueue", err);
+
+    fprintf(stderr, "[cldrive] OpenCL optimizations: %s\\n", optimizations ? "on" : "off");
+
+    cl_program program = clCreateProgramWithSource(ctx, 1, (const char **) &kernel_src, NULL, &err);
+    check_error("clCreateProgramWithSource", err);
+
+    int build_err = clBuildProgram(program, 0, NULL, optimizations ? NULL : "-cl-opt-disable", NULL, NULL);
+
+    size_t log_size;
+    err = clGetProgramBuildInfo(program, cl_device_id, CL_PROGRAM_BUILD_LOG, 0, NULL, &log_size);
+    check_error("clGetProgramBuildInfo", err);
+
+    if (log_size > 2) {{
+        char* log = (char*)malloc(sizeof(char) * (log_size + 1));
+        err = clGetProgramBuildInfo(program, cl_device_id, CL_PROGRAM_BUILD_LOG, log_size, log, NULL);
+        check_error("clGetProgramBuildInfo", err);
+        fprintf(stderr, "%s", log);
+    }}
+
+    check_error("clBuildProgram", build_err);
+
+    if (!create_kernel) {{
+        fprintf(stderr, "done.\\n");
+        return 0;
+    }}
+
+    cl_kernel kernels[128];
+    cl_uint num_kernels;
+    err = clCreateKernelsInProgram(program, 128, kernels, &num_kernels);
+    check_error("clCreateKernelsInProgram", err);
+
+    if (num_kernels != 1) {{
+        fprintf(stderr, "fatal: require 1 kernel, got %u\\n", num_kernels);
+        return 3;
+    }}
+
+    cl_kernel kernel = kernels[0];
+
+    char kernel_name[128];
+    err = clGetKernelInfo(kernel, CL_KERNEL_FUNCTION_NAME, 128, kernel_name, NULL);
+    check_error("clGetKernelInfo", err);
+
+    if (strcmp(kernel_name, expected_kernel_name))
+        fprintf(stderr, "fatal: expected kernel name \\"%s\\", got \\"%s\\"\\n", expected_kernel_name, kernel_name);
+
+    fprintf(stderr, "[cldrive] Kernel: \\"%s\\"\\n", kernel_name);
+
+    if (!run) {{
+        fprintf(stderr, "done.\\n");
+        return 0;
+    }}
+
+    for (size_t i = 0; i < num_args; i++) {{
+        if (args[i].is_pointer) {{
+            cl_mem_flags flags = CL_MEM_COPY_HOST_PTR | (args[i].is_const ? CL_MEM_READ_ONLY : CL_MEM_READ_WRITE);
+            args[i].dev = clCreateBuffer(ctx, flags, args[i].size * args[i].count, args[i].data, &err);
+            check_error("clCreateBuffer", err);
+            err = clSetKernelArg(kernel, i, sizeof(cl_mem), &args[i].dev);
+            check_error("clSetKernelArg", err);
+        }} else {{
+            err = clSetKernelArg(kernel, i, args[i].size, args[i].data);
+            check_error("clSetKernelArg", err);
+        }}
+    }}
+
+    const size_t lsize[3] = {{ ndrange[3], ndrange[4], ndrange[5] }};
+    const size_t gsize[3] = {{ ndrange[0], ndrange[1], ndrange[2] }};
+
+    err = clEnqueueNDRangeKernel(queue, kernel, 3, NULL, gsize, lsize, 0, NULL, NULL);
+    check_error("clEnqueueNDRangeKernel", err);
+
+    for (size_t i = 0; i < num_args; i++) {{
+        if (args[i].is_pointer && args[i].print_type) {{
+            err = clEnqueueReadBuffer(queue, args[i].dev, CL_TRUE, 0, args[i].size * args[i].count, args[i].data, 0, NULL, NULL);
+            check_error("clEnqueueReadBuffer", err);
+        }}
+    }}
+
+    err = clFinish(queue);
+    check_error("clFinish", err);
+
+    for (size_t i = 0; i < num_args; i++) {{
+        if (args[i].is_pointer && args[i].print_type)
+            print_array(args[i].label, args[i].print_type, args[i].data, args[i].count);
+    }}
+
+    clReleaseProgram(program);
+    clReleaseKernel(kernel);
+    clReleaseCommandQueue(queue);
+    clReleaseContext(ctx);
+
+    fprintf(stderr, "done.\\n");
+    return 0;
+}}
+"""
+
+
+def emit_generic_input(src: str, inputs: np.array,
+                       gsize: typing.Optional[driver.NDRange],
+                       lsize: typing.Optional[driver.NDRange],
+                       optimizations: bool = True, compile_only: bool = False,
+                       create_kernel: bool = True) -> bytes:
+  """
+  Serialize a kernel and its inputs for the driver of emit_generic_c().
+
+  The input is a sequence of newline terminated lines of whitespace separated
+  integers, and newline terminated blocks of bytes whose lengths are given by
+  the preceding line. Array data is stored in the native binary format of the
+  host.
+
+  Parameters
+  ----------
+  The same as emit_c(). Running the generic driver on the returned input
+  produces the same output as running the driver returned by emit_c().
+
+  Returns
+  -------
+  bytes
+      The driver input.
+
+  Raises
+  ------
+  ValueError
+      If input types are incorrect.
+  TypeError
+      If an input is of an incorrect type.
+  LogicError
+      If the input types do not match OpenCL kernel types.
+  """
+  # Drivers generated by emit_c() embed the kernel using escape_c_string(), as
+  # a sequence of adjacent string literals, one per non-empty line, which C
+  # decodes to the original lines and concatenates without line breaks.
+  # Reproduce this, so that the OpenCL compiler receives the same source.
+  src_bytes = ''.join(
+      line for line in src.split('\n') if len(line.strip())).encode('utf-8')
+  kernel_name = b''
+  if not compile_only or create_kernel:
+    kernel_name = _args.GetKernelName(src).encode('utf-8')
+  ndrange = [0] * 6
+  num_args, arg_blocks = 0, []
+  if not compile_only:
+    ndrange = [gsize.x, gsize.y, gsize.z, lsize.x, lsize.y, lsize.z]
+    for arg, array in zip(_args.GetKernelArguments(src), inputs):
+      # Raise an error for types which the generated drivers do not support.
+      _args.OPENCL_TYPES[array.dtype]
+      print_type = 0
+      if arg.is_pointer and not arg.is_const:
+        print_type = _GENERIC_PRINT_TYPES.get(array.dtype, 0)
+      label = str(arg).encode('utf-8')
+      data = np.ascontiguousarray(array).tobytes()
+      num_args += 1
+      arg_blocks += [
+        _generic_input_line(int(arg.is_pointer), int(arg.is_const),
+                            print_type, array.itemsize, array.size,
+                            len(label)),
+        label, b'\n', data, b'\n',
+      ]
+  return b''.join([
+    _generic_input_line(GENERIC_INPUT_VERSION),
+    _generic_input_line(int(optimizations),
+                        int(not compile_only or create_kernel),
+                        int(not compile_only)),
+    _generic_input_line(len(src_bytes)), src_bytes, b'\n',
+    _generic_input_line(len(kernel_name)), kernel_name, b'\n',
+    _generic_input_line(*ndrange),
+    _generic_input_line(num_args),
+  ] + arg_blocks)
+
+
+def _generic_input_line(*values: int) -> bytes:
+  """Return a line of the generic driver input format."""
+  return (' '.join(str(v) for v in values) + '\n').encode('utf-8')
@@ -0,0 +1,120 @@
+"""Unit tests for //gpu/cldrive/cgen.py."""
+import re
+import sys
+
+import numpy as np
+import pytest
+from absl import app
+
+from gpu.cldrive import cgen
+from gpu.cldrive import driver
+
+
+_SRC = "kernel void A(global int* a, const float b, global float* c) {}"
+
+
+def _Inputs():
+  return [np.arange(4, dtype=np.int32), np.array([1.5], dtype=np.float32),
+          np.array([0.1, -2.5e30], dtype=np.float32)]
+
+
+def _EmitC(**kwargs) -> str:
+  return cgen.emit_c(_SRC, _Inputs(), driver.NDRange(4, 1, 1),
+                     driver.NDRange(1, 1, 1), **kwargs)
+
+
+def test_emit_c_inputs():
+  """Test that buffers are written after the header, and scalars are not."""
+  inputs = _Inputs()
+  contents = cgen.emit_c_inputs(_SRC, inputs)
+  header, buffers = contents.split(b'\n', 1)
+  assert header == f'cldrive inputs {cgen.C_INPUTS_VERSION} 24'.encode('utf-8')
+  assert buffers == inputs[0].tobytes() + inputs[2].tobytes()
+
+
+def test_emit_c_inputs_non_contiguous():
+  """Test that non-contiguous buffers are written in element order."""
+  inputs = _Inputs()
+  inputs[0] = np.arange(8, dtype=np.int32)[::2]
+  buffers = cgen.emit_c_inputs(_SRC, inputs).split(b'\n', 1)[1]
+  assert np.frombuffer(buffers[:16], dtype=np.int32).tolist() == [0, 2, 4, 6]
+
+
+def test_emit_c_inputs_file():
+  """Test that buffers are read from the inputs file, and scalars are not."""
+  c = _EmitC(inputs_file='/tmp/in"puts.bin')
+  assert '# define INPUTS_FILE "/tmp/in\\"puts.bin"' in c
+  assert 'cldrive inputs 1 24\\n' in c
+  assert 'int *host_0 = (int*)malloc(sizeof(int) * 4);' in c
+  assert 'read_inputs(host_0, sizeof(int) * 4);' in c
+  assert 'read_inputs(host_2, sizeof(float) * 2);' in c
+  assert 'float host_1 = 1.5;' in c
+  # Buffer contents are not written into the code.
+  assert 'host_0[4] =' not in c
+  assert '-2.5e+30' not in c
+
+
+def test_emit_c_without_inputs_file():
+  """Test that buffers are written into the code by default."""
+  c = _EmitC()
+  assert 'int host_0[4] = { 0, 1, 2, 3 };' in c
+  assert 'read_inputs' not in c
+  assert 'INPUTS_FILE' not in c
+
+
+def test_emit_c_compile_only_ignores_inputs_file():
+  """Test that a compile-only driver does not read an inputs file."""
+  c = cgen.emit_c(_SRC, [], None, None, compile_only=True,
+                  inputs_file='inputs.bin')
+  assert 'INPUTS_FILE' not in c
+  assert 'read_inputs' not in c
+
+
+# The simple escape sequences of C string literals, see C99 6.4.4.4.
+_C_SIMPLE_ESCAPES = {
+  "'": "'", '"': '"', '?': '?', '\\': '\\', 'a': '\a', 'b': '\b',
+  'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+}
+
+
+def _EmbeddedKernelSource(c: str) -> str:
+  """Decode the kernel source which is embedded in an emit_c() driver."""
+  literals = c.split('const char *kernel_src = \\\n', 1)[1].split(';\n', 1)[0]
+  # Trigraphs would be replaced before escape sequences are decoded.
+  assert '??' not in literals
+  return ''.join(
+      re.sub(r'\\(.)', lambda m: _C_SIMPLE_ESCAPES[m.group(1)], literal)
+      for literal in re.findall(r'"((?:\\.|[^"\\\n])*)"', literals))
+
+
+def _GenericInputSource(input_: bytes) -> bytes:
+  """Return the kernel source of an emit_generic_input() input."""
+  _, _, size, rest = input_.split(b'\n', 3)
+  return rest[:int(size)]
+
+
+@pytest.mark.parametrize('src', [
+  _SRC,
+  'kernel void A(global int* a) {\n\n  printf("a\\n\\"b\\" \\\\ %d", a[0]);\n}',
+  'kernel void A() {\n  int a = 1 + \\\n      2;\r\n}',
+  'kernel void A() { printf("??/??="); }',
+])
+def test_emit_c_emit_generic_input_same_source(src: str):
+  """Test that both drivers pass the same kernel source to OpenCL."""
+  c = cgen.emit_c(src, [], None, None, compile_only=True,
+                  create_kernel=False)
+  input_ = cgen.emit_generic_input(src, [], None, None, compile_only=True,
+                                   create_kernel=False)
+  embedded_src = _EmbeddedKernelSource(c)
+  assert embedded_src.encode('utf-8') == _GenericInputSource(input_)
+  assert embedded_src == ''.join(
+      line for line in src.split('\n') if line.strip())
+
+
+def main(argv):  # pylint: disable=missing-docstring
+  del argv
+  sys.exit(pytest.main([__file__, '-v']))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -4,6 +4,7 @@ Reads an OpenCL kernel from stdin, generates data for it, executes it on a
 suitable device, and prints the outputs.
 """
 import io
+import pathlib
 import pickle
 import sys
 
@@ -72,6 +73,15 @@ flags.DEFINE_boolean(
 flags.DEFINE_boolean(
     "binary", False,
     "Print outputs as a pickled binary numpy array.")
+flags.DEFINE_string(
+    "args_cache_dir", None,
+    "If set, the kernel signatures are cached in this directory, so that a "
+    "kernel is parsed at most once across invocations.")
+flags.DEFINE_string(
+    "inputs_file", None,
+    "If --emit_c, write the input buffers to this binary file, which the "
+    "generated program reads at startup, rather than inlining them in the C "
+    "code.")
 
 
 def main(argv):
@@ -82,6 +92,9 @@ def main(argv):
   if FLAGS.ls_env:
     env.PrintOpenClEnvironments()
 
+  if FLAGS.args_cache_dir:
+    args.SetKernelSignatureCacheDir(pathlib.Path(FLAGS.args_cache_dir))
+
   # Read kernel source.
   src = sys.stdin.read()
 
@@ -116,6 +129,10 @@ def main(argv):
       "compile_only": FLAGS.compile_only,
       "create_kernel": FLAGS.with_kernel,
     }
+    if FLAGS.inputs_file and not FLAGS.compile_only:
+      with open(FLAGS.inputs_file, 'wb') as f:
+        f.write(cgen.emit_c_inputs(src, inputs))
+      emit_c_args["inputs_file"] = FLAGS.inputs_file
 
     print(cgen.emit_c(**drive_args, **emit_c_args))
   else:
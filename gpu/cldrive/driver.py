@@ -1,12 +1,23 @@
+"""Drive OpenCL kernels.
+
+Kernels are executed by a KernelRunner, a long-lived subprocess per OpenCL
+device which keeps its context and command queues between jobs. A runner which
+crashes or times out is killed, and a new runner is started for the next job.
+"""
 import collections
+import ctypes
+import multiprocessing
+import multiprocessing.connection
+import os
 import pickle
 import re
+import signal
 import sys
+import tempfile
+import threading
 import typing
 from contextlib import suppress
 from signal import Signals
-from subprocess import PIPE, Popen
-from tempfile import NamedTemporaryFile
 
 import numpy as np
 
@@ -108,6 +119,295 @@ class NDRange(collections.namedtuple('NDRange', ['x', 'y', 'z'])):
     return NDRange(x, y, z)
 
 
+class RunnerResult(typing.NamedTuple):
+  """The result of running a job in a KernelRunner."""
+  # The return value of the job function.
+  outputs: typing.Any
+  # The exception raised by the job function, if any.
+  error: typing.Optional[Exception]
+  # The output of the runner during the job.
+  stdout: bytes
+  stderr: bytes
+  # The status of the runner: 0 if the job completed, else the exit code of the
+  # runner process, or a negative signal number if it was killed.
+  status: int
+
+
+def _FlushCStdio() -> None:
+  """Flush the C stdio buffers, e.g. of printf() in an OpenCL kernel."""
+  with suppress(Exception):
+    ctypes.CDLL(None).fflush(None)
+
+
+def _RunnerMain(connection: multiprocessing.connection.Connection,
+                job_fn: typing.Callable[[typing.Dict[str, typing.Any],
+                                         typing.Dict[typing.Any, typing.Any]],
+                                        typing.Any],
+                stdout_path: str, stderr_path: str) -> None:
+  """The main loop of a runner process.
+
+  Jobs are received as dictionaries, and the result of each job is sent back as
+  an <outputs, exception> tuple. A None job ends the loop. The job function is
+  passed a dictionary which persists between jobs, e.g. to hold OpenCL
+  contexts.
+  """
+  # Redirect all output, including that of the OpenCL implementation, to the
+  # files which are read by the parent process.
+  for fd, path in ((1, stdout_path), (2, stderr_path)):
+    output_fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    os.dup2(output_fd, fd)
+    os.close(output_fd)
+
+  state = {}
+  while True:
+    try:
+      job = connection.recv()
+    except EOFError:
+      # The parent process has exited.
+      break
+    if job is None:
+      break
+    try:
+      outputs, error = job_fn(job, state), None
+    except Exception as e:
+      outputs, error = None, e
+    sys.stdout.flush()
+    sys.stderr.flush()
+    _FlushCStdio()
+    try:
+      connection.send((outputs, error))
+    except (pickle.PicklingError, TypeError, AttributeError):
+      # Some OpenCL exceptions cannot be pickled.
+      connection.send((None, RuntimeError(f'{type(error).__name__}: {error}')))
+  connection.close()
+
+
+class KernelRunner(object):
+  """A long-lived subprocess which runs jobs for an OpenCL device.
+
+  Jobs are run one at a time, in a process which is started on the first job.
+  If a job does not complete within its timeout the process is killed, and if
+  the process crashes, a new process is started for the next job.
+  """
+
+  def __init__(self, job_fn: typing.Optional[typing.Callable[
+    [typing.Dict[str, typing.Any], typing.Dict[typing.Any, typing.Any]],
+    typing.Any]] = None):
+    """Instantiate a runner.
+
+    Args:
+      job_fn: The function which runs a job in the runner process. It must be
+        importable by the runner process. Defaults to running OpenCL kernels.
+    """
+    self.job_fn = job_fn or _RunJob
+    self._process = None
+    self._connection = None
+    self._lock = threading.Lock()
+    self._tempdir = tempfile.TemporaryDirectory(prefix='cldrive-runner-')
+    self._stdout_path = os.path.join(self._tempdir.name, 'stdout')
+    self._stderr_path = os.path.join(self._tempdir.name, 'stderr')
+
+  @property
+  def pid(self) -> typing.Optional[int]:
+    """The process ID of the runner, or None if it is not running."""
+    if self._process and self._process.is_alive():
+      return self._process.pid
+    return None
+
+  def Run(self, job: typing.Dict[str, typing.Any],
+          timeout: int = -1) -> RunnerResult:
+    """Run a job.
+
+    Args:
+      job: The job to pass to the job function.
+      timeout: Kill the runner if the job has not completed after this many
+        seconds. A value <= 0 means never time out.
+
+    Returns:
+      The result of the job.
+    """
+    with self._lock:
+      for path in (self._stdout_path, self._stderr_path):
+        open(path, 'wb').close()
+      if not self.pid:
+        self._Stop()
+        self._Start()
+      try:
+        self._connection.send(job)
+      except (BrokenPipeError, ConnectionResetError):
+        # The runner exited while idle. Restart it, and resend the job.
+        self._Stop()
+        self._Start()
+        self._connection.send(job)
+
+      if timeout > 0 and not self._connection.poll(timeout):
+        # Kill the runner, as the timeout command used to.
+        os.kill(self._process.pid, signal.SIGKILL)
+      try:
+        outputs, error = self._connection.recv()
+        status = 0
+      except EOFError:
+        outputs, error = None, None
+        status = self._Stop()
+
+      with open(self._stdout_path, 'rb') as f:
+        stdout = f.read()
+      with open(self._stderr_path, 'rb') as f:
+        stderr = f.read()
+      return RunnerResult(outputs=outputs, error=error, stdout=stdout,
+                          stderr=stderr, status=status)
+
+  def Close(self) -> None:
+    """Stop the runner process."""
+    with self._lock:
+      if self.pid:
+        with suppress(OSError):
+          self._connection.send(None)
+        self._process.join(timeout=10)
+      self._Stop()
+      self._tempdir.cleanup()
+
+  def _Start(self) -> None:
+    """Start a runner process.
+
+    The process is spawned rather than forked, so that it does not inherit any
+    OpenCL state of this process.
+    """
+    context = multiprocessing.get_context('spawn')
+    self._connection, child_connection = context.Pipe()
+    self._process = context.Process(
+        target=_RunnerMain, args=(child_connection, self.job_fn,
+                                  self._stdout_path, self._stderr_path),
+        daemon=True)
+    self._process.start()
+    child_connection.close()
+
+  def _Stop(self) -> int:
+    """Reap the runner process, killing it if required.
+
+    Returns:
+      The exit code of the process.
+    """
+    if not self._process:
+      return 0
+    if self._process.is_alive():
+      self._process.join(timeout=1)
+    if self._process.is_alive():
+      os.kill(self._process.pid, signal.SIGKILL)
+    self._process.join()
+    status = self._process.exitcode
+    self._connection.close()
+    self._process, self._connection = None, None
+    return status
+
+
+# The kernel runners of each OpenCL device, keyed by device.
+_KERNEL_RUNNERS: typing.Dict[typing.Tuple[str, int, int], KernelRunner] = {}
+_KERNEL_RUNNERS_LOCK = threading.Lock()
+
+
+def GetKernelRunner(env: _env.OpenCLEnvironment) -> KernelRunner:
+  """Return the kernel runner for an OpenCL environment."""
+  key = (env.name, env.platform_id, env.device_id)
+  with _KERNEL_RUNNERS_LOCK:
+    if key not in _KERNEL_RUNNERS:
+      _KERNEL_RUNNERS[key] = KernelRunner()
+    return _KERNEL_RUNNERS[key]
+
+
+def CloseKernelRunners() -> None:
+  """Stop the kernel runners of all OpenCL devices."""
+  with _KERNEL_RUNNERS_LOCK:
+    for runner in _KERNEL_RUNNERS.values():
+      runner.Close()
+    _KERNEL_RUNNERS.clear()
+
+
+def _GetQueue(env: _env.OpenCLEnvironment, profiling: bool,
+              state: typing.Dict[typing.Any, typing.Any]):
+  """Return the context and a command queue for a device.
+
+  Contexts and queues are created once per runner process, and kept in state.
+  """
+  import pyopencl as cl
+
+  context_key = ('context', env.platform_id, env.device_id)
+  if context_key not in state:
+    platform = cl.get_platforms()[env.platform_id]
+    device = platform.get_devices()[env.device_id]
+    state[context_key] = cl.Context([device])
+  ctx = state[context_key]
+
+  queue_key = ('queue', env.platform_id, env.device_id, profiling)
+  if queue_key not in state:
+    properties = (cl.command_queue_properties.PROFILING_ENABLE
+                  if profiling else 0)
+    state[queue_key] = cl.CommandQueue(ctx, properties=properties)
+  return ctx, state[queue_key]
+
+
+def _RunJob(job: typing.Dict[str, typing.Any],
+            state: typing.Dict[typing.Any, typing.Any]) -> np.array:
+  """Run an OpenCL kernel. This runs in a KernelRunner process.
+
+  Returns:
+    The values of the kernel's non-local arguments after execution.
+  """
+  import pyopencl as cl
+
+  args, gsize, lsize = job['args'], job['gsize'], job['lsize']
+  profiling = job['profiling']
+  ctx, queue = _GetQueue(job['env'], profiling, state)
+
+  def LogTime(name: str, event) -> None:
+    """Log the duration of an OpenCL event to stderr."""
+    if profiling:
+      event.wait()
+      elapsed_ms = (event.profile.end - event.profile.start) / 1e6
+      print(f"[cldrive] {name} time: {elapsed_ms:.6f} ms", file=sys.stderr)
+
+  build_opts = [] if job['optimizations'] else ['-cl-opt-disable']
+  program = cl.Program(ctx, job['src']).build(build_opts)
+  kernel = program.all_kernels()[0]
+
+  # Create the device buffers. Local arguments have no host data.
+  argtuples = []
+  inputs = iter(job['data'])
+  for arg in args:
+    if arg.address_space == 'local':
+      nbytes = lsize.product * arg.vector_width * arg.numpy_type.itemsize
+      argtuples.append(ArgTuple(hostdata=None, devdata=cl.LocalMemory(nbytes)))
+    elif arg.is_pointer:
+      hostdata = next(inputs)
+      flags = (cl.mem_flags.READ_ONLY if arg.is_const else
+               cl.mem_flags.READ_WRITE)
+      argtuples.append(ArgTuple(hostdata=hostdata,
+                                devdata=cl.Buffer(ctx, flags, hostdata.nbytes)))
+    else:
+      # Scalar values are arrays, with one element per vector component.
+      # 3-component vectors have the size of 4-component vectors.
+      hostdata = next(inputs)
+      if arg.vector_width == 3:
+        devdata = np.append(hostdata, hostdata[:1] * 0)
+      else:
+        devdata = hostdata if arg.is_vector else hostdata[0]
+      argtuples.append(ArgTuple(hostdata=hostdata, devdata=devdata))
+  kernel.set_args(*[a.devdata for a in argtuples])
+
+  buffers = [a for a in argtuples if isinstance(a.devdata, cl.Buffer)]
+  for a in buffers:
+    LogTime('host -> device transfer',
+            cl.enqueue_copy(queue, a.devdata, a.hostdata, is_blocking=False))
+  LogTime('kernel execution',
+          cl.enqueue_nd_range_kernel(queue, kernel, gsize, lsize))
+  for a in buffers:
+    LogTime('device -> host transfer',
+            cl.enqueue_copy(queue, a.hostdata, a.devdata, is_blocking=False))
+  queue.finish()
+
+  return np.array([a.hostdata for a in argtuples if a.hostdata is not None])
+
+
 def DriveKernel(env: _env.OpenCLEnvironment, src: str, inputs: np.array,
                 gsize: typing.Union[typing.Tuple[int, int, int], NDRange],
                 lsize: typing.Union[typing.Tuple[int, int, int], NDRange],
@@ -116,7 +416,8 @@ def DriveKernel(env: _env.OpenCLEnvironment, src: str, inputs: np.array,
   """Drive an OpenCL kernel.
 
   Executes an OpenCL kernel on the given environment, over the given inputs.
-  Execution is performed in a subprocess.
+  Execution is performed in the KernelRunner subprocess of the environment, see
+  GetKernelRunner().
 
   Args:
     env: The OpenCL environment to run the kernel in.
@@ -138,6 +439,7 @@ def DriveKernel(env: _env.OpenCLEnvironment, src: str, inputs: np.array,
   TypeError: If an input is of an incorrect type.
   LogicError: If the input types do not match OpenCL kernel types.
   PorcelainError: If the OpenCL subprocess exits with non-zero return code.
+  TimeoutError: If the kernel does not complete within the timeout.
   RuntimeError: If OpenCL program fails to build or run.
 
   Examples:
@@ -189,8 +491,8 @@ def DriveKernel(env: _env.OpenCLEnvironment, src: str, inputs: np.array,
     err.assert_or_raise(len(x), ValueError, f"Input {i} has size zero")
 
   # Copy inputs into the expected data types.
-  data = np.array([np.array(d).astype(a.numpy_type)
-                   for d, a in zip(inputs, args)])
+  data = [np.array(d).astype(args[i].numpy_type)
+          for d, i in zip(inputs, args_with_inputs)]
 
   job = {
     "env": env,
@@ -203,61 +505,37 @@ def DriveKernel(env: _env.OpenCLEnvironment, src: str, inputs: np.array,
     "profiling": profiling
   }
 
-  with NamedTemporaryFile('rb+', prefix='cldrive-', suffix='.job') as tmp_file:
-    porcelain_job_file = tmp_file.name
-
-    # Write job file.
-    pickle.dump(job, tmp_file)
-    tmp_file.flush()
-
-    # Enforce timeout using sigkill.
-    if timeout > 0:
-      cli = ["timeout", "--signal=9", str(int(timeout))]
+  runner = GetKernelRunner(env)
+  Log(f"Kernel runner process: {runner.pid}")
+  result = runner.Run(job, timeout=timeout)
+  status = result.status
+
+  if debug:
+    print(result.stdout.decode('utf-8').strip(), file=sys.stderr)
+    print(result.stderr.decode('utf-8').strip(), file=sys.stderr)
+  elif profiling:
+    # Print profiling output when not in debug mode.
+    for line in result.stderr.decode('utf-8').split('\n'):
+      if re.match(r'\[cldrive\] .+ time: [0-9]+\.[0-9]+ ms', line):
+        print(line, file=sys.stderr)
+  Log(f"Kernel runner status: {status}")
+
+  # Test for non-zero exit codes. The runner catches exceptions and returns
+  # them, so a non-zero status means that the runner process died during the
+  # job. The runner is restarted for the next job.
+  if status != 0:
+    # A negative status means a signal. Try and convert the value into a
+    # signal name.
+    with suppress(ValueError):
+      status = Signals(-status).name
+
+    # Runners which time out are killed with SIGKILL.
+    if status == "SIGKILL":
+      raise TimeoutError(timeout)
     else:
-      cli = []
-    cli += [sys.executable, __file__, porcelain_job_file]
+      raise PorcelainError(status)
 
-    cli_str = " ".join(cli)
-    Log("Porcelain invocation:", cli_str)
-
-    # Fork and run.
-    process = Popen(cli, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = process.communicate()
-    status = process.returncode
-
-    if debug:
-      print(stdout.decode('utf-8').strip(), file=sys.stderr)
-      print(stderr.decode('utf-8').strip(), file=sys.stderr)
-    elif profiling:
-      # Print profiling output when not in debug mode.
-      for line in stderr.decode('utf-8').split('\n'):
-        if re.match(r'\[cldrive\] .+ time: [0-9]+\.[0-9]+ ms', line):
-          print(line, file=sys.stderr)
-    Log(f"Porcelain return code: {status}")
-
-    # Test for non-zero exit codes. The porcelain subprocess catches exceptions
-    # and completes gracefully, so a non-zero return code is indicative of a
-    # more serious problem.
-    #
-    # FIXME: I'm seeing a number of SIGABRT return codes which I can't explain.
-    # However, ignoring them seems to not cause a problem ...
-    if status != 0 and status != -Signals['SIGABRT'].value:
-      # A negative return code means a signal. Try and convert the value into a
-      # signal name.
-      with suppress(ValueError):
-        status = Signals(-status).name
-
-      if status == "SIGKILL":
-        raise TimeoutError(timeout)
-      else:
-        raise PorcelainError(status)
-
-    # Read result.
-    tmp_file.seek(0)
-    return_value = pickle.load(tmp_file)
-    outputs = return_value["outputs"]
-    error = return_value["err"]
-    if error:  # Porcelain raised an exception, re-raise it.
-      raise error
-    else:
-      return outputs
+  if result.error:  # The kernel raised an exception, re-raise it.
+    raise result.error
+  else:
+    return result.outputs
@@ -1,4 +1,5 @@
 """Unit tests for //gpu/cldrive/driver.py."""
+import signal
 import sys
 
 import numpy as np
@@ -244,6 +245,88 @@ def test_vector_input_switch():
   testlib.Assert2DArraysAlmostEqual(outputs, outputs_gs)
 
 
+# KernelRunner tests.
+
+@pytest.fixture(scope='function')
+def runner() -> driver.KernelRunner:
+  """A test fixture which returns a runner of testlib.RunnerJob."""
+  runner = driver.KernelRunner(testlib.RunnerJob)
+  yield runner
+  runner.Close()
+
+
+def test_KernelRunner_outputs(runner: driver.KernelRunner):
+  """Test that the value returned by a job is returned."""
+  result = runner.Run({'action': 'return', 'value': np.array([1, 2, 3])})
+  assert result.status == 0
+  assert result.error is None
+  assert list(result.outputs) == [1, 2, 3]
+
+
+def test_KernelRunner_is_persistent(runner: driver.KernelRunner):
+  """Test that jobs are run in the same process, with the same state."""
+  assert runner.pid is None
+  assert runner.Run({'action': 'count'}).outputs == 1
+  pid = runner.pid
+  assert pid
+  assert runner.Run({'action': 'count'}).outputs == 2
+  assert runner.pid == pid
+
+
+def test_KernelRunner_output(runner: driver.KernelRunner):
+  """Test that the output of each job is captured."""
+  result = runner.Run({'action': 'print', 'value': 'hello'})
+  assert result.stdout == b'hello\n'
+  assert result.stderr == b'hello\n'
+  result = runner.Run({'action': 'count'})
+  assert result.stdout == b''
+  assert result.stderr == b''
+
+
+def test_KernelRunner_error(runner: driver.KernelRunner):
+  """Test that an exception raised by a job is returned."""
+  result = runner.Run({'action': 'raise', 'value': 'oh no'})
+  assert result.status == 0
+  assert isinstance(result.error, ValueError)
+  assert str(result.error) == 'oh no'
+  assert runner.Run({'action': 'count'}).outputs == 2
+
+
+def test_KernelRunner_timeout(runner: driver.KernelRunner):
+  """Test that the runner is killed if a job times out, and restarted."""
+  runner.Run({'action': 'count'})
+  pid = runner.pid
+  result = runner.Run({'action': 'sleep', 'value': 60}, timeout=1)
+  assert result.status == -signal.SIGKILL
+  result = runner.Run({'action': 'count'}, timeout=10)
+  assert result.outputs == 1
+  assert runner.pid != pid
+
+
+@pytest.mark.parametrize('action,value,status', [
+  ('exit', 3, 3),
+  ('signal', signal.SIGSEGV, -signal.SIGSEGV),
+])
+def test_KernelRunner_crash(runner: driver.KernelRunner, action: str,
+                            value: int, status: int):
+  """Test that the exit status of a crashed runner is returned."""
+  result = runner.Run({'action': action, 'value': value})
+  assert result.status == status
+  assert result.outputs is None
+  assert runner.Run({'action': 'count'}).outputs == 1
+
+
+def test_DriveKernel_runner_job(runner: driver.KernelRunner, mocker):
+  """Test that the inputs are sent to the runner as the kernel's types."""
+  mocker.patch.object(driver, 'GetKernelRunner', return_value=runner)
+  src = "kernel void A(local int* a, global float* b, const short c) {}"
+  outputs = driver.DriveKernel(env.OclgrindOpenCLEnvironment(), src,
+                               [[1, 2], [3]], gsize=(1, 1, 1),
+                               lsize=(1, 1, 1))
+  assert [o.dtype for o in outputs] == [np.float32, np.int16]
+  testlib.Assert2DArraysAlmostEqual(outputs, [[1, 2], [3]])
+
+
 def main(argv):  # pylint: disable=missing-docstring
   del argv
   sys.exit(pytest.main(
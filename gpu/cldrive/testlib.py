@@ -1,4 +1,7 @@
 """Shared testing utilities."""
+import os
+import sys
+import time
 import typing
 
 import numpy as np
@@ -10,6 +13,33 @@ def ListOfListsToNumpy(list_of_lists: typing.List[list]) -> np.array:
   return np.array([np.array(x) for x in list_of_lists])
 
 
+def RunnerJob(job: typing.Dict[str, typing.Any],
+              state: typing.Dict[typing.Any, typing.Any]) -> typing.Any:
+  """A KernelRunner job function which performs the action named by the job.
+
+  Jobs without an action, such as the jobs of DriveKernel(), return their data.
+  """
+  state['num_jobs'] = state.get('num_jobs', 0) + 1
+  action, value = job.get('action'), job.get('value')
+  if action is None:
+    return job['data']
+  elif action == 'return':
+    return value
+  elif action == 'count':
+    return state['num_jobs']
+  elif action == 'print':
+    print(value)
+    print(value, file=sys.stderr)
+  elif action == 'raise':
+    raise ValueError(value)
+  elif action == 'sleep':
+    time.sleep(value)
+  elif action == 'exit':
+    os._exit(value)
+  elif action == 'signal':
+    os.kill(os.getpid(), value)
+
+
 def Assert2DArraysAlmostEqual(l1: np.array, l2: np.array) -> None:
   """Assert that 2D arrays are almost equal."""
   for x, y in zip(l1, l2):